@@ -35,25 +35,31 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def decode_access_token(token: str) -> Optional[dict]:
+    """Claims of a valid, unexpired access token, else None."""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    return payload if payload.get("sub") else None
+
+async def get_user_by_subject(session: AsyncSession, username: str) -> Optional[User]:
+    # Check by email or admission_number
+    statement = select(User).where((User.email == username) | (User.admission_number == username))
+    result = await session.exec(statement)
+    return result.first()
+
 async def get_current_user(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
+    payload = decode_access_token(token)
+    if payload is None:
         raise credentials_exception
     
-    # Check by email or admission_number
-    statement = select(User).where((User.email == username) | (User.admission_number == username))
-    result = await session.exec(statement)
-    user = result.first()
-    
+    user = await get_user_by_subject(session, payload["sub"])
     if user is None:
         raise credentials_exception
     return user
@@ -62,12 +68,11 @@ async def get_current_user(token: str = Depends(oauth2_scheme), session: AsyncSe
 from ldap3 import Server, Connection, ALL, SUBTREE
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
-from app.models import SystemConfig
 
 async def verify_ldap_login(username, password, session: AsyncSession):
     # Fetch configs
-    configs = (await session.exec(select(SystemConfig))).all()
-    config_dict = {c.key: c.value for c in configs}
+    from app.utils.reference_cache import reference_cache
+    config_dict = await reference_cache.get_configs(session)
     
     server_uri = config_dict.get('ldap_server_uri')
     bind_dn = config_dict.get('ldap_bind_dn') # e.g., cn=admin,dc=example,dc=com or user@domain.com
@@ -108,9 +113,8 @@ async def verify_ldap_login(username, password, session: AsyncSession):
         return False
 
 async def verify_google_token(token: str, session: AsyncSession):
-    configs = (await session.exec(select(SystemConfig))).all()
-    config_dict = {c.key: c.value for c in configs}
-    client_id = config_dict.get('google_client_id')
+    from app.utils.reference_cache import reference_cache
+    client_id = await reference_cache.get_config(session, 'google_client_id')
     
     if not client_id:
         raise Exception("Google Client ID not configured")
@@ -123,8 +127,8 @@ async def verify_google_token(token: str, session: AsyncSession):
         return None
 
 async def get_current_admin(current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)) -> User:
-    from app.models import Role
-    role = await session.get(Role, current_user.role_id)
+    from app.utils.reference_cache import reference_cache
+    role = await reference_cache.get_role(session, current_user.role_id)
     if not role or role.name not in ["SuperAdmin", "Admin"]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
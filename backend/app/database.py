@@ -38,6 +38,80 @@ async def init_db():
     await migrate_notice_board()
     await migrate_gate_exits()
     await migrate_assets()
+    await migrate_gate_scan_batch()
+    await migrate_activity_indexes()
+    await migrate_roster_sync()
+    await migrate_class_session_slots()
+    await migrate_attendance_photo_hash()
+    await migrate_attendance_scan_time_index()
+    await migrate_open_log_indexes()
+async def migrate_attendance_photo_hash():
+    """Manual migration to add the evidence photo's perceptual hash to attendance_records."""
+    print("Checking attendance_records schema for photo hashes...")
+    try:
+        async with engine.begin() as conn:
+            def get_cols(connection):
+                from sqlalchemy import inspect
+                inspector = inspect(connection)
+                if not inspector.has_table('attendance_records'): return []
+                return [c['name'] for c in inspector.get_columns('attendance_records')]
+
+            columns = await conn.run_sync(get_cols)
+            if columns and "photo_hash" not in columns:
+                print("Adding photo_hash column to attendance_records...")
+                await conn.execute(text("ALTER TABLE attendance_records ADD COLUMN photo_hash VARCHAR(16) NULL"))
+
+            print("Attendance photo hash migration checked/applied.")
+    except Exception as e:
+        print(f"Attendance photo hash migration skipped/failed: {e}")
+
+async def migrate_attendance_scan_time_index():
+    """Manual migration to index attendance_records.scan_time, which exports filter by date on."""
+    print("Checking attendance_records scan_time index...")
+    try:
+        async with engine.begin() as conn:
+            def get_indexes(connection):
+                from sqlalchemy import inspect
+                inspector = inspect(connection)
+                if not inspector.has_table('attendance_records'): return None
+                return [i["name"] for i in inspector.get_indexes('attendance_records')]
+
+            existing = await conn.run_sync(get_indexes)
+            if existing is not None and "ix_attendance_records_scan_time" not in existing:
+                print("Adding ix_attendance_records_scan_time to attendance_records...")
+                await conn.execute(text("CREATE INDEX ix_attendance_records_scan_time ON attendance_records (scan_time)"))
+
+            print("Attendance scan_time index checked/applied.")
+    except Exception as e:
+        print(f"Attendance scan_time index migration skipped/failed: {e}")
+
+async def migrate_open_log_indexes():
+    """Manual migration to index the open-log lookups (entity, exit_time) the gate confirms presence with."""
+    print("Checking open gate log indexes...")
+    indexes = {
+        "entry_logs": ("ix_entry_logs_user_id_exit_time", "user_id"),
+        "vehicle_logs": ("ix_vehicle_logs_vehicle_id_exit_time", "vehicle_id"),
+    }
+    try:
+        async with engine.begin() as conn:
+            def get_indexes(connection):
+                from sqlalchemy import inspect
+                inspector = inspect(connection)
+                return {
+                    table: [i["name"] for i in inspector.get_indexes(table)]
+                    for table in indexes if inspector.has_table(table)
+                }
+
+            existing = await conn.run_sync(get_indexes)
+            for table, (name, column) in indexes.items():
+                if table in existing and name not in existing[table]:
+                    print(f"Adding {name} to {table}...")
+                    await conn.execute(text(f"CREATE INDEX {name} ON {table} ({column}, exit_time)"))
+
+            print("Open gate log indexes checked/applied.")
+    except Exception as e:
+        print(f"Open gate log index migration skipped/failed: {e}")
+
 async def get_session() -> AsyncSession:
     async_session = sessionmaker(
         engine, class_=AsyncSession, expire_on_commit=False
@@ -46,6 +120,7 @@ async def get_session() -> AsyncSession:
         yield session
 
 from sqlalchemy import text
+from app.utils.timezone import get_eat_time
 async def migrate_users():
     """Manual migration to add columns for extended user profiles."""
     print("Checking users table schema...")
@@ -391,3 +466,116 @@ async def migrate_assets():
     except Exception as e:
         print(f"Assets table migration skipped/failed: {e}")
 
+async def migrate_gate_scan_batch():
+    """Manual migration to add the device idempotency key used by batch scan uploads."""
+    print("Checking gate_scan_logs schema for batch uploads...")
+    try:
+        async with engine.begin() as conn:
+            def get_cols(connection):
+                from sqlalchemy import inspect
+                inspector = inspect(connection)
+                if not inspector.has_table('gate_scan_logs'): return []
+                return [c['name'] for c in inspector.get_columns('gate_scan_logs')]
+
+            columns = await conn.run_sync(get_cols)
+            if columns and "idempotency_key" not in columns:
+                print("Adding idempotency_key column to gate_scan_logs...")
+                await conn.execute(text("ALTER TABLE gate_scan_logs ADD COLUMN idempotency_key VARCHAR(255) NULL"))
+                await conn.execute(text("CREATE UNIQUE INDEX ix_gate_scan_logs_idempotency_key ON gate_scan_logs (idempotency_key)"))
+
+            print("Gate scan batch migration checked/applied.")
+    except Exception as e:
+        print(f"Gate scan batch migration skipped/failed: {e}")
+
+async def migrate_activity_indexes():
+    """Manual migration to add the (time, id) indexes the activity timeline pages through."""
+    print("Checking activity timeline indexes...")
+    indexes = {
+        "entry_logs": ("ix_entry_logs_entry_time_id", "entry_time"),
+        "vehicle_logs": ("ix_vehicle_logs_entry_time_id", "entry_time"),
+        "visitors": ("ix_visitors_time_in_id", "time_in"),
+        "gate_scan_logs": ("ix_gate_scan_logs_timestamp_id", "timestamp"),
+    }
+    try:
+        async with engine.begin() as conn:
+            def get_indexes(connection):
+                from sqlalchemy import inspect
+                inspector = inspect(connection)
+                return {
+                    table: [i["name"] for i in inspector.get_indexes(table)]
+                    for table in indexes if inspector.has_table(table)
+                }
+
+            existing = await conn.run_sync(get_indexes)
+            for table, (name, column) in indexes.items():
+                if table in existing and name not in existing[table]:
+                    print(f"Adding {name} to {table}...")
+                    await conn.execute(text(f"CREATE INDEX {name} ON {table} ({column}, id)"))
+
+            print("Activity timeline indexes checked/applied.")
+    except Exception as e:
+        print(f"Activity timeline index migration skipped/failed: {e}")
+
+async def migrate_roster_sync():
+    """Manual migration to add the updated_at change cursor to users, vehicles and visitors."""
+    print("Checking roster sync schema migration...")
+    try:
+        async with engine.begin() as conn:
+            def get_cols(connection):
+                from sqlalchemy import inspect
+                inspector = inspect(connection)
+                return {
+                    table: [c['name'] for c in inspector.get_columns(table)]
+                    for table in ('users', 'vehicles', 'visitors') if inspector.has_table(table)
+                }
+
+            columns = await conn.run_sync(get_cols)
+            for table, cols in columns.items():
+                if "updated_at" not in cols:
+                    print(f"Adding updated_at column to {table}...")
+                    await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN updated_at DATETIME NULL"))
+                    await conn.execute(text(f"UPDATE {table} SET updated_at = :now"), {"now": get_eat_time()})
+                    await conn.execute(text(f"CREATE INDEX ix_{table}_updated_at ON {table} (updated_at)"))
+
+            print("Roster sync schema migration checked/applied.")
+    except Exception as e:
+        print(f"Roster sync schema migration skipped/failed: {e}")
+
+async def migrate_class_session_slots():
+    """Manual migration to make (timetable_slot_id, session_date) unique on class_sessions."""
+    print("Checking class_sessions slot/date uniqueness...")
+    try:
+        async with engine.begin() as conn:
+            def get_state(connection):
+                from sqlalchemy import inspect
+                inspector = inspect(connection)
+                if not inspector.has_table('class_sessions'): return None
+                names = [i["name"] for i in inspector.get_indexes('class_sessions')]
+                names += [c["name"] for c in inspector.get_unique_constraints('class_sessions')]
+                return names
+
+            names = await conn.run_sync(get_state)
+            if names is not None and "uq_class_sessions_slot_date" not in names:
+                # Sessions created twice for the same slot and day (racing first scans) keep their
+                # attendance but become ad-hoc, all but the earliest-starting one per slot and day
+                rows = (await conn.execute(text(
+                    "SELECT id, timetable_slot_id, session_date FROM class_sessions "
+                    "WHERE timetable_slot_id IS NOT NULL ORDER BY timetable_slot_id, session_date, start_time, id"
+                ))).all()
+                seen = set()
+                duplicates = []
+                for row in rows:
+                    key = (row[1], row[2])
+                    if key in seen:
+                        duplicates.append(row[0])
+                    seen.add(key)
+                for session_id in duplicates:
+                    await conn.execute(text("UPDATE class_sessions SET timetable_slot_id = NULL WHERE id = :id"), {"id": session_id})
+                print(f"Adding uq_class_sessions_slot_date ({len(duplicates)} duplicate sessions detached)...")
+                await conn.execute(text(
+                    "CREATE UNIQUE INDEX uq_class_sessions_slot_date ON class_sessions (timetable_slot_id, session_date)"
+                ))
+
+            print("Class session uniqueness migration checked/applied.")
+    except Exception as e:
+        print(f"Class session uniqueness migration skipped/failed: {e}")
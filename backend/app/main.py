@@ -1,10 +1,26 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles # Import StaticFiles
-from app.database import init_db, get_session
+from app.database import init_db, get_session, engine
 from app.models import * 
 from app.auth import create_access_token, get_password_hash, verify_password, verify_ldap_login, verify_google_token, get_current_user
-from app.utils.audit import log_action
+from app.utils.audit import log_action, audit_writer
+from app.utils.access_queue import access_queue
+from app.utils.schedule_index import schedule_index, materialize_sessions
+from app.utils.timezone import get_eat_time
+from app.utils.identity_index import identity_index
+from app.utils.presence import presence
+from app.utils import traffic_rollup
+from app.utils.gate_feed import gate_feed
+from app.utils.reference_cache import reference_cache
+from app.utils.plate_ocr import plate_ocr
+from app.utils.evidence import evidence_pool
+from app.utils.photo_hash import photo_hash_index
+from app.utils.live_attendance import live_attendance
+from app.utils.media_store import MediaFiles, MEDIA_DIR, MEDIA_URL
+from app.utils.redis_client import close_redis
+from app.utils.timing import RequestTimingMiddleware, install as install_timing
+from app.utils.idempotency import IdempotencyMiddleware
 from app.routers import dashboard, users, gate_control, attendance, admin, external_sync
 from pydantic import BaseModel
 from sqlmodel import select
@@ -14,6 +30,7 @@ from contextlib import asynccontextmanager
 import os
 import asyncio
 import sys
+from datetime import timedelta
 
 # Set Windows event loop policy for compatibility with aiomysql/asyncio on Windows
 if sys.platform == 'win32':
@@ -21,6 +38,7 @@ if sys.platform == 'win32':
 
 # Create static directory if not exists
 os.makedirs("static/profiles", exist_ok=True)
+os.makedirs(MEDIA_DIR, exist_ok=True)
 
 # Seed Data
 async def seed_data(session: AsyncSession):
@@ -419,6 +437,73 @@ async def lifespan(app: FastAPI):
                 break
         except Exception as e:
             print(f"Seed data failed: {e}")
+
+        # Warm the gate scan identity index so the first scans skip SQL probing
+        try:
+            async for session in get_session():
+                await identity_index.warm(session)
+                break
+        except Exception as e:
+            print(f"Identity index warm-up failed: {e}")
+
+        # Load who is currently inside so gate toggles need no open-log query
+        try:
+            async for session in get_session():
+                await presence.rebuild(session)
+                break
+            presence.start_sync()
+        except Exception as e:
+            print(f"Presence table rebuild failed: {e}")
+
+        # The hourly traffic rollup is kept by ORM hooks; history needs a one-off backfill
+        try:
+            async for session in get_session():
+                await traffic_rollup.check(session)
+                break
+        except Exception as e:
+            print(f"Gate traffic rollup check failed: {e}")
+
+        # Backfill the gate console ring buffers so /ws/gate snapshots need no SQL
+        try:
+            async for session in get_session():
+                await gate_feed.seed(session)
+                break
+            gate_feed.start_sync()
+        except Exception as e:
+            print(f"Gate feed seed failed: {e}")
+
+        # Today's classroom schedule, so classroom QR scans resolve their session without SQL.
+        # Sessions for today and tomorrow are created up front in case the nightly job was missed.
+        try:
+            async for session in get_session():
+                today = get_eat_time().date()
+                for day in (today, today + timedelta(days=1)):
+                    await materialize_sessions(session, day)
+                await session.commit()
+                await schedule_index.ensure(session)
+                break
+            schedule_index.start_sync()
+        except Exception as e:
+            print(f"Schedule index build failed: {e}")
+
+        # The term's evidence photo hashes, so reused photos are caught from the first upload
+        try:
+            async for session in get_session():
+                await photo_hash_index.ensure(session)
+                break
+            photo_hash_index.start_sync()
+            print(f"Photo hash index loaded with {photo_hash_index.stats()['photos']} photos")
+        except Exception as e:
+            print(f"Photo hash index build failed: {e}")
+
+        reference_cache.start_sync()
+        live_attendance.start_sync()
+        audit_writer.start()
+        access_queue.start()
+
+    # Plate OCR and attendance photos run in their own processes; start them before the first photo arrives
+    plate_ocr.start()
+    evidence_pool.start()
     
     # Start Scheduler
     try:
@@ -435,6 +520,17 @@ async def lifespan(app: FastAPI):
              scheduler.shutdown()
     except:
         pass
+    await presence.stop_sync()
+    await gate_feed.stop_sync()
+    await reference_cache.stop_sync()
+    await schedule_index.stop_sync()
+    await photo_hash_index.stop_sync()
+    await live_attendance.stop_sync()
+    await access_queue.stop()
+    await audit_writer.stop()
+    plate_ocr.shutdown()
+    evidence_pool.shutdown()
+    await close_redis()
 
 app = FastAPI(title="Smart Campus System", version="1.0.0", lifespan=lifespan)
 
@@ -446,10 +542,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "Idempotent-Replayed"],
 )
 
+# Retried scan/check-in POSTs carrying an Idempotency-Key get the first response back
+app.add_middleware(IdempotencyMiddleware)
+
+# Per-stage latency of the scan endpoints (/api/admin/metrics/timing, Server-Timing header)
+install_timing(engine)
+app.add_middleware(RequestTimingMiddleware)
+
 # Mount Static Files
 os.makedirs("uploads", exist_ok=True)
+# Content-addressed uploads are immutable; mounted ahead of /static so they get long-lived cache headers
+app.mount(MEDIA_URL, MediaFiles(directory=MEDIA_DIR), name="media")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
@@ -458,16 +564,14 @@ import ipaddress
 async def is_ip_allowed(ip_address: str, session: AsyncSession) -> bool:
     """Check if an IP address is allowed based on geofence settings."""
     # 1. Check if geofencing is enabled (global toggle)
-    stmt = select(SystemConfig).where(SystemConfig.key == "enable_geofencing")
-    config = (await session.exec(stmt)).first()
-    if not config or config.value.lower() != "true":
+    enabled = await reference_cache.get_config(session, "enable_geofencing")
+    if not enabled or enabled.lower() != "true":
         return True # Geofencing disabled
         
     # 2. Get active geofence settings
-    stmt = select(GeofenceSetting).where(GeofenceSetting.is_active == True)
-    settings = (await session.exec(stmt)).all()
+    ip_ranges = await reference_cache.get_geofence_ranges(session)
     
-    if not settings:
+    if not ip_ranges:
         # If enabled but no rules, we block all for security (Whitelist mode)
         return False 
 
@@ -476,9 +580,9 @@ async def is_ip_allowed(ip_address: str, session: AsyncSession) -> bool:
     except ValueError:
         return False # Invalid IP
         
-    for setting in settings:
+    for ip_range in ip_ranges:
         # Range can be "192.168.1.0/24" or "192.168.1.1, 192.168.1.2"
-        ranges = [r.strip() for r in setting.ip_range.split(",")]
+        ranges = [r.strip() for r in ip_range.split(",")]
         for r in ranges:
             try:
                 if "/" in r:
@@ -540,8 +644,7 @@ async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequ
                 
                 # Fetch detailed attributes if possible using LDAPClient
                 from app.utils.ldap import LDAPClient
-                configs = (await session.exec(select(SystemConfig))).all()
-                config_dict = {c.key: c.value for c in configs}
+                config_dict = await reference_cache.get_configs(session)
                 uri = config_dict.get('ldap_server_uri')
                 bind_dn = config_dict.get('ldap_bind_dn')
                 bind_password = config_dict.get('ldap_bind_password')
@@ -588,6 +691,7 @@ async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequ
                 query = select(User).where(User.id == user.id).options(selectinload(User.role))
                 result = await session.exec(query)
                 user = result.first()
+                identity_index.remember_user(user)
                 print(f"Auto-provisioned local user {user.full_name}")
         else:
             # 2. LDAP verification failed or wasn't configured: fallback to local database authentication
@@ -754,6 +858,7 @@ async def register(
     try:
         await session.commit()
         await session.refresh(new_user)
+        identity_index.remember_user(new_user)
         
         # Log the creation
         await log_action(
@@ -836,6 +941,9 @@ async def ldap_login(req: LDAPLoginRequest, session: AsyncSession = Depends(get_
 app.include_router(dashboard.router, prefix="/api/dashboard", tags=["dashboard"])
 app.include_router(users.router, prefix="/api/users", tags=["users"])
 app.include_router(gate_control.router, prefix="/api/gate", tags=["gate"])
+# Import and include activity timeline router
+from app.routers import activity
+app.include_router(activity.router, prefix="/api/activity", tags=["activity"])
 app.include_router(attendance.router, prefix="/api/attendance", tags=["attendance"])
 app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
 # Import and include fleet router
@@ -874,6 +982,19 @@ app.include_router(reports.router, prefix="/api/reports", tags=["reports"])
 # Import and include audit router
 from app.routers import audit
 app.include_router(audit.router, prefix="/api/audit", tags=["audit"])
+
+# Gate console push feed (WebSocket)
+from app.routers import gate_feed as gate_feed_router
+app.include_router(gate_feed_router.router, tags=["gate"])
+# Persistent scan channel for gate devices (WebSocket)
+from app.routers import scanner
+app.include_router(scanner.router, tags=["gate"])
+# Live attendance for the lecturer view (WebSocket)
+from app.routers import attendance_feed
+app.include_router(attendance_feed.router, tags=["attendance"])
+# Offline roster sync for gate devices
+from app.routers import roster
+app.include_router(roster.router, prefix="/api/gate", tags=["gate"])
 app.include_router(external_sync.router, prefix="/api/external-sync", tags=["external_sync"])
 
 # Import and include academic dashboards router
@@ -895,11 +1016,10 @@ async def get_public_config(request: Request, session: AsyncSession = Depends(ge
     """
     Publicly accessible configuration (e.g., for Login page).
     """
-    stmt = select(SystemConfig).where(SystemConfig.key == "demo_mode")
-    config = (await session.exec(stmt)).first()
+    demo_mode = await reference_cache.get_config(session, "demo_mode")
     
     is_demo = False
-    if config and config.value.lower() == "true":
+    if demo_mode and demo_mode.lower() == "true":
         is_demo = True
 
     # Detect local LAN IP
@@ -920,12 +1040,11 @@ async def get_public_config(request: Request, session: AsyncSession = Depends(ge
     req_host = request.url.hostname or "localhost"
     
     # Check if there is a stored setting for system domain
-    domain_stmt = select(SystemConfig).where(SystemConfig.key == "system_domain_or_ip")
-    domain_config = (await session.exec(domain_stmt)).first()
+    domain_config = await reference_cache.get_config(session, "system_domain_or_ip")
     
     server_host = None
-    if domain_config and domain_config.value and domain_config.value not in ["localhost", "127.0.0.1", "::1"]:
-        server_host = domain_config.value
+    if domain_config and domain_config not in ["localhost", "127.0.0.1", "::1"]:
+        server_host = domain_config
     elif req_host not in ["localhost", "127.0.0.1", "::1"]:
         server_host = req_host
     else:
@@ -954,10 +1073,9 @@ async def demo_login(req: DemoLoginRequest, request: Request, session: AsyncSess
     ONLY works if 'demo_mode' system config is set to 'true'.
     """
     # 1. Check if Demo Mode is enabled
-    stmt = select(SystemConfig).where(SystemConfig.key == "demo_mode")
-    config = (await session.exec(stmt)).first()
+    demo_mode = await reference_cache.get_config(session, "demo_mode")
     
-    if not config or config.value.lower() != "true":
+    if not demo_mode or demo_mode.lower() != "true":
         raise HTTPException(status_code=403, detail="Demo mode is not enabled")
     
     # 2. Select Target User based on Role
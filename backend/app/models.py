@@ -3,7 +3,7 @@ from datetime import datetime, date, time
 from uuid import UUID, uuid4
 from sqlmodel import SQLModel, Field, Relationship, Column, ARRAY
 # from pgvector.sqlalchemy import Vector # Commented out for MySQL Local Dev
-from sqlalchemy import JSON, Text
+from sqlalchemy import JSON, Text, UniqueConstraint, Index
 from app.utils.timezone import get_eat_time
 
 
@@ -29,6 +29,8 @@ class User(UUIDModel, table=True):
     status: str = Field(default="Active") # Active, Graduated, Suspended, Registered, Deferred, Unregistered
     has_smartphone: bool = Field(default=False)
     created_at: datetime = Field(default_factory=get_eat_time)
+    # Roster sync change cursor (app.utils.roster); bumped on every ORM update
+    updated_at: Optional[datetime] = Field(default_factory=get_eat_time, index=True, sa_column_kwargs={"onupdate": get_eat_time})
     
     # New Fields
     profile_image: Optional[str] = None
@@ -102,6 +104,12 @@ class Gate(UUIDModel, table=True):
 
 class EntryLog(UUIDModel, table=True):
     __tablename__ = "entry_logs"
+    # Keyset order of the activity timeline (app.utils.activity)
+    __table_args__ = (
+        Index("ix_entry_logs_entry_time_id", "entry_time", "id"),
+        # Open-log lookup that confirms a presence-table miss
+        Index("ix_entry_logs_user_id_exit_time", "user_id", "exit_time"),
+    )
     user_id: UUID = Field(foreign_key="users.id")
     gate_id: UUID = Field(foreign_key="gates.id")
     exit_gate_id: Optional[UUID] = Field(default=None, foreign_key="gates.id", nullable=True)
@@ -117,6 +125,7 @@ class EntryLog(UUIDModel, table=True):
 
 class GateScanLog(UUIDModel, table=True):
     __tablename__ = "gate_scan_logs"
+    __table_args__ = (Index("ix_gate_scan_logs_timestamp_id", "timestamp", "id"),)
     timestamp: datetime = Field(default_factory=get_eat_time, index=True)
     scan_type: str
     scanned_value: Optional[str] = None
@@ -127,6 +136,8 @@ class GateScanLog(UUIDModel, table=True):
     scanner_name: Optional[str] = None
     
     details: Optional[str] = None
+    # Device-generated key for scans uploaded through /api/gate/scan/batch
+    idempotency_key: Optional[str] = Field(default=None, unique=True, index=True, max_length=255)
     
     gate: Optional[Gate] = Relationship()
 
@@ -158,6 +169,7 @@ class Vehicle(UUIDModel, table=True):
     
     # Status
     status: str = "active" # active, maintenance, inactive, trip
+    updated_at: Optional[datetime] = Field(default_factory=get_eat_time, index=True, sa_column_kwargs={"onupdate": get_eat_time})
     
     # Metadata
     insurance_expiry: Optional[date] = None
@@ -173,6 +185,10 @@ class Vehicle(UUIDModel, table=True):
 
 class VehicleLog(UUIDModel, table=True):
     __tablename__ = "vehicle_logs"
+    __table_args__ = (
+        Index("ix_vehicle_logs_entry_time_id", "entry_time", "id"),
+        Index("ix_vehicle_logs_vehicle_id_exit_time", "vehicle_id", "exit_time"),
+    )
     vehicle_id: UUID = Field(foreign_key="vehicles.id")
     vehicle_images: Optional[dict] = Field(default={}, sa_column=Column(JSON))
     detected_passengers: Optional[int] = None
@@ -187,6 +203,18 @@ class VehicleLog(UUIDModel, table=True):
 
     vehicle: Vehicle = Relationship(back_populates="logs")
 
+class GateTrafficHourly(UUIDModel, table=True):
+    """Per-gate hourly counts of EntryLog/VehicleLog traffic, kept current by app.utils.traffic_rollup"""
+    __tablename__ = "gate_traffic_hourly"
+    __table_args__ = (UniqueConstraint("gate_id", "hour", name="uq_gate_traffic_hourly_gate_hour"),)
+    gate_id: UUID = Field(foreign_key="gates.id", index=True)
+    hour: datetime = Field(index=True) # EAT, truncated to the hour
+    people_in: int = Field(default=0)
+    people_out: int = Field(default=0)
+    vehicles_in: int = Field(default=0)
+    vehicles_out: int = Field(default=0)
+    rejected: int = Field(default=0) # Gate entries with a status other than "allowed"
+
 # --- Fleet Management System Models ---
 
 class FleetTrip(UUIDModel, table=True):
@@ -374,6 +402,8 @@ class TimetableSlot(UUIDModel, table=True):
 class ClassSession(UUIDModel, table=True):
     """Individual class sessions (generated from timetable or ad-hoc)"""
     __tablename__ = "class_sessions"
+    # One session per slot per day; ad-hoc sessions (no slot) are not constrained
+    __table_args__ = (UniqueConstraint("timetable_slot_id", "session_date", name="uq_class_sessions_slot_date"),)
     
     course_id: UUID = Field(foreign_key="courses.id")
     timetable_slot_id: Optional[UUID] = Field(default=None, foreign_key="timetable_slots.id")
@@ -401,7 +431,7 @@ class AttendanceRecord(UUIDModel, table=True):
     __tablename__ = "attendance_records"
     session_id: UUID = Field(foreign_key="class_sessions.id")
     student_id: UUID = Field(foreign_key="users.id")
-    scan_time: datetime = Field(default_factory=get_eat_time)
+    scan_time: datetime = Field(default_factory=get_eat_time, index=True)
     live_image: Optional[str] = None
     face_match_score: Optional[float] = None
     assisted_by: Optional[UUID] = Field(foreign_key="users.id", nullable=True)
@@ -409,6 +439,8 @@ class AttendanceRecord(UUIDModel, table=True):
     connection_type: Optional[str] = None
     connection_name: Optional[str] = None
     metadata_info: Optional[str] = None # JSON string
+    # 64-bit perceptual hash (dHash, hex) of live_image, for spotting reused photos
+    photo_hash: Optional[str] = Field(default=None, max_length=16)
 
     session: ClassSession = Relationship(back_populates="attendance")
     cheating_flags: List["CheatingFlag"] = Relationship(back_populates="attendance_record")
@@ -549,6 +581,7 @@ class ScanLog(UUIDModel, table=True):
 
 class Visitor(UUIDModel, table=True):
     __tablename__ = "visitors"
+    __table_args__ = (Index("ix_visitors_time_in_id", "time_in", "id"),)
     
     first_name: str
     last_name: str
@@ -563,6 +596,14 @@ class Visitor(UUIDModel, table=True):
     
     gate_id: Optional[UUID] = Field(foreign_key="gates.id", nullable=True) # Link to Gate
     status: str = "checked_in"
+    updated_at: Optional[datetime] = Field(default_factory=get_eat_time, index=True, sa_column_kwargs={"onupdate": get_eat_time})
+
+class RosterTombstone(UUIDModel, table=True):
+    """A deleted user, vehicle or visitor, so gate devices can drop it on their next roster sync"""
+    __tablename__ = "roster_tombstones"
+    kind: str # user, vehicle, visitor, or "*" when the whole roster was reset with raw SQL
+    entity_id: Optional[UUID] = None
+    deleted_at: datetime = Field(default_factory=get_eat_time, index=True)
 
 # Event Management Models
 class Event(UUIDModel, table=True):
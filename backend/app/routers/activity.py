@@ -0,0 +1,32 @@
+import uuid
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.database import get_session
+from app.models import User
+from app.auth import get_current_user
+from app.utils import activity
+
+router = APIRouter()
+
+@router.get("")
+async def get_activity(
+    cursor: Optional[str] = None,
+    limit: int = activity.DEFAULT_PAGE,
+    gate_id: Optional[uuid.UUID] = None,
+    types: Optional[str] = None, # comma separated: user,vehicle,visitor,scan
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Merged gate activity timeline, newest first; pass next_cursor back to scroll further"""
+    kinds = [t.strip() for t in types.split(",") if t.strip()] if types else None
+    try:
+        items, next_cursor = await activity.timeline(
+            session, limit=limit, cursor=cursor, gate_id=gate_id, types=kinds, since=since, until=until
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items, "next_cursor": next_cursor}
@@ -5,6 +5,18 @@ from app.database import get_session
 from app.models import SystemConfig, User, Role, Course, Classroom, TimetableSlot, ScanLog
 from app.auth import get_current_user, get_password_hash
 from app.utils.audit import log_action
+from app.utils.identity_index import identity_index
+from app.utils.presence import presence
+from app.utils import traffic_rollup
+from app.utils import roster
+from app.utils.reference_cache import reference_cache
+from app.utils.timing import timing_stats
+from app.utils.idempotency import idempotency_store
+from app.utils.access_queue import access_queue
+from app.utils.evidence import evidence_pool, EvidenceBusy, EvidenceTooLarge, EVIDENCE_MAX_BYTES
+from app.utils.media_store import save_upload, save_bytes
+from app.utils.photo_hash import photo_hash_index
+from app.utils.live_attendance import live_attendance
 import csv
 import io
 import uuid
@@ -17,7 +29,7 @@ router = APIRouter()
 # Dependency: Ensure Admin
 async def ensure_admin(current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
     # Fetch role name
-    role = await session.get(Role, current_user.role_id)
+    role = await reference_cache.get_role(session, current_user.role_id)
     if not role or role.name not in ["SuperAdmin", "Admin"]:
         raise HTTPException(status_code=403, detail="Administrator access required")
     return current_user
@@ -46,6 +58,7 @@ async def update_settings(
             session.add(new_config)
             
     await session.commit()
+    reference_cache.invalidate("configs")
     
     await log_action(
         session=session,
@@ -101,6 +114,7 @@ async def save_dashboard_config(
         session.add(new_config)
     
     await session.commit()
+    reference_cache.invalidate("configs")
     
     await log_action(
         session=session,
@@ -167,6 +181,11 @@ async def factory_reset_users(
         
         # Commit the transaction
         await session.commit()
+        identity_index.invalidate()
+        await presence.refresh()
+        await traffic_rollup.refresh()
+        # Raw DELETEs leave no tombstones; make gate devices re-download their roster
+        await roster.mark_reset(session)
         
         await log_action(
             session=session,
@@ -226,6 +245,7 @@ async def save_company_settings(
         session.add(new_config)
     
     await session.commit()
+    reference_cache.invalidate("configs")
     
     try:
         await log_action(
@@ -250,29 +270,22 @@ async def upload_logo(
     admin: User = Depends(ensure_admin)
 ):
     """Upload company logo"""
-    import os
-    import shutil
-    from pathlib import Path
-    
     # Validate file type
     if not logo.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File must be an image")
     
-    # Create uploads directory if it doesn't exist
-    upload_dir = Path("uploads/logos")
-    upload_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Generate unique filename
+    # Save file (formats Pillow cannot re-encode, e.g. SVG, are kept as uploaded)
     file_extension = logo.filename.split('.')[-1]
-    filename = f"logo_{uuid.uuid4()}.{file_extension}"
-    file_path = upload_dir / filename
-    
-    # Save file
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(logo.file, buffer)
+    try:
+        stored = await save_upload(logo, "logos", fallback_ext=file_extension)
+    except EvidenceBusy:
+        raise HTTPException(status_code=429, detail="Too many images being processed. Please retry.", headers={"Retry-After": "2"})
+    except EvidenceTooLarge as e:
+        raise HTTPException(status_code=413, detail=f"Logo too large: {e}")
     
     # Return URL
-    logo_url = f"/uploads/logos/{filename}"
+    logo_url = stored["url"]
+    filename = logo_url.rsplit("/", 1)[-1]
     
     await log_action(
         session=session,
@@ -378,6 +391,7 @@ async def bulk_upload_lecturers(
                 error_count += 1
                 errors.append(f"Row {row_num}: {str(e)}")
         
+        identity_index.invalidate()
         return {
             "success": True,
             "added": added_count,
@@ -510,6 +524,7 @@ async def bulk_upload_students(
                 error_count += 1
                 errors.append(f"Row {row_num}: {str(e)}")
         
+        identity_index.invalidate()
         return {
             "success": True,
             "added": added_count,
@@ -920,6 +935,7 @@ async def create_geofence_setting(
         action = "create_geofence"
         
     await session.commit()
+    reference_cache.invalidate("geofences")
     
     await log_action(
         session=session,
@@ -947,6 +963,7 @@ async def delete_geofence_setting(
         
     await session.delete(setting)
     await session.commit()
+    reference_cache.invalidate("geofences")
     
     await log_action(
         session=session,
@@ -974,7 +991,6 @@ async def bulk_upload_photos(
     """
     import zipfile
     import os
-    import shutil
     import csv
     from io import StringIO
     from pathlib import Path
@@ -1128,19 +1144,11 @@ async def bulk_upload_photos(
                     
 
                         if user:
-                            # Save Image
-                            ext = os.path.splitext(name_only)[1].lower()
-                            if ext not in ['.jpg', '.jpeg', '.png', '.webp', '.gif']:
-                                ext = '.jpg' # Fallback
-                                
-                            new_filename = f"profile_{user.id}_{uuid.uuid4().hex[:8]}{ext}"
-                            target_path = Path("static/profiles") / new_filename
-                            target_path.parent.mkdir(parents=True, exist_ok=True)
+                            # Save Image (recompressed in the image pool; identical photos are stored once)
+                            with zip_ref.open(file_name) as source:
+                                stored = await save_bytes(source.read(EVIDENCE_MAX_BYTES + 1), "profiles")
                             
-                            with zip_ref.open(file_name) as source, open(target_path, "wb") as target:
-                                shutil.copyfileobj(source, target)
-                            
-                            user.profile_image = f"/static/profiles/{new_filename}"
+                            user.profile_image = stored["url"]
                             session.add(user)
                             
                             # Audit Trail Logging
@@ -1185,6 +1193,41 @@ async def bulk_upload_photos(
         "errors": errors
     }
 
+@router.get("/metrics/timing")
+async def get_timing_metrics(admin: User = Depends(ensure_admin)):
+    """Per-stage latency and SQL count histograms for the scan endpoints (this worker only)"""
+    return timing_stats.snapshot()
+
+@router.delete("/metrics/timing")
+async def reset_timing_metrics(admin: User = Depends(ensure_admin)):
+    timing_stats.reset()
+    return {"message": "Timing metrics reset"}
+
+@router.get("/metrics/idempotency")
+async def get_idempotency_metrics(admin: User = Depends(ensure_admin)):
+    """Stored and replayed Idempotency-Key responses (this worker only)"""
+    return idempotency_store.stats()
+
+@router.get("/metrics/live-attendance")
+async def get_live_attendance_metrics(admin: User = Depends(ensure_admin)):
+    """Lecturer live views: sessions watched, viewers, rows held and pushed (this worker only)"""
+    return live_attendance.stats()
+
+@router.get("/metrics/photo-hash")
+async def get_photo_hash_metrics(admin: User = Depends(ensure_admin)):
+    """Reused-photo index: photos indexed, bucket counts, lookups and matches (this worker only)"""
+    return photo_hash_index.stats()
+
+@router.get("/metrics/evidence")
+async def get_evidence_metrics(admin: User = Depends(ensure_admin)):
+    """Image pool (attendance photos and other uploads): bytes in flight, processed and rejected images (this worker only)"""
+    return evidence_pool.stats()
+
+@router.get("/metrics/access-queue")
+async def get_access_queue_metrics(admin: User = Depends(ensure_admin)):
+    """Self-service check-in queue depth, batches and throttled callers (this worker only)"""
+    return access_queue.stats()
+
 @router.get("/scan-logs")
 async def get_scan_logs(limit: int = 100, session: AsyncSession = Depends(get_session)):
     # Join ScanLog with User and optionally Classroom
@@ -1318,8 +1361,7 @@ async def sync_ad(
 ):
     try:
         from ldap3 import Server, Connection, ALL, SUBTREE
-        configs = (await session.exec(select(SystemConfig))).all()
-        config_dict = {c.key: c.value for c in configs}
+        config_dict = await reference_cache.get_configs(session)
         
         server_uri = config_dict.get('ldap_server_uri')
         bind_dn = config_dict.get('ldap_bind_dn')
@@ -1396,6 +1438,7 @@ async def sync_ad(
                     
         if current_batch > 0:
             await session.commit()
+        identity_index.invalidate()
             
         return {"status": "success", "message": "Synchronization completed", "new_accounts_count": added_count}
         
@@ -1822,6 +1865,7 @@ async def sync_dynamics_records(
                 synced_registrations_count += 1
                 await session.commit()
 
+    identity_index.invalidate()
     return {
         "status": "success",
         "added_students": synced_students_count,
@@ -4,6 +4,7 @@ from sqlmodel import select
 from app.database import get_session
 from app.models import SystemConfig, User
 from app.auth import get_current_user
+from app.utils.reference_cache import reference_cache
 import json
 
 router = APIRouter()
@@ -50,6 +51,7 @@ async def save_ai_config(
         session.add(new_config)
     
     await session.commit()
+    reference_cache.invalidate("configs")
     return {"status": "success"}
 
 @router.post("/ai-test/{service}")
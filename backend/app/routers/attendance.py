@@ -1,15 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Request, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Request, UploadFile, File, Form, Query
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlmodel import select, col
 from sqlalchemy import func
 from app.database import get_session
-from app.models import Course, ClassSession, AttendanceRecord, User, TimetableSlot, Classroom, ScanLog
+from app.models import Course, ClassSession, AttendanceRecord, User, TimetableSlot, Classroom, ScanLog, CheatingFlag
 from app.auth import get_current_user
-from datetime import datetime, date, timedelta
+from datetime import datetime, date, time, timedelta
 from app.utils.timezone import get_eat_time
+from app.utils.timing import span, timed
+from app.utils import qr_signing
+from app.utils.schedule_index import slots_running_on
+from app.utils.evidence import evidence_pool, EvidenceBusy, EvidenceTooLarge
+from app.utils.media_store import save_upload
+from app.utils.live_attendance import load_rows, IPHistogram, flag_outliers
+from app.utils.photo_hash import photo_hash_index, PhotoEntry, PHOTO_HASH_MAX_FLAGS
+from app.utils.exports import stream_rows, export_response, day_range, ExportFormatInvalid
 import uuid
 import json
-from typing import List
+from typing import List, Optional
 
 router = APIRouter()
 
@@ -86,20 +94,6 @@ async def start_session(
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
 
-    new_session = ClassSession(
-        course_id=uuid.UUID(course_id),
-        timetable_slot_id=slot.id if slot else None,
-        session_date=start_time.date(),
-        start_time=start_time.time(),
-        end_time=end_time.time(),
-        qr_code=str(uuid.uuid4()), # Secret token
-        room_unique_number=room_unique,
-        classroom_id=slot.classroom_id if slot else course.classroom_id,
-        lecturer_id=current_user.id, # The person who starts it is the lecturer
-        status="ongoing",
-        active=True
-    )
-
     # Deactivate other active sessions for this lecturer to prevent confusion
     existing_sessions = await session.exec(
         select(ClassSession).where(
@@ -111,6 +105,30 @@ async def start_session(
         s.active = False
         s.status = "completed"
         session.add(s)
+
+    # The slot's session for today is normally materialized already; start that one
+    new_session = None
+    if slot:
+        new_session = (await session.exec(
+            select(ClassSession).where(
+                ClassSession.timetable_slot_id == slot.id,
+                ClassSession.session_date == start_time.date()
+            )
+        )).first()
+    if not new_session:
+        new_session = ClassSession(
+            course_id=uuid.UUID(course_id),
+            timetable_slot_id=slot.id if slot else None,
+            session_date=start_time.date()
+        )
+    new_session.start_time = start_time.time()
+    new_session.end_time = end_time.time()
+    new_session.qr_code = str(uuid.uuid4()) # Secret token
+    new_session.room_unique_number = room_unique
+    new_session.classroom_id = slot.classroom_id if slot else course.classroom_id
+    new_session.lecturer_id = current_user.id # The person who starts it is the lecturer
+    new_session.status = "ongoing"
+    new_session.active = True
     
     session.add(new_session)
     await session.commit()
@@ -128,8 +146,6 @@ async def activate_all_classes(
     2. Activates 'Open Study' sessions for any room without a schedule to ensure GLOBAL system availability.
     """
     today = get_eat_time().date()
-    now = get_eat_time()
-    day_of_week = now.weekday()
     
     activated_count = 0
     already_active = 0
@@ -152,32 +168,42 @@ async def activate_all_classes(
         await session.commit()
         await session.refresh(open_course)
 
-    # 3. Iterate all rooms and ensure they have an active session
-    for room in classrooms:
-        # Check if room already has an active session
-        existing_session = (await session.exec(
+    # 3. Ensure every room has an active session, from three set queries instead of two per room
+    active_rooms = set((await session.exec(
+        select(ClassSession.classroom_id).where(
+            ClassSession.active == True,
+            ClassSession.session_date == today
+        )
+    )).all())
+    # First slot of the day per room (Simplification: the room runs that class)
+    room_slots = {}
+    for slot in (await session.exec(
+        select(TimetableSlot).where(slots_running_on(today)).order_by(TimetableSlot.start_time)
+    )).all():
+        room_slots.setdefault(slot.classroom_id, slot)
+    slot_sessions = {}
+    if room_slots:
+        slot_sessions = {s.timetable_slot_id: s for s in (await session.exec(
             select(ClassSession).where(
-                ClassSession.classroom_id == room.id,
-                ClassSession.active == True,
-                ClassSession.session_date == today
+                ClassSession.session_date == today,
+                ClassSession.timetable_slot_id.in_([slot.id for slot in room_slots.values()])
             )
-        )).first()
+        )).all()}
 
-        if existing_session:
+    for room in classrooms:
+        if room.id in active_rooms:
             already_active += 1
             continue
 
-        # Check for a specific timetable slot for this room right now/today
-        # (Simplification: If multiple slots exist, we pick the first one matching today)
-        slot_query = (
-            select(TimetableSlot)
-            .where(
-                TimetableSlot.classroom_id == room.id,
-                TimetableSlot.day_of_week == day_of_week,
-                TimetableSlot.is_active == True
-            )
-        )
-        slot = (await session.exec(slot_query)).first()
+        slot = room_slots.get(room.id)
+        if slot and slot.id in slot_sessions:
+            # Today's session for the slot exists but was ended: reopen it
+            existing_session = slot_sessions[slot.id]
+            existing_session.active = True
+            existing_session.status = "ongoing"
+            session.add(existing_session)
+            activated_count += 1
+            continue
 
         new_session = ClassSession(
             course_id=slot.course_id if slot else open_course.id,
@@ -220,6 +246,7 @@ async def get_my_active_session(
     return (await session.exec(query)).first()
 
 @router.post("/mark")
+@timed("attendance_mark")
 async def mark_attendance(
     request: Request,
     file: UploadFile = File(...),
@@ -230,15 +257,13 @@ async def mark_attendance(
     session: AsyncSession = Depends(get_session)
 ):
     try:
-        from PIL import Image
-        import io
-
         # Capture Client IP
         client_ip = request.client.host if request.client else "unknown"
         
         # 1. Fetch live session
         try:
-            class_session = await session.get(ClassSession, uuid.UUID(session_id))
+            with span("class_session"):
+                class_session = await session.get(ClassSession, uuid.UUID(session_id))
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid Session ID format")
             
@@ -250,13 +275,15 @@ async def mark_attendance(
             raise HTTPException(status_code=400, detail="Invalid QR Code")
             
         # 3. Prevent duplicate attendance
-        existing = await session.exec(
-            select(AttendanceRecord).where(
-                AttendanceRecord.session_id == class_session.id,
-                AttendanceRecord.student_id == current_user.id
+        with span("duplicate_check"):
+            existing = await session.exec(
+                select(AttendanceRecord).where(
+                    AttendanceRecord.session_id == class_session.id,
+                    AttendanceRecord.student_id == current_user.id
+                )
             )
-        )
-        if existing.first():
+            already_marked = existing.first()
+        if already_marked:
             raise HTTPException(status_code=400, detail="Attendance already marked")
             
         # 4. Anti-Cheating Logic (Photo Metadata + Environment)
@@ -266,25 +293,25 @@ async def mark_attendance(
             meta = json.loads(metadata)
         except: pass
 
-        # Check A: Photo Metadata (EXIF)
-        img_bytes = await file.read()
-        try:
-            image = Image.open(io.BytesIO(img_bytes))
-            exif = image._getexif()
-            
-            if exif:
-                # Extract interesting tags (MsgID 306=DateTime, 271=Make, 272=Model)
-                meta['camera_make'] = exif.get(271, 'Unknown')
-                meta['camera_model'] = exif.get(272, 'Unknown') 
-                meta['photo_date'] = exif.get(306, 'Unknown')
-                # meta['exif_raw'] = str(exif) # Debug only, too large
-            else:
-                status = "flagged_no_metadata"
-                meta['camera_error'] = "No EXIF found (Screenshot/Downloaded?)"
-                
-        except Exception as e:
+        # Check A: Photo Metadata (EXIF). Validation, EXIF parsing and storing the
+        # evidence photo run in the evidence process pool, off the event loop.
+        with span("image"):
+            try:
+                evidence = await evidence_pool.process_upload(file)
+            except EvidenceBusy:
+                raise HTTPException(status_code=429, detail="Too many photos being processed. Please retry.", headers={"Retry-After": "2"})
+            except EvidenceTooLarge as e:
+                raise HTTPException(status_code=413, detail=f"Photo too large: {e}")
+
+        if evidence["error"]:
             status = "flagged_corrupt_image"
-            meta['camera_error'] = f"Corrupt Image: {str(e)}"
+            meta['camera_error'] = f"Corrupt Image: {evidence['error']}"
+        elif evidence["exif"]:
+            # Extract interesting tags (MsgID 306=DateTime, 271=Make, 272=Model)
+            meta.update(evidence["exif"])
+        else:
+            status = "flagged_no_metadata"
+            meta['camera_error'] = "No EXIF found (Screenshot/Downloaded?)"
 
         # Check B: Geolocation (Browser)
         geo = meta.get('geolocation')
@@ -301,14 +328,8 @@ async def mark_attendance(
         # Prepare for Save
         meta['ip_address'] = client_ip
         
-        # Save the image evidence
-        # Ensure directory exists
-        import os
-        os.makedirs("static/evidence", exist_ok=True)
-        filename = f"{session_id}_{current_user.id}.jpg"
-        path = f"static/evidence/{filename}"
-        with open(path, "wb") as f: f.write(img_bytes)
-        meta['evidence_url'] = f"/static/evidence/{filename}"
+        meta['evidence_url'] = evidence['url']
+        meta['evidence_sha256'] = evidence['sha256']
 
         record = AttendanceRecord(
             session_id=class_session.id,
@@ -317,14 +338,46 @@ async def mark_attendance(
             scan_time=get_eat_time(),
             live_image=meta.get('evidence_url'), # Explicitly save path to column
             connection_type=meta.get('connection', {}).get('type', 'unknown') if isinstance(meta.get('connection'), dict) else 'unknown',
-            metadata_info=json.dumps(meta)
+            metadata_info=json.dumps(meta),
+            photo_hash=evidence['dhash']
         )
+
+        # Check D: Reused photo (same or lightly edited picture submitted before, by anyone this term)
+        photo_entry = None
+        if evidence['dhash']:
+            with span("photo_hash"):
+                await photo_hash_index.ensure(session)
+                value = int(evidence['dhash'], 16)
+                matches = photo_hash_index.match(value, current_user.id, class_session.id)
+                # Held before the commit, so a simultaneous upload of the same photo is caught too
+                photo_entry = PhotoEntry(value, record.id, current_user.id, class_session.id)
+                photo_hash_index.hold(photo_entry)
+            for m in matches[:PHOTO_HASH_MAX_FLAGS]:
+                owner = "the same student" if m.entry.student_id == current_user.id else f"student {m.entry.student_id}"
+                session.add(CheatingFlag(
+                    attendance_id=record.id,
+                    reason=f"Reused photo: matches attendance {m.entry.record_id} by {owner} "
+                           f"in session {m.entry.session_id} ({m.distance} bits apart)",
+                    similarity_score=m.similarity,
+                ))
+            if matches:
+                record.status = status = "flagged_reused_photo"
         
         session.add(record)
-        await session.commit()
+        try:
+            await session.commit()
+        except BaseException:
+            # The row was never written; don't leave it behind for later uploads to match
+            if photo_entry:
+                photo_hash_index.discard(photo_entry)
+            raise
+        if photo_entry:
+            photo_hash_index.add(photo_entry)
         await session.refresh(record)
         
         return {"status": "success", "record_status": status}
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -336,90 +389,15 @@ async def get_live_attendance(
     session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
-    """Get real-time list of attendees for the lecturer view"""
-    results = await session.exec(
-        select(AttendanceRecord, User)
-        .join(User, AttendanceRecord.student_id == User.id)
-        .where(AttendanceRecord.session_id == uuid.UUID(session_id))
-        .order_by(AttendanceRecord.scan_time.desc())
-    )
-    
-    attendance_data = []
-    ips = []
-    
-    # First pass: Collect data
-    from app.models import UserLocationLog
-    for record, user in results:
-        meta = {}
-        if record.metadata_info:
-            try: meta = json.loads(record.metadata_info)
-            except: pass
-        
-        ip = meta.get('ip_address', 'unknown')
-        conn = record.connection_type or meta.get('connection', {}).get('type', 'unknown') if isinstance(meta.get('connection'), dict) else 'unknown'
-
-        # Fallback to UserLocationLog if data is missing
-        if ip == 'unknown' or conn == 'unknown':
-            # Find most recent location log for this user
-            recent_log = (await session.exec(
-                select(UserLocationLog)
-                .where(UserLocationLog.user_id == user.id)
-                .order_by(UserLocationLog.timestamp.desc())
-                .limit(1)
-            )).first()
-            
-            if recent_log:
-                if ip == 'unknown': ip = recent_log.ip_address or 'unknown'
-                if conn == 'unknown': conn = recent_log.network_type or 'unknown'
-
-        ips.append(ip)
-        
-        attendance_data.append({
-            "name": user.full_name,
-            "admission_number": user.admission_number,
-            "time": record.scan_time.isoformat(),
-            "status": record.status,
-            "connection": conn,
-            "ip": ip,
-            "location": meta.get('geolocation', {}),
-            "camera_info": {
-                "make": meta.get('camera_make'),
-                "model": meta.get('camera_model'),
-                "date": meta.get('photo_date'),
-                "error": meta.get('camera_error')
-            },
-            "evidence_url": record.live_image or meta.get('evidence_url'),
-            "device": {
-                "user_agent": meta.get('userAgent'),
-                "screen": meta.get('screen')
-            },
-            "ai_flag": None # Placeholder
-        })
+    """Get real-time list of attendees for the lecturer view (/ws/attendance/{session_id} streams it)"""
+    rows = await load_rows(session, uuid.UUID(session_id))
 
     # AI IP Clustering Logic
-    from collections import Counter
-    session_analysis = {"mode": "Unknown", "dominant_ip": None}
-    
-    if len(ips) > 2:
-        counts = Counter(ips)
-        dominant_ip, freq = counts.most_common(1)[0]
-        ratio = freq / len(ips)
-        
-        if ratio > 0.5:
-            # Physical Class detected (Majority on same IP)
-            session_analysis["mode"] = "Physical Class"
-            session_analysis["dominant_ip"] = dominant_ip
-            
-            # Flag outliers
-            for item in attendance_data:
-                if item['ip'] != dominant_ip and item['ip'] != 'unknown':
-                    item['ai_flag'] = "Suspicious IP Limit (VPN/Data)"
-                    # Override status for display if it was clean
-                    if item['status'] == 'present':
-                        item['status'] = "flagged_ip_mismatch"
-        else:
-            # High variance
-            session_analysis["mode"] = "Online / Distributed"
+    ips = IPHistogram()
+    for row in rows:
+        ips.add(row["ip"])
+    session_analysis = ips.analysis()
+    attendance_data = [flag_outliers(row, session_analysis) for row in rows]
             
     return {"attendees": attendance_data, "analysis": session_analysis}
 
@@ -485,8 +463,15 @@ async def scan_room_qr(
     )
     session.add(log)
     
-    # 3. Find Classroom
-    room = (await session.exec(select(Classroom).where(Classroom.room_code == qr_content))).first()
+    # 3. Find Classroom (signed room codes carry its primary key)
+    try:
+        signed_room = qr_signing.verify(qr_content)
+    except qr_signing.InvalidQR as e:
+        return {"status": "rejected", "message": str(e)}
+    if signed_room:
+        room = await session.get(Classroom, signed_room.id) if signed_room.kind == "classroom" else None
+    else:
+        room = (await session.exec(select(Classroom).where(Classroom.room_code == qr_content))).first()
     
     if not room:
          await session.commit()
@@ -518,18 +503,18 @@ async def scan_room_qr(
         await session.commit()
         return {"status": "success", "message": f"Already marked present for {active_session.id} (Refreshed Data)", "record_status": "present"}
 
-    import os
-    os.makedirs("static/evidence", exist_ok=True)
-    filename = f"{active_session.id}_{current_user.id}_room.jpg"
-    path = f"static/evidence/{filename}"
-    content = await file.read()
-    with open(path, "wb") as f: f.write(content)
+    try:
+        stored = await save_upload(file, "evidence", fallback_ext="jpg")
+    except EvidenceBusy:
+        raise HTTPException(status_code=429, detail="Too many photos being processed. Please retry.", headers={"Retry-After": "2"})
+    except EvidenceTooLarge as e:
+        raise HTTPException(status_code=413, detail=f"Photo too large: {e}")
     
     record = AttendanceRecord(
         session_id=active_session.id,
         student_id=current_user.id,
         status="present",
-        live_image=f"/static/evidence/{filename}",
+        live_image=stored["url"],
         connection_type=meta.get('connection', {}).get('type') if isinstance(meta.get('connection'), dict) else "unknown",
         metadata_info=json.dumps(meta)
     )
@@ -539,7 +524,7 @@ async def scan_room_qr(
     scan_log = ScanLog(
         timestamp=get_eat_time(),
         student_id=current_user.id,
-        room_code=qr_content, 
+        room_code=room.room_code, 
         is_successful=True,
         status_message="Room Scan: Present",
         class_session_id=active_session.id,
@@ -670,7 +655,8 @@ async def get_room_qr_list(
             "building": room.building or "Main Building",
             "floor": room.floor or "Ground Floor",
             "capacity": room.capacity,
-            "qr_content": f"/?room={room.room_code}",
+            # Signed room token: verify-scan gets the classroom's primary key straight from the poster
+            "qr_content": f"/?room={qr_signing.sign('classroom', room.id)}",
             "schedule": final_schedules.get(room.id, [])
         }
         for room in classrooms
@@ -678,6 +664,15 @@ async def get_room_qr_list(
 
 from fastapi.responses import Response
 
+def _export(export_format: str, filename: str, header, batches):
+    try:
+        return export_response(export_format, filename, header, batches)
+    except ExportFormatInvalid as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _clock(moment) -> str:
+    return moment.strftime("%H:%M:%S") if moment else "-"
+
 @router.get("/courses/{course_id}/reports")
 async def get_course_reports(
     course_id: uuid.UUID,
@@ -710,13 +705,11 @@ async def get_course_reports(
 @router.get("/reports/{session_id}/download")
 async def download_session_report(
     session_id: uuid.UUID,
+    export_format: str = Query("csv", alias="format"),
     session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
-    """Download CSV report for a specific session."""
-    import csv 
-    import io
-    
+    """Download CSV (or XLSX with format=xlsx) report for a specific session."""
     # Fetch Session Details (Room, Course)
     sess_query = (
         select(ClassSession, Course, Classroom)
@@ -731,107 +724,68 @@ async def download_session_report(
         
     class_session, course, classroom = sess_result
     room_code = classroom.room_code if classroom else (class_session.room_unique_number or "Unknown")
+    course_label = f"{course.course_name} ({course.course_code})"
     
-    # Fetch data
     att_query = (
-        select(AttendanceRecord, User)
+        select(User.admission_number, User.full_name, AttendanceRecord.scan_time, AttendanceRecord.status)
         .join(User, AttendanceRecord.student_id == User.id)
         .where(AttendanceRecord.session_id == session_id)
         .order_by(AttendanceRecord.scan_time)
     )
-    results = await session.exec(att_query)
     
-    # Create CSV in memory
-    output = io.StringIO()
-    writer = csv.writer(output)
     # Header requested: ADMISSION NUMBER, ROOM, CLASS, TIME (and Name/Date useful too)
-    writer.writerow(["Admission Number", "Student Name", "Course", "Room", "Date", "Time Scanned", "Status"])
-    
-    for record, student in results.all():
-        writer.writerow([
-            student.admission_number,
-            student.full_name,
-            f"{course.course_name} ({course.course_code})",
-            room_code,
-            class_session.session_date,
-            record.scan_time.strftime("%H:%M:%S") if record.scan_time else "-",
-            record.status
+    return _export(
+        export_format,
+        f"attendance_{course.course_code}_{class_session.session_date}",
+        ["Admission Number", "Student Name", "Course", "Room", "Date", "Time Scanned", "Status"],
+        stream_rows(att_query, lambda r: [
+            r.admission_number, r.full_name, course_label, room_code, class_session.session_date,
+            _clock(r.scan_time), r.status
         ])
-        
-    output.seek(0)
-    
-    return Response(
-        content=output.getvalue(),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename=attendance_{course.course_code}_{class_session.session_date}.csv"}
     )
 
 @router.get("/courses/{course_id}/reports/weekly-download")
 async def download_weekly_report(
     course_id: uuid.UUID,
     start_date: date, # User provides the start of the week (or any date in the week)
+    export_format: str = Query("csv", alias="format"),
     session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
-    """Download combined CSV for all sessions in a specific week."""
-    import csv 
-    import io
-    
+    """Download combined CSV (or XLSX) for all sessions in a specific week."""
     # Calculate week range (Mon-Sun)
     start_of_week = start_date - timedelta(days=start_date.weekday())
     end_of_week = start_of_week + timedelta(days=6)
-    
-    # Fetch All Sessions in this week
-    query = (
-        select(ClassSession, Course, Classroom)
-        .join(Course, ClassSession.course_id == Course.id)
-        .outerjoin(Classroom, ClassSession.classroom_id == Classroom.id)
-        .where(ClassSession.course_id == course_id)
-        .where(ClassSession.session_date >= start_of_week)
-        .where(ClassSession.session_date <= end_of_week)
-        .order_by(ClassSession.session_date, ClassSession.start_time)
+    in_week = (
+        ClassSession.course_id == course_id,
+        ClassSession.session_date >= start_of_week,
+        ClassSession.session_date <= end_of_week,
     )
     
-    sessions_in_week = (await session.exec(query)).all()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Date", "Admission Number", "Student Name", "Course", "Room", "Time Scanned", "Status"])
-    
-    if not sessions_in_week:
+    course = await session.get(Course, course_id)
+    has_sessions = (await session.exec(select(ClassSession.id).where(*in_week).limit(1))).first()
+    if not course or not has_sessions:
          return Response(content="No sessions found for this week.", media_type="text/plain")
 
-    course_code = sessions_in_week[0][1].course_code
-    
-    for class_session, course, classroom in sessions_in_week:
-        room_code = classroom.room_code if classroom else (class_session.room_unique_number or "Unknown")
-        
-        # Get Attendance
-        att_query = (
-            select(AttendanceRecord, User)
-            .join(User, AttendanceRecord.student_id == User.id)
-            .where(AttendanceRecord.session_id == class_session.id)
-            .order_by(AttendanceRecord.scan_time)
-        )
-        att_results = (await session.exec(att_query)).all()
-        
-        for record, student in att_results:
-            writer.writerow([
-                class_session.session_date,
-                student.admission_number,
-                student.full_name,
-                course.course_code,
-                room_code,
-                record.scan_time.strftime("%H:%M:%S") if record.scan_time else "-",
-                record.status
-            ])
-
-    output.seek(0)
+    # The whole week's attendance in one query, session by session
+    query = (
+        select(ClassSession.session_date, User.admission_number, User.full_name, Classroom.room_code,
+               ClassSession.room_unique_number, AttendanceRecord.scan_time, AttendanceRecord.status)
+        .join(AttendanceRecord, AttendanceRecord.session_id == ClassSession.id)
+        .join(User, AttendanceRecord.student_id == User.id)
+        .outerjoin(Classroom, ClassSession.classroom_id == Classroom.id)
+        .where(*in_week)
+        .order_by(ClassSession.session_date, ClassSession.start_time, ClassSession.id, AttendanceRecord.scan_time)
+    )
     
-    return Response(
-        content=output.getvalue(),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename=Weekly_Attendance_{course_code}_{start_of_week}.csv"}
+    return _export(
+        export_format,
+        f"Weekly_Attendance_{course.course_code}_{start_of_week}",
+        ["Date", "Admission Number", "Student Name", "Course", "Room", "Time Scanned", "Status"],
+        stream_rows(query, lambda r: [
+            r.session_date, r.admission_number, r.full_name, course.course_code,
+            r.room_code or r.room_unique_number or "Unknown", _clock(r.scan_time), r.status
+        ])
     )
 
 @router.get("/reports/{session_id}/details")
@@ -917,56 +871,59 @@ async def get_all_attendance_logs(
 
 @router.get("/download-all")
 async def download_all_attendance_logs(
-    session: AsyncSession = Depends(get_session),
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    export_format: str = Query("csv", alias="format"),
     current_user: User = Depends(get_current_user)
 ):
-    """Download CSV report for all attendance scans that have been made."""
-    import csv 
-    import io
-    
-    # Query all attendance records with related user, session, course, and classroom details
+    """
+    Download CSV (or XLSX) report for all attendance scans that have been made,
+    or those scanned between start_date and end_date (inclusive).
+    """
+    # All attendance records with related user, session, course, and classroom details
     query = (
-        select(AttendanceRecord, User, ClassSession, Course, Classroom)
+        select(AttendanceRecord.id, User.admission_number, User.full_name, Course.course_code, Course.course_name,
+               Classroom.room_code, Classroom.room_name, ClassSession.room_unique_number,
+               ClassSession.session_date, ClassSession.start_time, ClassSession.end_time,
+               AttendanceRecord.scan_time, AttendanceRecord.status, AttendanceRecord.connection_type)
         .join(User, AttendanceRecord.student_id == User.id)
         .join(ClassSession, AttendanceRecord.session_id == ClassSession.id)
         .join(Course, ClassSession.course_id == Course.id)
         .outerjoin(Classroom, ClassSession.classroom_id == Classroom.id)
         .order_by(AttendanceRecord.scan_time.desc())
     )
-    results = await session.exec(query)
-    
-    # Create CSV in memory
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow([
-        "Scan ID", "Admission Number", "Student Name", "Course Code", "Course Name", 
-        "Room Code", "Room Name", "Session Date", "Session Start", "Session End", 
-        "Scan Date Time", "Status", "Connection Type"
-    ])
-    
-    for record, student, class_session, course, classroom in results.all():
-        writer.writerow([
-            str(record.id),
-            student.admission_number,
-            student.full_name,
-            course.course_code,
-            course.course_name,
-            classroom.room_code if classroom else (class_session.room_unique_number or "N/A"),
-            classroom.room_name if classroom else "Unknown",
-            class_session.session_date.isoformat(),
-            class_session.start_time.isoformat(),
-            class_session.end_time.isoformat(),
-            record.scan_time.isoformat() if record.scan_time else "-",
-            record.status,
-            record.connection_type or "QR_SCAN_LAN"
-        ])
-        
-    output.seek(0)
-    
-    return Response(
-        content=output.getvalue(),
-        media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=all_attendance_scans.csv"}
+    scanned_from, scanned_before = day_range(start_date, end_date)
+    if scanned_from:
+        query = query.where(AttendanceRecord.scan_time >= scanned_from)
+    if scanned_before:
+        query = query.where(AttendanceRecord.scan_time < scanned_before)
+
+    def row(r):
+        return [
+            str(r.id),
+            r.admission_number,
+            r.full_name,
+            r.course_code,
+            r.course_name,
+            r.room_code or r.room_unique_number or "N/A",
+            r.room_name or "Unknown",
+            r.session_date.isoformat(),
+            r.start_time.isoformat(),
+            r.end_time.isoformat(),
+            r.scan_time.isoformat() if r.scan_time else "-",
+            r.status,
+            r.connection_type or "QR_SCAN_LAN"
+        ]
+
+    return _export(
+        export_format,
+        "all_attendance_scans",
+        [
+            "Scan ID", "Admission Number", "Student Name", "Course Code", "Course Name", 
+            "Room Code", "Room Name", "Session Date", "Session Start", "Session End", 
+            "Scan Date Time", "Status", "Connection Type"
+        ],
+        stream_rows(query, row)
     )
 
 @router.get("/courses-summary")
@@ -1077,54 +1034,57 @@ async def get_course_students_attendance(
 @router.get("/courses/{course_id}/download")
 async def download_course_attendance_report(
     course_id: uuid.UUID,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    export_format: str = Query("csv", alias="format"),
     session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
-    """Download CSV report of all sessions and scans for a specific course."""
-    import csv 
-    import io
-    
+    """
+    Download CSV (or XLSX) report of all sessions and scans for a specific course,
+    or only the sessions held between start_date and end_date (inclusive).
+    """
     # Check if course exists
     course = await session.get(Course, course_id)
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
         
-    # Query all attendance records for this course session
+    # All attendance records for this course's sessions
     query = (
-        select(AttendanceRecord, User, ClassSession, Classroom)
+        select(User.admission_number, User.full_name, Classroom.room_code, ClassSession.room_unique_number,
+               ClassSession.session_date, ClassSession.start_time, ClassSession.end_time,
+               AttendanceRecord.scan_time, AttendanceRecord.status, AttendanceRecord.connection_type)
         .join(User, AttendanceRecord.student_id == User.id)
         .join(ClassSession, AttendanceRecord.session_id == ClassSession.id)
         .outerjoin(Classroom, ClassSession.classroom_id == Classroom.id)
         .where(ClassSession.course_id == course_id)
         .order_by(ClassSession.session_date.desc(), AttendanceRecord.scan_time.desc())
     )
-    results = await session.exec(query)
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow([
-        "Admission Number", "Student Name", "Course Code", "Course Name", 
-        "Room Code", "Session Date", "Session Time", "Scan Time", "Status", "Connection Type"
-    ])
-    
-    for record, student, class_session, classroom in results.all():
-        writer.writerow([
-            student.admission_number,
-            student.full_name,
+    if start_date:
+        query = query.where(ClassSession.session_date >= start_date)
+    if end_date:
+        query = query.where(ClassSession.session_date <= end_date)
+
+    def row(r):
+        return [
+            r.admission_number,
+            r.full_name,
             course.course_code,
             course.course_name,
-            classroom.room_code if classroom else (class_session.room_unique_number or "N/A"),
-            class_session.session_date.isoformat(),
-            f"{class_session.start_time.strftime('%H:%M')} - {class_session.end_time.strftime('%H:%M')}",
-            record.scan_time.strftime("%H:%M:%S") if record.scan_time else "-",
-            record.status,
-            record.connection_type or "QR_SCAN_LAN"
-        ])
-        
-    output.seek(0)
-    
-    return Response(
-        content=output.getvalue(),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename=attendance_{course.course_code}_all.csv"}
+            r.room_code or r.room_unique_number or "N/A",
+            r.session_date.isoformat(),
+            f"{r.start_time.strftime('%H:%M')} - {r.end_time.strftime('%H:%M')}",
+            _clock(r.scan_time),
+            r.status,
+            r.connection_type or "QR_SCAN_LAN"
+        ]
+
+    return _export(
+        export_format,
+        f"attendance_{course.course_code}_all",
+        [
+            "Admission Number", "Student Name", "Course Code", "Course Name", 
+            "Room Code", "Session Date", "Session Time", "Scan Time", "Status", "Connection Type"
+        ],
+        stream_rows(query, row)
     )
@@ -0,0 +1,68 @@
+import asyncio
+import uuid
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.database import engine
+from app.auth import decode_access_token, get_user_by_subject
+from app.utils.live_attendance import live_attendance
+
+ATTENDANCE_FEED_HELLO_TIMEOUT = 10
+
+router = APIRouter()
+
+@router.websocket("/ws/attendance/{session_id}")
+async def live_attendance_feed(websocket: WebSocket, session_id: str):
+    """
+    Live attendance for one class session, for the lecturer view.
+
+    The client sends {"type": "hello", "token": <JWT>} first. It then gets
+    {"type": "snapshot", "attendees": [...], "analysis": {...}} with the full roster
+    (newest first, same rows as GET /api/attendance/sessions/{id}/live), followed by
+    {"type": "attendance", "attendee": {...}, "analysis": {...}} for each new record
+    as it commits. A view that falls far behind is sent a fresh snapshot instead.
+    Rows are sent unflagged: apply flag_outliers with the latest analysis to every
+    row, since a new dominant_ip can change which earlier rows are outliers.
+    """
+    try:
+        key = uuid.UUID(session_id)
+    except ValueError:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    try:
+        hello = await asyncio.wait_for(websocket.receive_json(), ATTENDANCE_FEED_HELLO_TIMEOUT)
+    except (asyncio.TimeoutError, WebSocketDisconnect, ValueError):
+        await websocket.close(code=1008)
+        return
+
+    claims = decode_access_token(str(hello.get("token") or "")) if isinstance(hello, dict) else None
+    user = None
+    if claims is not None and hello.get("type") == "hello":
+        async with AsyncSession(engine) as session:
+            user = await get_user_by_subject(session, claims["sub"])
+    if user is None:
+        await websocket.send_json({"type": "error", "message": "Could not validate credentials"})
+        await websocket.close(code=1008)
+        return
+
+    queue = await live_attendance.subscribe(key)
+
+    async def drain_client():
+        # Viewers only listen; reading lets us notice a disconnect while idle
+        while True:
+            await websocket.receive_text()
+
+    reader = asyncio.create_task(drain_client())
+    try:
+        while True:
+            next_message = asyncio.create_task(queue.get())
+            done, _ = await asyncio.wait({next_message, reader}, return_when=asyncio.FIRST_COMPLETED)
+            if reader in done:
+                next_message.cancel()
+                break
+            await websocket.send_json(next_message.result())
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        reader.cancel()
+        live_attendance.unsubscribe(key, queue)
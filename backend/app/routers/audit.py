@@ -4,14 +4,16 @@ from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List, Optional
 from datetime import datetime, date
 from app.database import get_session
-from app.models import AuditLog, User, Role
+from app.models import AuditLog, User
 from app.auth import get_current_user
+from app.utils.audit import audit_writer
+from app.utils.reference_cache import reference_cache
 
 router = APIRouter()
 
 async def check_admin(user: User, session: AsyncSession):
     # Fetch role name
-    role = await session.get(Role, user.role_id)
+    role = await reference_cache.get_role(session, user.role_id)
     if not role or role.name != "SuperAdmin":
         raise HTTPException(status_code=403, detail="Unauthorized: Admin access required")
     return True
@@ -48,3 +50,12 @@ async def get_audit_logs(
     logs = results.all()
     
     return logs
+
+@router.get("/writer-stats")
+async def get_audit_writer_stats(
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Queue depth and flush latency of the write-behind audit writer (Admin only)"""
+    await check_admin(current_user, session)
+    return audit_writer.stats()
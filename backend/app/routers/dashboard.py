@@ -7,6 +7,9 @@ from app.database import get_session
 from app.models import User, AttendanceRecord, Gate, EntryLog, Vehicle, VehicleLog, SystemActivity, Role, FleetTrip, Event
 
 from app.auth import get_current_user
+from app.utils.presence import presence
+from app.utils import traffic_rollup
+from app.utils import activity
 
 router = APIRouter()
 
@@ -17,19 +20,23 @@ async def get_dashboard_stats(session: AsyncSession = Depends(get_session), curr
     total_users_query = select(func.count(User.id)).where(User.status == "active")
     total_users = (await session.exec(total_users_query)).one()
 
-    people_entries = (await session.exec(select(func.count(EntryLog.id)).where(EntryLog.entry_time >= today_start))).one()
-    vehicle_entries = (await session.exec(select(func.count(VehicleLog.id)).where(VehicleLog.entry_time >= today_start))).one()
-    total_entries = people_entries + vehicle_entries
+    # Today's gate totals from the hourly rollup (one row per gate per hour)
+    today_rows = await traffic_rollup.hourly(session, today_start)
+    rejected_entries = sum(r.rejected for r in today_rows)
+    total_entries = sum(r.people_in + r.vehicles_in for r in today_rows) + rejected_entries
     
-    rejected_entries_query = select(func.count(EntryLog.id)).where((EntryLog.status != "allowed") & (EntryLog.entry_time >= today_start))
-    rejected_entries = (await session.exec(rejected_entries_query)).one()
-    
-    vehicles_query = select(func.count(VehicleLog.id)).where(VehicleLog.exit_time == None)
-    vehicles_parked = (await session.exec(vehicles_query)).one()
+    # Headcounts come from the live presence table when it is loaded
+    await presence.ensure(session)
+    if presence.ready:
+        vehicles_parked = presence.count_inside("vehicle")
+        students_in_school = presence.count_inside("user")
+    else:
+        vehicles_query = select(func.count(VehicleLog.id)).where(VehicleLog.exit_time == None)
+        vehicles_parked = (await session.exec(vehicles_query)).one()
 
-    # Students in school (EntryLog with no exit_time)
-    students_in_school_query = select(func.count(func.distinct(EntryLog.user_id))).where(EntryLog.exit_time == None)
-    students_in_school = (await session.exec(students_in_school_query)).one()
+        # Students in school (EntryLog with no exit_time)
+        students_in_school_query = select(func.count(func.distinct(EntryLog.user_id))).where(EntryLog.exit_time == None)
+        students_in_school = (await session.exec(students_in_school_query)).one()
 
     return {
         "active_students": total_users,
@@ -49,19 +56,20 @@ async def get_kpi_data(session: AsyncSession = Depends(get_session), current_use
     people_data = []
     vehicle_data = []
     
-    # Last 7 Days Trend
+    # Last 7 Days Trend, summed from the hourly rollup
+    first_day = today - timedelta(days=6)
+    people_by_day = {}
+    vehicles_by_day = {}
+    for row in await traffic_rollup.hourly(session, datetime.combine(first_day, datetime.min.time())):
+        day = row.hour.date()
+        # Rejected attempts are gate entries too
+        people_by_day[day] = people_by_day.get(day, 0) + row.people_in + row.rejected
+        vehicles_by_day[day] = vehicles_by_day.get(day, 0) + row.vehicles_in
+
     for i in range(6, -1, -1):
         day = today - timedelta(days=i)
-        start = datetime.combine(day, datetime.min.time())
-        end = datetime.combine(day, datetime.max.time())
-        
-        # People Entries
-        q1 = select(func.count(EntryLog.id)).where((EntryLog.entry_time >= start) & (EntryLog.entry_time <= end))
-        c1 = (await session.exec(q1)).one()
-        
-        # Vehicle Entries
-        q2 = select(func.count(VehicleLog.id)).where((VehicleLog.entry_time >= start) & (VehicleLog.entry_time <= end))
-        c2 = (await session.exec(q2)).one()
+        c1 = people_by_day.get(day, 0)
+        c2 = vehicles_by_day.get(day, 0)
         
         total = c1 + c2
         data.append(total)
@@ -85,51 +93,17 @@ async def get_kpi_data(session: AsyncSession = Depends(get_session), current_use
 
 @router.get("/recent-logs")
 async def get_recent_logs(session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
-    # 1. Gate Entries
-    p_stm = select(EntryLog).order_by(EntryLog.entry_time.desc()).limit(10)
-    p_logs = (await session.exec(p_stm)).all()
-    
-    # 2. Vehicle Entries - Join with Vehicle to get plate_number
-    from sqlalchemy.orm import selectinload
-    v_stm = select(VehicleLog).options(selectinload(VehicleLog.vehicle)).order_by(VehicleLog.entry_time.desc()).limit(10)
-    v_logs = (await session.exec(v_stm)).all()
-    
-    combined = []
-    
-    # Process Gate Logs
-    for p in p_logs:
-         user = await session.get(User, p.user_id)
-         user_name = user.full_name if user else "Unknown User"
-         combined.append({
-             "user": user_name,
-             "time_obj": p.entry_time,
-             "time": p.entry_time.strftime("%H:%M %p"),
-             "status": f"Gate: {p.status.title()}",
-             "isAlert": p.status != "allowed"
-         })
-
-    # Process Vehicle Logs
-    for v in v_logs:
-         plate = v.vehicle.plate_number if v.vehicle else "Unknown Vehicle"
-         combined.append({
-             "user": f"{plate}",
-             "time_obj": v.entry_time,
-             "time": v.entry_time.strftime("%H:%M %p"),
-             "status": "Vehicle Entry",
-             "isAlert": False
-         })
-         
-    # Sort by time descend
-    combined.sort(key=lambda x: x["time_obj"], reverse=True)
-    
-    # Limit to 15 items for richer dashboard
-    final_logs = combined[:15]
-    
-    # Remove time_obj
-    for item in final_logs:
-        del item["time_obj"]
-        
-    return final_logs
+    # Gate and vehicle entries, merged in timeline order (user/plate names joined in SQL)
+    items, _ = await activity.timeline(session, limit=15, types=("user", "vehicle"))
+    return [
+        {
+            "user": item["name"],
+            "time": item["time"].strftime("%H:%M %p"),
+            "status": f"Gate: {item['status'].title()}" if item["type"] == "user" else "Vehicle Entry",
+            "isAlert": item["type"] == "user" and item["status"] != "allowed"
+        }
+        for item in items
+    ]
 
 @router.get("/guardian")
 async def get_guardian_dashboard(session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
@@ -229,11 +203,18 @@ async def get_live_monitor_stats(session: AsyncSession = Depends(get_session)):
     today_end = datetime.combine(today, datetime.max.time())
     
     # 1. Cars (Vehicles) inside vs checked out today
-    vehicles_inside = (await session.exec(select(func.count(VehicleLog.id)).where(VehicleLog.exit_time == None))).one()
+    await presence.ensure(session)
+    if presence.ready:
+        vehicles_inside = presence.count_inside("vehicle")
+    else:
+        vehicles_inside = (await session.exec(select(func.count(VehicleLog.id)).where(VehicleLog.exit_time == None))).one()
     vehicles_checked_out = (await session.exec(select(func.count(VehicleLog.id)).where(VehicleLog.exit_time >= today_start))).one()
     
     # 2. Students inside
-    students_inside = (await session.exec(select(func.count(func.distinct(EntryLog.user_id))).where(EntryLog.exit_time == None))).one()
+    if presence.ready:
+        students_inside = presence.count_inside("user")
+    else:
+        students_inside = (await session.exec(select(func.count(func.distinct(EntryLog.user_id))).where(EntryLog.exit_time == None))).one()
     
     # 3. Male vs Female inside
     # Find all users currently inside, group by gender
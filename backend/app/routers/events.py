@@ -4,7 +4,7 @@ import io
 from sqlmodel import select, func, and_, extract
 from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List, Dict, Any, Optional
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import uuid
 # Import func explicitly from sqlalchemy to ensure correct SQL generation
 from sqlalchemy import func as sa_func 
@@ -12,6 +12,8 @@ from ..database import get_session
 from ..models import Event, EventVisitor, User, EntryLog, VehicleLog, ClassSession, GateScanLog, TimetableSlot
 from ..auth import get_current_user, get_current_admin
 from app.utils.timezone import get_eat_time
+from app.utils.identity_index import identity_index
+from app.utils import qr_signing
 
 router = APIRouter(prefix="/api/events", tags=["Events"])
 
@@ -22,10 +24,16 @@ async def get_events(session: AsyncSession = Depends(get_session)):
 
 @router.post("/", response_model=Event)
 async def create_event(event: Event, session: AsyncSession = Depends(get_session), user: User = Depends(get_current_admin)):
-    event.qr_code_token = str(uuid.uuid4())
+    # Signed token: the gate reads the event id from the pass itself; it lapses the day after the event
+    # (table-model bodies are not validated, so event_date may still be the ISO string)
+    event_day = event.event_date if isinstance(event.event_date, date) else date.fromisoformat(str(event.event_date)[:10])
+    event.qr_code_token = qr_signing.sign(
+        "event", event.id, expires_at=datetime.combine(event_day + timedelta(days=1), datetime.max.time())
+    )
     session.add(event)
     await session.commit()
     await session.refresh(event)
+    identity_index.remember_event(event)
     return event
 
 @router.get("/by-token/{token}", response_model=Event)
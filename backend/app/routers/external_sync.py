@@ -2,11 +2,13 @@ from fastapi import APIRouter, Depends, HTTPException, Header, Request
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 from app.database import get_session
-from app.models import User, Role, SystemConfig
+from app.models import User, Role
 from app.auth import get_password_hash
 from pydantic import BaseModel
 from typing import List, Optional
 from app.utils.audit import log_action
+from app.utils.identity_index import identity_index
+from app.utils.reference_cache import reference_cache
 
 router = APIRouter()
 
@@ -21,9 +23,8 @@ class ExternalStudent(BaseModel):
     password: Optional[str] = None # If not provided, use admission number as default password
 
 async def verify_api_key(session: AsyncSession = Depends(get_session), x_api_key: str = Header(..., alias="X-API-KEY")):
-    stmt = select(SystemConfig).where(SystemConfig.key == "external_sync_api_key")
-    config = (await session.exec(stmt)).first()
-    if not config or x_api_key != config.value:
+    api_key = await reference_cache.get_config(session, "external_sync_api_key")
+    if not api_key or x_api_key != api_key:
         raise HTTPException(status_code=403, detail="Invalid or missing API Key")
     return True
 
@@ -89,6 +90,7 @@ async def sync_students(
             results["errors"].append({"admission_number": s_data.admission_number, "error": str(e)})
 
     await session.commit()
+    identity_index.invalidate()
     
     # Log the sync action
     await log_action(
@@ -6,15 +6,19 @@ from typing import List, Optional
 from uuid import UUID
 from datetime import datetime, date as date_type, timedelta
 from app.utils.timezone import get_eat_time
+from app.utils.idempotency import idempotent
+from app.utils import qr_signing
 
 from app.database import get_session
 from app.models import (
     Vehicle, VehicleLog, FleetTrip, FleetPassengerManifest,
     FleetFuelLog, FleetGPSLog, FleetMaintenanceLog,
-    FleetNotification, User, Role, Gate
+    FleetNotification, User, Role
 )
 from app.auth import get_current_user, get_current_admin
 from app.utils.audit import log_action
+from app.utils.identity_index import identity_index
+from app.utils.reference_cache import reference_cache
 
 router = APIRouter()
 
@@ -219,6 +223,7 @@ async def create_vehicle(
             
         await session.commit()
         await session.refresh(vehicle)
+        identity_index.remember_vehicle(vehicle)
 
         await log_action(
             session=session,
@@ -307,6 +312,7 @@ async def update_vehicle(
         if not vehicle:
             raise HTTPException(status_code=404, detail="Vehicle not found")
         
+        old_plate = vehicle.plate_number
         update_dict = vehicle_data.dict(exclude_unset=True)
         for key, value in update_dict.items():
             if hasattr(vehicle, key) and value is not None:
@@ -315,6 +321,8 @@ async def update_vehicle(
         session.add(vehicle)
         await session.commit()
         await session.refresh(vehicle)
+        identity_index.forget_vehicle(old_plate)
+        identity_index.remember_vehicle(vehicle)
         return {"status": "success", "plate_number": vehicle.plate_number}
     except HTTPException:
         raise
@@ -377,12 +385,7 @@ async def check_in_fleet_vehicle(
         if open_log:
             raise HTTPException(status_code=400, detail="Vehicle is already checked in.")
             
-        gate = (await session.exec(select(Gate).where(Gate.name == "Main Gate"))).first()
-        if not gate:
-            gate = Gate(name="Main Gate", location="Main Entrance")
-            session.add(gate)
-            await session.commit()
-            await session.refresh(gate)
+        gate = await reference_cache.main_gate(session)
 
         log = VehicleLog(
             vehicle_id=vehicle_id,
@@ -422,12 +425,7 @@ async def check_out_fleet_vehicle(
         
         if not open_log:
             # Auto-create entry to allow checkout
-            gate = (await session.exec(select(Gate).where(Gate.name == "Main Gate"))).first()
-            if not gate:
-                gate = Gate(name="Main Gate", location="Main Entrance")
-                session.add(gate)
-                await session.commit()
-                await session.refresh(gate)
+            gate = await reference_cache.main_gate(session)
             open_log = VehicleLog(
                 vehicle_id=vehicle_id,
                 gate_id=gate.id,
@@ -832,6 +830,7 @@ async def start_trip(
         raise HTTPException(status_code=500, detail=f"Failed to start trip: {str(e)}")
 
 @router.post("/trips/{trip_id}/board")
+@idempotent
 async def board_passenger(
     request: Request,
     trip_id: UUID,
@@ -849,6 +848,18 @@ async def board_passenger(
         if ":" in scanned_data:
             admission_number = scanned_data.split(":")[-1].strip()
 
+        # Signed ID card QRs carry the user's primary key; forged or expired ones stop here
+        try:
+            signed = qr_signing.verify(admission_number)
+        except qr_signing.InvalidQR as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        signed_user = None
+        if signed:
+            signed_user = await session.get(User, signed.id) if signed.kind == "user" else None
+            if not signed_user:
+                raise HTTPException(status_code=404, detail="Passenger not found in the student directory.")
+            admission_number = signed_user.admission_number
+
         # Find the passenger on this trip
         passenger = (await session.exec(
             select(FleetPassengerManifest)
@@ -858,11 +869,13 @@ async def board_passenger(
 
         if not passenger:
             # Let's search the User database for this admission number
-            user_res = await session.exec(
-                select(User)
-                .where(User.admission_number == admission_number)
-            )
-            db_user = user_res.first()
+            db_user = signed_user
+            if not db_user:
+                user_res = await session.exec(
+                    select(User)
+                    .where(User.admission_number == admission_number)
+                )
+                db_user = user_res.first()
             if not db_user:
                 raise HTTPException(
                     status_code=404, 
@@ -1114,6 +1127,9 @@ async def create_maintenance_log(
 @router.post("/gps-logs")
 async def log_gps(log: FleetGPSLog, session: AsyncSession = Depends(get_session)):
     try:
+        # Table models skip validation, so the id arrives as the raw JSON string
+        if not isinstance(log.vehicle_id, UUID):
+            log.vehicle_id = UUID(str(log.vehicle_id))
         session.add(log)
         await session.commit()
         return {"status": "success"}
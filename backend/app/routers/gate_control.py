@@ -1,20 +1,110 @@
 from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Request, Query
+from fastapi.responses import JSONResponse
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlmodel import select
 from app.database import get_session
 from app.models import User, EntryLog, Gate, Vehicle, VehicleLog, Visitor, Event, GateScanLog
 from app.utils.audit import log_action
+from app.utils.identity_index import identity_index, normalize_code
+from app.utils.presence import presence
+from app.utils.gate_feed import gate_feed
+from app.utils.reference_cache import reference_cache
+from app.utils.scan_debounce import scan_debounce
+from app.utils.plate_index import plate_index, display_plate
+from app.utils.trusted_proxies import trusted_proxies
+from app.utils import qr_signing
+from app.utils import traffic_rollup
+from app.utils import activity
+from app.utils.plate_ocr import plate_ocr, PlateOCRBusy, PlateOCRUnavailable, PLATE_OCR_MAX_FRAMES
+from app.utils.timing import span, timed
+from app.utils.idempotency import idempotent
+from app.utils.access_queue import access_queue, validate_request, AccessRequestInvalid, AccessQueueFull, VISITOR_ROLES
+from app.utils.evidence import EvidenceBusy, EvidenceTooLarge, EVIDENCE_MAX_BYTES
+from app.utils.media_store import save_upload, save_bytes, MediaInvalid
 from app.auth import get_current_user, get_current_admin
 from datetime import datetime
 from app.utils.timezone import get_eat_time
-import shutil
-import os
 import uuid
+import math
 import random # For mocking
-from typing import Optional
+from typing import Optional, List
 
 router = APIRouter()
 
+async def get_open_entry_log(session: AsyncSession, user_id) -> Optional[EntryLog]:
+    """
+    Open EntryLog for a user. A presence-table hit is loaded by primary key; a miss
+    is confirmed with the (user_id, exit_time) index, since this worker's table can
+    lag a check-in made through another one (Redis down, or its message late).
+    """
+    if presence.ready:
+        log_id = presence.open_log_id("user", user_id)
+        if log_id:
+            log = await session.get(EntryLog, log_id)
+            if log and log.exit_time is None:
+                return log
+    return (await session.exec(
+        select(EntryLog)
+        .where(EntryLog.user_id == user_id)
+        .where(EntryLog.exit_time == None)
+        .order_by(EntryLog.entry_time.desc())
+    )).first()
+
+async def get_open_vehicle_log(session: AsyncSession, vehicle_id) -> Optional[VehicleLog]:
+    """Open VehicleLog for a vehicle, resolved through the presence table like get_open_entry_log."""
+    if presence.ready:
+        log_id = presence.open_log_id("vehicle", vehicle_id)
+        if log_id:
+            log = await session.get(VehicleLog, log_id)
+            if log and log.exit_time is None:
+                return log
+    return (await session.exec(
+        select(VehicleLog)
+        .where(VehicleLog.vehicle_id == vehicle_id)
+        .where(VehicleLog.exit_time == None)
+        .order_by(VehicleLog.entry_time.desc())
+    )).first()
+
+async def find_vehicle_by_plate(session: AsyncSession, plate: str) -> Optional[Vehicle]:
+    """Vehicle for a typed or OCR-read plate: the exact plate, else the one registered plate it can only be a misread of."""
+    vehicle = (await session.exec(select(Vehicle).where(Vehicle.plate_number == plate))).first()
+    if not vehicle:
+        close = plate_index.match(plate)
+        if close:
+            vehicle = await session.get(Vehicle, close.vehicle_id)
+    return vehicle
+
+def parse_scan_prefix(code: str):
+    """Split a typed scan code (EVENT:, VEHICLE:/BUS:, VISITOR:, STUDENT:/STAFF:) into (entity_type, code)."""
+    upper_code = code.upper()
+    if upper_code.startswith("EVENT:"):
+        return "event", code[6:].strip()
+    if upper_code.startswith("VEHICLE:") or upper_code.startswith("BUS:"):
+        return "vehicle", code.split(":", 1)[1].strip()
+    if upper_code.startswith("VISITOR:"):
+        return "visitor", code[8:].strip()
+    if upper_code.startswith("STUDENT:") or upper_code.startswith("STAFF:"):
+        return "user", code.split(":", 1)[1].strip()
+    return None, code
+
+# Entity each signed QR kind names at the gate (classroom codes are not gate passes)
+SIGNED_GATE_MODELS = {"user": User, "visitor": Visitor, "event": Event}
+
+def verify_signed_code(code: str):
+    """The SignedQR in a scanned code (bare or behind a typed prefix), or None for legacy codes; raises InvalidQR."""
+    signed = qr_signing.verify(code)
+    if signed is None and ":" in code:
+        signed = qr_signing.verify(parse_scan_prefix(code)[1])
+    return signed
+
+def signed_natural_code(kind: str, entity) -> str:
+    """The legacy code the entity behind a signed QR is known by (admission number, ID number, event token)."""
+    if kind == "user":
+        return entity.admission_number
+    if kind == "visitor":
+        return entity.id_number
+    return entity.qr_code_token
+
 # --- Student Self-Service Gate Endpoints ---
 
 @router.get("/my-status")
@@ -95,10 +185,12 @@ async def manual_vehicle_entry(
         raise HTTPException(status_code=400, detail="Plate number required")
 
     # 1. Lookup/Create Vehicle
-    vehicle = (await session.exec(select(Vehicle).where(Vehicle.plate_number == plate))).first()
+    vehicle = await find_vehicle_by_plate(session, plate)
     
     status = "allowed"
-    if not vehicle:
+    if vehicle:
+        plate = vehicle.plate_number
+    else:
         # Create new "Visitor" vehicle
         vehicle = Vehicle(
             plate_number=plate,
@@ -116,23 +208,11 @@ async def manual_vehicle_entry(
     session.add(vehicle)
     await session.commit()
     await session.refresh(vehicle)
+    identity_index.remember_vehicle(vehicle)
     
     # 2. Get Gate
     gate_id = payload.get("gate_id")
-    gate = None
-    if gate_id:
-        try:
-            import uuid
-            gate = await session.get(Gate, uuid.UUID(str(gate_id)))
-        except Exception:
-            pass
-    if not gate:
-        gate = (await session.exec(select(Gate).where(Gate.name == "Main Gate"))).first()
-        if not gate:
-            gate = Gate(name="Main Gate", location="Main Entrance")
-            session.add(gate)
-            await session.commit()
-            await session.refresh(gate)
+    gate = await reference_cache.resolve_gate(session, gate_id)
 
     # 3. Log Entry
     log = VehicleLog(
@@ -159,6 +239,11 @@ async def manual_vehicle_entry(
         description=f"Manual vehicle entry logged for {plate} ({passengers} passengers)",
         request=request
     )
+    gate_feed.publish(
+        gate, "vehicle", "allowed", f"Vehicle {plate} logged manually",
+        identifier=plate, role=f"Manual Entry - {passengers} Passenger(s)",
+        image="https://cdn-icons-png.flaticon.com/512/3202/3202926.png", direction="in"
+    )
 
     return {
         "status": status,
@@ -173,96 +258,118 @@ async def manual_vehicle_entry(
     }
 
 @router.post("/scan")
+@idempotent
+@timed("gate_scan")
 async def scan_entry(
     request: Request,
     scan_data: dict, # { "admission_number": "...", "gate_id": "optional" }
     session: AsyncSession = Depends(get_session)
 ):
+    """Gate scan. Repeat reads of a code at the same gate within SCAN_DEBOUNCE_MS get the first result back."""
+    code = str(scan_data.get("admission_number") or "").strip()
+    return await scan_debounce.run(
+        scan_data.get("gate_id"), code, lambda: process_scan(request, scan_data, session)
+    )
+
+@router.get("/scan/debounce-stats")
+async def get_scan_debounce_stats(current_user: User = Depends(get_current_admin)):
+    """Suppressed repeat scans per gate (Admin only)"""
+    return scan_debounce.stats()
+
+async def process_scan(request: Request, scan_data: dict, session: AsyncSession, guard: Optional[User] = None):
+    """Resolve a scanned code and toggle the holder IN/OUT at the gate (guard: the signed-in scanner operator, if known)."""
     import re
     code = scan_data.get("admission_number", "").strip()
     if not code:
         return {"status": "rejected", "message": "Scanned code is empty", "data": None}
 
     # 1. Check for Gate
-    gate = None
-    gate_id = scan_data.get("gate_id")
-    if gate_id:
-        try:
-            import uuid
-            gate = await session.get(Gate, uuid.UUID(str(gate_id)))
-        except Exception:
-            pass
-    if not gate:
-        gate_query = select(Gate).where(Gate.name == "Main Gate")
-        gate = (await session.exec(gate_query)).first()
-        if not gate:
-            gate = Gate(name="Main Gate", location="Main Entrance")
-            session.add(gate)
-            await session.commit()
-            await session.refresh(gate)
+    with span("gate"):
+        gate = await reference_cache.resolve_gate(session, scan_data.get("gate_id"))
 
-    # 2. Check for Prefix
-    upper_code = code.upper()
-    parsed_code = code
-    entity_type = None
+    with span("classify"):
+        # 2. Signed QR codes carry their type and primary key; forged or expired ones stop here
+        upper_code = code.upper()
+        try:
+            signed = verify_signed_code(code)
+        except qr_signing.InvalidQR as e:
+            return gate_feed.publish_result(gate, "qr", code[:16], {"status": "rejected", "message": str(e), "data": None})
+        if signed and signed.kind not in SIGNED_GATE_MODELS:
+            return gate_feed.publish_result(gate, signed.kind, code[:16], {
+                "status": "rejected", "message": "This QR code is not a gate pass", "data": None
+            })
 
-    if upper_code.startswith("EVENT:"):
-        entity_type = "event"
-        parsed_code = code[6:].strip()
-    elif upper_code.startswith("VEHICLE:") or upper_code.startswith("BUS:"):
-        entity_type = "vehicle"
-        parsed_code = code.split(":", 1)[1].strip()
-    elif upper_code.startswith("VISITOR:"):
-        entity_type = "visitor"
-        parsed_code = code[8:].strip()
-    elif upper_code.startswith("STUDENT:") or upper_code.startswith("STAFF:"):
-        entity_type = "user"
-        parsed_code = code.split(":", 1)[1].strip()
+        # Check for Prefix
+        entity_type, parsed_code = (signed.kind, code) if signed else parse_scan_prefix(code)
     
-    # 3. If no prefix matched, we auto-identify from the string format/data
-    if not entity_type:
-        # Check User first
-        user = (await session.exec(select(User).where(User.admission_number == code))).first()
-        if user:
-            entity_type = "user"
-            parsed_code = code
-        else:
-            # Check Vehicle table
-            vehicle = (await session.exec(select(Vehicle).where(Vehicle.plate_number == code.upper()))).first()
-            if vehicle:
-                entity_type = "vehicle"
+        # 3. Resolve the code against the in-memory identity index before touching SQL
+        resolved_id = signed.id if signed else None
+        if entity_type and not signed:
+            lookup_code = parsed_code.replace("-", " ") if entity_type == "vehicle" else parsed_code
+            resolved_id = identity_index.resolve(entity_type, lookup_code)
+        elif not entity_type:
+            classified = identity_index.classify(code)
+            if classified:
+                entity_type, resolved_id = classified
                 parsed_code = code
+            elif identity_index.ready:
+                # Not a known code as typed; it may still be a misread of a registered plate
+                close = plate_index.match(code)
+                if close:
+                    entity_type, resolved_id, parsed_code = "vehicle", close.vehicle_id, close.plate_number
+
+        # 4. If no prefix matched and the index missed, we auto-identify from the string format/data
+        if not entity_type:
+            # Check User first
+            user = (await session.exec(select(User).where(User.admission_number == code))).first()
+            if user:
+                entity_type = "user"
+                parsed_code = code
+                resolved_id = user.id
             else:
-                # Check Visitor table
-                visitor = (await session.exec(select(Visitor).where(Visitor.id_number == code))).first()
-                if not visitor:
-                    # check if code is UUID matching visitor ID
-                    try:
-                        import uuid
-                        val_uuid = uuid.UUID(code)
-                        visitor = await session.get(Visitor, val_uuid)
-                    except Exception:
-                        pass
-                
-                if visitor:
-                    entity_type = "visitor"
+                # Check Vehicle table
+                vehicle = (await session.exec(select(Vehicle).where(Vehicle.plate_number == code.upper()))).first()
+                if vehicle:
+                    entity_type = "vehicle"
                     parsed_code = code
+                    resolved_id = vehicle.id
                 else:
-                    # Check if code matches standard Kenyan vehicle plate formats or generic alphanumeric format
-                    is_plate = bool(re.match(r'^[A-Z]{2,3}\s?\d{3,4}\s?[A-Z]{0,2}$', upper_code)) or bool(re.match(r'^[A-Z0-9\s]{5,10}$', upper_code))
-                    if is_plate:
-                        entity_type = "vehicle"
+                    # Check Visitor table
+                    visitor = (await session.exec(select(Visitor).where(Visitor.id_number == code))).first()
+                    if not visitor:
+                        # check if code is UUID matching visitor ID
+                        try:
+                            import uuid
+                            val_uuid = uuid.UUID(code)
+                            visitor = await session.get(Visitor, val_uuid)
+                        except Exception:
+                            pass
+                
+                    if visitor:
+                        entity_type = "visitor"
                         parsed_code = code
+                        resolved_id = visitor.id
                     else:
-                        entity_type = "user"
-                        parsed_code = code
+                        # Check if code matches standard Kenyan vehicle plate formats or generic alphanumeric format
+                        is_plate = bool(re.match(r'^[A-Z]{2,3}\s?\d{3,4}\s?[A-Z]{0,2}$', upper_code)) or bool(re.match(r'^[A-Z0-9\s]{5,10}$', upper_code))
+                        if is_plate:
+                            entity_type = "vehicle"
+                            parsed_code = code
+                        else:
+                            entity_type = "user"
+                            parsed_code = code
 
     # Now handle based on detected entity type
     if entity_type == "event":
         token = parsed_code
-        ev = (await session.exec(select(Event).where(Event.qr_code_token == token))).first()
+        with span("lookup"):
+            ev = await session.get(Event, resolved_id) if resolved_id else None
+            if signed:
+                token = ev.qr_code_token if ev else token
+            elif not ev or normalize_code(ev.qr_code_token) != normalize_code(token):
+                ev = (await session.exec(select(Event).where(Event.qr_code_token == token))).first()
         if ev:
-             return {
+             return gate_feed.publish_result(gate, "event", token, {
                  "status": "event_pass",
                  "message": f"Valid Event Pass: {ev.name}",
                  "data": {
@@ -272,13 +379,18 @@ async def scan_entry(
                      "event_id": str(ev.id),
                      "is_active": ev.is_active
                  }
-             }
+             })
         else:
-             return {"status": "rejected", "message": "Invalid Event Pass"}
+             return gate_feed.publish_result(gate, "event", token, {"status": "rejected", "message": "Invalid Event Pass"})
 
     elif entity_type == "vehicle":
         plate = parsed_code.upper().replace("-", " ")
-        vehicle = (await session.exec(select(Vehicle).where(Vehicle.plate_number == plate))).first()
+        with span("lookup"):
+            vehicle = await session.get(Vehicle, resolved_id) if resolved_id else None
+            if not vehicle or normalize_code(vehicle.plate_number) != plate:
+                vehicle = await find_vehicle_by_plate(session, plate)
+            if vehicle:
+                plate = vehicle.plate_number
         
         # Auto-create vehicle if not exists
         if not vehicle:
@@ -297,14 +409,11 @@ async def scan_entry(
             session.add(vehicle)
             await session.commit()
             await session.refresh(vehicle)
+            identity_index.remember_vehicle(vehicle)
             
-        # Check logs for open entry (exit_time is null)
-        open_log = (await session.exec(
-            select(VehicleLog)
-            .where(VehicleLog.vehicle_id == vehicle.id)
-            .where(VehicleLog.exit_time == None)
-            .order_by(VehicleLog.entry_time.desc())
-        )).first()
+        # Check presence for an open entry (exit_time is null)
+        with span("open_log"):
+            open_log = await get_open_vehicle_log(session, vehicle.id)
 
         if open_log:
             # Check Out
@@ -319,10 +428,11 @@ async def scan_entry(
                 table_name="vehicle_logs",
                 record_id=str(open_log.id),
                 description=f"Auto vehicle checkout for {plate} at {gate.name}",
+                user=guard,
                 request=request
             )
             
-            return {
+            return gate_feed.publish_result(gate, "vehicle", plate, {
                 "status": "allowed",
                 "message": f"Vehicle {plate} checked OUT successfully",
                 "data": {
@@ -331,7 +441,7 @@ async def scan_entry(
                     "time": get_eat_time().strftime("%I:%M %p"),
                     "image": "https://cdn-icons-png.flaticon.com/512/3202/3202926.png"
                 }
-            }
+            }, direction="out")
         else:
             # Check In
             new_log = VehicleLog(
@@ -339,7 +449,8 @@ async def scan_entry(
                 gate_id=gate.id,
                 entry_time=get_eat_time(),
                 manual_override=False,
-                detected_passengers=1
+                detected_passengers=1,
+                guard_id=guard.id if guard else None
             )
             session.add(new_log)
             await session.commit()
@@ -351,10 +462,11 @@ async def scan_entry(
                 table_name="vehicle_logs",
                 record_id=str(new_log.id),
                 description=f"Auto vehicle checkin for {plate} at {gate.name}",
+                user=guard,
                 request=request
             )
 
-            return {
+            return gate_feed.publish_result(gate, "vehicle", plate, {
                 "status": "allowed",
                 "message": f"Vehicle {plate} checked IN successfully",
                 "data": {
@@ -363,7 +475,7 @@ async def scan_entry(
                     "time": get_eat_time().strftime("%I:%M %p"),
                     "image": "https://cdn-icons-png.flaticon.com/512/3202/3202926.png"
                 }
-            }
+            }, direction="in")
 
     elif entity_type == "visitor":
         # Look up visitor by parsing details or ID number
@@ -377,7 +489,10 @@ async def scan_entry(
             phone = visitor_parts[2]
             details = visitor_parts[3] if len(visitor_parts) > 3 else "Scanned Visitor Card"
             
-            visitor = (await session.exec(select(Visitor).where(Visitor.id_number == id_no))).first()
+            visitor_id = identity_index.resolve("visitor", id_no)
+            visitor = await session.get(Visitor, visitor_id) if visitor_id else None
+            if not visitor or normalize_code(visitor.id_number) != normalize_code(id_no):
+                visitor = (await session.exec(select(Visitor).where(Visitor.id_number == id_no))).first()
             if not visitor:
                 first_name = name.split(" ")[0]
                 last_name = " ".join(name.split(" ")[1:]) if len(name.split(" ")) > 1 else "Visitor"
@@ -393,8 +508,19 @@ async def scan_entry(
                 session.add(visitor)
                 await session.commit()
                 await session.refresh(visitor)
+                identity_index.remember_visitor(visitor)
+        elif signed:
+            visitor = await session.get(Visitor, resolved_id)
+            if not visitor:
+                return gate_feed.publish_result(gate, "visitor", code[:16], {
+                    "status": "rejected", "message": "Visitor pass no longer valid", "data": None
+                })
         else:
-            visitor = (await session.exec(select(Visitor).where(Visitor.id_number == parsed_code))).first()
+            visitor = await session.get(Visitor, resolved_id) if resolved_id else None
+            if visitor and normalize_code(parsed_code) not in (normalize_code(visitor.id_number), str(visitor.id).upper(), visitor.id.hex.upper()):
+                visitor = None
+            if not visitor:
+                visitor = (await session.exec(select(Visitor).where(Visitor.id_number == parsed_code))).first()
             if not visitor:
                 try:
                     val_uuid = uuid.UUID(parsed_code)
@@ -415,6 +541,7 @@ async def scan_entry(
                 session.add(visitor)
                 await session.commit()
                 await session.refresh(visitor)
+                identity_index.remember_visitor(visitor)
                 
         if visitor.status == "checked_in" and not visitor.time_out:
             # Check Out
@@ -429,10 +556,11 @@ async def scan_entry(
                 table_name="visitors",
                 record_id=str(visitor.id),
                 description=f"Auto visitor checkout for {visitor.first_name} {visitor.last_name}",
+                user=guard,
                 request=request
             )
             
-            return {
+            return gate_feed.publish_result(gate, "visitor", visitor.id_number, {
                 "status": "allowed",
                 "message": f"Visitor {visitor.first_name} checked OUT successfully",
                 "data": {
@@ -441,7 +569,7 @@ async def scan_entry(
                     "time": get_eat_time().strftime("%I:%M %p"),
                     "image": "https://cdn-icons-png.flaticon.com/512/3135/3135715.png"
                 }
-            }
+            }, direction="out")
         else:
             # Check In
             visitor.time_in = get_eat_time()
@@ -456,10 +584,11 @@ async def scan_entry(
                 table_name="visitors",
                 record_id=str(visitor.id),
                 description=f"Auto visitor checkin for {visitor.first_name} {visitor.last_name}",
+                user=guard,
                 request=request
             )
             
-            return {
+            return gate_feed.publish_result(gate, "visitor", visitor.id_number, {
                 "status": "allowed",
                 "message": f"Visitor {visitor.first_name} checked IN successfully",
                 "data": {
@@ -468,23 +597,28 @@ async def scan_entry(
                     "time": get_eat_time().strftime("%I:%M %p"),
                     "image": "https://cdn-icons-png.flaticon.com/512/3135/3135715.png"
                 }
-            }
+            }, direction="in")
 
     else: # user
-        user = (await session.exec(select(User).where(User.admission_number == parsed_code))).first()
+        with span("lookup"):
+            user = await session.get(User, resolved_id) if resolved_id else None
+            if signed:
+                parsed_code = user.admission_number if user else code[:16]
+            elif not user or normalize_code(user.admission_number) != normalize_code(parsed_code):
+                user = (await session.exec(select(User).where(User.admission_number == parsed_code))).first()
         if not user:
-            return {
+            return gate_feed.publish_result(gate, "user", parsed_code, {
                 "status": "rejected",
                 "message": f"User not found for code: {parsed_code}",
                 "data": None
-            }
+            })
             
         status = "allowed"
         message = "Access Granted"
         if user.status != "active":
             status = "rejected"
             message = f"User is inactive ({user.status})"
-            return {
+            return gate_feed.publish_result(gate, "user", user.admission_number, {
                 "status": status,
                 "message": message,
                 "data": {
@@ -493,14 +627,10 @@ async def scan_entry(
                     "time": get_eat_time().strftime("%I:%M %p"),
                     "image": user.profile_image or "https://cdn-icons-png.flaticon.com/512/3135/3135715.png"
                 }
-            }
+            })
 
-        open_log = (await session.exec(
-            select(EntryLog)
-            .where(EntryLog.user_id == user.id)
-            .where(EntryLog.exit_time == None)
-            .order_by(EntryLog.entry_time.desc())
-        )).first()
+        with span("open_log"):
+            open_log = await get_open_entry_log(session, user.id)
 
         if open_log:
             # Check Out
@@ -515,10 +645,11 @@ async def scan_entry(
                 table_name="entry_logs",
                 record_id=str(open_log.id),
                 description=f"Auto gate scan checkout for {user.full_name} at {gate.name}",
+                user=guard,
                 request=request
             )
             
-            return {
+            return gate_feed.publish_result(gate, "user", user.admission_number, {
                 "status": "allowed",
                 "message": f"Checked OUT successfully: {user.full_name}",
                 "data": {
@@ -527,7 +658,7 @@ async def scan_entry(
                     "time": get_eat_time().strftime("%I:%M %p"),
                     "image": user.profile_image or "https://cdn-icons-png.flaticon.com/512/3135/3135715.png"
                 }
-            }
+            }, direction="out")
         else:
             # Check In
             new_log = EntryLog(
@@ -535,7 +666,8 @@ async def scan_entry(
                 gate_id=gate.id,
                 entry_time=get_eat_time(),
                 method="qr",
-                status="allowed"
+                status="allowed",
+                guard_id=guard.id if guard else None
             )
             session.add(new_log)
             await session.commit()
@@ -547,10 +679,11 @@ async def scan_entry(
                 table_name="entry_logs",
                 record_id=str(new_log.id),
                 description=f"Auto gate scan checkin for {user.full_name} at {gate.name}",
+                user=guard,
                 request=request
             )
             
-            return {
+            return gate_feed.publish_result(gate, "user", user.admission_number, {
                 "status": "allowed",
                 "message": f"Checked IN successfully: {user.full_name}",
                 "data": {
@@ -559,9 +692,395 @@ async def scan_entry(
                     "time": get_eat_time().strftime("%I:%M %p"),
                     "image": user.profile_image or "https://cdn-icons-png.flaticon.com/512/3135/3135715.png"
                 }
-            }
+            }, direction="in")
+
+# --- Offline / Batch Scan Ingestion ---
+
+BATCH_SCAN_LIMIT = 500
+
+def parse_client_time(value) -> Optional[datetime]:
+    """Device timestamp as naive EAT: ISO-8601 (zoned values are converted) or epoch seconds/milliseconds."""
+    from datetime import timezone, timedelta
+    eat_tz = timezone(timedelta(hours=3))
+    if value is None or value == "":
+        return None
+    try:
+        if isinstance(value, (int, float)):
+            seconds = value / 1000 if value > 1e11 else value
+            return datetime.fromtimestamp(seconds, eat_tz).replace(tzinfo=None)
+        parsed = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+        if parsed.tzinfo:
+            parsed = parsed.astimezone(eat_tz).replace(tzinfo=None)
+        return parsed
+    except (ValueError, TypeError, OverflowError, OSError):
+        return None
+
+@router.post("/scan/batch")
+async def scan_batch(
+    request: Request,
+    payload: dict,
+    session: AsyncSession = Depends(get_session)
+):
+    """
+    Drain scans buffered by a gate device while it was offline.
+    Payload: { "gate_id": "optional default", "scanner_name": "optional",
+               "scans": [{ "code": str, "client_ts": iso|epoch, "gate_id": "optional", "idempotency_key": str }] }
+
+    Codes are resolved with one query per entity type, IN/OUT toggles are applied per
+    entity in client-timestamp order using the same rules as /scan, and all log rows are
+    written in a single transaction. Keys that were already applied come back as duplicates.
+    """
+    import re
+    scans = payload.get("scans")
+    if not isinstance(scans, list) or not scans:
+        raise HTTPException(status_code=400, detail="scans must be a non-empty list")
+    if len(scans) > BATCH_SCAN_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_SCAN_LIMIT} scans per batch")
+
+    received_at = get_eat_time()
+    scanner_name = payload.get("scanner_name")
+    results = [None] * len(scans)
+    items = []
+    batch_keys = set()
+
+    # 1. Validate items and drop keys repeated inside the batch
+    for index, raw in enumerate(scans):
+        raw = raw if isinstance(raw, dict) else {}
+        key = str(raw.get("idempotency_key") or "").strip()
+        code = str(raw.get("code") or raw.get("admission_number") or "").strip()
+        result = {"index": index, "idempotency_key": key or None}
+        if not key or len(key) > 255:
+            results[index] = {**result, "status": "rejected", "message": "A device idempotency_key (max 255 chars) is required"}
+            continue
+        if key in batch_keys:
+            results[index] = {**result, "status": "duplicate", "message": "Key repeated within this batch"}
+            continue
+        batch_keys.add(key)
+        if not code:
+            results[index] = {**result, "status": "rejected", "message": "Scanned code is empty"}
+            continue
+        try:
+            signed = verify_signed_code(code)
+        except qr_signing.InvalidQR as e:
+            results[index] = {**result, "status": "rejected", "message": str(e)}
+            continue
+        if signed and signed.kind not in SIGNED_GATE_MODELS:
+            results[index] = {**result, "status": "rejected", "message": "This QR code is not a gate pass"}
+            continue
+        client_ts = parse_client_time(raw.get("client_ts")) or received_at
+        items.append({
+            "index": index, "key": key, "code": code, "client_ts": client_ts,
+            "gate_id": raw.get("gate_id") or payload.get("gate_id"), "signed": signed
+        })
+
+    # 2. Keys applied by an earlier (retried) upload
+    if items:
+        applied = (await session.exec(
+            select(GateScanLog.idempotency_key, GateScanLog.status, GateScanLog.details)
+            .where(GateScanLog.idempotency_key.in_([item["key"] for item in items]))
+        )).all()
+        applied = {key: (status, details) for key, status, details in applied}
+        fresh = []
+        for item in items:
+            if item["key"] in applied:
+                status, details = applied[item["key"]]
+                results[item["index"]] = {
+                    "index": item["index"], "idempotency_key": item["key"], "status": "duplicate",
+                    "original_status": status, "message": details or "Already applied"
+                }
+            else:
+                fresh.append(item)
+        items = fresh
+
+    # 3. Gates from the reference cache, falling back to the Main Gate like /scan
+    gates = {}
+    for item in items:
+        gate = await reference_cache.get_gate(session, item["gate_id"]) if item["gate_id"] else None
+        item["gate_id"] = gate.id if gate else None
+        if gate:
+            gates[gate.id] = gate
+    default_gate = None
+    if any(item["gate_id"] is None for item in items):
+        default_gate = await reference_cache.main_gate(session)
+
+    # 4. Signed codes name their entity by primary key: one query per kind
+    signed_entities = {}
+    for kind, model in SIGNED_GATE_MODELS.items():
+        ids = {item["signed"].id for item in items if item["signed"] and item["signed"].kind == kind}
+        if ids:
+            for entity in (await session.exec(select(model).where(model.id.in_(ids)))).all():
+                signed_entities[(kind, entity.id)] = entity
+
+    # Classify the other codes; the identity index narrows which tables each code is looked up in
+    user_codes, plates, visitor_codes, event_tokens = set(), set(), set(), set()
+    for item in items:
+        if item["signed"]:
+            entity = signed_entities.get((item["signed"].kind, item["signed"].id))
+            item["entity_type"], item["visitor_card"] = item["signed"].kind, None
+            item["parsed_code"] = signed_natural_code(item["signed"].kind, entity) if entity else item["code"]
+            continue
+        entity_type, parsed_code = parse_scan_prefix(item["code"])
+        if not entity_type:
+            classified = identity_index.classify(item["code"])
+            if classified:
+                entity_type = classified[0]
+        if entity_type == "visitor":
+            parts = parsed_code.split(":")
+            item["visitor_card"] = parts if len(parts) >= 3 else None
+            if item["visitor_card"]:
+                parsed_code = parts[1]
+        item["entity_type"], item["parsed_code"] = entity_type, parsed_code
+
+        if entity_type in (None, "user"):
+            user_codes.add(parsed_code)
+        if entity_type in (None, "vehicle"):
+            plates.add(parsed_code.upper().replace("-", " "))
+        if entity_type in (None, "visitor"):
+            visitor_codes.add(parsed_code)
+        if entity_type == "event":
+            event_tokens.add(parsed_code)
+
+    # Plates that are only a misread of a registered plate are looked up (and logged) as that plate
+    plate_aliases = {}
+    for plate in plates:
+        close = plate_index.match(plate)
+        if close and normalize_code(close.plate_number) != normalize_code(plate):
+            plate_aliases[normalize_code(plate)] = normalize_code(close.plate_number)
+    plates |= set(plate_aliases.values())
+
+    users, vehicles, visitors, events = {}, {}, {}, {}
+    if user_codes:
+        for user in (await session.exec(select(User).where(User.admission_number.in_(user_codes)))).all():
+            users[normalize_code(user.admission_number)] = user
+    if plates:
+        for vehicle in (await session.exec(select(Vehicle).where(Vehicle.plate_number.in_(plates)))).all():
+            vehicles[normalize_code(vehicle.plate_number)] = vehicle
+        for alias, registered in plate_aliases.items():
+            if registered in vehicles and alias not in vehicles:
+                vehicles[alias] = vehicles[registered]
+    if visitor_codes:
+        visitor_uuids = set()
+        for visitor_code in visitor_codes:
+            try:
+                visitor_uuids.add(uuid.UUID(visitor_code))
+            except ValueError:
+                pass
+        from sqlalchemy import or_
+        visitor_query = select(Visitor).where(or_(Visitor.id_number.in_(visitor_codes), Visitor.id.in_(visitor_uuids)))
+        # Oldest first so the latest visit wins for a reused ID number
+        for visitor in (await session.exec(visitor_query.order_by(Visitor.time_in))).all():
+            visitors[normalize_code(visitor.id_number)] = visitor
+            visitors[str(visitor.id).upper()] = visitor
+            visitors[visitor.id.hex.upper()] = visitor
+    if event_tokens:
+        for ev in (await session.exec(select(Event).where(Event.qr_code_token.in_(event_tokens)))).all():
+            events[normalize_code(ev.qr_code_token)] = ev
+    for (kind, _), entity in signed_entities.items():
+        {"user": users, "visitor": visitors, "event": events}[kind][normalize_code(signed_natural_code(kind, entity))] = entity
+
+    # Un-prefixed codes the index did not know: same priority as /scan
+    for item in items:
+        if item["entity_type"]:
+            continue
+        key = normalize_code(item["parsed_code"])
+        upper_code = item["code"].upper()
+        if key in users:
+            item["entity_type"] = "user"
+        elif key.replace("-", " ") in vehicles:
+            item["entity_type"] = "vehicle"
+        elif key in visitors:
+            item["entity_type"] = "visitor"
+            item["visitor_card"] = None
+        elif re.match(r'^[A-Z]{2,3}\s?\d{3,4}\s?[A-Z]{0,2}$', upper_code) or re.match(r'^[A-Z0-9\s]{5,10}$', upper_code):
+            item["entity_type"] = "vehicle"
+        else:
+            item["entity_type"] = "user"
+
+    # 5. Open logs for every entity in the batch (one query per log table)
+    open_entries, open_vehicle_logs = {}, {}
+    batch_user_ids = {u.id for u in users.values()}
+    batch_vehicle_ids = {v.id for v in vehicles.values()}
+    # By entity rather than through the presence table, which may lag the other workers
+    for model, column, entity_ids, open_map in (
+        (EntryLog, EntryLog.user_id, batch_user_ids, open_entries),
+        (VehicleLog, VehicleLog.vehicle_id, batch_vehicle_ids, open_vehicle_logs),
+    ):
+        if not entity_ids:
+            continue
+        query = select(model).where(model.exit_time == None).where(column.in_(entity_ids))
+        for log in (await session.exec(query.order_by(model.entry_time))).all():
+            open_map[getattr(log, column.key)] = log
+
+    # 6. Apply toggles in client-timestamp order (stable, so ties keep upload order)
+    new_vehicles, new_visitors = [], []
+    summary = {"in": 0, "out": 0, "rejected": 0}
+    for item in sorted(items, key=lambda i: i["client_ts"]):
+        # Devices with a drifting clock must not log scans in the future
+        ts = min(item["client_ts"], received_at)
+        gate = gates.get(item["gate_id"]) or default_gate
+        entity_type = item["entity_type"]
+        key = normalize_code(item["parsed_code"])
+        status, action, message = "rejected", None, None
+
+        if entity_type == "event":
+            ev = events.get(key)
+            if ev:
+                status, message = "event_pass", f"Valid Event Pass: {ev.name}"
+            else:
+                message = "Invalid Event Pass"
+
+        elif entity_type == "vehicle":
+            plate = item["parsed_code"].upper().replace("-", " ")
+            vehicle = vehicles.get(normalize_code(plate))
+            if not vehicle:
+                vehicle = Vehicle(
+                    plate_number=plate,
+                    make=random.choice(["Toyota", "Subaru", "Mazda", "Nissan", "Honda", "Mercedes"]),
+                    model=random.choice(["Corolla", "Outback", "Demio", "Note", "Fit", "C200"]),
+                    color=random.choice(["White", "Silver", "Black", "Blue", "Red", "Grey"]),
+                    vehicle_type="bus" if "BUS" in item["code"].upper() else "utility"
+                )
+                session.add(vehicle)
+                vehicles[normalize_code(plate)] = vehicle
+                new_vehicles.append(vehicle)
+            plate = vehicle.plate_number
+            open_log = open_vehicle_logs.pop(vehicle.id, None)
+            status = "allowed"
+            if open_log:
+                open_log.exit_time = max(ts, open_log.entry_time)
+                open_log.exit_gate_id = gate.id
+                session.add(open_log)
+                action, message = "out", f"Vehicle {plate} checked OUT successfully"
+            else:
+                new_log = VehicleLog(vehicle_id=vehicle.id, gate_id=gate.id, entry_time=ts, manual_override=False, detected_passengers=1)
+                session.add(new_log)
+                open_vehicle_logs[vehicle.id] = new_log
+                action, message = "in", f"Vehicle {plate} checked IN successfully"
+
+        elif entity_type == "visitor" and item["signed"] and key not in visitors:
+            message = "Visitor pass no longer valid"
+
+        elif entity_type == "visitor":
+            visitor = visitors.get(key)
+            is_new = False
+            if not visitor:
+                is_new = True
+                card = item.get("visitor_card")
+                if card:
+                    name = card[0]
+                    visitor = Visitor(
+                        first_name=name.split(" ")[0],
+                        last_name=" ".join(name.split(" ")[1:]) if len(name.split(" ")) > 1 else "Visitor",
+                        id_number=card[1],
+                        phone_number=card[2],
+                        visit_details=card[3] if len(card) > 3 else "Scanned Visitor Card",
+                        status="checked_in",
+                        time_in=ts
+                    )
+                else:
+                    visitor = Visitor(
+                        first_name="Scanned",
+                        last_name=f"Guest-{item['parsed_code'][-4:]}",
+                        id_number=item["parsed_code"],
+                        phone_number="N/A",
+                        visit_details="Auto-Registered Guest",
+                        status="checked_in",
+                        time_in=ts
+                    )
+                session.add(visitor)
+                visitors[key] = visitor
+                new_visitors.append(visitor)
+            status = "allowed"
+            if is_new:
+                action, message = "in", f"Visitor {visitor.first_name} checked IN successfully"
+            elif visitor.status == "checked_in" and not visitor.time_out:
+                visitor.time_out = max(ts, visitor.time_in)
+                visitor.status = "checked_out"
+                action, message = "out", f"Visitor {visitor.first_name} checked OUT successfully"
+            else:
+                visitor.time_in = ts
+                visitor.time_out = None
+                visitor.status = "checked_in"
+                action, message = "in", f"Visitor {visitor.first_name} checked IN successfully"
+            session.add(visitor)
+
+        else:
+            user = users.get(key)
+            if not user:
+                message = f"User not found for code: {item['parsed_code']}"
+            elif user.status != "active":
+                message = f"User is inactive ({user.status})"
+            else:
+                status = "allowed"
+                open_log = open_entries.pop(user.id, None)
+                if open_log:
+                    open_log.exit_time = max(ts, open_log.entry_time)
+                    open_log.exit_gate_id = gate.id
+                    session.add(open_log)
+                    action, message = "out", f"Checked OUT successfully: {user.full_name}"
+                else:
+                    new_log = EntryLog(user_id=user.id, gate_id=gate.id, entry_time=ts, method="qr", status="allowed")
+                    session.add(new_log)
+                    open_entries[user.id] = new_log
+                    action, message = "in", f"Checked IN successfully: {user.full_name}"
+
+        session.add(GateScanLog(
+            gate_id=gate.id,
+            scan_type=entity_type,
+            scanned_value=item["code"],
+            status=status,
+            details=message,
+            scanner_name=scanner_name,
+            timestamp=ts,
+            idempotency_key=item["key"]
+        ))
+        if action:
+            summary[action] += 1
+        elif status == "rejected":
+            summary["rejected"] += 1
+        results[item["index"]] = {
+            "index": item["index"], "idempotency_key": item["key"], "status": status,
+            "action": action, "entity_type": entity_type, "message": message,
+            "time": ts.strftime("%I:%M %p")
+        }
+
+    # 7. One commit for the whole batch
+    if items:
+        from sqlalchemy.exc import IntegrityError
+        try:
+            await session.commit()
+        except IntegrityError:
+            # The same keys were applied concurrently (device retried mid-request); a retry reports them as duplicates
+            await session.rollback()
+            raise HTTPException(status_code=409, detail="Batch overlaps one that is still being applied, retry shortly")
+        for vehicle in new_vehicles:
+            identity_index.remember_vehicle(vehicle)
+        for visitor in new_visitors:
+            identity_index.remember_visitor(visitor)
+        for item in sorted(items, key=lambda i: i["client_ts"]):
+            result = results[item["index"]]
+            gate_feed.publish(
+                gates.get(item["gate_id"]) or default_gate, result["entity_type"], result["status"],
+                result["message"], identifier=item["parsed_code"], direction=result.get("action")
+            )
+
+        await log_action(
+            session=session,
+            action_type="gate_scan_batch",
+            table_name="gate_scan_logs",
+            description=f"Batch upload of {len(items)} scans ({summary['in']} in, {summary['out']} out, {summary['rejected']} rejected)",
+            request=request
+        )
+
+    return {
+        "received": len(scans),
+        "applied": len(items),
+        "duplicates": sum(1 for r in results if r["status"] == "duplicate"),
+        "results": results
+    }
 
 @router.post("/check-in/{admission_number}")
+@idempotent
 async def check_in_user(
     request: Request,
     admission_number: str, 
@@ -573,20 +1092,7 @@ async def check_in_user(
         raise HTTPException(status_code=404, detail="User not found")
     
     # 2. Get Gate
-    gate = None
-    if gate_id:
-        try:
-            import uuid
-            gate = await session.get(Gate, uuid.UUID(str(gate_id)))
-        except Exception:
-            pass
-    if not gate:
-        gate = (await session.exec(select(Gate).where(Gate.name == "Main Gate"))).first()
-        if not gate:
-            gate = Gate(name="Main Gate", location="Main Entrance")
-            session.add(gate)
-            await session.commit()
-            await session.refresh(gate)
+    gate = await reference_cache.resolve_gate(session, gate_id)
 
     # 1. Close any open sessions
     open_logs = (await session.exec(select(EntryLog).where(EntryLog.user_id == user.id).where(EntryLog.exit_time == None))).all()
@@ -629,23 +1135,10 @@ async def check_out_user(
         raise HTTPException(status_code=404, detail="User not found")
     
     # Get Gate
-    gate = None
-    if gate_id:
-        try:
-            import uuid
-            gate = await session.get(Gate, uuid.UUID(str(gate_id)))
-        except Exception:
-            pass
-    if not gate:
-        gate = (await session.exec(select(Gate).where(Gate.name == "Main Gate"))).first()
-        if not gate:
-            gate = Gate(name="Main Gate", location="Main Entrance")
-            session.add(gate)
-            await session.commit()
-            await session.refresh(gate)
+    gate = await reference_cache.resolve_gate(session, gate_id)
 
     # Find last open entry
-    log = (await session.exec(select(EntryLog).where(EntryLog.user_id == user.id).where(EntryLog.exit_time == None).order_by(EntryLog.entry_time.desc()))).first()
+    log = await get_open_entry_log(session, user.id)
     
     if not log:
         # Create a mock entry if none found, to allow checking out.
@@ -686,18 +1179,14 @@ async def scan_vehicle_plate(
     """
     Uploads an image of a vehicle, performs OCR (Simulated), and logs the entry.
     """
-    # 1. Setup Directories
-    upload_dir = "static/vehicle_logs"
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    # 2. Save Image
-    file_id = str(uuid.uuid4())
+    # 1-2. Save Image
     ext = file.filename.split(".")[-1] if "." in file.filename else "jpg"
-    filename = f"{file_id}.{ext}"
-    filepath = f"{upload_dir}/{filename}"
-    
-    with open(filepath, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    try:
+        image_url = (await save_upload(file, "vehicle_logs", fallback_ext=ext))["url"]
+    except EvidenceBusy:
+        raise HTTPException(status_code=429, detail="Too many images being processed, retry shortly", headers={"Retry-After": "1"})
+    except EvidenceTooLarge as e:
+        raise HTTPException(status_code=413, detail=f"Image too large: {e}")
         
     # 3. Perform OCR (Simulated for Demo)
     # In production: text = ocr_engine.process(filepath)
@@ -712,23 +1201,21 @@ async def scan_vehicle_plate(
     else:
         detected_text = f"KCA {random.randint(100, 999)}{random.choice(['A','B','C'])}"
         
-    # 4. Lookup Vehicle with Owner details
+    # 4. Lookup Vehicle with Owner details (OCR misreads resolve to the registered plate)
     from sqlalchemy.orm import selectinload
+    close = plate_index.match(detected_text)
     vehicle = (await session.exec(
         select(Vehicle)
-        .where(Vehicle.plate_number == detected_text)
+        .where(Vehicle.id == close.vehicle_id if close else Vehicle.plate_number == detected_text)
         .options(selectinload(Vehicle.owner))
     )).first()
+    if vehicle:
+        detected_text = vehicle.plate_number
     
     status = "allowed" if vehicle else "flagged" # Flagged if unknown
     
     # 5. Get Gate
-    gate = (await session.exec(select(Gate).where(Gate.name == "Main Gate"))).first()
-    if not gate:
-        # Create default gate if missing (auto-heal)
-        gate = Gate(name="Main Gate", location="Main Entrance")
-        session.add(gate)
-        await session.commit()
+    gate = await reference_cache.main_gate(session)
     
     # 6. Log Entry
     owner_data = None
@@ -754,6 +1241,7 @@ async def scan_vehicle_plate(
         session.add(vehicle)
         await session.commit()
         await session.refresh(vehicle)
+        identity_index.remember_vehicle(vehicle)
         status = "visitor"
     elif not vehicle.owner:
         # We have a vehicle but no registered system owner (e.g. staff car not linked yet)
@@ -768,7 +1256,7 @@ async def scan_vehicle_plate(
         vehicle_id=vehicle.id,
         gate_id=gate.id,
         entry_time=get_eat_time(),
-        vehicle_images={"front": f"/{filepath}"},
+        vehicle_images={"front": image_url},
         manual_override=False,
         detected_passengers=random.randint(1, 4)
     )
@@ -796,45 +1284,79 @@ async def scan_vehicle_plate(
             "color": vehicle.color,
             "passengers": log.detected_passengers,
             "entry_time": log.entry_time.strftime("%I:%M %p"),
-            "image_url": f"/{filepath}",
+            "image_url": image_url,
             "owner": owner_data
         }
     }
 
 @router.post("/ocr-plate")
 async def ocr_plate(
-    file: UploadFile = File(...),
+    file: Optional[UploadFile] = File(None),
+    files: Optional[List[UploadFile]] = File(None),
     session: AsyncSession = Depends(get_session)
 ):
     """
-    Perform OCR on vehicle plate image and return the plate number and registration status.
+    Read the plate in a vehicle photo and return the plate number and registration status.
+    Send several frames of the same car as `files` to have their reads combined.
     """
-    upload_dir = "static/vehicle_logs"
-    os.makedirs(upload_dir, exist_ok=True)
-    file_id = str(uuid.uuid4())
-    ext = file.filename.split(".")[-1] if "." in file.filename else "jpg"
-    filename = f"ocr_{file_id}.{ext}"
-    filepath = f"{upload_dir}/{filename}"
-    
-    with open(filepath, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
-    # Simulate OCR plate detection
-    existing_vehicle = (await session.exec(select(Vehicle))).first()
-    if existing_vehicle and random.choice([True, True, False]):
-        detected_text = existing_vehicle.plate_number
-    else:
-        detected_text = f"KCA {random.randint(100, 999)}{random.choice(['A','B','C'])}"
-        
-    vehicle = (await session.exec(select(Vehicle).where(Vehicle.plate_number == detected_text))).first()
+    uploads = ([file] if file else []) + (files or [])
+    if not uploads:
+        raise HTTPException(status_code=400, detail="No image uploaded")
+    if len(uploads) > PLATE_OCR_MAX_FRAMES:
+        raise HTTPException(status_code=400, detail=f"At most {PLATE_OCR_MAX_FRAMES} frames per request")
+    # Frames are held and pickled to the OCR pool whole, so cap them like every other photo
+    frames = []
+    for upload in uploads:
+        data = await upload.read(EVIDENCE_MAX_BYTES + 1)
+        if len(data) > EVIDENCE_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Image too large: photo exceeds {EVIDENCE_MAX_BYTES // (1024 * 1024)} MB")
+        frames.append(data)
+
+    try:
+        result = await plate_ocr.recognize(frames)
+    except PlateOCRBusy:
+        raise HTTPException(status_code=429, detail="Plate recognition is busy, retry shortly", headers={"Retry-After": "1"})
+    except PlateOCRUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"Plate recognition is not available: {e}")
+
+    # Keep the frame the plate was best read from as evidence (stored off the event loop);
+    # the read itself is still returned when the image pool is too busy to store it
+    best = uploads[result["best_frame"]]
+    ext = best.filename.split(".")[-1] if best.filename and "." in best.filename else "jpg"
+    try:
+        image_url = (await save_bytes(frames[result["best_frame"]], "vehicle_logs", fallback_ext=ext))["url"]
+    except (EvidenceBusy, EvidenceTooLarge) as e:
+        print(f"OCR frame not stored: {e}")
+        image_url = None
+
+    detected_text = result["text"]
+    vehicle = await find_vehicle_by_plate(session, detected_text) if detected_text else None
+    candidates = plate_index.search(detected_text) if detected_text else []
     
     return {
-        "plate_number": detected_text,
+        # Copied into manual entry, so write it the way registered plates are written
+        "plate_number": (vehicle.plate_number if vehicle else display_plate(detected_text)) if detected_text else None,
+        "confidence": result["confidence"],
+        # Lowest per-character share of the vote across frames (1.0 for a single frame)
+        "agreement": result["agreement"],
+        "plate_box": result["frames"][result["best_frame"]]["box"],
+        "frames": len(frames),
         "is_registered": vehicle is not None,
+        "matched_plate": vehicle.plate_number if vehicle else None,
         "vehicle": vehicle,
-        "image_url": f"/{filepath}"
+        # Registered plates close to the read, best first, for the guard to pick from
+        "candidates": [
+            {"vehicle_id": str(c.vehicle_id), "plate_number": c.plate_number, "distance": c.distance, "score": c.score}
+            for c in candidates
+        ],
+        "image_url": image_url
     }
 
+@router.get("/ocr-plate/stats")
+async def ocr_plate_stats(admin: User = Depends(get_current_admin)):
+    """Plate OCR pool size, queue depth and rejection counts for this worker"""
+    return plate_ocr.stats()
+
 # Duplicate get_vehicle_logs removed (Use the one below)
 
 @router.get("/vehicles")
@@ -866,25 +1388,32 @@ async def get_all_vehicles(limit: int = 100, session: AsyncSession = Depends(get
 
 @router.get("/vehicles/search")
 async def search_vehicles(q: str, session: AsyncSession = Depends(get_session)):
-    """Autocomplete search for vehicles by plate"""
+    """Autocomplete search for vehicles by plate; close matches for a mistyped full plate come first"""
     if len(q) < 2: return []
-    query = select(Vehicle).where(Vehicle.plate_number.contains(q)).limit(10)
-    results = await session.exec(query)
-    return results.all()
+    close_ids = [c.vehicle_id for c in plate_index.search(q, limit=10)]
+    vehicles = []
+    if close_ids:
+        found = {v.id: v for v in (await session.exec(select(Vehicle).where(Vehicle.id.in_(close_ids)))).all()}
+        vehicles = [found[vid] for vid in close_ids if vid in found]
+    if len(vehicles) < 10:
+        query = select(Vehicle).where(Vehicle.plate_number.contains(q))
+        if close_ids:
+            query = query.where(Vehicle.id.notin_(close_ids))
+        vehicles += (await session.exec(query.limit(10 - len(vehicles)))).all()
+    return vehicles
 
 @router.post("/vehicle-exit")
 async def vehicle_exit(payload: dict, session: AsyncSession = Depends(get_session)):
     """Mark a vehicle as exited"""
     plate = payload.get("plate_number")
     # Find last entry without exit
-    query = (
-        select(VehicleLog)
-        .join(Vehicle)
-        .where(Vehicle.plate_number == plate)
-        .where(VehicleLog.exit_time == None)
-        .order_by(VehicleLog.entry_time.desc())
-    )
-    log = (await session.exec(query)).first()
+    vehicle_id = identity_index.resolve("vehicle", plate) if plate else None
+    if not vehicle_id and plate:
+        close = plate_index.match(plate)
+        vehicle_id = close.vehicle_id if close else None
+    if not vehicle_id:
+        vehicle_id = (await session.exec(select(Vehicle.id).where(Vehicle.plate_number == plate))).first()
+    log = await get_open_vehicle_log(session, vehicle_id) if vehicle_id else None
     
     if not log:
          raise HTTPException(status_code=404, detail="Vehicle not inside")
@@ -911,58 +1440,55 @@ async def get_vehicle_stats(
     today = get_eat_time().date()
     start_of_day = datetime.combine(today, datetime.min.time())
     
-    query_today = select(VehicleLog, Vehicle).join(Vehicle).where(VehicleLog.entry_time >= start_of_day)
+    gate_uuid = None
     if gate_id:
         try:
             import uuid
             gate_uuid = uuid.UUID(gate_id)
-            query_today = query_today.where((VehicleLog.gate_id == gate_uuid) | (VehicleLog.exit_gate_id == gate_uuid))
         except Exception:
             pass
-    results = (await session.exec(query_today)).all()
-    
-    logs_data = [] # List of dicts
-    for log, vehicle in results:
-        logs_data.append({"log": log, "vehicle": vehicle})
+
+    # Only the columns the totals and stay lengths need; no Vehicle rows are loaded
+    query_today = select(
+        VehicleLog.vehicle_id, VehicleLog.entry_time, VehicleLog.exit_time, VehicleLog.manual_override
+    ).where(VehicleLog.entry_time >= start_of_day)
+    if gate_uuid:
+        query_today = query_today.where((VehicleLog.gate_id == gate_uuid) | (VehicleLog.exit_gate_id == gate_uuid))
+    logs_data = (await session.exec(query_today)).all()
     
     total_entered = len(logs_data)
-    exited_logs = [d for d in logs_data if d["log"].exit_time]
-    active_logs = [d for d in logs_data if not d["log"].exit_time]
-    
-    total_exited = len(exited_logs)
-    current_inside = len(active_logs)
-    manual_entries = len([d for d in logs_data if d["log"].manual_override])
+    total_exited = len([d for d in logs_data if d.exit_time])
+    current_inside = total_entered - total_exited
+    manual_entries = len([d for d in logs_data if d.manual_override])
     
     # Calculate Longest Stays
     now = get_eat_time()
     durations = []
-    
-    # Init Hourly Traffic (0-23)
-    traffic_map = {i: {"entries": 0, "exits": 0} for i in range(24)}
-
     for d in logs_data:
-        entry = d["log"].entry_time
-        exit_t = d["log"].exit_time or now
-        duration_sec = (exit_t - entry).total_seconds()
+        exit_t = d.exit_time or now
         durations.append({
-            "plate": d["vehicle"].plate_number,
-            "driver": d["vehicle"].driver_name or "Unknown",
-            "make": d["vehicle"].make or "Unknown",
-            "duration_sec": duration_sec,
-            "status": "Exited" if d["log"].exit_time else "Parked",
-            "entry_time": entry.strftime("%H:%M")
+            "vehicle_id": d.vehicle_id,
+            "duration_sec": (exit_t - d.entry_time).total_seconds(),
+            "status": "Exited" if d.exit_time else "Parked",
+            "entry_time": d.entry_time.strftime("%H:%M")
         })
-        
-        # Traffic Counts
-        h_in = entry.hour
-        if 0 <= h_in < 24: traffic_map[h_in]["entries"] += 1
-        
-        if d["log"].exit_time:
-            h_out = d["log"].exit_time.hour
-            if 0 <= h_out < 24: traffic_map[h_out]["exits"] += 1
+    
+    # Hourly Traffic (0-23) from the gate traffic rollup
+    traffic_map = {i: {"entries": 0, "exits": 0} for i in range(24)}
+    for row in await traffic_rollup.hourly(session, start_of_day, gate_id=gate_uuid):
+        traffic_map[row.hour.hour]["entries"] += row.vehicles_in
+        traffic_map[row.hour.hour]["exits"] += row.vehicles_out
     
     # Top 5 longest
     longest_stays = sorted(durations, key=lambda x: x["duration_sec"], reverse=True)[:5]
+    stay_vehicles = {v.id: v for v in (await session.exec(
+        select(Vehicle).where(Vehicle.id.in_([d["vehicle_id"] for d in longest_stays]))
+    )).all()} if longest_stays else {}
+    for d in longest_stays:
+        vehicle = stay_vehicles.get(d.pop("vehicle_id"))
+        d["plate"] = vehicle.plate_number if vehicle else "Unknown"
+        d["driver"] = (vehicle.driver_name if vehicle else None) or "Unknown"
+        d["make"] = (vehicle.make if vehicle else None) or "Unknown"
     
     # Format durations
     for d in longest_stays:
@@ -988,15 +1514,11 @@ async def get_vehicle_stats(
         "total_exited": total_exited,
         "current_inside": current_inside,
         "manual_entries": manual_entries,
-        "unique_vehicles": len({d["log"].vehicle_id for d in logs_data}),
+        "unique_vehicles": len({d.vehicle_id for d in logs_data}),
         "longest_stays": longest_stays,
         "hourly_traffic": hourly_traffic
     }
 
-from sqlmodel import select, func, text
-
-# ... imports ...
-
 @router.get("/vehicle-logs")
 async def get_vehicle_logs(session: AsyncSession = Depends(get_session)):
     """
@@ -1087,6 +1609,7 @@ async def list_visitors(session: AsyncSession = Depends(get_session)):
     return results.all()
 
 @router.post("/visitors/check-in")
+@idempotent
 async def check_in_visitor(
     request: Request,
     payload: dict, # { first_name, last_name, phone_number, id_number, visit_details }
@@ -1119,6 +1642,7 @@ async def check_in_visitor(
         session.add(visitor)
         await session.commit()
         await session.refresh(visitor)
+        identity_index.remember_visitor(visitor)
 
         # Log visitor check-in
         await log_action(
@@ -1129,11 +1653,25 @@ async def check_in_visitor(
             description=f"Visitor {visitor.first_name} {visitor.last_name} checked in",
             request=request
         )
+        gate_feed.publish(
+            None, "visitor", "allowed", f"Visitor {visitor.first_name} checked IN successfully",
+            name=f"{visitor.first_name} {visitor.last_name}", identifier=visitor.id_number,
+            role="Visitor", gate_id=gate_uuid, direction="in"
+        )
 
         return visitor
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Check-in failed: {str(e)}")
 
+@router.get("/visitors/{visitor_id}/qr")
+async def get_visitor_qr(visitor_id: uuid.UUID, session: AsyncSession = Depends(get_session)):
+    """Signed visitor pass, valid until the end of the visit day"""
+    visitor = await session.get(Visitor, visitor_id)
+    if not visitor:
+        raise HTTPException(status_code=404, detail="Visitor not found")
+    expires_at = datetime.combine(get_eat_time().date(), datetime.max.time())
+    return {"qr_token": qr_signing.sign("visitor", visitor.id, expires_at=expires_at), "expires_at": expires_at}
+
 @router.post("/visitors/check-out")
 async def check_out_visitor(
     request: Request,
@@ -1167,6 +1705,11 @@ async def check_out_visitor(
         description=f"Visitor {visitor.first_name} {visitor.last_name} checked out",
         request=request
     )
+    gate_feed.publish(
+        None, "visitor", "allowed", f"Visitor {visitor.first_name} checked OUT successfully",
+        name=f"{visitor.first_name} {visitor.last_name}", identifier=visitor.id_number,
+        role="Visitor", gate_id=visitor.gate_id, direction="out"
+    )
 
     return visitor
 
@@ -1238,6 +1781,11 @@ async def get_gate_statistics(session: AsyncSession = Depends(get_session)):
         
     return stats_data
 
+@router.get("/identity-index/stats")
+async def get_identity_index_stats(admin: User = Depends(get_current_admin)):
+    """Hit/miss counters and size of the in-memory scan identity index"""
+    return identity_index.stats()
+
 # --- Gate Management CRUD ---
 
 @router.get("/manage/gates")
@@ -1252,6 +1800,7 @@ async def create_gate(gate_data: dict, session: AsyncSession = Depends(get_sessi
     session.add(gate)
     await session.commit()
     await session.refresh(gate)
+    reference_cache.invalidate("gates")
     return gate
 
 @router.put("/manage/gates/{gate_id}")
@@ -1266,6 +1815,7 @@ async def update_gate(gate_id: uuid.UUID, gate_data: dict, session: AsyncSession
     session.add(gate)
     await session.commit()
     await session.refresh(gate)
+    reference_cache.invalidate("gates")
     return gate
 
 @router.delete("/manage/gates/{gate_id}")
@@ -1274,14 +1824,11 @@ async def delete_gate(gate_id: uuid.UUID, session: AsyncSession = Depends(get_se
     if gate:
         session.delete(gate)
         await session.commit()
+        reference_cache.invalidate("gates")
     return {"message": "Deleted"}
 
 # --- Public/Self-Service Access ---
 
-from sqlalchemy import desc
-
-# ... existing code ...
-
 @router.get("/recent-activity")
 async def get_global_recent_activity(session: AsyncSession = Depends(get_session)):
     """Fetch live recent activity (Last 5) from ALL gates"""
@@ -1293,89 +1840,8 @@ async def get_gate_recent_activity(gate_id: uuid.UUID, session: AsyncSession = D
     return await fetch_recent_activity(session, gate_id)
 
 async def fetch_recent_activity(session: AsyncSession, gate_id: Optional[uuid.UUID]):
-    combined = []
-    
-    # helper for filtering
-    def apply_filter(stmt, model_col):
-        if gate_id: return stmt.where(model_col == gate_id)
-        return stmt
-
-    # 1. User Entries
-    q_users = (
-        select(EntryLog, User, Gate)
-        .join(User)
-        .join(Gate, EntryLog.gate_id == Gate.id)
-        .order_by(desc(EntryLog.entry_time))
-        .limit(5)
-    )
-    if gate_id: q_users = q_users.where(EntryLog.gate_id == gate_id)
-    
-    user_logs = (await session.exec(q_users)).all()
-    for log, user, gate in user_logs:
-        combined.append({
-            "id": str(log.id),
-            "type": "user", 
-            "role": "Student/Staff", 
-            "name": user.full_name or user.first_name, 
-            "identifier": user.admission_number,
-            "gate": gate.name,
-            "time": log.entry_time,
-            "status": log.status,
-            "details": f"IP: {log.ip_address}" if log.ip_address else "QR Scan",
-            "verification_image": log.verification_image
-        })
-
-    # 2. Vehicles
-    q_vehicles = (
-        select(VehicleLog, Vehicle, Gate)
-        .join(Vehicle)
-        .join(Gate, VehicleLog.gate_id == Gate.id)
-        .order_by(desc(VehicleLog.entry_time))
-        .limit(5)
-    )
-    if gate_id: q_vehicles = q_vehicles.where(VehicleLog.gate_id == gate_id)
-    
-    vehicle_logs = (await session.exec(q_vehicles)).all()
-    for log, vehicle, gate in vehicle_logs:
-        combined.append({
-            "id": str(log.id),
-            "type": "vehicle",
-            "role": "Vehicle",
-            "name": vehicle.plate_number,
-            "identifier": vehicle.driver_name or "Unknown Driver",
-            "gate": gate.name,
-            "time": log.entry_time,
-            "status": "allowed",
-            "details": f"{log.detected_passengers} Passenger(s)"
-        })
-
-    # 3. Visitors
-    # Need to join Gate to get name
-    q_visitors = (
-        select(Visitor, Gate)
-        .join(Gate, isouter=True) # Left join just in case
-        .order_by(desc(Visitor.time_in))
-        .limit(5)
-    )
-    if gate_id: q_visitors = q_visitors.where(Visitor.gate_id == gate_id)
-    
-    visitors = (await session.exec(q_visitors)).all()
-    for v, gate in visitors:
-        combined.append({
-            "id": str(v.id),
-            "type": "visitor",
-            "role": (v.visitor_type or "visitor").title(),
-            "name": f"{v.first_name} {v.last_name}",
-            "identifier": v.id_number,
-            "gate": gate.name if gate else "Unknown",
-            "time": v.time_in,
-            "status": v.status,
-            "details": v.visit_details
-        })
-
-    # Sort and slice
-    combined.sort(key=lambda x: x['time'], reverse=True)
-    return combined[:5]
+    items, _ = await activity.timeline(session, limit=5, gate_id=gate_id, types=("user", "vehicle", "visitor"))
+    return items
 
 @router.post("/public/access-request")
 async def public_access_request(
@@ -1386,89 +1852,39 @@ async def public_access_request(
     """
     Handles self-service entry requests from QR Code scan pages.
     Payload varies by role: { gate_id, role, data: {...} }
+    Visitor, taxi and delivery requests are queued and answered with a ticket
+    (202); poll GET /public/access-request/{ticket} for the outcome.
     """
     role = payload.get("role")
     gate_id = payload.get("gate_id")
     data = payload.get("data", {})
-    
-    # Verify Gate
-    gate = None
-    if gate_id:
-        try:
-            import uuid
-            gate = await session.get(Gate, uuid.UUID(str(gate_id)))
-        except Exception:
-            pass
-    if not gate:
-        # Fallback to "Main Gate"
-        from sqlmodel import select
-        gate = (await session.exec(select(Gate).where(Gate.name.ilike("%main%")))).first()
-        if not gate:
-            gate = (await session.exec(select(Gate))).first()
-        if not gate:
-            gate = Gate(
-                name="Main Gate",
-                description="Default Main Gate"
-            )
-            session.add(gate)
-            await session.commit()
-            await session.refresh(gate)
+
+    # Throttle per caller; forwarded addresses count only from TRUSTED_PROXIES (nginx)
+    client_ip = await trusted_proxies.client_ip(request.client.host if request.client else None, request.headers)
+    retry_after = access_queue.throttle.take(client_ip)
+    if retry_after:
+        raise HTTPException(
+            status_code=429, detail="Too many requests. Please wait a moment and try again.",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
 
     # Handle Logic based on Role
-    if role in ["taxi", "cab", "delivery", "visitor"]:
-         # Register Visitor / Vehicle
-         # 1. Vehicle if applicable
-         vehicle = None
-         if data.get("plate_number"):
-             # Normalize Plate
-             plate = data["plate_number"].strip().upper()
-             vehicle = (await session.exec(select(Vehicle).where(Vehicle.plate_number == plate))).first()
-             if not vehicle:
-                 vehicle = Vehicle(
-                     plate_number=plate,
-                     driver_name=data.get("name"),
-                     driver_id_number=data.get("id_number"),
-                     driver_contact=data.get("mobile"),
-                     make="Self-Reg",
-                     model=role.title(),
-                     color="Unknown"
-                 )
-                 session.add(vehicle)
-                 await session.commit()
-                 await session.refresh(vehicle)
-             
-             # Log Vehicle Entry
-             v_log = VehicleLog(
-                 vehicle_id=vehicle.id,
-                 gate_id=gate.id,
-                 entry_time=get_eat_time(),
-                 vehicle_images={},
-                 manual_override=True, # Flag as manual/self-service
-                 detected_passengers=int(data.get("passengers", 1))
-             )
-             session.add(v_log)
-         
-         # 2. Register Visitor Person (if no vehicle or driver details distinct)
-         if not vehicle:
-             visitor = Visitor(
-                 first_name=data.get("name", "").split(" ")[0],
-                 last_name=data.get("name", "").split(" ")[-1] if " " in data.get("name", "") else "",
-                 phone_number=data.get("mobile"),
-                 id_number=data.get("id_number"),
-                 visit_details=f"{role.title()}: {data.get('purpose') or data.get('delivery_details')}",
-                 status="checked_in",
-                 time_in=get_eat_time(),
-                 gate_id=gate.id, # LINK TO GATE
-                 visitor_type=role  # RECORD TYPE
-             )
-             session.add(visitor)
-
-         await session.commit()
-         return {"status": "success", "message": "Check-in Successful. You may proceed."}
+    if role in VISITOR_ROLES:
+        try:
+            item = validate_request(role, gate_id, data)
+            ticket = await access_queue.submit(item)
+        except AccessRequestInvalid as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except AccessQueueFull:
+            raise HTTPException(
+                status_code=503, detail="The gate is very busy right now. Please try again shortly.",
+                headers={"Retry-After": "5"}
+            )
+        return JSONResponse(status_code=202 if ticket["status"] == "queued" else 200, content=ticket)
 
     elif role in ["student", "staff"]:
-        # Check IP Address
-        client_ip = request.client.host if request.client else "unknown"
+        # Verify Gate
+        gate = await reference_cache.resolve_gate(session, gate_id)
         # Define allowed University IPs (Mock Range + Localhost)
         # Strictly enforces university IP for approval
         ALLOWED_IPS = ["127.0.0.1", "::1", "localhost"] 
@@ -1494,15 +1910,12 @@ async def public_access_request(
             # TODO: Add deeper metadata verification here (e.g. check EXIF if available, though canvas usually strips it)
             # For now, we trust the frontend enforced camera-only usage and analyze usage later.
             
-            file_id = str(uuid.uuid4())
-            filename = f"{file_id}.jpg"
-            save_dir = "static/verifications"
-            os.makedirs(save_dir, exist_ok=True)
-            saved_image_path = f"{save_dir}/{filename}"
-            
-            with open(saved_image_path, "wb") as f:
-                f.write(img_bytes)
+            saved_image_path = (await save_bytes(img_bytes, "verifications"))["url"]
                 
+        except EvidenceBusy:
+            raise HTTPException(429, "Too many photos being processed, retry shortly", headers={"Retry-After": "2"})
+        except (EvidenceTooLarge, MediaInvalid) as e:
+            raise HTTPException(400, f"Invalid verification photo: {e}")
         except Exception as e:
             print(f"Image processing failed: {e}")
             raise HTTPException(500, "Failed to process verification image")
@@ -1543,6 +1956,11 @@ async def public_access_request(
                  )
                  session.add(log)
                  await session.commit()
+                 gate_feed.publish(
+                     gate, "user", final_status, status_msg, name=user.full_name,
+                     identifier=user.admission_number, role="Self-Service Verification",
+                     image=saved_image_path, direction="in" if final_status == "allowed" else None
+                 )
                  
                  if final_status == "rejected":
                      return {"status": "rejected", "message": status_msg}
@@ -1555,6 +1973,18 @@ async def public_access_request(
         
     return {"status": "pending", "message": "Request processed"}
 
+@router.get("/public/access-request/{ticket}")
+async def public_access_ticket(ticket: str, wait: float = 0):
+    """
+    Outcome of a queued self-service request: status is "queued" until the
+    worker has checked it in, then "success" (or "error"). With wait=N (up to 25)
+    the call holds until the outcome is known or N seconds pass.
+    """
+    state = await access_queue.wait(ticket, wait)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired ticket")
+    return state
+
 @router.get("/scan-logs")
 async def get_all_gate_scan_logs(limit: int = 100, session: AsyncSession = Depends(get_session)):
     """Fetch all gate scan logs"""
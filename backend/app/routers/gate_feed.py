@@ -0,0 +1,41 @@
+import asyncio
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from app.utils.gate_feed import gate_feed, gate_key
+
+router = APIRouter()
+
+@router.websocket("/ws/gate/{gate_id}")
+async def gate_activity_feed(websocket: WebSocket, gate_id: str):
+    """
+    Live scan outcomes for one gate ('all' for the whole campus).
+    Sends {"type": "snapshot", "events": [...]} from the ring buffer on connect,
+    then {"type": "scan", "event": {...}} for every new scan at the gate.
+    """
+    key = gate_key(gate_id)
+    if not key:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    queue = gate_feed.subscribe(key)
+
+    async def drain_client():
+        # Consoles only listen; reading lets us notice a disconnect while idle
+        while True:
+            await websocket.receive_text()
+
+    reader = asyncio.create_task(drain_client())
+    try:
+        await websocket.send_json({"type": "snapshot", "gate_id": key, "events": gate_feed.snapshot(key)})
+        while True:
+            next_event = asyncio.create_task(queue.get())
+            done, _ = await asyncio.wait({next_event, reader}, return_when=asyncio.FIRST_COMPLETED)
+            if reader in done:
+                next_event.cancel()
+                break
+            await websocket.send_json({"type": "scan", "event": next_event.result()})
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        reader.cancel()
+        gate_feed.unsubscribe(key, queue)
@@ -2,11 +2,13 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlmodel import select, func, col, case
 from sqlmodel.ext.asyncio.session import AsyncSession
 from app.database import get_session
-from app.models import User, EntryLog, VehicleLog, AttendanceRecord, Role, Gate, ClassSession
+from app.models import User, EntryLog, VehicleLog, AttendanceRecord, Role, Gate, ClassSession, GateTrafficHourly
 from app.auth import get_current_user
 from datetime import datetime, timedelta
 from app.utils.timezone import get_eat_time
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from sqlalchemy.orm import aliased
+from app.utils.exports import stream_rows, export_response, day_range, ExportFormatInvalid
 
 router = APIRouter()
 
@@ -100,12 +102,13 @@ async def get_user_roles(session: AsyncSession = Depends(get_session), user: Use
 @router.get("/traffic/peak-hours")
 async def get_peak_hours(session: AsyncSession = Depends(get_session), user: User = Depends(ensure_admin)):
     """Average traffic by hour of day"""
-    # Group by EXTRACT(HOUR from entry_time)
+    # Summed from the hourly rollup rather than the whole entry_logs history
     # Note: Syntax varies by DB. Postgres: extract(hour from ...), MySQL: extract(hour from ...) or hour(...)
-    
-    # Universal way: 
     query = (
-        select(func.extract('hour', EntryLog.entry_time).label("hour"), func.count(EntryLog.id))
+        select(
+            func.extract('hour', GateTrafficHourly.hour).label("hour"),
+            func.sum(GateTrafficHourly.people_in + GateTrafficHourly.rejected),
+        )
         .group_by("hour")
         .order_by("hour")
     )
@@ -122,7 +125,7 @@ async def get_peak_hours(session: AsyncSession = Depends(get_session), user: Use
     for h in range(24):
         formatted.append({
             "hour": f"{h:02d}:00",
-            "count": data.get(h, 0)
+            "count": int(data.get(h) or 0)
         })
         
     return formatted
@@ -139,156 +142,134 @@ async def get_security_flags(session: AsyncSession = Depends(get_session), user:
 
 from app.models import Vehicle
 
+ExitGate = aliased(Gate)
+Guard = aliased(User)
+
+PEOPLE_EXPORT_HEADER = ["Name", "Email", "Role", "Gate Entered", "Gate Exited", "Entry Time", "Exit Time", "Method", "Guard", "Status"]
+VEHICLE_EXPORT_HEADER = ["Plate Number", "Driver Name", "Vehicle Type", "Gate Entered", "Gate Exited", "Entry Time", "Exit Time", "Guard"]
+
+
+def _people_query(start_dt: datetime, end_dt: datetime):
+    """EntryLog rows in [start_dt, end_dt) with their user, role, gates and guard, newest first."""
+    return (
+        select(
+            EntryLog.id, EntryLog.entry_time, EntryLog.exit_time, EntryLog.method, EntryLog.status,
+            User.full_name, User.email, Role.name.label("role_name"), Gate.name.label("gate_name"),
+            ExitGate.name.label("exit_gate_name"), Guard.full_name.label("guard_name"),
+        )
+        .select_from(EntryLog)
+        .outerjoin(User, EntryLog.user_id == User.id)
+        .outerjoin(Role, User.role_id == Role.id)
+        .outerjoin(Gate, EntryLog.gate_id == Gate.id)
+        .outerjoin(ExitGate, EntryLog.exit_gate_id == ExitGate.id)
+        .outerjoin(Guard, EntryLog.guard_id == Guard.id)
+        .where(EntryLog.entry_time >= start_dt, EntryLog.entry_time < end_dt)
+        .order_by(EntryLog.entry_time.desc())
+    )
+
+
+def _vehicle_query(start_dt: datetime, end_dt: datetime):
+    """VehicleLog rows in [start_dt, end_dt) with their vehicle, gates and guard, newest first."""
+    return (
+        select(
+            VehicleLog.id, VehicleLog.entry_time, VehicleLog.exit_time,
+            Vehicle.plate_number, Vehicle.driver_name, Vehicle.vehicle_type, Gate.name.label("gate_name"),
+            ExitGate.name.label("exit_gate_name"), Guard.full_name.label("guard_name"),
+        )
+        .select_from(VehicleLog)
+        .outerjoin(Vehicle, VehicleLog.vehicle_id == Vehicle.id)
+        .outerjoin(Gate, VehicleLog.gate_id == Gate.id)
+        .outerjoin(ExitGate, VehicleLog.exit_gate_id == ExitGate.id)
+        .outerjoin(Guard, VehicleLog.guard_id == Guard.id)
+        .where(VehicleLog.entry_time >= start_dt, VehicleLog.entry_time < end_dt)
+        .order_by(VehicleLog.entry_time.desc())
+    )
+
+
+def _entry_item(row) -> Dict[str, Any]:
+    return {
+        "id": str(row.id),
+        "name": row.full_name or "Unknown User",
+        "email": row.email or "-",
+        "role": row.role_name or "User",
+        "gate": row.gate_name or "Unknown Gate",
+        "exit_gate": row.exit_gate_name or "-",
+        "entry_time": row.entry_time.isoformat() if row.entry_time else None,
+        "exit_time": row.exit_time.isoformat() if row.exit_time else None,
+        "method": row.method,
+        "guard": row.guard_name or "System",
+        "status": row.status
+    }
+
+
+def _vehicle_item(row) -> Dict[str, Any]:
+    return {
+        "id": str(row.id),
+        "plate_number": row.plate_number or "Unknown Plate",
+        "driver_name": row.driver_name or "-",
+        "vehicle_type": row.vehicle_type or "utility",
+        "gate": row.gate_name or "Unknown Gate",
+        "exit_gate": row.exit_gate_name or "-",
+        "entry_time": row.entry_time.isoformat() if row.entry_time else None,
+        "exit_time": row.exit_time.isoformat() if row.exit_time else None,
+        "guard": row.guard_name or "System"
+    }
+
+
+# kind -> (filename stem, header, query, item) of the /detailed downloads
+DETAILED_EXPORTS = {
+    "people": ("people_scans_report", PEOPLE_EXPORT_HEADER, _people_query, _entry_item),
+    "vehicles": ("vehicle_scans_report", VEHICLE_EXPORT_HEADER, _vehicle_query, _vehicle_item),
+}
+
+
+def _parse_day(value: Optional[str], name: str):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name} format. Use YYYY-MM-DD.")
+
+
 @router.get("/detailed")
 async def get_detailed_report(
     date: str = Query(None),
+    end_date: str = Query(None),
+    export_format: Optional[str] = Query(None, alias="format"),
+    kind: str = Query("people"),
     session: AsyncSession = Depends(get_session),
     user: User = Depends(ensure_admin)
 ):
-    """Generate detailed daily reports containing scans, vehicles, and key metrics."""
-    if not date:
-        date_obj = get_eat_time().date()
-    else:
-        try:
-            date_obj = datetime.strptime(date, "%Y-%m-%d").date()
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
-    
-    start_dt = datetime.combine(date_obj, datetime.min.time())
-    end_dt = datetime.combine(date_obj, datetime.max.time())
-    
-    # 1. Fetch People Entry Logs for the given day
-    query_entries = (
-        select(EntryLog)
-        .where(EntryLog.entry_time >= start_dt, EntryLog.entry_time <= end_dt)
-        .order_by(EntryLog.entry_time.desc())
-    )
-    entries = (await session.exec(query_entries)).all()
-    
-    entry_list = []
-    for entry in entries:
-        user_obj = None
-        role_name = "User"
-        try:
-            user_stmt = select(User).where(User.id == entry.user_id)
-            user_res = await session.exec(user_stmt)
-            user_obj = user_res.first()
-            if user_obj:
-                role_stmt = select(Role).where(Role.id == user_obj.role_id)
-                role_res = await session.exec(role_stmt)
-                role_obj = role_res.first()
-                if role_obj:
-                    role_name = role_obj.name
-        except Exception as e:
-            print(f"Error loading user for entry: {e}")
-            
-        gate_name = "Unknown Gate"
-        try:
-            gate_stmt = select(Gate).where(Gate.id == entry.gate_id)
-            gate_res = await session.exec(gate_stmt)
-            gate_obj = gate_res.first()
-            if gate_obj:
-                gate_name = gate_obj.name
-        except Exception as e:
-            print(f"Error loading gate for entry: {e}")
-
-        exit_gate_name = "-"
-        try:
-            if entry.exit_gate_id:
-                exit_gate_stmt = select(Gate).where(Gate.id == entry.exit_gate_id)
-                exit_gate_res = await session.exec(exit_gate_stmt)
-                exit_gate_obj = exit_gate_res.first()
-                if exit_gate_obj:
-                    exit_gate_name = exit_gate_obj.name
-        except Exception as e:
-            print(f"Error loading exit gate for entry: {e}")
-            
-        guard_name = "System"
-        try:
-            if entry.guard_id:
-                guard_stmt = select(User).where(User.id == entry.guard_id)
-                guard_res = await session.exec(guard_stmt)
-                guard_obj = guard_res.first()
-                if guard_obj:
-                    guard_name = guard_obj.full_name
-        except Exception as e:
-            print(f"Error loading guard for entry: {e}")
-            
-        entry_list.append({
-            "id": str(entry.id),
-            "name": user_obj.full_name if user_obj else "Unknown User",
-            "email": user_obj.email if user_obj else "-",
-            "role": role_name,
-            "gate": gate_name,
-            "exit_gate": exit_gate_name,
-            "entry_time": entry.entry_time.isoformat() if entry.entry_time else None,
-            "exit_time": entry.exit_time.isoformat() if entry.exit_time else None,
-            "method": entry.method,
-            "guard": guard_name,
-            "status": entry.status
-        })
+    """
+    Generate detailed daily reports containing scans, vehicles, and key metrics.
 
-    # 2. Fetch Vehicle Scan Logs for the given day
-    query_vehicles = (
-        select(VehicleLog)
-        .where(VehicleLog.entry_time >= start_dt, VehicleLog.entry_time <= end_dt)
-        .order_by(VehicleLog.entry_time.desc())
-    )
-    vehicle_logs = (await session.exec(query_vehicles)).all()
-    
-    vehicle_list = []
-    for vlog in vehicle_logs:
-        vehicle_obj = None
-        try:
-            vehicle_stmt = select(Vehicle).where(Vehicle.id == vlog.vehicle_id)
-            vehicle_res = await session.exec(vehicle_stmt)
-            vehicle_obj = vehicle_res.first()
-        except Exception as e:
-            print(f"Error loading vehicle for log: {e}")
-            
-        gate_name = "Unknown Gate"
-        try:
-            gate_stmt = select(Gate).where(Gate.id == vlog.gate_id)
-            gate_res = await session.exec(gate_stmt)
-            gate_obj = gate_res.first()
-            if gate_obj:
-                gate_name = gate_obj.name
-        except Exception as e:
-            print(f"Error loading gate for vehicle: {e}")
-
-        exit_gate_name = "-"
-        try:
-            if vlog.exit_gate_id:
-                exit_gate_stmt = select(Gate).where(Gate.id == vlog.exit_gate_id)
-                exit_gate_res = await session.exec(exit_gate_stmt)
-                exit_gate_obj = exit_gate_res.first()
-                if exit_gate_obj:
-                    exit_gate_name = exit_gate_obj.name
-        except Exception as e:
-            print(f"Error loading exit gate for vehicle: {e}")
-            
-        guard_name = "System"
+    With format=csv|xlsx, the day's (or date..end_date's) people entries, or vehicle
+    logs with kind=vehicles, are streamed as a download instead.
+    """
+    date_obj = _parse_day(date, "date") if date else get_eat_time().date()
+    end_obj = _parse_day(end_date, "end_date") if end_date else date_obj
+    start_dt, end_dt = day_range(date_obj, end_obj)
+
+    if export_format is not None:
+        if kind not in DETAILED_EXPORTS:
+            raise HTTPException(status_code=400, detail="kind must be 'people' or 'vehicles'.")
+        stem, header, build_query, item = DETAILED_EXPORTS[kind]
+        span_label = f"{date_obj}" if end_obj == date_obj else f"{date_obj}_{end_obj}"
         try:
-            if vlog.guard_id:
-                guard_stmt = select(User).where(User.id == vlog.guard_id)
-                guard_res = await session.exec(guard_stmt)
-                guard_obj = guard_res.first()
-                if guard_obj:
-                    guard_name = guard_obj.full_name
-        except Exception as e:
-            print(f"Error loading guard for vehicle: {e}")
-            
-        vehicle_list.append({
-            "id": str(vlog.id),
-            "plate_number": vehicle_obj.plate_number if vehicle_obj else "Unknown Plate",
-            "driver_name": vehicle_obj.driver_name if vehicle_obj else "-",
-            "vehicle_type": vehicle_obj.vehicle_type if vehicle_obj else "utility",
-            "gate": gate_name,
-            "exit_gate": exit_gate_name,
-            "entry_time": vlog.entry_time.isoformat() if vlog.entry_time else None,
-            "exit_time": vlog.exit_time.isoformat() if vlog.exit_time else None,
-            "guard": guard_name
-        })
+            return export_response(
+                export_format, f"{stem}_{span_label}", header,
+                # Same columns as the JSON items, in header order, without the id
+                stream_rows(build_query(start_dt, end_dt), lambda row: [
+                    value if value is not None else "-" for key, value in item(row).items() if key != "id"
+                ])
+            )
+        except ExportFormatInvalid as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # 1. People Entry Logs for the given day, with user, role, gates and guard joined in
+    entry_list = [_entry_item(row) for row in (await session.exec(_people_query(start_dt, end_dt))).all()]
+
+    # 2. Vehicle Scan Logs for the given day
+    vehicle_list = [_vehicle_item(row) for row in (await session.exec(_vehicle_query(start_dt, end_dt))).all()]
 
     # 3. Calculate Daily Metrics Summary
     total_people_in = len([e for e in entry_list if e["status"] == "allowed"])
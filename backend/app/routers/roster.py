@@ -0,0 +1,41 @@
+import gzip
+import hashlib
+import json
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.database import get_session
+from app.models import User
+from app.auth import get_current_user
+from app.utils import roster
+
+router = APIRouter()
+
+@router.get("/roster")
+async def get_roster(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = roster.ROSTER_PAGE,
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Roster for gate devices that validate scans offline: a snapshot on the first call,
+    then only changes since the returned next_cursor. Gzipped when the client accepts
+    it, and ETag'd so an unchanged delta costs a 304.
+    """
+    try:
+        page = await roster.page(session, cursor, max(1, min(limit, roster.ROSTER_PAGE)))
+    except roster.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    body = json.dumps(page, separators=(",", ":")).encode()
+    # Weak: the same page is served both gzipped and plain
+    etag = 'W/"' + hashlib.sha1(body).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,133 @@
+import asyncio
+import os
+import time
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.database import engine
+from app.auth import decode_access_token, get_user_by_subject
+from app.utils.reference_cache import reference_cache
+from app.utils.scan_debounce import scan_debounce
+from app.utils.timing import measure
+from app.routers.gate_control import process_scan
+
+# Scan frames a device may have in flight before the server stops reading from its socket
+SCANNER_MAX_IN_FLIGHT = int(os.getenv("SCANNER_MAX_IN_FLIGHT", "64"))
+SCANNER_HELLO_TIMEOUT = 10
+
+router = APIRouter()
+
+@router.websocket("/ws/scanner")
+async def scanner_channel(websocket: WebSocket):
+    """
+    Persistent scan channel for one gate device.
+
+    The device opens the socket and sends {"type": "hello", "token": <JWT>, "gate_id": <optional>};
+    the guard and gate are resolved once and confirmed with {"type": "ready", ...}. It then streams
+    {"type": "scan", "seq": n, "code": "...", "gate_id": <optional override>, "client_ts": ...}
+    frames without waiting for answers. Each frame runs through the same logic as POST /api/gate/scan
+    (debounce included) on the connection's own session, strictly in the order sent, and is answered
+    with {"type": "result", "seq": n, "result": {...}, "server_ms": ...}. {"type": "ping"} gets a pong
+    in line with the results. Frames without a result when the socket drops should be resent.
+    """
+    await websocket.accept()
+    try:
+        hello = await asyncio.wait_for(websocket.receive_json(), SCANNER_HELLO_TIMEOUT)
+    except (asyncio.TimeoutError, WebSocketDisconnect, ValueError):
+        await websocket.close(code=1008)
+        return
+
+    claims = decode_access_token(str(hello.get("token") or "")) if isinstance(hello, dict) else None
+    if claims is None or hello.get("type") != "hello":
+        await websocket.send_json({"type": "error", "message": "Could not validate credentials"})
+        await websocket.close(code=1008)
+        return
+    expires_at = claims.get("exp")
+
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        guard = await get_user_by_subject(session, claims["sub"])
+        if guard is None:
+            await websocket.send_json({"type": "error", "message": "Could not validate credentials"})
+            await websocket.close(code=1008)
+            return
+        gate = await reference_cache.resolve_gate(session, hello.get("gate_id"))
+        gate_id = str(gate.id) if gate else None
+        # The guard is reused for every frame; keep it out of the identity map resets below
+        session.expunge(guard)
+        await websocket.send_json({
+            "type": "ready",
+            "gate": {"id": gate_id, "name": gate.name if gate else None},
+            "guard": {"id": str(guard.id), "name": guard.full_name},
+            "max_in_flight": SCANNER_MAX_IN_FLIGHT,
+        })
+        # Don't hold the read transaction (and its snapshot and connection) open while the device is idle
+        await session.rollback()
+
+        # Reading runs ahead of processing so devices can pipeline; the bounded queue is the backpressure
+        frames: asyncio.Queue = asyncio.Queue(maxsize=SCANNER_MAX_IN_FLIGHT)
+        disconnected = asyncio.Event()
+
+        async def read_frames():
+            try:
+                while True:
+                    try:
+                        frame = await websocket.receive_json()
+                    except ValueError:
+                        frame = {"type": "invalid"}
+                    await frames.put(frame if isinstance(frame, dict) else {"type": "invalid"})
+            except WebSocketDisconnect:
+                # Frames still queued are dropped: they were never answered, so the device resends them
+                disconnected.set()
+                await frames.put(None)
+
+        reader = asyncio.create_task(read_frames())
+        try:
+            while True:
+                frame = await frames.get()
+                if frame is None or disconnected.is_set():
+                    break
+                kind = frame.get("type")
+                if kind == "ping":
+                    await websocket.send_json({"type": "pong", "seq": frame.get("seq")})
+                    continue
+                if kind != "scan":
+                    await websocket.send_json({"type": "error", "seq": frame.get("seq"), "message": "Unknown frame type"})
+                    continue
+                if expires_at and expires_at < time.time():
+                    await websocket.send_json({"type": "error", "message": "Token expired"})
+                    await websocket.close(code=1008)
+                    break
+
+                code = str(frame.get("code") or "").strip()
+                scan_data = {"admission_number": code, "gate_id": frame.get("gate_id") or gate_id}
+                with measure("ws_scan") as timer:
+                    try:
+                        result = await scan_debounce.run(
+                            scan_data["gate_id"], code,
+                            lambda: process_scan(websocket, scan_data, session, guard=guard)
+                        )
+                    except HTTPException as e:
+                        await session.rollback()
+                        result = {"status": "rejected", "message": e.detail, "data": None}
+                    except Exception as e:
+                        await session.rollback()
+                        print(f"Scanner channel scan failed: {e}")
+                        result = {"status": "error", "message": "Scan could not be processed", "data": None}
+                    finally:
+                        # Nothing cached in the session may outlive the frame (other workers write too).
+                        # Read-only paths never commit, so end their transaction too: under REPEATABLE READ
+                        # later frames would otherwise keep reading its snapshot and pin a pool connection.
+                        # Expunged first so the result's objects are not expired by the rollback.
+                        session.expunge_all()
+                        await session.rollback()
+                await websocket.send_json({
+                    "type": "result",
+                    "seq": frame.get("seq"),
+                    "client_ts": frame.get("client_ts"),
+                    "result": jsonable_encoder(result),
+                    "server_ms": round(timer.elapsed() * 1000, 2),
+                })
+        except WebSocketDisconnect:
+            pass
+        finally:
+            reader.cancel()
@@ -7,9 +7,9 @@ from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List, Optional
 from datetime import datetime, date
 from app.utils.timezone import get_eat_time
+from app.utils.evidence import EvidenceBusy, EvidenceTooLarge
+from app.utils.media_store import save_upload
 import uuid
-import os
-import shutil
 
 router = APIRouter()
 
@@ -158,6 +158,15 @@ async def get_incident(
         "followups": enriched_followups
     }
 
+async def _store_attachment(file: UploadFile, kind: str, file_ext: str) -> str:
+    """Store an uploaded photo in the media store (other files are kept as uploaded) and return its URL."""
+    try:
+        return (await save_upload(file, kind, fallback_ext=file_ext))["url"]
+    except EvidenceBusy:
+        raise HTTPException(status_code=429, detail="Too many uploads being processed. Please retry.", headers={"Retry-After": "2"})
+    except EvidenceTooLarge as e:
+        raise HTTPException(status_code=413, detail=f"File too large: {e}")
+
 @router.post("/incidents")
 async def create_incident(
     title: str = Form(...),
@@ -183,14 +192,8 @@ async def create_incident(
         
     evidence_image = None
     if file and file.filename:
-        os.makedirs("uploads/incidents", exist_ok=True)
         file_ext = file.filename.split('.')[-1].lower()
-        filename = f"{uuid.uuid4().hex[:12]}.{file_ext}"
-        file_path = f"uploads/incidents/{filename}"
-        
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        evidence_image = f"/uploads/incidents/{filename}"
+        evidence_image = await _store_attachment(file, "incidents", file_ext)
         
     inc_date = get_eat_time()
     if incident_date:
@@ -326,14 +329,8 @@ async def create_lost_found_item(
         
     image_path = None
     if file and file.filename:
-        os.makedirs("uploads/lost_found", exist_ok=True)
         file_ext = file.filename.split('.')[-1].lower()
-        filename = f"{uuid.uuid4().hex[:12]}.{file_ext}"
-        file_path = f"uploads/lost_found/{filename}"
-        
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        image_path = f"/uploads/lost_found/{filename}"
+        image_path = await _store_attachment(file, "lost_found", file_ext)
         
     d_found = get_eat_time().date()
     if date_found:
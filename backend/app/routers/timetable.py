@@ -8,6 +8,11 @@ from app.database import get_session
 from app.models import Classroom, Course, TimetableSlot, ClassSession, User, StudentCourseRegistration
 from app.auth import get_current_user, get_current_admin
 from app.logging_utils import log_system_activity
+from app.utils.timing import span, timed
+from app.utils.idempotency import idempotent
+from app.utils import qr_signing
+from app.utils.schedule_index import schedule_index, materialize_sessions, release_slot_sessions, Interval, CourseRef, RoomRef
+from app.utils.media_store import thumbnail_url
 import uuid
 
 router = APIRouter()
@@ -102,7 +107,8 @@ async def get_classroom_activity(
             "reg_no": student.admission_number,
             "time": rec.scan_time.strftime("%H:%M:%S"),
             "date": rec.scan_time.strftime("%Y-%m-%d"),
-            "image": rec.live_image or ""
+            "image": rec.live_image or "",
+            "thumb": thumbnail_url(rec.live_image, 128) or ""
         })
         
     # 2. Last Class
@@ -251,6 +257,7 @@ async def get_classrooms_detailed(
                 "floor": room.floor,
                 "capacity": room.capacity,
                 "qr_code": room.qr_code,
+                "qr_token": qr_signing.sign("classroom", room.id),
                 "last_attendance": last_time.isoformat() if last_time else None,
                 "total_scans_today": scans,
                 "is_active": is_active,
@@ -444,7 +451,60 @@ class VerifyScanRequest(BaseModel):
     longitude: Optional[float] = None
     metadata: Optional[dict] = None
 
+async def _open_class_session(
+    session: AsyncSession,
+    slot: Optional[Interval],
+    course: Optional[CourseRef],
+    room: Optional[RoomRef],
+    now: datetime
+) -> Optional[Interval]:
+    """
+    Today's ClassSession for a timetable slot the nightly job has not materialized
+    yet (e.g. created during the day), or an ad-hoc one for a course with nothing
+    scheduled today. Scans racing for the same slot wait on one lock and pick up
+    the session the first of them created.
+    """
+    current_time = now.time()
+
+    def resolve() -> Optional[Interval]:
+        if course:
+            return schedule_index.for_course(course.id, current_time)
+        return schedule_index.for_room(room.id, current_time)
+
+    async with schedule_index.creating(slot.slot_id if slot else ("ad-hoc", course.id)):
+        await schedule_index.ensure(session)
+        existing = resolve()
+        if existing and existing.session_id:
+            return existing
+
+        if slot:
+            # Same insert as the nightly job; the slot/date unique constraint absorbs other workers
+            await materialize_sessions(session, now.date(), [slot.slot_id])
+            await session.commit()
+            await schedule_index.ensure(session)
+            existing = resolve()
+            return existing if existing and existing.session_id else None
+
+        new_session = ClassSession(
+            course_id=course.id,
+            session_date=now.date(),
+            start_time=current_time,
+            end_time=(now + timedelta(hours=2)).time(),
+            classroom_id=course.classroom_id or (room.id if room else None),
+            lecturer_id=course.lecturer_id,
+            status="ongoing",
+            active=True
+        )
+        session.add(new_session)
+        await session.commit()
+        return Interval(
+            new_session.start_time, new_session.end_time, new_session.id, None,
+            new_session.course_id, new_session.classroom_id, new_session.lecturer_id
+        )
+
 @router.post("/verify-scan")
+@idempotent
+@timed("verify_scan")
 async def verify_classroom_scan(
     request: Request,
     scan_data: VerifyScanRequest,
@@ -464,6 +524,16 @@ async def verify_classroom_scan(
     room_code_val = scan_data.room_code
     course_code_val = scan_data.course_code
 
+    # Signed room posters carry the classroom's primary key; forged or expired ones are refused before any SQL
+    signed_room = None
+    if room_code_val:
+        try:
+            signed_room = qr_signing.verify(room_code_val)
+        except qr_signing.InvalidQR as e:
+            return {"success": False, "message": str(e)}
+        if signed_room and signed_room.kind != "classroom":
+            return {"success": False, "message": "This QR code is not a classroom code"}
+
     # 0. Initialize Log
     scan_log = ScanLog(
         student_id=current_user.id,
@@ -479,24 +549,27 @@ async def verify_classroom_scan(
         await session.commit()
         return {"success": False, "message": "No room or course code provided"}
 
-    # 1. Find Classroom (if room_code provided)
+    # 1. Identify classroom / course from today's schedule index (no SQL once it is built)
+    with span("lookup"):
+        await schedule_index.ensure(session)
+
     room = None
     if room_code_val:
-        room_query = select(Classroom).where(Classroom.room_code == room_code_val)
-        room_result = await session.exec(room_query)
-        room = room_result.first()
+        if signed_room:
+            room = schedule_index.room(signed_room.id)
+            if room:
+                scan_log.room_code = room.room_code
+        else:
+            room = schedule_index.room_by_code(room_code_val)
         
         if not room and not course_code_val:
             scan_log.status_message = "Invalid Room Code"
             await session.commit()
             return {"success": False, "message": "Unknown Room Code (Logged)"}
 
-    # Find Course (if course_code provided)
     course = None
     if course_code_val:
-        course_query = select(Course).where(Course.course_code == course_code_val)
-        course_result = await session.exec(course_query)
-        course = course_result.first()
+        course = schedule_index.course_by_code(course_code_val)
         
         if not course:
             scan_log.status_message = f"Invalid Course Code: {course_code_val}"
@@ -505,124 +578,22 @@ async def verify_classroom_scan(
         
     # 2. Determine Current Context
     now = get_eat_time()
-    today_date = now.date()
     current_time = now.time()
-    day_of_week = now.weekday() # 0=Monday
-    
-    # 3. Find Active Session
-    active_session = None
-
-    if course:
-        # Check active session for this course today and now
-        session_query = select(ClassSession).where(
-            (ClassSession.course_id == course.id) &
-            (ClassSession.session_date == today_date) &
-            (ClassSession.start_time <= current_time) &
-            (ClassSession.end_time >= current_time)
-        )
-        session_result = await session.exec(session_query)
-        active_session = session_result.first()
-
-        # If not active exactly now, check for any session for this course today
-        if not active_session:
-            session_query = select(ClassSession).where(
-                (ClassSession.course_id == course.id) &
-                (ClassSession.session_date == today_date)
-            )
-            session_result = await session.exec(session_query)
-            active_session = session_result.first()
-
-        # If still no session today, check TimetableSlot for this course today
-        if not active_session:
-            slot_query = select(TimetableSlot).where(
-                (TimetableSlot.course_id == course.id) &
-                (TimetableSlot.day_of_week == day_of_week) &
-                (TimetableSlot.is_active == True)
-            )
-            slot_result = await session.exec(slot_query)
-            slot = slot_result.first()
-
-            if slot:
-                active_session = ClassSession(
-                    course_id=slot.course_id,
-                    timetable_slot_id=slot.id,
-                    session_date=today_date,
-                    start_time=slot.start_time,
-                    end_time=slot.end_time,
-                    classroom_id=slot.classroom_id,
-                    lecturer_id=slot.lecturer_id or course.lecturer_id,
-                    status="ongoing",
-                    active=True
-                )
-                session.add(active_session)
-                await session.commit()
-                await session.refresh(active_session)
-
-        # If still no session/slot today, dynamically create an ad-hoc session
-        if not active_session:
-            from datetime import timedelta
-            start_time_val = current_time
-            end_dt = now + timedelta(hours=2)
-            end_time_val = end_dt.time()
-
-            classroom_id_val = course.classroom_id
-            if not classroom_id_val and room:
-                classroom_id_val = room.id
-
-            active_session = ClassSession(
-                course_id=course.id,
-                session_date=today_date,
-                start_time=start_time_val,
-                end_time=end_time_val,
-                classroom_id=classroom_id_val,
-                lecturer_id=course.lecturer_id,
-                status="ongoing",
-                active=True
-            )
-            session.add(active_session)
-            await session.commit()
-            await session.refresh(active_session)
-
-    # Fallback to classroom-based checking if we only have room_code and no active session yet
-    if not active_session and room:
-        # Check ClassSession (Specific)
-        session_query = select(ClassSession).where(
-            (ClassSession.classroom_id == room.id) &
-            (ClassSession.session_date == today_date) &
-            (ClassSession.start_time <= current_time) &
-            (ClassSession.end_time >= current_time)
-        )
-        session_result = await session.exec(session_query)
-        active_session = session_result.first()
-        
-        # If no specific session, check TimetableSlot (Recurring) and auto-create session
-        if not active_session:
-            slot_query = select(TimetableSlot).where(
-                (TimetableSlot.classroom_id == room.id) &
-                (TimetableSlot.day_of_week == day_of_week) &
-                (TimetableSlot.start_time <= current_time) &
-                (TimetableSlot.end_time >= current_time) &
-                (TimetableSlot.is_active == True)
-            )
-            slot_result = await session.exec(slot_query)
-            slot = slot_result.first()
-            
-            if slot:
-                # Auto-create session from slot
-                active_session = ClassSession(
-                    course_id=slot.course_id,
-                    timetable_slot_id=slot.id,
-                    session_date=today_date,
-                    start_time=slot.start_time,
-                    end_time=slot.end_time,
-                    classroom_id=room.id,
-                    lecturer_id=slot.lecturer_id,
-                    status="ongoing",
-                    active=True
-                )
-                session.add(active_session)
-                await session.commit()
-                await session.refresh(active_session)
+    
+    with span("class_session"):
+        # 3. Find Active Session: the course's session (or slot) today, else what runs in the room now
+        active_session = None
+        if course:
+            active_session = schedule_index.for_course(course.id, current_time)
+            if not active_session:
+                # No session or slot today: dynamically create an ad-hoc session
+                active_session = await _open_class_session(session, None, course, room, now)
+        elif room:
+            active_session = schedule_index.for_room(room.id, current_time)
+
+        if active_session and not active_session.session_id:
+            # A timetable slot without today's session yet: create it from the slot
+            active_session = await _open_class_session(session, active_session, course, room, now)
             
     if not active_session:
         scan_log.status_message = "unrelated student no class"
@@ -634,32 +605,33 @@ async def verify_classroom_scan(
         }
     
     # Update log with session
-    scan_log.class_session_id = active_session.id
+    scan_log.class_session_id = active_session.session_id
+    course = schedule_index.course(active_session.course_id) or await session.get(Course, active_session.course_id)
         
-    # 3.5 Verify Student Registration - auto-register student if not registered
-    reg_query = select(StudentCourseRegistration).where(
-        (StudentCourseRegistration.student_id == current_user.id) &
-        (StudentCourseRegistration.course_id == active_session.course_id)
-    )
-    reg_result = await session.exec(reg_query)
-    if not reg_result.first():
-        new_reg = StudentCourseRegistration(
-            student_id=current_user.id,
-            course_id=active_session.course_id,
-            semester="Current"
+    with span("registration"):
+        # 3.5 Verify Student Registration - auto-register student if not registered
+        reg_query = select(StudentCourseRegistration).where(
+            (StudentCourseRegistration.student_id == current_user.id) &
+            (StudentCourseRegistration.course_id == active_session.course_id)
         )
-        session.add(new_reg)
-        await session.commit()
+        reg_result = await session.exec(reg_query)
+        if not reg_result.first():
+            new_reg = StudentCourseRegistration(
+                student_id=current_user.id,
+                course_id=active_session.course_id,
+                semester="Current"
+            )
+            session.add(new_reg)
         
     # 4. Check for Existing Attendance
     existing_query = select(AttendanceRecord).where(
-        (AttendanceRecord.session_id == active_session.id) &
+        (AttendanceRecord.session_id == active_session.session_id) &
         (AttendanceRecord.student_id == current_user.id)
     )
-    existing_result = await session.exec(existing_query)
-    if existing_result.first():
-        course = await session.get(Course, active_session.course_id)
-        
+    with span("duplicate_check"):
+        existing_result = await session.exec(existing_query)
+        already_marked = existing_result.first()
+    if already_marked:
         scan_log.is_successful = True # Access granted
         scan_log.status_message = "Duplicate Scan (Already Marked)"
         await session.commit()
@@ -680,7 +652,7 @@ async def verify_classroom_scan(
         meta["ip_address"] = client_ip
 
     record = AttendanceRecord(
-        session_id=active_session.id,
+        session_id=active_session.session_id,
         student_id=current_user.id,
         scan_time=now,
         status="present",
@@ -694,8 +666,6 @@ async def verify_classroom_scan(
     scan_log.status_message = "Success: Marked Present"
     
     # Log System Activity (Success)
-    course = await session.get(Course, active_session.course_id)
-    
     log_meta = {"status": "Present", "course": course.course_code}
     if scan_data.metadata:
         log_meta.update(scan_data.metadata)
@@ -839,6 +809,12 @@ async def get_timetable(
     
     return enriched
 
+async def _materialize_slot(session: AsyncSession, slot_id):
+    """Sessions for today and tomorrow for a slot created or changed after the nightly job."""
+    today = get_eat_time().date()
+    for day in (today, today + timedelta(days=1)):
+        await materialize_sessions(session, day, [slot_id])
+
 @router.post("/timetable")
 async def create_timetable_slot(
     slot_data: dict,
@@ -879,6 +855,9 @@ async def create_timetable_slot(
     )
     
     session.add(slot)
+    await session.flush()
+    # The nightly job has already run for today and tomorrow
+    await _materialize_slot(session, slot.id)
     await session.commit()
     await session.refresh(slot)
     
@@ -915,6 +894,10 @@ async def update_timetable_slot(
         slot.effective_until = datetime.strptime(slot_data['effective_until'], '%Y-%m-%d').date()
     
     session.add(slot)
+    # Re-create the sessions materialized from the old schedule that nobody has used yet
+    await release_slot_sessions(session, slot.id, get_eat_time().date())
+    await session.flush()
+    await _materialize_slot(session, slot.id)
     await session.commit()
     await session.refresh(slot)
     
@@ -934,6 +917,8 @@ async def delete_timetable_slot(
     if not slot:
         raise HTTPException(status_code=404, detail="Timetable slot not found")
     
+    # Unused upcoming sessions go with the slot; sessions with attendance stay as history
+    await release_slot_sessions(session, slot.id, get_eat_time().date(), detach=True)
     await session.delete(slot)
     await session.commit()
     
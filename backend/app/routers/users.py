@@ -9,9 +9,14 @@ from sqlalchemy import text as sa_text
 from typing import List, Optional
 from pydantic import BaseModel
 from app.database import get_session, engine
-from app.models import User, Role, SystemConfig, EntryLog
+from app.models import User, Role, EntryLog
 from app.auth import get_current_user, get_password_hash
 from app.utils.audit import log_action
+from app.utils.identity_index import identity_index
+from app.utils.reference_cache import reference_cache
+from app.utils import qr_signing
+from app.utils.evidence import EvidenceBusy, EvidenceTooLarge
+from app.utils.media_store import save_upload, MediaInvalid
 import csv
 import codecs
 import io
@@ -50,6 +55,8 @@ async def get_all_users(
     for user, role in results.all():
         u_dict = user.dict(exclude={"hashed_password"})
         u_dict["role"] = role.name if role else "Unknown" # Handle missing role
+        # Signed gate pass for ID cards; the scanner gets the user's primary key without a lookup
+        u_dict["qr_token"] = qr_signing.sign("user", user.id)
         users_list.append(u_dict)
         
     return users_list
@@ -94,6 +101,8 @@ async def update_user(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
+    old_admission_number = user.admission_number
+    
     # Update allowed fields
     if 'full_name' in user_data: user.full_name = user_data['full_name']
     if 'first_name' in user_data: user.first_name = user_data['first_name']
@@ -141,6 +150,8 @@ async def update_user(
     
     await session.commit()
     await session.refresh(user)
+    identity_index.forget_user(old_admission_number)
+    identity_index.remember_user(user)
 
     # Log the update
     await log_action(
@@ -170,6 +181,7 @@ async def delete_user(
         
     await session.delete(user)
     await session.commit()
+    identity_index.forget_user(user.admission_number)
 
     # Log the deletion
     await log_action(
@@ -208,7 +220,8 @@ async def get_current_user_info(
         "pin_setup_required": current_user.pin_setup_required,
         "role": role.name if role else "Unknown",
         "role_id": current_user.role_id,
-        "status": current_user.status
+        "status": current_user.status,
+        "qr_token": qr_signing.sign("user", current_user.id)
     }
 
 class UserUpdateMe(BaseModel):
@@ -382,6 +395,7 @@ async def create_user(
     session.add(db_user)
     await session.commit()
     await session.refresh(db_user)
+    identity_index.remember_user(db_user)
     
     await log_action(
         session=session,
@@ -551,7 +565,8 @@ async def _process_bulk_upload_task(content: bytes, job_id: str):
                             "email": email_val,
                             "gender": gender_val,
                             "program": program_val,
-                            "profile_image": existing_img or profile_val
+                            "profile_image": existing_img or profile_val,
+                            "updated_at": get_eat_time(),
                         })
                         updated_count += 1
                     else:
@@ -590,13 +605,14 @@ async def _process_bulk_upload_task(content: bytes, job_id: str):
                                 (id, admission_number, full_name, first_name, last_name,
                                  phone_number, school, email, gender, program,
                                  hashed_password, role_id, status, profile_image,
-                                 has_smartphone, pin, pin_setup_required, created_at)
+                                 has_smartphone, pin, pin_setup_required, created_at, updated_at)
                             VALUES
                                 (:new_id, :adm, :full_name, :first_name, :last_name,
                                  :phone, :school, :email, :gender, :program,
                                  :pwd, :role_id, 'active', :profile_image,
-                                 0, '2424', 1, :created_at)
+                                 0, '2424', 1, :created_at, :created_at)
                             ON DUPLICATE KEY UPDATE
+                                updated_at       = VALUES(updated_at),
                                 full_name        = VALUES(full_name),
                                 first_name       = VALUES(first_name),
                                 last_name        = VALUES(last_name),
@@ -627,7 +643,8 @@ async def _process_bulk_upload_task(content: bytes, job_id: str):
                                 gender        = :gender,
                                 program       = :program,
                                 profile_image = :profile_image,
-                                status        = 'active'
+                                status        = 'active',
+                                updated_at    = :updated_at
                             WHERE id = :existing_id
                         """), rec)
                     await session.commit()
@@ -636,6 +653,8 @@ async def _process_bulk_upload_task(content: bytes, job_id: str):
                     error_count += len(batch)
                     errors.append(f"Update batch {i//batch_size+1} failed: {str(e)}")
 
+            identity_index.invalidate()
+
             _upload_jobs[job_id] = {
                 "status": "done",
                 "added": added_count,
@@ -817,6 +836,7 @@ async def register_visitor(
     
     session.add(new_visitor)
     await session.commit()
+    identity_index.remember_user(new_visitor)
     return {"message": "Visitor account created successfully"}
 
     session.add(current_user)
@@ -826,11 +846,21 @@ async def register_visitor(
 
 @router.get("/verify/{admission_number}")
 async def verify_student(admission_number: str, session: AsyncSession = Depends(get_session)):
-    """Public endpoint to verify student by admission number or email"""
+    """Public endpoint to verify student by ID card QR, admission number or email"""
     user = None
+
+    # 0. Signed ID card QRs carry the user's primary key; forged or expired ones stop here
+    try:
+        signed = qr_signing.verify(admission_number)
+    except qr_signing.InvalidQR as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if signed:
+        user = await session.get(User, signed.id) if signed.kind == "user" else None
+        if not user:
+            raise HTTPException(status_code=404, detail="Student not found")
     
     # 1. Check if it's an email
-    if "@" in admission_number:
+    if not user and "@" in admission_number:
         query = select(User).where(User.email == admission_number)
         user = (await session.exec(query)).first()
     
@@ -848,14 +878,15 @@ async def verify_student(admission_number: str, session: AsyncSession = Depends(
  
     # 4. LDAP/AD Fallback
     if not user:
-        uri = (await session.exec(select(SystemConfig).where(SystemConfig.key == "ldap_server_uri"))).first()
-        bind_dn = (await session.exec(select(SystemConfig).where(SystemConfig.key == "ldap_bind_dn"))).first()
-        password = (await session.exec(select(SystemConfig).where(SystemConfig.key == "ldap_bind_password"))).first()
-        base_dn = (await session.exec(select(SystemConfig).where(SystemConfig.key == "ldap_base_dn"))).first()
+        config_dict = await reference_cache.get_configs(session)
+        uri = config_dict.get("ldap_server_uri")
+        bind_dn = config_dict.get("ldap_bind_dn")
+        password = config_dict.get("ldap_bind_password")
+        base_dn = config_dict.get("ldap_base_dn")
 
         if uri and base_dn:
             try:
-                ldap = LDAPClient(uri.value, bind_dn.value if bind_dn else "", password.value if password else "", base_dn.value)
+                ldap = LDAPClient(uri, bind_dn or "", password or "", base_dn)
                 ldap_data = ldap.get_user_by_id(admission_number)
                 if ldap_data:
                     return {
@@ -935,6 +966,7 @@ async def import_ad_student(
     session.add(new_user)
     await session.commit()
     await session.refresh(new_user)
+    identity_index.remember_user(new_user)
 
     return {
         "status": "success", 
@@ -959,9 +991,8 @@ async def verify_supervisor_pin(
     if not pin:
         raise HTTPException(status_code=400, detail="PIN is required")
         
-    stmt = select(SystemConfig).where(SystemConfig.key == "supervisor_pin")
-    config = (await session.exec(stmt)).first()
-    if not config or config.value != pin:
+    supervisor_pin = await reference_cache.get_config(session, "supervisor_pin")
+    if not supervisor_pin or supervisor_pin != pin:
         raise HTTPException(status_code=401, detail="Invalid Supervisor PIN")
         
     return {"status": "success", "message": "PIN verified"}
@@ -997,6 +1028,18 @@ async def verify_user_pin(
         return {"status": "success"}
     raise HTTPException(status_code=401, detail="Invalid Security PIN")
 
+async def _store_profile_photo(file: UploadFile) -> str:
+    """Store a profile photo in the media store and return its URL."""
+    try:
+        stored = await save_upload(file, "profiles")
+    except EvidenceBusy:
+        raise HTTPException(status_code=429, detail="Too many photos being processed. Please retry.", headers={"Retry-After": "2"})
+    except EvidenceTooLarge as e:
+        raise HTTPException(status_code=413, detail=f"Photo too large: {e}")
+    except MediaInvalid:
+        raise HTTPException(status_code=400, detail="Invalid image format")
+    return stored["url"]
+
 @router.post("/secure-profile-image-update")
 async def secure_profile_image_update(
     request: Request,
@@ -1013,22 +1056,11 @@ async def secure_profile_image_update(
         raise HTTPException(status_code=404, detail="User not found")
         
     # 3. Save Image
-    import os
-    import shutil
-    import uuid
-    
-    os.makedirs("static/profiles", exist_ok=True)
     file_ext = file.filename.split('.')[-1].lower()
     if file_ext not in ['jpg', 'jpeg', 'png', 'webp', 'gif']:
          raise HTTPException(status_code=400, detail="Invalid image format")
          
-    filename = f"{target_user.id}_{uuid.uuid4().hex[:8]}.{file_ext}"
-    file_path = f"static/profiles/{filename}"
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
-    image_url = f"/static/profiles/{filename}"
+    image_url = await _store_profile_photo(file)
     old_image = target_user.profile_image
     target_user.profile_image = image_url
     session.add(target_user)
@@ -1091,34 +1123,13 @@ async def upload_profile_image(
         if not target_user:
              raise HTTPException(status_code=404, detail="Student not found by Admission Number")
 
-    # Ensure Directory Exists
-    import os
-    os.makedirs("static/profiles", exist_ok=True)
-
     # Determine file extension
-    import shutil
-    import os
-    
     file_ext = file.filename.split('.')[-1].lower()
     if file_ext not in ['jpg', 'jpeg', 'png', 'webp', 'gif']:
          raise HTTPException(status_code=400, detail="Invalid image format")
     
-    import uuid
-    # Use unique filename to prevent browser caching issues
-    filename = f"{target_user.id}_{uuid.uuid4().hex[:8]}.{file_ext}"
-    file_path = f"static/profiles/{filename}"
-    
-    # Save file
-    try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to save image: {str(e)}")
-    
-    # Update User Record with URL
-    # Assuming server is running on same host, we store relative path or absolute URL
-    # Storing relative path is flexible
-    image_url = f"/static/profiles/{filename}"
+    # Save file (content-addressed, so a new photo always gets a new URL and caches never go stale)
+    image_url = await _store_profile_photo(file)
     
     target_user.profile_image = image_url
     session.add(target_user)
@@ -1160,7 +1171,8 @@ async def remove_profile_image(
         if not target_user:
             raise HTTPException(status_code=404, detail=f"User not found by ID '{user_id}'")
             
-    # Delete file physically if it exists and is local
+    # Delete file physically if it exists and is local. Media store photos can be shared by
+    # identical uploads, so those are left to the media reaper once nobody references them.
     import os
     if target_user.profile_image and target_user.profile_image.startswith("/static/profiles/"):
         file_path = target_user.profile_image.lstrip("/")
@@ -1261,7 +1273,6 @@ async def create_user_complete(
     Fixes 'User not found' race conditions.
     """
     import json
-    import uuid
     from uuid import UUID
     
     # 1. Permission Check
@@ -1344,22 +1355,14 @@ async def create_user_complete(
     # 6. Handle Image (Atomic)
     if file:
         try:
-            os.makedirs("static/profiles", exist_ok=True)
-            file_ext = file.filename.split('.')[-1]
-            filename = f"{new_user.id}_{uuid.uuid4().hex[:8]}.{file_ext}"
-            file_path = os.path.join("static/profiles", filename)
-            
-            content = await file.read()
-            with open(file_path, "wb") as f:
-                f.write(content)
-                
-            new_user.profile_image = f"/static/profiles/{filename}"
+            new_user.profile_image = await _store_profile_photo(file)
             session.add(new_user) # Update
         except Exception as e:
-            print(f"Image Save Error: {e}")
+            print(f"Image Save Error: {getattr(e, 'detail', e)}")
             
     await session.commit()
     await session.refresh(new_user)
+    identity_index.remember_user(new_user)
     return new_user
 
 @router.delete("/{user_id}")
@@ -1395,4 +1398,5 @@ async def delete_user(
         
     await session.delete(target)
     await session.commit()
+    identity_index.forget_user(target.admission_number)
     return {"status": "deleted", "user": target.full_name}
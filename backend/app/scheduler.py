@@ -108,12 +108,38 @@ async def auto_checkout_users_and_visitors():
         await session.commit()
         print(f"Auto-checked out {len(open_logs)} users and {len(open_visitors)} visitors.")
 
+async def rebuild_schedule_index():
+    """Load the new day's classroom schedule before the first scan of the day needs it."""
+    from app.utils.schedule_index import schedule_index
+    schedule_index.invalidate()
+    async with AsyncSession(engine) as session:
+        await schedule_index.ensure(session)
+
+async def materialize_next_day_sessions():
+    """Create tomorrow's ClassSessions from the timetable, so no scan has to insert one."""
+    from datetime import timedelta
+    from app.utils.schedule_index import materialize_sessions
+    tomorrow = get_eat_time().date() + timedelta(days=1)
+    async with AsyncSession(engine) as session:
+        created = await materialize_sessions(session, tomorrow)
+        await session.commit()
+    print(f"Materialized {created} class sessions for {tomorrow}")
+
+async def reap_media():
+    """Apply the media retention rules (expired evidence, unreferenced profile photos)."""
+    from app.utils import media_store
+    async with AsyncSession(engine) as session:
+        await media_store.reap(session)
+
 def start_scheduler():
     # Schedule report at 6:00 PM every day
     try:
         scheduler.add_job(generate_and_send_daily_reports, 'cron', hour=18, minute=0)
         scheduler.add_job(auto_checkout_users_and_visitors, 'cron', hour=0, minute=0)
+        scheduler.add_job(rebuild_schedule_index, 'cron', hour=0, minute=0, second=5)
+        scheduler.add_job(materialize_next_day_sessions, 'cron', hour=22, minute=0)
+        scheduler.add_job(reap_media, 'cron', hour=3, minute=30)
         scheduler.start()
-        print("Scheduler Started: Daily Reports at 18:00, Auto Checkout at 00:00")
+        print("Scheduler Started: Daily Reports at 18:00, next-day class sessions at 22:00, Auto Checkout and schedule index rebuild at 00:00, media reaper at 03:30")
     except Exception as e:
         print(f"Failed to start scheduler: {e}")
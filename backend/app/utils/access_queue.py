@@ -0,0 +1,384 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.models import Vehicle, VehicleLog, Visitor
+from app.utils import redis_client
+from app.utils.identity_index import identity_index
+from app.utils.gate_feed import gate_feed
+from app.utils.reference_cache import reference_cache
+from app.utils.plate_index import plate_index
+from app.utils.timezone import get_eat_time
+
+# Self-service submissions waiting for the worker; 0 turns queued ingestion off (requests insert inline)
+PUBLIC_ACCESS_QUEUE_SIZE = int(os.getenv("PUBLIC_ACCESS_QUEUE_SIZE", "2000"))
+PUBLIC_ACCESS_BATCH_SIZE = int(os.getenv("PUBLIC_ACCESS_BATCH_SIZE", "100"))
+PUBLIC_ACCESS_FLUSH_MS = int(os.getenv("PUBLIC_ACCESS_FLUSH_MS", "200"))
+# Per client IP: sustained submissions per minute and the burst allowed on top
+PUBLIC_ACCESS_RATE_PER_MIN = float(os.getenv("PUBLIC_ACCESS_RATE_PER_MIN", "6"))
+PUBLIC_ACCESS_BURST = int(os.getenv("PUBLIC_ACCESS_BURST", "5"))
+# How long a caller can look up the outcome of a ticket
+PUBLIC_ACCESS_TICKET_TTL = int(os.getenv("PUBLIC_ACCESS_TICKET_TTL", "900"))
+PUBLIC_ACCESS_MAX_WAIT = 25
+TICKET_KEY = "smartcampus:access-ticket:"
+
+VISITOR_ROLES = ("taxi", "cab", "delivery", "visitor")
+_MAX_FIELD = 255
+_MAX_BUCKETS = 50000
+_MAX_TICKETS = 50000
+
+
+class AccessRequestInvalid(ValueError):
+    """A self-service submission that can never be checked in."""
+
+
+class AccessQueueFull(Exception):
+    """The ingestion queue is at capacity; the caller should retry later."""
+
+
+def _text(data: dict, name: str, required: bool = False) -> Optional[str]:
+    value = data.get(name)
+    value = str(value).strip()[:_MAX_FIELD] if value is not None else ""
+    if required and not value:
+        raise AccessRequestInvalid(f"{name.replace('_', ' ').capitalize()} is required")
+    return value or None
+
+
+def validate_request(role: Optional[str], gate_id: Any, data: Any) -> Dict[str, Any]:
+    """
+    Check a visitor/taxi/delivery submission up front, so nothing that reaches the
+    queue can fail on insert; returns the normalized request the worker ingests.
+    """
+    if role not in VISITOR_ROLES:
+        raise AccessRequestInvalid("Unknown role")
+    if not isinstance(data, dict):
+        raise AccessRequestInvalid("Invalid request data")
+    plate = _text(data, "plate_number")
+    if plate:
+        plate = plate.upper()
+        if len(plate) > 20:
+            raise AccessRequestInvalid("Invalid plate number")
+    name = _text(data, "name", required=not plate)
+    try:
+        passengers = int(data.get("passengers") or 1)
+    except (TypeError, ValueError):
+        raise AccessRequestInvalid("Invalid passenger count")
+    if not 0 <= passengers <= 100:
+        raise AccessRequestInvalid("Invalid passenger count")
+    return {
+        "role": role,
+        "gate_id": str(gate_id) if gate_id else None,
+        "plate_number": plate,
+        "name": name,
+        "mobile": _text(data, "mobile", required=not plate),
+        "id_number": _text(data, "id_number", required=not plate),
+        "purpose": _text(data, "purpose") or _text(data, "delivery_details"),
+        "passengers": passengers,
+    }
+
+
+class TokenBuckets:
+    """Per-IP token buckets: PUBLIC_ACCESS_BURST submissions at once, refilled at PUBLIC_ACCESS_RATE_PER_MIN."""
+
+    def __init__(self, rate_per_min: float = PUBLIC_ACCESS_RATE_PER_MIN, burst: int = PUBLIC_ACCESS_BURST):
+        self.rate = rate_per_min / 60
+        self.burst = burst
+        # ip -> (tokens, last refill monotonic); least recently seen first
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self.throttled = 0
+
+    def take(self, ip: str) -> float:
+        """Spend one token for ip; returns 0 when allowed, else the seconds until the next token."""
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(ip, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - last) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            self.throttled += 1
+            wait = (1 - tokens) / self.rate if self.rate > 0 else 60.0
+        self._buckets[ip] = (tokens, now)
+        while len(self._buckets) > _MAX_BUCKETS:
+            # Long idle buckets are full again anyway
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class AccessQueue:
+    """
+    Queued ingestion for self-service visitor, taxi and delivery check-ins.
+
+    The public endpoint validates a submission, hands it to submit() and answers
+    at once with a ticket. A single background task drains the bounded queue in
+    batches of up to PUBLIC_ACCESS_BATCH_SIZE (or every PUBLIC_ACCESS_FLUSH_MS)
+    and inserts each batch in one transaction, so a flood from the public QR
+    holds one pooled connection instead of one per request. Ticket outcomes are
+    kept in memory (and in Redis when REDIS_URL is set, for polls that land on
+    the other worker) for PUBLIC_ACCESS_TICKET_TTL seconds.
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # ticket -> (expires_at monotonic, state); insertion order is expiry order
+        self._tickets: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._waiters: Dict[str, asyncio.Event] = {}
+        self.throttle = TokenBuckets()
+        self.enqueued = 0
+        self.rejected_full = 0
+        self.checked_in = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_batch = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running or PUBLIC_ACCESS_QUEUE_SIZE <= 0:
+            return
+        self._queue = asyncio.Queue(maxsize=PUBLIC_ACCESS_QUEUE_SIZE)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        print(f"Public access queue started (queue {PUBLIC_ACCESS_QUEUE_SIZE}, batch {PUBLIC_ACCESS_BATCH_SIZE})")
+
+    async def stop(self):
+        """Stop the worker and check in everything still queued (called on shutdown)."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        remaining = []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        for start in range(0, len(remaining), PUBLIC_ACCESS_BATCH_SIZE):
+            await self._ingest(remaining[start:start + PUBLIC_ACCESS_BATCH_SIZE])
+        print(f"Public access queue stopped ({len(remaining)} queued requests checked in)")
+
+    # --- Tickets ---
+
+    async def _set_ticket(self, ticket: str, state: dict):
+        self._tickets[ticket] = (time.monotonic() + PUBLIC_ACCESS_TICKET_TTL, state)
+        self._tickets.move_to_end(ticket)
+        now = time.monotonic()
+        while self._tickets:
+            expires_at, _ = next(iter(self._tickets.values()))
+            if expires_at > now and len(self._tickets) <= _MAX_TICKETS:
+                break
+            self._tickets.popitem(last=False)
+        waiter = self._waiters.pop(ticket, None) if state["status"] != "queued" else None
+        if waiter:
+            waiter.set()
+        redis = await redis_client.get_redis()
+        if redis is None:
+            return
+        try:
+            # The queued state must never overwrite a decision the worker already stored
+            await redis.set(TICKET_KEY + ticket, json.dumps(state), ex=PUBLIC_ACCESS_TICKET_TTL,
+                            nx=state["status"] == "queued")
+        except Exception as e:
+            print(f"Access ticket Redis store failed: {e}")
+
+    async def ticket(self, ticket: str) -> Optional[dict]:
+        entry = self._tickets.get(ticket)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        redis = await redis_client.get_redis()
+        if redis is None:
+            return None
+        try:
+            raw = await redis.get(TICKET_KEY + ticket)
+        except Exception as e:
+            print(f"Access ticket Redis lookup failed: {e}")
+            return None
+        return json.loads(raw) if raw else None
+
+    async def wait(self, ticket: str, timeout: float) -> Optional[dict]:
+        """The ticket's state, waiting up to timeout seconds for it to leave "queued"."""
+        deadline = time.monotonic() + min(max(timeout, 0), PUBLIC_ACCESS_MAX_WAIT)
+        while True:
+            state = await self.ticket(ticket)
+            remaining = deadline - time.monotonic()
+            if state is None or state["status"] != "queued" or remaining <= 0:
+                return state
+            if ticket in self._tickets:
+                # Queued on this worker: woken as soon as its batch commits
+                waiter = self._waiters.setdefault(ticket, asyncio.Event())
+                try:
+                    await asyncio.wait_for(waiter.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(min(0.5, remaining))
+
+    # --- Ingestion ---
+
+    async def submit(self, item: Dict[str, Any]) -> dict:
+        """
+        Queue a validated submission and return its ticket. Without a running
+        worker the submission is checked in before returning.
+        """
+        ticket = uuid.uuid4().hex
+        item = {**item, "ticket": ticket}
+        if not self.running:
+            await self._ingest([item])
+            return await self.ticket(ticket)
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.rejected_full += 1
+            raise AccessQueueFull()
+        self.enqueued += 1
+        state = {"ticket": ticket, "status": "queued", "message": "Request received. Please wait at the gate."}
+        await self._set_ticket(ticket, state)
+        return state
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            try:
+                deadline = time.monotonic() + PUBLIC_ACCESS_FLUSH_MS / 1000
+                while len(batch) < PUBLIC_ACCESS_BATCH_SIZE:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout=timeout))
+                    except asyncio.TimeoutError:
+                        break
+                await self._ingest(batch)
+            except asyncio.CancelledError:
+                # Shutdown while collecting or inserting: put the requests back so stop() checks them in
+                for item in batch:
+                    self._queue.put_nowait(item)
+                raise
+
+    async def _ingest(self, batch: List[Dict[str, Any]]):
+        from app.database import engine
+        try:
+            async with AsyncSession(engine, expire_on_commit=False) as session:
+                checked_in, created = await self._insert(session, batch)
+                await session.commit()
+        except Exception as e:
+            if len(batch) > 1:
+                # Isolate the bad request(s) instead of failing the whole batch
+                print(f"Public access batch insert failed ({e}); retrying one by one")
+                for item in batch:
+                    await self._ingest([item])
+                return
+            self.failed += 1
+            print(f"Self-service check-in failed: {e}")
+            await self._set_ticket(batch[0]["ticket"], {
+                "ticket": batch[0]["ticket"], "status": "error",
+                "message": "Check-in could not be completed. Please see the guard.",
+            })
+            return
+
+        self.batches += 1
+        self.max_batch = max(self.max_batch, len(batch))
+        for vehicle in created:
+            identity_index.remember_vehicle(vehicle)
+        for item, gate, vehicle, visitor in checked_in:
+            self.checked_in += 1
+            if visitor is not None:
+                identity_index.remember_visitor(visitor)
+            gate_feed.publish(
+                gate, "vehicle" if vehicle else "visitor", "allowed", f"Self-service {item['role']} check-in",
+                name=vehicle.plate_number if vehicle else item["name"],
+                identifier=item["id_number"], role=item["role"].title(), direction="in"
+            )
+            await self._set_ticket(item["ticket"], {
+                "ticket": item["ticket"], "status": "success", "message": "Check-in Successful. You may proceed.",
+            })
+
+    async def _insert(self, session: AsyncSession, batch: List[Dict[str, Any]]) -> Tuple[list, List[Vehicle]]:
+        """
+        Add the VehicleLog or Visitor rows of a batch to session, with one plate
+        lookup for the whole batch; returns the rows per request and the vehicles
+        registered on the way.
+        """
+        plates = {item["plate_number"] for item in batch if item["plate_number"]}
+        vehicles: Dict[str, Vehicle] = {}
+        if plates:
+            found = (await session.exec(select(Vehicle).where(Vehicle.plate_number.in_(plates)))).all()
+            vehicles = {v.plate_number: v for v in found}
+        created = []
+        for plate in sorted(plates - set(vehicles)):
+            # Misread of a registered plate, else a new self-registered vehicle
+            close = plate_index.match(plate)
+            vehicle = await session.get(Vehicle, close.vehicle_id) if close else None
+            if vehicle is None:
+                item = next(i for i in batch if i["plate_number"] == plate)
+                vehicle = Vehicle(
+                    plate_number=plate,
+                    driver_name=item["name"],
+                    driver_id_number=item["id_number"],
+                    driver_contact=item["mobile"],
+                    make="Self-Reg",
+                    model=item["role"].title(),
+                    color="Unknown"
+                )
+                session.add(vehicle)
+                created.append(vehicle)
+            vehicles[plate] = vehicle
+        if created:
+            await session.flush()
+
+        checked_in = []
+        for item in batch:
+            gate = await reference_cache.resolve_gate(session, item["gate_id"])
+            vehicle = vehicles.get(item["plate_number"]) if item["plate_number"] else None
+            visitor = None
+            if vehicle:
+                session.add(VehicleLog(
+                    vehicle_id=vehicle.id,
+                    gate_id=gate.id if gate else None,
+                    entry_time=get_eat_time(),
+                    vehicle_images={},
+                    manual_override=True, # Flag as manual/self-service
+                    detected_passengers=item["passengers"]
+                ))
+            else:
+                name = item["name"]
+                visitor = Visitor(
+                    first_name=name.split(" ")[0],
+                    last_name=name.split(" ")[-1] if " " in name else "",
+                    phone_number=item["mobile"],
+                    id_number=item["id_number"],
+                    visit_details=f"{item['role'].title()}: {item['purpose']}",
+                    status="checked_in",
+                    time_in=get_eat_time(),
+                    gate_id=gate.id if gate else None,
+                    visitor_type=item["role"]
+                )
+                session.add(visitor)
+            checked_in.append((item, gate, vehicle, visitor))
+        return checked_in, created
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_capacity": PUBLIC_ACCESS_QUEUE_SIZE,
+            "enqueued": self.enqueued,
+            "rejected_full": self.rejected_full,
+            "throttled": self.throttle.throttled,
+            "checked_in": self.checked_in,
+            "failed": self.failed,
+            "batches": self.batches,
+            "max_batch": self.max_batch,
+            "tickets": len(self._tickets),
+        }
+
+
+access_queue = AccessQueue()
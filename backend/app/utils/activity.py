@@ -0,0 +1,201 @@
+import base64
+import heapq
+from datetime import datetime
+from typing import Optional, Dict, List, Any, Iterable, Tuple, Callable, NamedTuple
+from uuid import UUID
+from sqlalchemy import and_, or_
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.models import EntryLog, VehicleLog, Visitor, GateScanLog, User, Vehicle, Gate
+
+DEFAULT_PAGE = 50
+MAX_PAGE = 200
+
+
+class InvalidCursor(ValueError):
+    """A cursor that was not produced by encode_cursor."""
+
+
+# --- Cursors: opaque (time, id) of the last item on the previous page ---
+
+def encode_cursor(moment: datetime, row_id: UUID) -> str:
+    raw = f"{moment.isoformat()}|{row_id.hex}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        moment, _, row_id = raw.partition("|")
+        return datetime.fromisoformat(moment), UUID(hex=row_id)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise InvalidCursor("invalid cursor")
+
+
+# --- Sources: one SQL query each, already in timeline order ---
+
+class _Source(NamedTuple):
+    time_col: Any
+    id_col: Any
+    gate_col: Any
+    query: Callable
+    item: Callable
+
+
+def _user_item(row) -> Dict[str, Any]:
+    return {
+        "id": str(row.id),
+        "type": "user",
+        "role": "Student/Staff",
+        "name": row.full_name or row.first_name or "Unknown User",
+        "identifier": row.admission_number,
+        "gate": row.gate_name or "Unknown",
+        "gate_id": str(row.gate_id) if row.gate_id else None,
+        "time": row.entry_time,
+        "exit_time": row.exit_time,
+        "status": row.status,
+        "details": f"IP: {row.ip_address}" if row.ip_address else "QR Scan",
+        "verification_image": row.verification_image,
+    }
+
+
+def _vehicle_item(row) -> Dict[str, Any]:
+    return {
+        "id": str(row.id),
+        "type": "vehicle",
+        "role": "Vehicle",
+        "name": row.plate_number or "Unknown Vehicle",
+        "identifier": row.driver_name or "Unknown Driver",
+        "gate": row.gate_name or "Unknown",
+        "gate_id": str(row.gate_id) if row.gate_id else None,
+        "time": row.entry_time,
+        "exit_time": row.exit_time,
+        "status": "allowed",
+        "details": f"{row.detected_passengers} Passenger(s)",
+        "verification_image": None,
+    }
+
+
+def _visitor_item(row) -> Dict[str, Any]:
+    return {
+        "id": str(row.id),
+        "type": "visitor",
+        "role": (row.visitor_type or "visitor").title(),
+        "name": f"{row.first_name} {row.last_name}",
+        "identifier": row.id_number,
+        "gate": row.gate_name or "Unknown",
+        "gate_id": str(row.gate_id) if row.gate_id else None,
+        "time": row.time_in,
+        "exit_time": row.time_out,
+        "status": row.status,
+        "details": row.visit_details,
+        "verification_image": None,
+    }
+
+
+def _scan_item(row) -> Dict[str, Any]:
+    return {
+        "id": str(row.id),
+        "type": "scan",
+        "role": row.scan_type,
+        "name": row.scanned_value,
+        "identifier": row.scanner_name or "System",
+        "gate": row.gate_name or "Unknown Gate",
+        "gate_id": str(row.gate_id) if row.gate_id else None,
+        "time": row.timestamp,
+        "exit_time": None,
+        "status": row.status,
+        "details": row.details,
+        "verification_image": None,
+    }
+
+
+SOURCES: Dict[str, _Source] = {
+    "user": _Source(
+        EntryLog.entry_time, EntryLog.id, EntryLog.gate_id,
+        lambda: select(
+            EntryLog.id, EntryLog.entry_time, EntryLog.exit_time, EntryLog.status, EntryLog.gate_id,
+            EntryLog.ip_address, EntryLog.verification_image,
+            User.full_name, User.first_name, User.admission_number, Gate.name.label("gate_name"),
+        ).join(User, EntryLog.user_id == User.id, isouter=True).join(Gate, EntryLog.gate_id == Gate.id, isouter=True),
+        _user_item,
+    ),
+    "vehicle": _Source(
+        VehicleLog.entry_time, VehicleLog.id, VehicleLog.gate_id,
+        lambda: select(
+            VehicleLog.id, VehicleLog.entry_time, VehicleLog.exit_time, VehicleLog.gate_id,
+            VehicleLog.detected_passengers, Vehicle.plate_number, Vehicle.driver_name, Gate.name.label("gate_name"),
+        ).join(Vehicle, VehicleLog.vehicle_id == Vehicle.id, isouter=True).join(Gate, VehicleLog.gate_id == Gate.id, isouter=True),
+        _vehicle_item,
+    ),
+    "visitor": _Source(
+        Visitor.time_in, Visitor.id, Visitor.gate_id,
+        lambda: select(
+            Visitor.id, Visitor.time_in, Visitor.time_out, Visitor.status, Visitor.gate_id, Visitor.visitor_type,
+            Visitor.first_name, Visitor.last_name, Visitor.id_number, Visitor.visit_details, Gate.name.label("gate_name"),
+        ).join(Gate, Visitor.gate_id == Gate.id, isouter=True),
+        _visitor_item,
+    ),
+    "scan": _Source(
+        GateScanLog.timestamp, GateScanLog.id, GateScanLog.gate_id,
+        lambda: select(
+            GateScanLog.id, GateScanLog.timestamp, GateScanLog.scan_type, GateScanLog.scanned_value,
+            GateScanLog.status, GateScanLog.details, GateScanLog.scanner_name, GateScanLog.gate_id,
+            Gate.name.label("gate_name"),
+        ).join(Gate, GateScanLog.gate_id == Gate.id, isouter=True),
+        _scan_item,
+    ),
+}
+
+
+async def _stream(session: AsyncSession, source: _Source, limit: int, after: Optional[Tuple[datetime, UUID]],
+                  gate_id: Optional[UUID], since: Optional[datetime], until: Optional[datetime]) -> List[Tuple]:
+    """Up to `limit` (time, id, item) tuples from one source, newest first, strictly after the cursor."""
+    query = source.query()
+    if after is not None:
+        moment, row_id = after
+        query = query.where(or_(source.time_col < moment, and_(source.time_col == moment, source.id_col < row_id)))
+    if gate_id is not None:
+        query = query.where(source.gate_col == gate_id)
+    if since is not None:
+        query = query.where(source.time_col >= since)
+    if until is not None:
+        query = query.where(source.time_col < until)
+    query = query.order_by(source.time_col.desc(), source.id_col.desc()).limit(limit)
+    rows = (await session.exec(query)).all()
+    return [(row[1], row.id, source.item(row)) for row in rows]
+
+
+async def timeline(
+    session: AsyncSession,
+    limit: int = DEFAULT_PAGE,
+    cursor: Optional[str] = None,
+    gate_id: Optional[UUID] = None,
+    types: Optional[Iterable[str]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    One page of gate activity across entry, vehicle, visitor and scan logs,
+    newest first, and the cursor for the next page (None on the last page).
+
+    Each source is a single keyset query (ordering, joins and filters in SQL,
+    limit + 1 rows), and the sorted streams are k-way merged on (time, id), so
+    a page costs one query per source however deep the scroll.
+    """
+    limit = max(1, min(limit, MAX_PAGE))
+    after = decode_cursor(cursor) if cursor else None
+    kinds = list(types) if types else list(SOURCES)
+    unknown = [k for k in kinds if k not in SOURCES]
+    if unknown:
+        raise ValueError(f"unknown activity type: {', '.join(unknown)}")
+
+    streams = [
+        await _stream(session, SOURCES[kind], limit + 1, after, gate_id, since, until)
+        for kind in kinds
+    ]
+    merged = list(heapq.merge(*streams, key=lambda entry: (entry[0], entry[1]), reverse=True))[:limit + 1]
+
+    page = merged[:limit]
+    next_cursor = encode_cursor(page[-1][0], page[-1][1]) if len(merged) > limit else None
+    return [item for _, _, item in page], next_cursor
@@ -1,10 +1,19 @@
+import asyncio
+import os
+import time
 from datetime import datetime, date
-from typing import Optional, Any, Dict
+from typing import Optional, Any, Dict, List
 from uuid import UUID
 from fastapi import Request
 from sqlmodel.ext.asyncio.session import AsyncSession
 from app.models import AuditLog, User
 from app.utils.timezone import get_eat_time
+from app.utils.timing import span
+
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_MS = int(os.getenv("AUDIT_FLUSH_MS", "250"))
+AUDIT_ENQUEUE_WAIT_MS = int(os.getenv("AUDIT_ENQUEUE_WAIT_MS", "20"))
 
 def json_safe_dict(d: Any) -> Any:
     """Recursively convert UUIDs and datetimes to strings for JSON serialization."""
@@ -18,6 +27,148 @@ def json_safe_dict(d: Any) -> Any:
         return d.isoformat()
     return d
 
+class AuditWriter:
+    """
+    Write-behind writer for AuditLog rows.
+
+    log_action puts rows on a bounded in-process queue and a background task
+    bulk-inserts them every AUDIT_FLUSH_MS or AUDIT_BATCH_SIZE rows, whichever
+    comes first, so the audit insert is no longer a second commit on the request.
+    When the queue is full (or the writer is not running) callers fall back to
+    writing synchronously, which slows them down instead of dropping rows.
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.written = 0
+        self.failed = 0
+        self.sync_fallbacks = 0
+        self.batches = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._flush_ms_total = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=AUDIT_QUEUE_SIZE)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        print(f"Audit writer started (queue {AUDIT_QUEUE_SIZE}, batch {AUDIT_BATCH_SIZE}, every {AUDIT_FLUSH_MS}ms)")
+
+    async def stop(self):
+        """Stop the background task and flush everything still queued (called on shutdown)."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        remaining = []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        for start in range(0, len(remaining), AUDIT_BATCH_SIZE):
+            await self._flush(remaining[start:start + AUDIT_BATCH_SIZE])
+        print(f"Audit writer stopped ({len(remaining)} queued rows flushed)")
+
+    async def submit(self, log: AuditLog) -> bool:
+        """Queue a row; returns False when the caller must write it synchronously."""
+        if not self.running:
+            return False
+        try:
+            self._queue.put_nowait(log)
+        except asyncio.QueueFull:
+            # Backpressure: give the writer a moment to drain before falling back
+            try:
+                await asyncio.wait_for(self._queue.put(log), timeout=AUDIT_ENQUEUE_WAIT_MS / 1000)
+            except asyncio.TimeoutError:
+                self.sync_fallbacks += 1
+                return False
+        self.enqueued += 1
+        return True
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            try:
+                deadline = time.monotonic() + AUDIT_FLUSH_MS / 1000
+                while len(batch) < AUDIT_BATCH_SIZE:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout=timeout))
+                    except asyncio.TimeoutError:
+                        break
+                await self._flush(batch)
+            except asyncio.CancelledError:
+                # Shutdown while collecting or flushing: put the rows back so stop() writes them
+                for log in batch:
+                    self._queue.put_nowait(log)
+                raise
+
+    async def _flush(self, batch: List[AuditLog]):
+        from app.database import engine
+        started = time.perf_counter()
+        try:
+            async with AsyncSession(engine) as session:
+                session.add_all(batch)
+                await session.commit()
+            self.written += len(batch)
+        except Exception as e:
+            print(f"Audit batch insert failed ({e}); retrying")
+            await asyncio.sleep(AUDIT_FLUSH_MS / 1000)
+            try:
+                async with AsyncSession(engine) as session:
+                    session.add_all(batch)
+                    await session.commit()
+                self.written += len(batch)
+            except Exception:
+                # Isolate the bad row(s) instead of losing the whole batch
+                await self._flush_rows(batch)
+        elapsed = (time.perf_counter() - started) * 1000
+        self.batches += 1
+        self.last_flush_ms = round(elapsed, 2)
+        self.max_flush_ms = max(self.max_flush_ms, self.last_flush_ms)
+        self._flush_ms_total += elapsed
+
+    async def _flush_rows(self, batch: List[AuditLog]):
+        from app.database import engine
+        for log in batch:
+            try:
+                async with AsyncSession(engine) as session:
+                    session.add(log)
+                    await session.commit()
+                self.written += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Dropped audit row {log.action_type}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_capacity": AUDIT_QUEUE_SIZE,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "failed": self.failed,
+            "sync_fallbacks": self.sync_fallbacks,
+            "batches": self.batches,
+            "last_flush_ms": self.last_flush_ms,
+            "avg_flush_ms": round(self._flush_ms_total / self.batches, 2) if self.batches else None,
+            "max_flush_ms": self.max_flush_ms,
+        }
+
+
+audit_writer = AuditWriter()
+
 async def log_action(
     session: AsyncSession,
     action_type: str,
@@ -32,6 +183,8 @@ async def log_action(
     """
     Log an action to the audit trail.
     Captures IP, User-Agent, and other browser metadata if request is provided.
+    The row is handed to the write-behind audit_writer; it is only written (and
+    the session committed) here when the writer is not running or is full.
     """
     ip_address = None
     user_agent = None
@@ -75,5 +228,8 @@ async def log_action(
         description=description
     )
     
-    session.add(log)
-    await session.commit()
+    with span("audit"):
+        if await audit_writer.submit(log):
+            return
+        session.add(log)
+        await session.commit()
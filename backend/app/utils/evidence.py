@@ -0,0 +1,192 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Dict, Any
+
+EVIDENCE_WORKERS = int(os.getenv("EVIDENCE_WORKERS", "2"))
+# Largest photo accepted, and the photo bytes a web worker holds in memory at once
+EVIDENCE_MAX_BYTES = int(os.getenv("EVIDENCE_MAX_BYTES", str(10 * 1024 * 1024)))
+EVIDENCE_MAX_INFLIGHT_BYTES = int(os.getenv("EVIDENCE_MAX_INFLIGHT_BYTES", str(64 * 1024 * 1024)))
+# How long a request waits for room in that budget before it is turned away with 429
+EVIDENCE_QUEUE_TIMEOUT = float(os.getenv("EVIDENCE_QUEUE_TIMEOUT", "5"))
+EVIDENCE_TIMEOUT = float(os.getenv("EVIDENCE_TIMEOUT", "10"))
+
+# EXIF tags copied into the attendance metadata (IFD0: DateTime, Make, Model)
+_EXIF_TAGS = {271: "camera_make", 272: "camera_model", 306: "photo_date"}
+
+
+class EvidenceBusy(Exception):
+    """Too many photos already in flight; the caller should retry shortly."""
+
+
+class EvidenceTooLarge(Exception):
+    """The photo is bigger than EVIDENCE_MAX_BYTES."""
+
+
+# --- Worker side (runs in the pool processes) ---
+
+def process_evidence(data: bytes) -> Dict[str, Any]:
+    """
+    Validate an attendance photo, read its camera EXIF and keep it in the media store.
+    Runs inside a pool process. EXIF is read from the header before the re-encode drops it.
+    """
+    from PIL import Image
+    import io
+    from app.utils.media_store import store_image
+    started = time.perf_counter()
+    result: Dict[str, Any] = {"exif": None, "error": None}
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            exif = image.getexif()
+            if exif:
+                result["exif"] = {
+                    key: str(exif.get(tag, "Unknown")).strip("\x00 ") or "Unknown"
+                    for tag, key in _EXIF_TAGS.items()
+                }
+    except Exception as e:
+        result["error"] = str(e)
+
+    # Evidence is kept even when unreadable (as uploaded), so a flagged record can be reviewed
+    stored = store_image(data, "evidence", fallback_ext="jpg")
+    result["error"] = result["error"] or stored["error"]
+    result.update(url=stored["url"], thumbs=stored["thumbs"], sha256=stored["sha256"],
+                  deduped=stored["deduped"], dhash=stored["dhash"])
+    result["ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+def _warm() -> bool:
+    """Import Pillow and the media store in a fresh pool process."""
+    from PIL import Image  # noqa: F401
+    import app.utils.media_store  # noqa: F401
+    return True
+
+
+# --- Web-worker side ---
+
+class EvidencePool:
+    """
+    Uploaded photo handling off the event loop.
+
+    EXIF extraction, validation, recompression and writing to the media store run
+    in a ProcessPoolExecutor, so a lecture hall marking attendance at once does not
+    stall the loop that also serves the gate. Other uploads (profile photos, gate
+    captures) go through the same pool via app.utils.media_store. The photo bytes held by a web
+    worker are capped at EVIDENCE_MAX_INFLIGHT_BYTES; requests beyond that wait
+    up to EVIDENCE_QUEUE_TIMEOUT seconds for room and then get EvidenceBusy.
+    """
+
+    def __init__(self, workers: int = EVIDENCE_WORKERS, max_inflight_bytes: int = EVIDENCE_MAX_INFLIGHT_BYTES):
+        self.workers = workers
+        self.max_inflight_bytes = max_inflight_bytes
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._room: Optional[asyncio.Condition] = None
+        self.inflight_bytes = 0
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn, not fork: the web worker holds an event loop, DB connections and threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def start(self):
+        """Spin the pool processes up ahead of the first photo."""
+        pool = self._pool()
+        for _ in range(self.workers):
+            pool.submit(_warm)
+        print(f"Evidence pool started with {self.workers} processes")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _reserve(self, size: int):
+        if self._room is None:
+            self._room = asyncio.Condition()
+        async with self._room:
+            try:
+                await asyncio.wait_for(
+                    self._room.wait_for(lambda: self.inflight_bytes + size <= self.max_inflight_bytes
+                                        or self.inflight_bytes == 0),
+                    EVIDENCE_QUEUE_TIMEOUT,
+                )
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise EvidenceBusy(f"{self.inflight_bytes} bytes of photos already in flight")
+            self.inflight_bytes += size
+
+    async def _release(self, size: int):
+        async with self._room:
+            self.inflight_bytes -= size
+            self._room.notify_all()
+
+    async def process_upload(self, upload) -> Dict[str, Any]:
+        """
+        Read an uploaded attendance photo and have a pool process validate it, extract
+        its EXIF and store it, awaiting a single future. Returns {"exif": {...} or None,
+        "error": str or None, "url": ..., "thumbs": {size: url}, "sha256": ..., "deduped": bool,
+        "dhash": hex or None}.
+        """
+        return await self.submit_upload(upload, process_evidence)
+
+    async def submit_upload(self, upload, fn, *args) -> Any:
+        """Read an UploadFile within the byte budget and run fn(data, *args) in the pool."""
+        # Room is reserved before reading, for the declared size when the client sent one
+        size = min(upload.size or EVIDENCE_MAX_BYTES, EVIDENCE_MAX_BYTES)
+        if upload.size and upload.size > EVIDENCE_MAX_BYTES:
+            raise EvidenceTooLarge(f"photo exceeds {EVIDENCE_MAX_BYTES // (1024 * 1024)} MB")
+        await self._reserve(size)
+        try:
+            data = await upload.read(EVIDENCE_MAX_BYTES + 1)
+            if len(data) > EVIDENCE_MAX_BYTES:
+                raise EvidenceTooLarge(f"photo exceeds {EVIDENCE_MAX_BYTES // (1024 * 1024)} MB")
+            return await self._run(fn, data, *args)
+        finally:
+            await self._release(size)
+
+    async def submit_bytes(self, data: bytes, fn, *args) -> Any:
+        """submit_upload for bytes already read."""
+        if len(data) > EVIDENCE_MAX_BYTES:
+            raise EvidenceTooLarge(f"photo exceeds {EVIDENCE_MAX_BYTES // (1024 * 1024)} MB")
+        await self._reserve(len(data))
+        try:
+            return await self._run(fn, data, *args)
+        finally:
+            await self._release(len(data))
+
+    async def _run(self, fn, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        try:
+            result = await asyncio.wait_for(loop.run_in_executor(self._pool(), fn, *args), EVIDENCE_TIMEOUT)
+        except BrokenProcessPool:
+            # A worker died (e.g. a native crash in an image plugin); start a fresh pool for the next request
+            self._executor = None
+            self.failed += 1
+            raise
+        except asyncio.TimeoutError:
+            self.failed += 1
+            raise
+        self.processed += 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "max_inflight_bytes": self.max_inflight_bytes,
+            "inflight_bytes": self.inflight_bytes,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+        }
+
+
+evidence_pool = EvidencePool()
@@ -0,0 +1,177 @@
+import csv
+import io
+import os
+import re
+import zipfile
+from datetime import date, datetime, time, timedelta
+from typing import Optional, Any, AsyncIterator, Callable, List, Sequence, Tuple
+from xml.sax.saxutils import escape, quoteattr
+
+from fastapi.responses import StreamingResponse
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.database import engine
+
+# Rows fetched from the database cursor (and written out) at a time
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "1000"))
+EXPORT_FORMATS = ("csv", "xlsx")
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+Row = List[Any]
+
+
+class ExportFormatInvalid(ValueError):
+    """A format other than EXPORT_FORMATS was asked for."""
+
+
+# --- Fetching ---
+
+def day_range(start_date: Optional[date], end_date: Optional[date]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """[start, end) datetimes covering start_date..end_date inclusive, for filtering timestamps."""
+    start = datetime.combine(start_date, time.min) if start_date else None
+    end = datetime.combine(end_date + timedelta(days=1), time.min) if end_date else None
+    return start, end
+
+
+async def stream_rows(query, row_fn: Callable[[Any], Row]) -> AsyncIterator[List[Row]]:
+    """
+    Run query on a server-side cursor and yield its rows, converted by row_fn(row),
+    EXPORT_BATCH_ROWS at a time. The export gets its own session: it outlives the
+    request's, which is closed once the endpoint returns its StreamingResponse.
+    """
+    async with AsyncSession(engine) as session:
+        result = await session.stream(query.execution_options(yield_per=EXPORT_BATCH_ROWS))
+        async for partition in result.partitions():
+            yield [row_fn(row) for row in partition]
+
+
+# --- CSV ---
+
+async def _csv_chunks(header: Sequence[str], batches: AsyncIterator[List[Row]]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    async for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+# --- XLSX ---
+
+_XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+_XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name={name} sheetId="1" r:id="rId1"/></sheets></workbook>'
+)
+_XLSX_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_XLSX_SHEET_TAIL = '</sheetData></worksheet>'
+# Characters XML 1.0 cannot carry at all
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _xlsx_cell(value: Any) -> str:
+    if value is None:
+        return "<c/>"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f"<c><v>{value}</v></c>"
+    text = escape(_XML_ILLEGAL.sub("", str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_rows(rows: Sequence[Row]) -> bytes:
+    return "".join(f"<row>{''.join(_xlsx_cell(v) for v in row)}</row>" for row in rows).encode("utf-8")
+
+
+class _ChunkSink:
+    """Write-only file the zip is written into; what accumulates is handed out as response chunks."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def _xlsx_chunks(header: Sequence[str], batches: AsyncIterator[List[Row]], sheet: str) -> AsyncIterator[bytes]:
+    """
+    A one-sheet workbook, written as the rows arrive. The zip goes to a stream that
+    cannot seek, so zipfile puts each entry's sizes after its data; strings are
+    inline rather than shared, so nothing has to be held until the end.
+    """
+    sink = _ChunkSink()
+    # Sheet names are at most 31 characters, without []:*?/\
+    name = re.sub(r"[\[\]:*?/\\]", " ", sheet)[:31] or "Sheet1"
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as book:
+        for part, xml in _XLSX_PARTS.items():
+            book.writestr(part, xml)
+        book.writestr("xl/workbook.xml", _XLSX_WORKBOOK.format(name=quoteattr(name)))
+        with book.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as out:
+            out.write(_XLSX_SHEET_HEAD.encode("utf-8"))
+            out.write(_xlsx_rows([list(header)]))
+            async for batch in batches:
+                out.write(_xlsx_rows(batch))
+                chunk = sink.take()
+                if chunk:
+                    yield chunk
+            out.write(_XLSX_SHEET_TAIL.encode("utf-8"))
+    yield sink.take()
+
+
+# --- Responses ---
+
+def export_response(fmt: str, filename: str, header: Sequence[str], batches: AsyncIterator[List[Row]]) -> StreamingResponse:
+    """
+    Stream batches (from stream_rows) as a CSV or XLSX download; filename has no
+    extension. Raises ExportFormatInvalid for any other fmt.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ExportFormatInvalid(f"Unsupported export format '{fmt}'. Use one of: {', '.join(EXPORT_FORMATS)}.")
+    body = _csv_chunks(header, batches) if fmt == "csv" else _xlsx_chunks(header, batches, filename)
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename={filename}.{fmt}"},
+    )
@@ -0,0 +1,207 @@
+import asyncio
+import os
+import uuid
+from collections import deque
+from typing import Optional, Dict, List, Set, Any
+from sqlmodel import select, desc
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.models import EntryLog, User, Gate, VehicleLog, Vehicle, Visitor
+from app.utils import redis_client
+from app.utils.timezone import get_eat_time
+from app.utils.timing import span
+
+GATE_FEED_CHANNEL = "smartcampus:gate-feed"
+GATE_FEED_BUFFER = int(os.getenv("GATE_FEED_BUFFER", "50"))
+# Events a slow console may fall behind by before the oldest are dropped
+GATE_FEED_SUBSCRIBER_QUEUE = 100
+
+ALL_GATES = "all"
+
+
+def gate_key(gate_id: Any) -> Optional[str]:
+    """Normalize a gate id (UUID or string) to the feed key; 'all' is the campus-wide feed."""
+    if gate_id is None:
+        return None
+    if str(gate_id).lower() == ALL_GATES:
+        return ALL_GATES
+    try:
+        return str(uuid.UUID(str(gate_id)))
+    except ValueError:
+        return None
+
+
+class GateFeed:
+    """
+    In-process pub/sub hub for gate scan outcomes.
+
+    Each gate keeps a ring buffer of its latest events (plus one for the whole
+    campus) so a console that subscribes gets a snapshot without touching SQL.
+    Events published on one uvicorn worker are relayed to the others through
+    Redis when REDIS_URL is set.
+    """
+
+    def __init__(self):
+        self._buffers: Dict[str, deque] = {}
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._listener: Optional[asyncio.Task] = None
+
+    def _buffer(self, key: str) -> deque:
+        if key not in self._buffers:
+            self._buffers[key] = deque(maxlen=GATE_FEED_BUFFER)
+        return self._buffers[key]
+
+    def _deliver(self, event: Dict[str, Any]):
+        keys = [ALL_GATES]
+        if event.get("gate_id"):
+            keys.append(event["gate_id"])
+        for key in keys:
+            self._buffer(key).append(event)
+            for queue in self._subscribers.get(key, ()):
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(event)
+
+    # --- Public API ---
+
+    def publish(self, gate: Optional[Gate], entity_type: str, status: str, message: str,
+                name: Optional[str] = None, identifier: Optional[str] = None,
+                role: Optional[str] = None, image: Optional[str] = None, gate_id: Any = None,
+                direction: Optional[str] = None):
+        """
+        Push a scan outcome to consoles watching its gate (and the campus-wide feed).
+        status is the access decision ("allowed", "rejected" or "event_pass"); direction
+        says whether an allowed scan checked the person or vehicle "in" or "out" (None
+        when it moved nobody, or the log is not known).
+        """
+        event = {
+            "event_id": uuid.uuid4().hex,
+            "type": entity_type,
+            "gate_id": gate_key(gate.id if gate else gate_id),
+            "gate": gate.name if gate else None,
+            "name": name or identifier,
+            "identifier": identifier,
+            "role": role,
+            "status": status,
+            "direction": direction,
+            "details": message,
+            "image": image,
+            "time": get_eat_time().isoformat(),
+        }
+        self._deliver(event)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        loop.create_task(redis_client.publish(GATE_FEED_CHANNEL, self._worker_id, {"event": event}))
+
+    def publish_result(self, gate: Optional[Gate], entity_type: str, identifier: Optional[str], result: dict,
+                       direction: Optional[str] = None) -> dict:
+        """Publish a /scan style response ({status, message, data}) and hand it back for returning."""
+        data = result.get("data") or {}
+        with span("publish"):
+            self.publish(
+                gate, entity_type, result.get("status"), result.get("message"),
+                name=data.get("name"), identifier=identifier, role=data.get("role"), image=data.get("image"),
+                direction=direction
+            )
+        return result
+
+    def subscribe(self, key: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=GATE_FEED_SUBSCRIBER_QUEUE)
+        self._subscribers.setdefault(key, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, key: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(key)
+        if subscribers:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[key]
+
+    def snapshot(self, key: str) -> List[Dict[str, Any]]:
+        """Latest events for a gate, newest first."""
+        return list(reversed(self._buffers.get(key, ())))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "gates": len([k for k in self._buffers if k != ALL_GATES]),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+        }
+
+    # --- Boot backfill ---
+
+    async def seed(self, session: AsyncSession):
+        """Backfill the ring buffers once on startup from the latest gate logs."""
+        limit = GATE_FEED_BUFFER * 4
+        events = []
+
+        user_rows = (await session.exec(
+            select(EntryLog, User, Gate).join(User, EntryLog.user_id == User.id).join(Gate, EntryLog.gate_id == Gate.id)
+            .order_by(desc(EntryLog.entry_time)).limit(limit)
+        )).all()
+        for log, user, gate in user_rows:
+            events.append((log.entry_time, {
+                "type": "user", "name": user.full_name or user.first_name, "identifier": user.admission_number,
+                "role": "Student/Staff", "status": log.status, "direction": "in" if log.status == "allowed" else None, "gate": gate,
+                "details": f"IP: {log.ip_address}" if log.ip_address else "QR Scan",
+                "image": log.verification_image,
+            }))
+
+        vehicle_rows = (await session.exec(
+            select(VehicleLog, Vehicle, Gate).join(Vehicle).join(Gate, VehicleLog.gate_id == Gate.id)
+            .order_by(desc(VehicleLog.entry_time)).limit(limit)
+        )).all()
+        for log, vehicle, gate in vehicle_rows:
+            events.append((log.entry_time, {
+                "type": "vehicle", "name": vehicle.plate_number, "identifier": vehicle.driver_name or "Unknown Driver",
+                "role": "Vehicle", "status": "allowed", "direction": "in", "gate": gate,
+                "details": f"{log.detected_passengers} Passenger(s)", "image": None,
+            }))
+
+        visitor_rows = (await session.exec(
+            select(Visitor, Gate).join(Gate, isouter=True).order_by(desc(Visitor.time_in)).limit(limit)
+        )).all()
+        for visitor, gate in visitor_rows:
+            events.append((visitor.time_in, {
+                "type": "visitor", "name": f"{visitor.first_name} {visitor.last_name}", "identifier": visitor.id_number,
+                "role": (visitor.visitor_type or "visitor").title(), "status": "allowed", "direction": "in", "gate": gate,
+                "details": visitor.visit_details, "image": None,
+            }))
+
+        self._buffers = {}
+        events.sort(key=lambda e: e[0])
+        for when, event in events:
+            gate = event.pop("gate")
+            event.update({
+                "event_id": uuid.uuid4().hex,
+                "gate_id": gate_key(gate.id) if gate else None,
+                "gate": gate.name if gate else "Unknown",
+                "time": when.isoformat(),
+            })
+            self._deliver(event)
+        print(f"Gate feed seeded with {len(events)} events across {self.stats()['gates']} gates")
+
+    # --- Cross-worker relay ---
+
+    def _on_remote(self, payload: dict):
+        if payload.get("event"):
+            self._deliver(payload["event"])
+
+    def start_sync(self):
+        if self._listener is None:
+            self._listener = asyncio.get_running_loop().create_task(
+                redis_client.listen(GATE_FEED_CHANNEL, self._worker_id, self._on_remote)
+            )
+
+    async def stop_sync(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._listener = None
+
+
+gate_feed = GateFeed()
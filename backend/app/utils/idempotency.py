@@ -0,0 +1,308 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+from starlette.responses import JSONResponse
+from starlette.routing import Match
+from app.utils import redis_client
+
+# How long a retry with the same Idempotency-Key gets the stored response back
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "900"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "20000"))
+# Responses larger than this are passed through but not stored
+IDEMPOTENCY_MAX_BODY = 256 * 1024
+# How long a retry waits for the first attempt when that is still running on another worker
+IDEMPOTENCY_WAIT_SECONDS = 15
+IDEMPOTENCY_KEY = "smartcampus:idempotency:"
+
+HEADER = b"idempotency-key"
+MAX_KEY_LENGTH = 255
+# Not stored, so the retry re-executes: server failures and "try again later" answers
+_UNCACHED_STATUS = {409, 429}
+_ROUTE_CACHE_SIZE = 10000
+
+
+def idempotent(func):
+    """Mark a POST route as honouring the Idempotency-Key header (place below the route decorator)."""
+    func.idempotent = True
+    return func
+
+
+class IdempotencyStore:
+    """
+    Stored responses by (caller, path, Idempotency-Key): an in-memory LRU with
+    expiry, mirrored to Redis when REDIS_URL is set so a retry that lands on the
+    other worker is answered too. A short Redis lock marks a key as in flight, so
+    two workers never run the same request concurrently.
+    """
+
+    def __init__(self, ttl: int = IDEMPOTENCY_TTL_SECONDS, max_entries: int = IDEMPOTENCY_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (expires_at monotonic, record); insertion order is expiry order
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.stored = 0
+        self.replayed = 0
+        self.mismatched = 0
+        self.in_progress = 0
+
+    def _prune(self):
+        now = time.monotonic()
+        while self._entries:
+            expires_at, _ = next(iter(self._entries.values()))
+            if expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry:
+            if entry[0] > time.monotonic():
+                return entry[1]
+            del self._entries[key]
+
+        redis = await redis_client.get_redis()
+        if redis is None:
+            return None
+        try:
+            raw = await redis.get(IDEMPOTENCY_KEY + key)
+        except Exception as e:
+            print(f"Idempotency Redis lookup failed: {e}")
+            return None
+        if not raw:
+            return None
+        record = json.loads(raw)
+        remaining = record["expires_at"] - time.time()
+        if remaining <= 0:
+            return None
+        self._entries[key] = (time.monotonic() + remaining, record)
+        return record
+
+    async def put(self, key: str, record: dict):
+        self._entries[key] = (time.monotonic() + self.ttl, record)
+        self._entries.move_to_end(key)
+        self._prune()
+        self.stored += 1
+        redis = await redis_client.get_redis()
+        if redis is None:
+            return
+        try:
+            await redis.set(IDEMPOTENCY_KEY + key, json.dumps({**record, "expires_at": time.time() + self.ttl}), ex=self.ttl)
+        except Exception as e:
+            print(f"Idempotency Redis store failed: {e}")
+
+    async def claim(self, key: str, token: str) -> bool:
+        """Take the cross-worker in-flight lock for key (always granted without Redis)."""
+        redis = await redis_client.get_redis()
+        if redis is None:
+            return True
+        try:
+            return bool(await redis.set(IDEMPOTENCY_KEY + key + ":lock", token, nx=True, ex=IDEMPOTENCY_WAIT_SECONDS * 2))
+        except Exception as e:
+            print(f"Idempotency Redis lock failed: {e}")
+            return True
+
+    async def release(self, key: str, token: str):
+        redis = await redis_client.get_redis()
+        if redis is None:
+            return
+        try:
+            lock = IDEMPOTENCY_KEY + key + ":lock"
+            if await redis.get(lock) == token:
+                await redis.delete(lock)
+        except Exception as e:
+            print(f"Idempotency Redis unlock failed: {e}")
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._pending
+
+    def begin(self, key: str):
+        self._pending[key] = asyncio.get_running_loop().create_future()
+
+    def finish(self, key: str):
+        self._pending.pop(key).set_result(None)
+
+    async def _locked(self, key: str) -> bool:
+        redis = await redis_client.get_redis()
+        if redis is None:
+            return False
+        try:
+            return bool(await redis.exists(IDEMPOTENCY_KEY + key + ":lock"))
+        except Exception:
+            return False
+
+    async def wait_for(self, key: str) -> Optional[dict]:
+        """
+        The stored response of a request with this key that is still running here
+        or on another worker, once it is stored. None when that request ended
+        without a storable response (e.g. a 500) or did not finish in time.
+        """
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            if key in self._pending:
+                await asyncio.shield(self._pending[key])
+                return await self.get(key)
+            record = await self.get(key)
+            if record is not None or not await self._locked(key):
+                return record
+            await asyncio.sleep(0.1)
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        self._prune()
+        return {
+            "ttl_seconds": self.ttl,
+            "entries": len(self._entries),
+            "in_flight": len(self._pending),
+            "stored": self.stored,
+            "replayed": self.replayed,
+            "mismatched": self.mismatched,
+            "in_progress": self.in_progress,
+        }
+
+
+idempotency_store = IdempotencyStore()
+
+
+def _header(scope, name: bytes) -> Optional[bytes]:
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value
+    return None
+
+
+class IdempotencyMiddleware:
+    """
+    Answers a retried POST to an @idempotent route from the store instead of
+    running the handler again. The first request with a given Idempotency-Key
+    runs normally and its status, headers and body are stored; a repeat with the
+    same key and the same request gets that response back (with an
+    Idempotent-Replayed header), a repeat with a different body is refused with
+    422, and one arriving while the first is still running waits for it.
+    Requests without the header are untouched.
+    """
+
+    def __init__(self, app, store: IdempotencyStore = idempotency_store):
+        self.app = app
+        self.store = store
+        self._routes: Dict[str, bool] = {}
+
+    def _marked(self, scope) -> bool:
+        path = scope["path"]
+        marked = self._routes.get(path)
+        if marked is None:
+            marked = False
+            for route in scope["app"].router.routes:
+                match, _ = route.matches(scope)
+                if match == Match.FULL:
+                    marked = getattr(getattr(route, "endpoint", None), "idempotent", False)
+                    break
+            if len(self._routes) >= _ROUTE_CACHE_SIZE:
+                self._routes.clear()
+            self._routes[path] = marked
+        return marked
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+        key = _header(scope, HEADER)
+        if key is None or not self._marked(scope):
+            await self.app(scope, receive, send)
+            return
+        if not key.strip() or len(key) > MAX_KEY_LENGTH:
+            await JSONResponse({"detail": "Invalid Idempotency-Key header"}, status_code=400)(scope, receive, send)
+            return
+
+        # The whole body is needed up front to fingerprint the request
+        chunks: List[bytes] = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body = b"".join(chunks)
+        fingerprint = hashlib.sha256(
+            b"\0".join((scope["method"].encode(), scope["path"].encode(), scope.get("query_string", b""), body))
+        ).hexdigest()
+        # Keys are only unique per client, so the caller's credentials are part of the store key
+        caller = _header(scope, b"authorization") or b""
+        store_key = hashlib.sha256(b"\0".join((caller, scope["path"].encode(), key.strip()))).hexdigest()
+
+        record = await self.store.get(store_key)
+        while record is None and self.store.in_flight(store_key):
+            # A retry that arrived while the first attempt is still running on this worker
+            record = await self.store.wait_for(store_key)
+        if record is not None:
+            await self._replay(record, fingerprint, scope, receive, send)
+            return
+
+        token = uuid.uuid4().hex
+        if not await self.store.claim(store_key, token):
+            record = await self.store.wait_for(store_key)
+            if record is not None:
+                await self._replay(record, fingerprint, scope, receive, send)
+                return
+            if not await self.store.claim(store_key, token):
+                self.store.in_progress += 1
+                await JSONResponse(
+                    {"detail": "A request with this Idempotency-Key is still being processed"},
+                    status_code=409, headers={"Retry-After": "1"},
+                )(scope, receive, send)
+                return
+
+        self.store.begin(store_key)
+        response: Dict[str, Any] = {"status": None, "headers": [], "body": [], "size": 0}
+        delivered = False
+
+        async def replay_receive():
+            nonlocal delivered
+            if not delivered:
+                delivered = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [[k.decode("latin-1"), v.decode("latin-1")] for k, v in message.get("headers", [])]
+            elif message["type"] == "http.response.body" and response["size"] <= IDEMPOTENCY_MAX_BODY:
+                chunk = message.get("body", b"")
+                response["size"] += len(chunk)
+                response["body"].append(chunk)
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+            status = response["status"]
+            if status is not None and status < 500 and status not in _UNCACHED_STATUS and response["size"] <= IDEMPOTENCY_MAX_BODY:
+                await self.store.put(store_key, {
+                    "fingerprint": fingerprint,
+                    "status": status,
+                    "headers": response["headers"],
+                    "body": base64.b64encode(b"".join(response["body"])).decode(),
+                })
+        finally:
+            self.store.finish(store_key)
+            await self.store.release(store_key, token)
+
+    async def _replay(self, record: dict, fingerprint: str, scope, receive, send):
+        if record["fingerprint"] != fingerprint:
+            self.store.mismatched += 1
+            await JSONResponse(
+                {"detail": "Idempotency-Key was already used for a different request"}, status_code=422
+            )(scope, receive, send)
+            return
+        self.store.replayed += 1
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in record["headers"]]
+        headers.append((b"idempotent-replayed", b"true"))
+        await send({"type": "http.response.start", "status": record["status"], "headers": headers})
+        await send({"type": "http.response.body", "body": base64.b64decode(record["body"])})
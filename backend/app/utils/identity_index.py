@@ -0,0 +1,233 @@
+import asyncio
+import time
+from typing import Optional, Tuple, Dict, Any
+from uuid import UUID
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.models import User, Vehicle, Visitor, Event
+from app.utils.plate_index import plate_index
+
+# Loads a warm() retries when writes keep landing mid-read before it gives up (lookups use SQL until the next one)
+IDENTITY_INDEX_WARM_ATTEMPTS = 3
+
+
+def normalize_code(code: Any) -> str:
+    """Normalize a scanned code the same way for indexing and lookup (trimmed, upper-case)."""
+    return str(code or "").strip().upper()
+
+
+def _normalize_uuid(code: str) -> Optional[str]:
+    try:
+        return str(UUID(str(code).strip())).upper()
+    except Exception:
+        return None
+
+
+class IdentityIndex:
+    """
+    In-process map of scan codes -> (entity_type, id) for the gate.
+
+    Lets scan_entry classify a code (admission number, plate, visitor ID number,
+    visitor UUID or event token) with dictionary lookups instead of probing the
+    users, vehicles and visitors tables one after the other.
+    A miss never means "does not exist" - callers fall back to SQL.
+    """
+
+    def __init__(self):
+        self._users: Dict[str, UUID] = {}
+        self._vehicles: Dict[str, UUID] = {}
+        self._visitors: Dict[str, UUID] = {}
+        self._events: Dict[str, UUID] = {}
+        self._ready = False
+        self._generation = 0
+        self._rebuild_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.last_build_ms = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    # --- Build / invalidation ---
+
+    async def warm(self, session: AsyncSession):
+        """(Re)load the whole index from the database using a few narrow column queries."""
+        async with self._lock:
+            for _ in range(IDENTITY_INDEX_WARM_ATTEMPTS):
+                generation = self._generation
+                started = time.perf_counter()
+
+                users = {}
+                for user_id, adm in (await session.exec(select(User.id, User.admission_number))).all():
+                    if adm:
+                        users[normalize_code(adm)] = user_id
+
+                vehicles = {}
+                for vehicle_id, plate in (await session.exec(select(Vehicle.id, Vehicle.plate_number))).all():
+                    if plate:
+                        vehicles[normalize_code(plate)] = vehicle_id
+
+                # Oldest first so the latest visit wins for a reused ID number
+                visitors = {}
+                visitor_rows = (await session.exec(
+                    select(Visitor.id, Visitor.id_number).order_by(Visitor.time_in)
+                )).all()
+                for visitor_id, id_number in visitor_rows:
+                    if id_number:
+                        visitors[normalize_code(id_number)] = visitor_id
+                    visitors[str(visitor_id).upper()] = visitor_id
+
+                events = {}
+                for event_id, token in (await session.exec(select(Event.id, Event.qr_code_token))).all():
+                    if token:
+                        events[normalize_code(token)] = event_id
+
+                if generation != self._generation:
+                    # A write landed while we were reading; read again so it is not lost
+                    continue
+
+                self._users, self._vehicles, self._visitors, self._events = users, vehicles, visitors, events
+                plate_index.rebuild(vehicles.items())
+                self._ready = True
+                self.rebuilds += 1
+                self.last_build_ms = round((time.perf_counter() - started) * 1000, 2)
+                print(f"Identity index warmed: {len(users)} users, {len(vehicles)} vehicles, "
+                      f"{len(visitors)} visitor keys, {len(events)} events in {self.last_build_ms}ms")
+                return
+
+            # Writes keep streaming in (e.g. a bulk upload); the invalidate() it ends with warms us again
+            self._ready = False
+            print(f"Identity index not warmed: writes kept landing during {IDENTITY_INDEX_WARM_ATTEMPTS} loads, using SQL lookups")
+
+    async def _rebuild(self):
+        from app.database import engine
+        try:
+            async with AsyncSession(engine) as session:
+                await self.warm(session)
+        except Exception as e:
+            print(f"Identity index rebuild failed: {e}")
+
+    def invalidate(self):
+        """
+        Drop the index after bulk writes and rebuild it in the background.
+        Lookups miss (and fall back to SQL) until the rebuild finishes.
+        """
+        self._generation += 1
+        self._ready = False
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._rebuild_task is None or self._rebuild_task.done():
+            self._rebuild_task = loop.create_task(self._rebuild())
+
+    def _touch(self):
+        # Point writes while a rebuild is reading must force it to re-read
+        if self._lock.locked():
+            self._generation += 1
+
+    # --- Point updates from the write endpoints ---
+
+    def remember_user(self, user: User):
+        self._touch()
+        if user and user.admission_number:
+            self._users[normalize_code(user.admission_number)] = user.id
+
+    def forget_user(self, admission_number: Optional[str]):
+        self._touch()
+        if admission_number:
+            self._users.pop(normalize_code(admission_number), None)
+
+    def remember_vehicle(self, vehicle: Vehicle):
+        self._touch()
+        if vehicle and vehicle.plate_number:
+            self._vehicles[normalize_code(vehicle.plate_number)] = vehicle.id
+            plate_index.add(vehicle.plate_number, vehicle.id)
+
+    def forget_vehicle(self, plate_number: Optional[str]):
+        self._touch()
+        if plate_number:
+            self._vehicles.pop(normalize_code(plate_number), None)
+            plate_index.remove(plate_number)
+
+    def remember_visitor(self, visitor: Visitor):
+        self._touch()
+        if not visitor:
+            return
+        if visitor.id_number:
+            self._visitors[normalize_code(visitor.id_number)] = visitor.id
+        self._visitors[str(visitor.id).upper()] = visitor.id
+
+    def remember_event(self, event: Event):
+        self._touch()
+        if event and event.qr_code_token:
+            self._events[normalize_code(event.qr_code_token)] = event.id
+
+    # --- Lookups ---
+
+    def _count(self, found) -> Any:
+        if found is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return found
+
+    def classify(self, code: str) -> Optional[Tuple[str, UUID]]:
+        """
+        Classify an un-prefixed scan code using the same priority as scan_entry's
+        SQL probing: user, then vehicle, then visitor ID number / visitor UUID.
+        """
+        if not self._ready:
+            return self._count(None)
+        key = normalize_code(code)
+        if key in self._users:
+            return self._count(("user", self._users[key]))
+        if key in self._vehicles:
+            return self._count(("vehicle", self._vehicles[key]))
+        if key in self._visitors:
+            return self._count(("visitor", self._visitors[key]))
+        uuid_key = _normalize_uuid(code)
+        if uuid_key and uuid_key in self._visitors:
+            return self._count(("visitor", self._visitors[uuid_key]))
+        return self._count(None)
+
+    def resolve(self, entity_type: str, code: str) -> Optional[UUID]:
+        """Look up a code whose entity type is already known (prefixed codes, event tokens)."""
+        if not self._ready:
+            return self._count(None)
+        key = normalize_code(code)
+        if entity_type == "user":
+            return self._count(self._users.get(key))
+        if entity_type == "vehicle":
+            return self._count(self._vehicles.get(key))
+        if entity_type == "visitor":
+            found = self._visitors.get(key)
+            if found is None:
+                uuid_key = _normalize_uuid(code)
+                found = self._visitors.get(uuid_key) if uuid_key else None
+            return self._count(found)
+        if entity_type == "event":
+            return self._count(self._events.get(key))
+        return self._count(None)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "ready": self._ready,
+            "users": len(self._users),
+            "vehicles": len(self._vehicles),
+            "visitor_keys": len(self._visitors),
+            "events": len(self._events),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else None,
+            "rebuilds": self.rebuilds,
+            "last_build_ms": self.last_build_ms,
+            "plate_index": plate_index.stats(),
+        }
+
+
+identity_index = IdentityIndex()
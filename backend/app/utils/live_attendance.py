@@ -0,0 +1,302 @@
+import asyncio
+import json
+import os
+import uuid
+from typing import Optional, Dict, List, Set, Any, Iterable
+from uuid import UUID
+
+from sqlalchemy import event, func, and_
+from sqlalchemy.orm import Session, object_session
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.database import engine
+from app.models import AttendanceRecord, User, UserLocationLog
+from app.utils import redis_client
+from app.utils.media_store import thumbnail_url
+
+LIVE_ATTENDANCE_CHANNEL = "smartcampus:live-attendance"
+# Rows a slow lecturer view may fall behind by before its backlog is replaced by a fresh snapshot
+LIVE_ATTENDANCE_SUBSCRIBER_QUEUE = 500
+
+
+# --- Rows ---
+
+async def load_rows(session: AsyncSession, session_id: UUID, record_ids: Optional[Iterable[UUID]] = None) -> List[Dict[str, Any]]:
+    """
+    Lecturer-view rows for a class session's attendance (or just record_ids), newest
+    first. Students whose IP or connection is missing from the record get it from
+    their latest UserLocationLog, fetched for all of them in one query.
+    """
+    query = (
+        select(AttendanceRecord, User)
+        .join(User, AttendanceRecord.student_id == User.id)
+        .where(AttendanceRecord.session_id == session_id)
+        .order_by(AttendanceRecord.scan_time.desc())
+    )
+    if record_ids is not None:
+        query = query.where(AttendanceRecord.id.in_(list(record_ids)))
+    rows = []
+    for record, user in (await session.exec(query)).all():
+        meta = {}
+        if record.metadata_info:
+            try: meta = json.loads(record.metadata_info)
+            except: pass
+        connection = meta.get('connection')
+        conn = record.connection_type or connection.get('type', 'unknown') if isinstance(connection, dict) else 'unknown'
+        evidence_url = record.live_image or meta.get('evidence_url')
+        rows.append({
+            "record_id": str(record.id),
+            "student_id": user.id,
+            "name": user.full_name,
+            "admission_number": user.admission_number,
+            "time": record.scan_time.isoformat(),
+            "status": record.status,
+            "connection": conn,
+            "ip": meta.get('ip_address', 'unknown'),
+            "location": meta.get('geolocation', {}),
+            "camera_info": {
+                "make": meta.get('camera_make'),
+                "model": meta.get('camera_model'),
+                "date": meta.get('photo_date'),
+                "error": meta.get('camera_error')
+            },
+            "evidence_url": evidence_url,
+            "evidence_thumb_url": thumbnail_url(evidence_url, 128),
+            "device": {
+                "user_agent": meta.get('userAgent'),
+                "screen": meta.get('screen')
+            },
+            "ai_flag": None # Placeholder
+        })
+
+    # Fallback to each student's most recent UserLocationLog, in one query for all of them
+    missing = {row["student_id"] for row in rows if row["ip"] == 'unknown' or row["connection"] == 'unknown'}
+    if missing:
+        latest = (
+            select(UserLocationLog.user_id, func.max(UserLocationLog.timestamp).label("ts"))
+            .where(UserLocationLog.user_id.in_(missing))
+            .group_by(UserLocationLog.user_id)
+            .subquery()
+        )
+        logs = {
+            log.user_id: log
+            for log in (await session.exec(
+                select(UserLocationLog).join(latest, and_(
+                    UserLocationLog.user_id == latest.c.user_id, UserLocationLog.timestamp == latest.c.ts
+                ))
+            )).all()
+        }
+        for row in rows:
+            log = logs.get(row["student_id"])
+            if log:
+                if row["ip"] == 'unknown': row["ip"] = log.ip_address or 'unknown'
+                if row["connection"] == 'unknown': row["connection"] = log.network_type or 'unknown'
+    for row in rows:
+        row["student_id"] = str(row["student_id"])
+    return rows
+
+
+class IPHistogram:
+    """
+    Per-session IP counts with the dominant IP kept up to date, so the physical
+    class analysis costs O(1) per new attendance row. Counts only ever grow, so
+    the leader can only be overtaken by the IP that was just counted.
+    """
+
+    def __init__(self):
+        self.counts: Dict[str, int] = {}
+        self.total = 0
+        self.dominant: Optional[str] = None
+
+    def add(self, ip: str):
+        count = self.counts.get(ip, 0) + 1
+        self.counts[ip] = count
+        self.total += 1
+        if self.dominant is None or count > self.counts[self.dominant]:
+            self.dominant = ip
+
+    def analysis(self) -> Dict[str, Any]:
+        """AI IP Clustering: a majority on one IP means the class sits in one room."""
+        if self.total <= 2:
+            return {"mode": "Unknown", "dominant_ip": None}
+        if self.counts[self.dominant] / self.total > 0.5:
+            # Physical Class detected (Majority on same IP)
+            return {"mode": "Physical Class", "dominant_ip": self.dominant}
+        # High variance
+        return {"mode": "Online / Distributed", "dominant_ip": None}
+
+
+def flag_outliers(row: Dict[str, Any], analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """Mark a row whose IP is off the dominant one in a physical class (a copy; the row is kept raw)."""
+    dominant_ip = analysis.get("dominant_ip")
+    if not dominant_ip or row['ip'] == dominant_ip or row['ip'] == 'unknown':
+        return row
+    row = dict(row, ai_flag="Suspicious IP Limit (VPN/Data)")
+    # Override status for display if it was clean
+    if row['status'] == 'present':
+        row['status'] = "flagged_ip_mismatch"
+    return row
+
+
+# --- Live hub ---
+
+class _SessionView:
+    def __init__(self):
+        self.rows: Dict[str, Dict[str, Any]] = {}
+        self.ips = IPHistogram()
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.ready = asyncio.Event()
+
+    def add(self, row: Dict[str, Any]) -> bool:
+        if row["record_id"] in self.rows:
+            return False
+        self.rows[row["record_id"]] = row
+        self.ips.add(row["ip"])
+        return True
+
+
+class LiveAttendance:
+    """
+    Lecturer views of class sessions, kept up to date without re-reading the roster.
+
+    The first viewer of a session on this worker loads its rows once; after that
+    every AttendanceRecord commit (on any worker, relayed over Redis) loads just
+    the new rows and pushes them, with the updated IP analysis, to the session's
+    viewers. A session's state is dropped when its last viewer leaves.
+    """
+
+    def __init__(self):
+        self._views: Dict[str, _SessionView] = {}
+        self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._listener: Optional[asyncio.Task] = None
+        self.pushed = 0
+
+    async def subscribe(self, session_id: UUID) -> asyncio.Queue:
+        """Register a viewer; its queue starts with a snapshot, then gets one item per new row."""
+        key = str(session_id)
+        queue = asyncio.Queue(maxsize=LIVE_ATTENDANCE_SUBSCRIBER_QUEUE)
+        view = self._views.get(key)
+        if view is None:
+            view = self._views[key] = _SessionView()
+            # Registered before loading, so rows committed meanwhile are not missed (add() dedupes)
+            try:
+                async with AsyncSession(engine) as session:
+                    for row in reversed(await load_rows(session, session_id)):
+                        view.add(row)
+            except Exception:
+                del self._views[key]
+                raise
+            finally:
+                view.ready.set()
+        await view.ready.wait()
+        queue.put_nowait(self._snapshot(view))
+        view.subscribers.add(queue)
+        return queue
+
+    @staticmethod
+    def _snapshot(view: _SessionView) -> Dict[str, Any]:
+        return {
+            "type": "snapshot",
+            "attendees": list(reversed(list(view.rows.values()))),
+            "analysis": view.ips.analysis(),
+        }
+
+    def unsubscribe(self, session_id: UUID, queue: asyncio.Queue):
+        key = str(session_id)
+        view = self._views.get(key)
+        if view:
+            view.subscribers.discard(queue)
+            if not view.subscribers:
+                del self._views[key]
+
+    def notify(self, inserted: Dict[str, List[str]]):
+        """Called after AttendanceRecord rows commit: {session_id: [record_id, ...]}."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._fetch(loop, inserted)
+        loop.create_task(redis_client.publish(LIVE_ATTENDANCE_CHANNEL, self._worker_id, {"inserted": inserted}))
+
+    def _fetch(self, loop, inserted: Dict[str, List[str]]):
+        for key, record_ids in inserted.items():
+            if key in self._views:
+                loop.create_task(self._push(key, record_ids))
+
+    async def _push(self, key: str, record_ids: List[str]):
+        view = self._views.get(key)
+        if view is None:
+            return
+        await view.ready.wait()
+        try:
+            async with AsyncSession(engine) as session:
+                rows = await load_rows(session, UUID(key), [UUID(r) for r in record_ids])
+        except Exception as e:
+            print(f"Live attendance push for session {key} failed: {e}")
+            return
+        for row in reversed(rows):
+            if not view.add(row):
+                continue
+            message = {"type": "attendance", "attendee": row, "analysis": view.ips.analysis()}
+            for queue in view.subscribers:
+                if queue.full():
+                    # Too far behind to patch up row by row; start it over from the current roster
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(self._snapshot(view))
+                    continue
+                queue.put_nowait(message)
+            self.pushed += 1
+
+    # --- Cross-worker sync ---
+
+    def _on_remote(self, payload: dict):
+        self._fetch(asyncio.get_running_loop(), payload.get("inserted") or {})
+
+    def start_sync(self):
+        if self._listener is None:
+            self._listener = asyncio.get_running_loop().create_task(
+                redis_client.listen(LIVE_ATTENDANCE_CHANNEL, self._worker_id, self._on_remote)
+            )
+
+    async def stop_sync(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._listener = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._views),
+            "viewers": sum(len(v.subscribers) for v in self._views.values()),
+            "rows": sum(len(v.rows) for v in self._views.values()),
+            "pushed": self.pushed,
+        }
+
+
+live_attendance = LiveAttendance()
+
+
+# --- ORM hooks: note attendance inserts on flush, push them once they commit ---
+
+@event.listens_for(AttendanceRecord, "after_insert")
+def _stage(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("attendance_inserted", {}).setdefault(str(target.session_id), []).append(str(target.id))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_attendance_inserts(session):
+    inserted = session.info.pop("attendance_inserted", None)
+    if inserted:
+        live_attendance.notify(inserted)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_attendance_inserts(session, previous_transaction):
+    session.info.pop("attendance_inserted", None)
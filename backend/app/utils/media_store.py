@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import io
+import os
+import time
+import uuid
+from typing import Optional, Dict, Any, Iterable, Set
+
+from starlette.staticfiles import StaticFiles
+
+MEDIA_DIR = "static/media"
+MEDIA_URL = "/static/media"
+# Stored images are recompressed to WebP no larger than this on the long edge
+MEDIA_MAX_EDGE = int(os.getenv("MEDIA_MAX_EDGE", "1600"))
+MEDIA_WEBP_QUALITY = int(os.getenv("MEDIA_WEBP_QUALITY", "80"))
+THUMB_SIZES = (128, 512)
+# Decoded size beyond which an upload is treated as a decompression bomb
+MAX_IMAGE_PIXELS = 40_000_000
+
+# Days a file is kept after it was last uploaded (0 keeps it forever). Profile photos are
+# instead kept while a user references them; kinds not listed here are never reaped.
+MEDIA_RETENTION_DAYS = {
+    "evidence": int(os.getenv("MEDIA_EVIDENCE_RETENTION_DAYS", "180")),
+    "vehicle_logs": int(os.getenv("MEDIA_VEHICLE_LOG_RETENTION_DAYS", "30")),
+    "verifications": int(os.getenv("MEDIA_VERIFICATION_RETENTION_DAYS", "90")),
+}
+# How long an unreferenced profile photo survives (it may be uploaded just before the user is saved)
+MEDIA_ORPHAN_GRACE_HOURS = int(os.getenv("MEDIA_ORPHAN_GRACE_HOURS", "72"))
+# Upload directories from before the media store, swept with the same rules
+LEGACY_DIRS = {
+    "evidence": "static/evidence",
+    "vehicle_logs": "static/vehicle_logs",
+    "verifications": "static/verifications",
+    "profiles": "static/profiles",
+}
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class MediaInvalid(Exception):
+    """The upload is not an image that can be stored."""
+
+
+# --- Worker side (runs in the image pool processes) ---
+
+def _paths(kind: str, digest: str):
+    base = f"{kind}/{digest[:2]}/{digest}"
+    return os.path.join(MEDIA_DIR, base), f"{MEDIA_URL}/{base}"
+
+
+def _write(path: str, image=None, data: Optional[bytes] = None):
+    """Write atomically, so a concurrent identical upload never sees half a file."""
+    partial = f"{path}.{uuid.uuid4().hex}.part"
+    with open(partial, "wb") as f:
+        if image is not None:
+            image.save(f, "WEBP", quality=MEDIA_WEBP_QUALITY, method=4)
+        else:
+            f.write(data)
+    os.replace(partial, path)
+
+
+def dhash(image) -> int:
+    """64-bit difference hash of a PIL image: brightness gradients on a 9x8 grayscale thumbnail."""
+    from PIL import Image
+    small = image.convert("L").resize((9, 8), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] < pixels[row * 9 + col + 1])
+    return value
+
+
+def to_hex(value: int) -> str:
+    return f"{value:016x}"
+
+
+def _dhash_file(path: str) -> str:
+    from PIL import Image
+    with Image.open(path) as image:
+        return to_hex(dhash(image))
+
+
+def store_image(data: bytes, kind: str, fallback_ext: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Store an uploaded image under its SHA-256, recompressed to WebP with a thumbnail
+    per THUMB_SIZES. An identical upload is stored once: later copies only refresh the
+    file's retention clock. The result carries the perceptual hash (dhash, hex) of the
+    smallest thumbnail, so a copy hashes the same as the first upload. Images that cannot be decoded raise MediaInvalid, or are
+    kept as uploaded (without thumbnails) when fallback_ext is given.
+    """
+    from PIL import Image, ImageOps
+    digest = hashlib.sha256(data).hexdigest()
+    base_path, base_url = _paths(kind, digest)
+    os.makedirs(os.path.dirname(base_path), exist_ok=True)
+    result: Dict[str, Any] = {"sha256": digest, "url": f"{base_url}.webp", "deduped": False, "error": None,
+                              "thumbs": {size: f"{base_url}_{size}.webp" for size in THUMB_SIZES}}
+
+    # The full-size file is written last, so its presence means the thumbnails exist too
+    if os.path.exists(f"{base_path}.webp"):
+        os.utime(f"{base_path}.webp")
+        result.update(deduped=True, bytes=os.path.getsize(f"{base_path}.webp"),
+                      dhash=_dhash_file(f"{base_path}_{THUMB_SIZES[0]}.webp"))
+        return result
+
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            width, height = source.size
+            if width * height > MAX_IMAGE_PIXELS:
+                raise ValueError(f"image too large ({width}x{height})")
+            # Apply the camera orientation before EXIF is dropped by the re-encode
+            image = ImageOps.exif_transpose(source)
+            has_alpha = image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+            image = image.convert("RGBA" if has_alpha else "RGB")
+    except Exception as e:
+        if fallback_ext is None:
+            raise MediaInvalid(str(e))
+        ext = "".join(c for c in fallback_ext.lower() if c.isalnum())[:8] or "bin"
+        path = f"{base_path}.{ext}"
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            _write(path, data=data)
+        result.update(url=f"{base_url}.{ext}", thumbs={}, error=str(e), bytes=len(data), dhash=None)
+        return result
+
+    image.thumbnail((MEDIA_MAX_EDGE, MEDIA_MAX_EDGE))
+    for size in THUMB_SIZES:
+        thumb = image.copy()
+        thumb.thumbnail((size, size))
+        _write(f"{base_path}_{size}.webp", thumb)
+    _write(f"{base_path}.webp", image)
+    result.update(width=image.width, height=image.height, bytes=os.path.getsize(f"{base_path}.webp"),
+                  dhash=_dhash_file(f"{base_path}_{THUMB_SIZES[0]}.webp"))
+    return result
+
+
+# --- Web-worker side ---
+
+def thumbnail_url(url: Optional[str], size: int) -> Optional[str]:
+    """Derived URL of a stored image's thumbnail; other URLs are returned unchanged."""
+    if url and size in THUMB_SIZES and url.startswith(f"{MEDIA_URL}/") and url.endswith(".webp"):
+        return f"{url[:-5]}_{size}.webp"
+    return url
+
+
+async def save_upload(upload, kind: str, fallback_ext: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Store an UploadFile through the image pool (see store_image). Raises EvidenceBusy,
+    EvidenceTooLarge or MediaInvalid.
+    """
+    from app.utils.evidence import evidence_pool
+    return await evidence_pool.submit_upload(upload, store_image, kind, fallback_ext)
+
+
+async def save_bytes(data: bytes, kind: str, fallback_ext: Optional[str] = None) -> Dict[str, Any]:
+    """save_upload for bytes already in memory (ZIP members, base64 captures)."""
+    from app.utils.evidence import evidence_pool
+    return await evidence_pool.submit_bytes(data, store_image, kind, fallback_ext)
+
+
+class MediaFiles(StaticFiles):
+    """StaticFiles for MEDIA_DIR: content-addressed files never change, so browsers may cache them for good."""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+
+# --- Retention ---
+
+def _files(directory: str) -> Iterable[str]:
+    for root, _, names in os.walk(directory):
+        for name in names:
+            yield os.path.join(root, name)
+
+
+def _remove(path: str) -> int:
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except OSError:
+        return 0
+
+
+def _derived(path: str) -> Iterable[str]:
+    """A stored file and its thumbnails."""
+    yield path
+    stem, ext = os.path.splitext(path)
+    if ext == ".webp":
+        for size in THUMB_SIZES:
+            yield f"{stem}_{size}.webp"
+
+
+def _is_thumb(path: str) -> bool:
+    return any(path.endswith(f"_{size}.webp") for size in THUMB_SIZES)
+
+
+def _sweep(directory: str, keep, now: float) -> Dict[str, int]:
+    """Delete the files in directory that keep(path, age_seconds) rejects, with their thumbnails."""
+    removed = freed = 0
+    if not os.path.isdir(directory):
+        return {"files": 0, "bytes": 0}
+    for path in list(_files(directory)):
+        if _is_thumb(path):
+            continue
+        try:
+            age = now - os.path.getmtime(path)
+        except OSError:
+            continue
+        # A .part file younger than an hour is still being written
+        if keep(path, age) or path.endswith(".part") and age < 3600:
+            continue
+        for victim in _derived(path):
+            size = _remove(victim)
+            if size:
+                removed += 1
+                freed += size
+    return {"files": removed, "bytes": freed}
+
+
+def reap_files(referenced_profiles: Set[str], now: Optional[float] = None) -> Dict[str, Dict[str, int]]:
+    """
+    Apply the retention rules to MEDIA_DIR and the legacy upload directories (blocking).
+    referenced_profiles holds the "static/..." paths of profile photos still in use.
+    """
+    now = now or time.time()
+    report = {}
+    for kind, days in MEDIA_RETENTION_DAYS.items():
+        if days <= 0:
+            continue
+        by_age = lambda path, age, limit=days * 86400: age < limit
+        for directory in (os.path.join(MEDIA_DIR, kind), LEGACY_DIRS.get(kind)):
+            if directory:
+                stats = _sweep(directory, by_age, now)
+                report[directory] = stats
+
+    grace = MEDIA_ORPHAN_GRACE_HOURS * 3600
+    referenced = lambda path, age: age < grace or path.replace(os.sep, "/") in referenced_profiles
+    for directory in (os.path.join(MEDIA_DIR, "profiles"), LEGACY_DIRS["profiles"]):
+        report[directory] = _sweep(directory, referenced, now)
+    return report
+
+
+async def reap(session) -> Dict[str, Dict[str, int]]:
+    """Delete expired evidence/log images and profile photos no user refers to any more."""
+    from sqlmodel import select
+    from app.models import User, UserFace
+    urls = (await session.exec(select(User.profile_image).where(User.profile_image.is_not(None)))).all()
+    urls += (await session.exec(select(UserFace.image_path))).all()
+    # Stored as "/static/...", "static/..." or a full URL on this host; compare by the path from "static/" on
+    referenced = {url[url.find("static/"):] for url in urls if url and "static/" in url}
+    report = await asyncio.to_thread(reap_files, referenced)
+    removed = sum(r["files"] for r in report.values())
+    freed = sum(r["bytes"] for r in report.values())
+    print(f"Media reaper removed {removed} files ({freed // 1024} KB)")
+    return report
@@ -0,0 +1,211 @@
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from itertools import combinations
+from typing import Optional, Dict, Any, List, NamedTuple, Set
+from uuid import UUID
+
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.utils import redis_client
+from app.utils.media_store import to_hex
+from app.utils.timezone import get_eat_time
+
+# Hamming distance (of 64 bits) up to which two evidence photos count as the same picture
+PHOTO_HASH_MAX_DISTANCE = int(os.getenv("PHOTO_HASH_MAX_DISTANCE", "6"))
+# How far back uploads are compared (about a term)
+PHOTO_HASH_WINDOW_DAYS = int(os.getenv("PHOTO_HASH_WINDOW_DAYS", "120"))
+# How often rows written by other workers are pulled in when Redis is not there to push them
+PHOTO_HASH_SYNC_SECONDS = int(os.getenv("PHOTO_HASH_SYNC_SECONDS", "30"))
+# CheatingFlag rows raised per upload (closest matches first)
+PHOTO_HASH_MAX_FLAGS = 5
+PHOTO_HASH_CHANNEL = "smartcampus:photo-hash"
+
+_BANDS = 4
+_BAND_BITS = 64 // _BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+# A row is re-read this long after its scan_time, in case it committed after a later one
+_SYNC_OVERLAP = timedelta(seconds=60)
+
+
+class PhotoEntry(NamedTuple):
+    hash: int
+    record_id: UUID
+    student_id: UUID
+    session_id: UUID
+
+
+class PhotoMatch(NamedTuple):
+    entry: PhotoEntry
+    distance: int
+
+    @property
+    def similarity(self) -> float:
+        return round(1 - self.distance / 64, 4)
+
+
+class PhotoHashIndex:
+    """
+    Perceptual hashes of the term's attendance evidence, for spotting reused photos.
+
+    Multi-index hashing: each 64-bit hash is split into four 16-bit bands, each
+    with its own dict. Two hashes within PHOTO_HASH_MAX_DISTANCE bits must agree
+    to within MAX // 4 bits on at least one band, so a lookup probes a handful of
+    buckets per band and only checks the few entries found there. The index is
+    built from AttendanceRecord.photo_hash when the day changes, picks up rows
+    other workers committed every PHOTO_HASH_SYNC_SECONDS, and new entries are
+    pushed to the other workers over Redis straight away.
+    """
+
+    def __init__(self, max_distance: int = PHOTO_HASH_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._band_radius = max_distance // _BANDS
+        # XOR masks that flip up to _band_radius bits of one band
+        self._masks = [0] + [
+            sum(1 << bit for bit in bits)
+            for flipped in range(1, self._band_radius + 1)
+            for bits in combinations(range(_BAND_BITS), flipped)
+        ]
+        self._bands: List[Dict[int, List[PhotoEntry]]] = [{} for _ in range(_BANDS)]
+        self._ids: Set[UUID] = set()
+        self._day = None
+        self._synced_at: Optional[float] = None
+        self._watermark: Optional[datetime] = None
+        self._lock = asyncio.Lock()
+        self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._listener: Optional[asyncio.Task] = None
+        self.lookups = 0
+        self.matches = 0
+
+    # --- Loading ---
+
+    async def ensure(self, session: AsyncSession):
+        today = get_eat_time().date()
+        if self._day == today and time.monotonic() - self._synced_at < PHOTO_HASH_SYNC_SECONDS:
+            return
+        async with self._lock:
+            if self._day == today and time.monotonic() - self._synced_at < PHOTO_HASH_SYNC_SECONDS:
+                return
+            if self._day != today:
+                # Daily rebuild, which also drops photos that left the window
+                self._bands = [{} for _ in range(_BANDS)]
+                self._ids = set()
+                self._watermark = get_eat_time() - timedelta(days=PHOTO_HASH_WINDOW_DAYS)
+            await self._load(session, self._watermark - _SYNC_OVERLAP)
+            self._day = today
+            self._synced_at = time.monotonic()
+
+    async def _load(self, session: AsyncSession, since: datetime):
+        from app.models import AttendanceRecord
+        rows = (await session.exec(
+            select(AttendanceRecord.id, AttendanceRecord.student_id, AttendanceRecord.session_id,
+                   AttendanceRecord.scan_time, AttendanceRecord.photo_hash)
+            .where(AttendanceRecord.photo_hash.is_not(None), AttendanceRecord.scan_time >= since)
+        )).all()
+        for row in rows:
+            self._insert(PhotoEntry(int(row.photo_hash, 16), row.id, row.student_id, row.session_id))
+            if row.scan_time and row.scan_time > self._watermark:
+                self._watermark = row.scan_time
+
+    def _insert(self, entry: PhotoEntry):
+        if entry.record_id in self._ids:
+            return
+        self._ids.add(entry.record_id)
+        for band in range(_BANDS):
+            key = (entry.hash >> (band * _BAND_BITS)) & _BAND_MASK
+            self._bands[band].setdefault(key, []).append(entry)
+
+    # --- Lookups ---
+
+    def match(self, value: int, student_id: UUID, session_id: UUID) -> List[PhotoMatch]:
+        """
+        Earlier evidence photos within max_distance of value, closest first. The
+        student's own earlier attempts in the same session are not matches.
+        """
+        self.lookups += 1
+        limit = self.max_distance
+        found: Dict[UUID, PhotoMatch] = {}
+        for band, buckets in enumerate(self._bands):
+            key = (value >> (band * _BAND_BITS)) & _BAND_MASK
+            for mask in self._masks:
+                for entry in buckets.get(key ^ mask, ()):
+                    # Distance first: almost every candidate is a stranger sharing one band
+                    distance = (value ^ entry.hash).bit_count()
+                    if distance <= limit and not (entry.student_id == student_id and entry.session_id == session_id):
+                        found[entry.record_id] = PhotoMatch(entry, distance)
+        if found:
+            self.matches += 1
+        return sorted(found.values(), key=lambda m: m.distance)
+
+    def hold(self, entry: PhotoEntry):
+        """
+        Index an evidence photo on this worker only, ahead of its commit, so a
+        simultaneous upload of the same photo is caught. Follow with add() once the
+        row is committed, or discard() if it is not.
+        """
+        self._insert(entry)
+
+    def discard(self, entry: PhotoEntry):
+        """Drop a held photo whose attendance row was never written."""
+        if entry.record_id not in self._ids:
+            return
+        self._ids.discard(entry.record_id)
+        for band in range(_BANDS):
+            key = (entry.hash >> (band * _BAND_BITS)) & _BAND_MASK
+            bucket = self._bands[band].get(key)
+            if bucket is None:
+                continue
+            bucket[:] = [e for e in bucket if e.record_id != entry.record_id]
+            if not bucket:
+                del self._bands[band][key]
+
+    def add(self, entry: PhotoEntry):
+        """Index a committed evidence photo here and on the other workers."""
+        self._insert(entry)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        loop.create_task(redis_client.publish(PHOTO_HASH_CHANNEL, self._worker_id, {
+            "hash": to_hex(entry.hash), "record_id": str(entry.record_id),
+            "student_id": str(entry.student_id), "session_id": str(entry.session_id),
+        }))
+
+    # --- Cross-worker sync ---
+
+    def _on_remote(self, payload: dict):
+        self._insert(PhotoEntry(
+            int(payload["hash"], 16), UUID(payload["record_id"]),
+            UUID(payload["student_id"]), UUID(payload["session_id"]),
+        ))
+
+    def start_sync(self):
+        if self._listener is None:
+            self._listener = asyncio.get_running_loop().create_task(
+                redis_client.listen(PHOTO_HASH_CHANNEL, self._worker_id, self._on_remote)
+            )
+
+    async def stop_sync(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._listener = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "photos": len(self._ids),
+            "max_distance": self.max_distance,
+            "buckets": [len(b) for b in self._bands],
+            "window_days": PHOTO_HASH_WINDOW_DAYS,
+            "lookups": self.lookups,
+            "matches": self.matches,
+        }
+
+
+photo_hash_index = PhotoHashIndex()
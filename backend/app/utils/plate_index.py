@@ -0,0 +1,232 @@
+import os
+import re
+from typing import Optional, Dict, Set, List, Iterable, Tuple, Any, NamedTuple
+from uuid import UUID
+
+# Largest edit distance (after folding OCR look-alikes) a fuzzy plate match may have
+PLATE_MAX_DISTANCE = int(os.getenv("PLATE_MAX_DISTANCE", "1"))
+
+# Characters OCR and hurried typing mix up on Kenyan plates, folded to one representative
+CONFUSABLE = str.maketrans({"O": "0", "Q": "0", "D": "0", "I": "1", "L": "1", "B": "8", "S": "5", "Z": "2", "G": "6"})
+# Substituting one look-alike for another is cheap when ranking candidates
+CONFUSABLE_COST = 0.25
+
+_NON_ALNUM = re.compile(r"[^A-Z0-9]")
+# Letter prefix followed by the number and any suffix letter ('KCD' + '202B')
+_PREFIX_SPLIT = re.compile(r"^([A-Z]+)([0-9].*)$")
+
+
+def canonical_plate(plate: Any) -> str:
+    """Upper-case plate with spaces, dashes and other separators removed ('kcd-202 b' -> 'KCD202B')."""
+    return _NON_ALNUM.sub("", str(plate or "").upper())
+
+
+def fold_plate(plate: Any) -> str:
+    """Canonical plate with look-alike characters folded together ('KCD 2O2B' and 'KC0 202B' fold equal)."""
+    return canonical_plate(plate).translate(CONFUSABLE)
+
+
+def display_plate(plate: Any) -> str:
+    """Canonical plate written the way plates are registered ('kcd202b' -> 'KCD 202B'); others are left unspaced."""
+    canonical = canonical_plate(plate)
+    match = _PREFIX_SPLIT.match(canonical)
+    return f"{match.group(1)} {match.group(2)}" if match else canonical
+
+
+def _deletions(key: str, distance: int) -> Set[str]:
+    """key plus every string reachable by deleting up to `distance` characters."""
+    variants = {key}
+    frontier = {key}
+    for _ in range(distance):
+        frontier = {word[:i] + word[i + 1:] for word in frontier for i in range(len(word))}
+        variants |= frontier
+    return variants
+
+
+def _pattern(a: str) -> Dict[str, int]:
+    """Per-character bitmasks of a for _edit_distance."""
+    peq: Dict[str, int] = {}
+    for i, char in enumerate(a):
+        peq[char] = peq.get(char, 0) | (1 << i)
+    return peq
+
+
+def _edit_distance(peq: Dict[str, int], length: int, b: str) -> int:
+    """
+    Levenshtein distance between the pattern (from _pattern, `length` chars) and b,
+    using Myers' bit-parallel algorithm: one pass over b with a handful of integer
+    operations per character, which is what keeps candidate checks cheap in Python.
+    """
+    if not length:
+        return len(b)
+    mask = (1 << length) - 1
+    high = 1 << (length - 1)
+    pv, mv, score = mask, 0, length
+    for char in b:
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = (mv | ~(xh | pv)) & mask
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv
+    return score
+
+
+def _weighted_distance(a: str, b: str) -> float:
+    """Levenshtein distance on canonical plates where look-alike substitutions cost CONFUSABLE_COST."""
+    folded_b = b.translate(CONFUSABLE)
+    previous = [float(j) for j in range(len(b) + 1)]
+    for i, (ca, fa) in enumerate(zip(a, a.translate(CONFUSABLE)), 1):
+        current = [float(i)]
+        for j, cb in enumerate(b, 1):
+            if ca == cb:
+                substitution = 0.0
+            elif fa == folded_b[j - 1]:
+                substitution = CONFUSABLE_COST
+            else:
+                substitution = 1.0
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + substitution))
+        previous = current
+    return previous[-1]
+
+
+class PlateMatch(NamedTuple):
+    vehicle_id: UUID
+    plate_number: str
+    # Edit distance between the folded plates (0 = differs only in spacing / look-alikes)
+    distance: int
+    # Confusion-weighted distance between the canonical plates, for ranking
+    score: float
+
+
+class PlateIndex:
+    """
+    In-memory fuzzy index of registered plates.
+
+    Plates are keyed by their folded form (separators removed, OCR look-alikes
+    such as 0/O, 1/I and 8/B merged), so a misread that only confuses those
+    characters or drops a space is an exact hit. Plates within
+    PLATE_MAX_DISTANCE edits of the folded form are found through a
+    deletion-neighbourhood index (every key is also stored under each string
+    reachable by deleting up to that many characters), which keeps a lookup to
+    a few dozen dictionary probes instead of a scan of all vehicles.
+
+    Fed by identity_index, which already sees every Vehicle write.
+    """
+
+    def __init__(self, max_distance: int = PLATE_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._plates: Dict[UUID, str] = {}
+        self._by_plate: Dict[str, UUID] = {}
+        self._by_fold: Dict[str, Set[UUID]] = {}
+        self._deletes: Dict[str, Set[str]] = {}
+        self.lookups = 0
+
+    # --- Maintenance ---
+
+    def rebuild(self, vehicles: Iterable[Tuple[str, UUID]]):
+        """Replace the index with (plate_number, vehicle_id) pairs."""
+        self._plates, self._by_plate, self._by_fold, self._deletes = {}, {}, {}, {}
+        for plate, vehicle_id in vehicles:
+            self.add(plate, vehicle_id)
+
+    def add(self, plate: str, vehicle_id: UUID):
+        canonical = canonical_plate(plate)
+        if not canonical:
+            return
+        previous = self._plates.get(vehicle_id)
+        if previous is not None and canonical_plate(previous) != canonical:
+            self.remove(previous)
+        self._plates[vehicle_id] = plate
+        self._by_plate[canonical] = vehicle_id
+        key = canonical.translate(CONFUSABLE)
+        if key not in self._by_fold:
+            self._by_fold[key] = set()
+            for variant in _deletions(key, self.max_distance):
+                self._deletes.setdefault(variant, set()).add(key)
+        self._by_fold[key].add(vehicle_id)
+
+    def remove(self, plate: str):
+        canonical = canonical_plate(plate)
+        vehicle_id = self._by_plate.pop(canonical, None)
+        if vehicle_id is None:
+            return
+        self._plates.pop(vehicle_id, None)
+        key = canonical.translate(CONFUSABLE)
+        ids = self._by_fold.get(key)
+        if ids is None:
+            return
+        ids.discard(vehicle_id)
+        if not ids:
+            del self._by_fold[key]
+            for variant in _deletions(key, self.max_distance):
+                keys = self._deletes.get(variant)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._deletes[variant]
+
+    # --- Lookups ---
+
+    def search(self, text: str, limit: int = 5, max_distance: Optional[int] = None) -> List[PlateMatch]:
+        """Registered plates close to text, best first."""
+        self.lookups += 1
+        canonical = canonical_plate(text)
+        if not canonical:
+            return []
+        key = canonical.translate(CONFUSABLE)
+        distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        # A couple of edits on a very short fragment would match almost anything
+        distance = min(distance, max(0, (len(key) - 3) // 2))
+
+        keys = set()
+        for variant in _deletions(key, distance):
+            keys |= self._deletes.get(variant, set())
+
+        peq = _pattern(key)
+        matches = []
+        for candidate in keys:
+            folded_distance = _edit_distance(peq, len(key), candidate)
+            if folded_distance <= distance:
+                matches.extend((folded_distance, vehicle_id) for vehicle_id in self._by_fold[candidate])
+        # Only the closest plates are worth the confusion-weighted ranking pass
+        matches.sort(key=lambda m: m[0])
+        cutoff = matches[limit - 1][0] if len(matches) >= limit else distance
+        ranked = [
+            PlateMatch(vehicle_id, self._plates[vehicle_id], folded_distance,
+                       round(_weighted_distance(canonical, canonical_plate(self._plates[vehicle_id])), 2))
+            for folded_distance, vehicle_id in matches if folded_distance <= cutoff
+        ]
+        ranked.sort(key=lambda m: (m.distance, m.score, m.plate_number))
+        return ranked[:limit]
+
+    def match(self, text: str) -> Optional[PlateMatch]:
+        """
+        The registered plate text was meant to be, when that is unambiguous: the
+        only plate that differs from it just in spacing or look-alike characters.
+        Anything further away could be a different vehicle and is left to the caller.
+        """
+        exact = self._by_plate.get(canonical_plate(text))
+        if exact is not None:
+            return PlateMatch(exact, self._plates[exact], 0, 0.0)
+        candidates = self.search(text, limit=2, max_distance=0)
+        return candidates[0] if len(candidates) == 1 else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "plates": len(self._plates),
+            "folded_keys": len(self._by_fold),
+            "deletion_keys": len(self._deletes),
+            "max_distance": self.max_distance,
+            "lookups": self.lookups,
+        }
+
+
+plate_index = PlateIndex()
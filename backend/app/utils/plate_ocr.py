@@ -0,0 +1,289 @@
+import asyncio
+import importlib
+import importlib.util
+import multiprocessing
+import os
+import time
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Dict, List, Any, Callable, Tuple
+from app.utils.plate_index import canonical_plate
+
+# uvicorn runs several web workers and each gets its own pool, so split the cores between them
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "2"))
+PLATE_OCR_WORKERS = int(os.getenv("PLATE_OCR_WORKERS", str(max(1, (os.cpu_count() or 1) // max(1, WEB_CONCURRENCY)))))
+# Frames queued or running per web worker before new requests are turned away with 429
+PLATE_OCR_MAX_PENDING = int(os.getenv("PLATE_OCR_MAX_PENDING", str(PLATE_OCR_WORKERS * 4)))
+PLATE_OCR_TIMEOUT = float(os.getenv("PLATE_OCR_TIMEOUT", "10"))
+PLATE_OCR_MAX_FRAMES = int(os.getenv("PLATE_OCR_MAX_FRAMES", "8"))
+# "tesseract", or "package.module:callable" taking the binarised plate crop and returning (text, confidence 0-1)
+PLATE_OCR_RECOGNIZER = os.getenv("PLATE_OCR_RECOGNIZER", "tesseract")
+
+# Plate outline proportions (width / height) accepted by the localiser; Kenyan plates are ~4.7:1 front, ~2:1 rear
+PLATE_ASPECT_RANGE = (2.0, 6.0)
+MAX_IMAGE_WIDTH = 1280
+CROP_HEIGHT = 100
+PLATE_CHARS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+
+
+class PlateOCRUnavailable(Exception):
+    """OpenCV or the recognizer is not installed on this server."""
+
+
+class PlateOCRBusy(Exception):
+    """Too many frames already queued; the caller should retry shortly."""
+
+
+# --- Worker side (runs in the pool processes) ---
+
+_recognizer: Optional[Callable] = None
+
+
+def _tesseract(crop) -> Tuple[str, float]:
+    import pytesseract
+    data = pytesseract.image_to_data(
+        crop,
+        config=f"--psm 7 -c tessedit_char_whitelist={PLATE_CHARS}",
+        output_type=pytesseract.Output.DICT,
+    )
+    words = [(w, float(c)) for w, c in zip(data["text"], data["conf"]) if w.strip() and float(c) >= 0]
+    if not words:
+        return "", 0.0
+    text = " ".join(w for w, _ in words)
+    return text, sum(c for _, c in words) / len(words) / 100
+
+
+def _load_recognizer() -> Callable:
+    global _recognizer
+    if _recognizer is None:
+        if PLATE_OCR_RECOGNIZER == "tesseract":
+            _recognizer = _tesseract
+        else:
+            module, _, name = PLATE_OCR_RECOGNIZER.partition(":")
+            _recognizer = getattr(importlib.import_module(module), name)
+    return _recognizer
+
+
+def _localise(image):
+    """Crop of the most plate-like quadrilateral in a BGR image (the whole frame if none), and its box."""
+    import cv2
+    height, width = image.shape[:2]
+    if width > MAX_IMAGE_WIDTH:
+        scale = MAX_IMAGE_WIDTH / width
+        image = cv2.resize(image, (MAX_IMAGE_WIDTH, int(height * scale)), interpolation=cv2.INTER_AREA)
+        height, width = image.shape[:2]
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    # Smooth texture (grilles, gravel) while keeping the plate's border sharp
+    smooth = cv2.bilateralFilter(gray, 11, 17, 17)
+    edges = cv2.Canny(smooth, 30, 200)
+    contours, _ = cv2.findContours(edges, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    min_area = width * height * 0.002
+
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:30]:
+        approx = cv2.approxPolyDP(contour, 0.018 * cv2.arcLength(contour, True), True)
+        if len(approx) != 4:
+            continue
+        x, y, w, h = cv2.boundingRect(approx)
+        if h and PLATE_ASPECT_RANGE[0] <= w / h <= PLATE_ASPECT_RANGE[1] and w * h >= min_area:
+            return gray[y:y + h, x:x + w], [int(x), int(y), int(w), int(h)]
+    return gray, None
+
+
+def _binarise(crop):
+    """Scale the crop to a fixed character height and threshold it to black text on white."""
+    import cv2
+    h, w = crop.shape[:2]
+    crop = cv2.resize(crop, (max(1, int(w * CROP_HEIGHT / h)), CROP_HEIGHT), interpolation=cv2.INTER_CUBIC)
+    _, binary = cv2.threshold(crop, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Dark plates with light characters come out inverted
+    if cv2.countNonZero(binary) < binary.size / 2:
+        binary = cv2.bitwise_not(binary)
+    return binary
+
+
+def read_plate(data: bytes) -> Dict[str, Any]:
+    """Locate and read the plate in one encoded image. Runs inside a pool process."""
+    import cv2
+    import numpy as np
+    started = time.perf_counter()
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return {"text": "", "confidence": 0.0, "box": None, "error": "unreadable image"}
+    crop, box = _localise(image)
+    text, confidence = _load_recognizer()(_binarise(crop))
+    return {
+        "text": canonical_plate(text),
+        "confidence": round(float(confidence), 3),
+        "box": box,
+        "error": None,
+        "ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def _warm() -> bool:
+    """Import OpenCV and the recognizer in a fresh pool process."""
+    import cv2  # noqa: F401
+    _load_recognizer()
+    return True
+
+
+# --- Web-worker side ---
+
+def vote(reads: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Combine reads of several frames of the same car. Reads of the most common
+    length vote per character position, weighted by recognizer confidence, so
+    one frame misreading an 8 as a B is outvoted by the others.
+    """
+    usable = [r for r in reads if r.get("text")]
+    if not usable:
+        return {"text": "", "confidence": 0.0, "agreement": 0.0}
+    lengths = Counter()
+    for r in usable:
+        lengths[len(r["text"])] += r["confidence"] or 0.01
+    length = lengths.most_common(1)[0][0]
+    aligned = [r for r in usable if len(r["text"]) == length]
+
+    chars, agreement = [], []
+    for i in range(length):
+        weights = Counter()
+        for r in aligned:
+            weights[r["text"][i]] += r["confidence"] or 0.01
+        char, weight = weights.most_common(1)[0]
+        chars.append(char)
+        agreement.append(weight / sum(weights.values()))
+    return {
+        "text": "".join(chars),
+        "confidence": round(sum(r["confidence"] for r in aligned) / len(aligned), 3),
+        "agreement": round(min(agreement), 3),
+    }
+
+
+class PlateOCRPool:
+    """
+    Plate recognition off the event loop.
+
+    Frames are decoded, localised (OpenCV contour search for a plate-shaped
+    quadrilateral), binarised and read by the configured recognizer inside a
+    ProcessPoolExecutor, so image work never blocks the asyncio loop and runs on
+    all cores despite the GIL. At most PLATE_OCR_MAX_PENDING frames are queued
+    or running per web worker; beyond that recognize() raises PlateOCRBusy instead of
+    letting gate requests pile up behind a backlog.
+    """
+
+    def __init__(self, workers: int = PLATE_OCR_WORKERS, max_pending: int = PLATE_OCR_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.pending = 0
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def available(self) -> bool:
+        """OpenCV is importable (checked without importing it into the web worker)."""
+        return importlib.util.find_spec("cv2") is not None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn, not fork: the web worker holds an event loop, DB connections and threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def start(self):
+        """Spin the pool processes up ahead of the first scan (no-op without OpenCV)."""
+        if not self.available():
+            print("Plate OCR disabled: OpenCV (cv2) is not installed")
+            return
+        pool = self._pool()
+        for _ in range(self.workers):
+            pool.submit(_warm)
+        print(f"Plate OCR pool started with {self.workers} processes (recognizer: {PLATE_OCR_RECOGNIZER})")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _release(self):
+        self.pending -= 1
+
+    def _submit(self, data: bytes) -> Future:
+        """
+        Queue one frame on the pool. Its slot in `pending` is given back when the
+        process is done with it (or it is cancelled before starting), not when a
+        caller stops waiting, so frames still running after a timeout keep counting.
+        """
+        loop = asyncio.get_running_loop()
+        future = self._pool().submit(read_plate, data)
+        self.pending += 1
+
+        def release(_):
+            try:
+                loop.call_soon_threadsafe(self._release)
+            except RuntimeError:
+                pass  # the loop is already closed (shutdown)
+
+        future.add_done_callback(release)
+        return future
+
+    async def _read(self, future: Future) -> Dict[str, Any]:
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), PLATE_OCR_TIMEOUT)
+        except BrokenProcessPool:
+            # A worker died (e.g. a native crash in OpenCV); start a fresh pool for the next request
+            self._executor = None
+            self.failed += 1
+            raise PlateOCRUnavailable("recognition process crashed")
+        except asyncio.TimeoutError:
+            self.failed += 1
+            return {"text": "", "confidence": 0.0, "box": None, "error": "timed out"}
+        except (ImportError, AttributeError) as e:
+            raise PlateOCRUnavailable(str(e))
+
+    async def recognize(self, frames: List[bytes]) -> Dict[str, Any]:
+        """Read one or more frames of the same car; several frames are combined with vote()."""
+        if not self.available():
+            raise PlateOCRUnavailable("OpenCV (cv2) is not installed")
+        if self.pending + len(frames) > self.max_pending:
+            self.rejected += 1
+            raise PlateOCRBusy(f"{self.pending} frames already queued")
+
+        # Submitted together before any await, so concurrent requests see them in `pending`
+        futures = []
+        try:
+            for data in frames:
+                futures.append(self._submit(data))
+        except BrokenProcessPool:
+            for future in futures:
+                future.cancel()
+            self._executor = None
+            self.failed += 1
+            raise PlateOCRUnavailable("recognition process crashed")
+        reads = await asyncio.gather(*(self._read(future) for future in futures))
+        self.processed += len(frames)
+
+        best = max(range(len(reads)), key=lambda i: (bool(reads[i]["text"]), reads[i]["confidence"]))
+        result = vote(reads) if len(reads) > 1 else {
+            "text": reads[0]["text"], "confidence": reads[0]["confidence"], "agreement": 1.0,
+        }
+        return {**result, "best_frame": best, "frames": reads}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "available": self.available(),
+            "recognizer": PLATE_OCR_RECOGNIZER,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+        }
+
+
+plate_ocr = PlateOCRPool()
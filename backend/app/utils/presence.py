@@ -0,0 +1,198 @@
+import asyncio
+import os
+import time
+import uuid
+from typing import Optional, Dict, List, Tuple
+from uuid import UUID
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.models import EntryLog, VehicleLog
+from app.utils import redis_client
+
+PRESENCE_CHANNEL = "smartcampus:presence"
+# Seconds between resyncs with the database, which repair drift from missed or
+# undeliverable cross-worker updates (Redis down, restarted or not configured)
+PRESENCE_TTL = int(os.getenv("PRESENCE_TTL", "60"))
+
+# kind -> (model, entity id column)
+_TRACKED = {
+    "user": (EntryLog, "user_id"),
+    "vehicle": (VehicleLog, "vehicle_id"),
+}
+
+
+class PresenceTable:
+    """
+    Live "who is inside" table: the open EntryLog id per person and the open
+    VehicleLog id per vehicle.
+
+    Rebuilt from the database on boot and kept current by ORM events on
+    EntryLog/VehicleLog: changes are staged on the session when the row is
+    flushed and only applied once that session commits (dropped on rollback),
+    so the table moves together with the log write. With REDIS_URL set, applied
+    changes are broadcast so every uvicorn worker sees the same table; readers
+    call ensure(), which also reloads it at most every PRESENCE_TTL seconds.
+    """
+
+    def __init__(self):
+        self._open: Dict[str, Dict[UUID, UUID]] = {"user": {}, "vehicle": {}}
+        self._ready = False
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        # Changes applied while a rebuild is reading, replayed onto its result
+        self._replay: Optional[List[Tuple[str, str, str, str]]] = None
+        self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._listener: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    # --- Public API ---
+
+    def is_inside(self, kind: str, entity_id: UUID) -> bool:
+        return entity_id in self._open[kind]
+
+    def open_log_id(self, kind: str, entity_id: UUID) -> Optional[UUID]:
+        return self._open[kind].get(entity_id)
+
+    def count_inside(self, kind: str) -> int:
+        return len(self._open[kind])
+
+    def inside_ids(self, kind: str) -> List[UUID]:
+        return list(self._open[kind].keys())
+
+    async def rebuild(self, session: AsyncSession, quiet: bool = False):
+        """Reload open logs from the database (latest open log wins per entity)."""
+        rebuilt = {}
+        self._replay = []
+        try:
+            for kind, (model, column) in _TRACKED.items():
+                rows = (await session.exec(
+                    select(model.id, getattr(model, column))
+                    .where(model.exit_time == None)
+                    .order_by(model.entry_time)
+                )).all()
+                rebuilt[kind] = {entity_id: log_id for log_id, entity_id in rows}
+            # Commits that landed during the reads may be missing from them
+            self._apply_to(rebuilt, self._replay)
+        finally:
+            self._replay = None
+        self._open = rebuilt
+        self._ready = True
+        self._loaded_at = time.monotonic()
+        if not quiet:
+            print(f"Presence table rebuilt: {len(rebuilt['user'])} people and {len(rebuilt['vehicle'])} vehicles inside")
+
+    def _fresh(self) -> bool:
+        return self._ready and time.monotonic() - self._loaded_at < PRESENCE_TTL
+
+    async def ensure(self, session: AsyncSession):
+        """Resync with the database if the table is older than PRESENCE_TTL seconds."""
+        if self._fresh():
+            return
+        async with self._lock:
+            if self._fresh():
+                return
+            await self.rebuild(session, quiet=True)
+
+    async def refresh(self):
+        """Rebuild with a private session (after bulk SQL that bypasses the ORM events)."""
+        from app.database import engine
+        try:
+            async with AsyncSession(engine) as session:
+                await self.rebuild(session)
+        except Exception as e:
+            self._ready = False
+            print(f"Presence rebuild failed: {e}")
+
+    # --- Applying changes ---
+
+    @staticmethod
+    def _apply_to(tables: Dict[str, Dict[UUID, UUID]], ops: List[Tuple[str, str, str, str]]):
+        for action, kind, entity_id, log_id in ops:
+            entity_id, log_id = UUID(str(entity_id)), UUID(str(log_id))
+            table = tables[kind]
+            if action == "open":
+                table[entity_id] = log_id
+            elif table.get(entity_id) == log_id:
+                del table[entity_id]
+
+    def _apply(self, ops: List[Tuple[str, str, str, str]]):
+        self._apply_to(self._open, ops)
+        if self._replay is not None:
+            self._replay.extend(ops)
+
+    def _committed(self, ops):
+        self._apply(ops)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        loop.create_task(redis_client.publish(PRESENCE_CHANNEL, self._worker_id, {"ops": ops}))
+
+    def _on_remote(self, payload: dict):
+        self._apply([tuple(op) for op in payload.get("ops", [])])
+
+    def start_sync(self):
+        if self._listener is None:
+            self._listener = asyncio.get_running_loop().create_task(
+                redis_client.listen(PRESENCE_CHANNEL, self._worker_id, self._on_remote)
+            )
+
+    async def stop_sync(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._listener = None
+
+
+presence = PresenceTable()
+
+
+# --- ORM hooks: stage on flush, apply on commit ---
+
+def _stage(target, action: str, kind: str):
+    session = object_session(target)
+    entity_id = getattr(target, _TRACKED[kind][1])
+    if session is None or entity_id is None:
+        return
+    session.info.setdefault("presence_ops", []).append((action, kind, str(entity_id), str(target.id)))
+
+
+def _register(kind: str):
+    model = _TRACKED[kind][0]
+
+    @event.listens_for(model, "after_insert")
+    def _after_insert(mapper, connection, target):
+        if target.exit_time is None:
+            _stage(target, "open", kind)
+
+    @event.listens_for(model, "after_update")
+    def _after_update(mapper, connection, target):
+        _stage(target, "open" if target.exit_time is None else "close", kind)
+
+    @event.listens_for(model, "after_delete")
+    def _after_delete(mapper, connection, target):
+        _stage(target, "close", kind)
+
+
+for _kind in _TRACKED:
+    _register(_kind)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_presence_ops(session):
+    ops = session.info.pop("presence_ops", None)
+    if ops:
+        presence._committed(ops)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_presence_ops(session, previous_transaction):
+    session.info.pop("presence_ops", None)
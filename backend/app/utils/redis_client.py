@@ -0,0 +1,72 @@
+import json
+import os
+from typing import Callable
+
+REDIS_URL = os.getenv("REDIS_URL")
+
+_client = None
+_unavailable = False
+
+
+async def get_redis():
+    """
+    Return a shared redis.asyncio client, or None when REDIS_URL is not set or
+    Redis cannot be reached. Callers must keep working in-process without it.
+    """
+    global _client, _unavailable
+    if not REDIS_URL or _unavailable:
+        return None
+    if _client is None:
+        try:
+            import redis.asyncio as aioredis
+            client = aioredis.from_url(REDIS_URL, decode_responses=True)
+            await client.ping()
+            _client = client
+            print(f"Connected to Redis at {REDIS_URL}")
+        except Exception as e:
+            print(f"Redis unavailable ({e}); falling back to in-process state")
+            _unavailable = True
+            return None
+    return _client
+
+
+async def close_redis():
+    global _client
+    if _client is not None:
+        try:
+            await _client.aclose()
+        except Exception:
+            pass
+        _client = None
+
+
+async def publish(channel: str, sender: str, payload: dict):
+    """Broadcast a payload to the other workers; a no-op without Redis."""
+    redis = await get_redis()
+    if redis is None:
+        return
+    try:
+        await redis.publish(channel, json.dumps({"worker": sender, **payload}))
+    except Exception as e:
+        print(f"Redis publish on {channel} failed: {e}")
+
+
+async def listen(channel: str, sender: str, handler: Callable[[dict], None]):
+    """Feed payloads published by other workers to handler until cancelled."""
+    redis = await get_redis()
+    if redis is None:
+        return
+    pubsub = redis.pubsub()
+    await pubsub.subscribe(channel)
+    try:
+        async for message in pubsub.listen():
+            if message.get("type") != "message":
+                continue
+            try:
+                payload = json.loads(message["data"])
+                if payload.get("worker") != sender:
+                    handler(payload)
+            except Exception as e:
+                print(f"Ignored message on {channel}: {e}")
+    finally:
+        await pubsub.unsubscribe(channel)
@@ -0,0 +1,209 @@
+import asyncio
+import os
+import time
+import uuid
+from typing import Optional, Dict, List, Any, NamedTuple
+from uuid import UUID
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.models import Gate, Role, SystemConfig, GeofenceSetting
+from app.utils import redis_client
+
+REFERENCE_CACHE_TTL = int(os.getenv("REFERENCE_CACHE_TTL", "60"))
+REFERENCE_CACHE_CHANNEL = "smartcampus:reference-cache"
+
+MAIN_GATE_NAME = "Main Gate"
+
+
+class GateRef(NamedTuple):
+    id: UUID
+    name: str
+    location: Optional[str]
+    is_active: bool
+
+
+class RoleRef(NamedTuple):
+    id: UUID
+    name: str
+    description: Optional[str]
+
+
+class ReferenceCache:
+    """
+    Read-mostly cache for small reference tables: gates, roles, system_configs
+    and active geofence ranges.
+
+    Each section is loaded whole with one query and served from memory until it
+    is older than REFERENCE_CACHE_TTL seconds or invalidated by a write endpoint.
+    Values are immutable snapshots (GateRef/RoleRef/str), never ORM objects, so
+    they can be shared across requests. Unknown gate/role ids are read through
+    to the database. Invalidations are relayed to the other workers over Redis.
+    """
+
+    SECTIONS = ("gates", "roles", "configs", "geofences")
+
+    def __init__(self):
+        self.version = 0
+        self._loaded_at: Dict[str, float] = {}
+        self._locks = {section: asyncio.Lock() for section in self.SECTIONS}
+        self._gates: Dict[UUID, GateRef] = {}
+        self._gates_by_name: Dict[str, GateRef] = {}
+        self._roles: Dict[UUID, RoleRef] = {}
+        self._configs: Dict[str, str] = {}
+        self._geofences: List[str] = []
+        self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._listener: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.loads = 0
+
+    # --- Loading ---
+
+    def _fresh(self, section: str) -> bool:
+        loaded_at = self._loaded_at.get(section)
+        return loaded_at is not None and time.monotonic() - loaded_at < REFERENCE_CACHE_TTL
+
+    async def _ensure(self, section: str, session: AsyncSession):
+        if self._fresh(section):
+            self.hits += 1
+            return
+        async with self._locks[section]:
+            if self._fresh(section):
+                return
+            version = self.version
+            await getattr(self, f"_load_{section}")(session)
+            self.loads += 1
+            # An invalidation that raced the load leaves the section stale
+            if version == self.version:
+                self._loaded_at[section] = time.monotonic()
+
+    async def _load_gates(self, session: AsyncSession):
+        gates = [GateRef(g.id, g.name, g.location, g.is_active) for g in (await session.exec(select(Gate))).all()]
+        self._gates = {g.id: g for g in gates}
+        self._gates_by_name = {g.name: g for g in gates}
+
+    async def _load_roles(self, session: AsyncSession):
+        roles = [RoleRef(r.id, r.name, r.description) for r in (await session.exec(select(Role))).all()]
+        self._roles = {r.id: r for r in roles}
+
+    async def _load_configs(self, session: AsyncSession):
+        self._configs = {c.key: c.value for c in (await session.exec(select(SystemConfig))).all()}
+
+    async def _load_geofences(self, session: AsyncSession):
+        rows = (await session.exec(select(GeofenceSetting.ip_range).where(GeofenceSetting.is_active == True))).all()
+        self._geofences = [ip_range for ip_range in rows if ip_range]
+
+    # --- Gates ---
+
+    async def get_gate(self, session: AsyncSession, gate_id: Any) -> Optional[GateRef]:
+        try:
+            gate_id = gate_id if isinstance(gate_id, UUID) else UUID(str(gate_id))
+        except (ValueError, TypeError):
+            return None
+        await self._ensure("gates", session)
+        gate = self._gates.get(gate_id)
+        if gate is None:
+            row = await session.get(Gate, gate_id)
+            if row:
+                gate = GateRef(row.id, row.name, row.location, row.is_active)
+                self._gates[gate.id] = gate
+                self._gates_by_name[gate.name] = gate
+        return gate
+
+    async def main_gate(self, session: AsyncSession) -> GateRef:
+        """The default 'Main Gate', created on first use like the gate endpoints always did."""
+        await self._ensure("gates", session)
+        gate = self._gates_by_name.get(MAIN_GATE_NAME)
+        if gate is None:
+            row = (await session.exec(select(Gate).where(Gate.name == MAIN_GATE_NAME))).first()
+            if not row:
+                row = Gate(name=MAIN_GATE_NAME, location="Main Entrance")
+                session.add(row)
+                await session.commit()
+                await session.refresh(row)
+            gate = GateRef(row.id, row.name, row.location, row.is_active)
+            self._gates[gate.id] = gate
+            self._gates_by_name[gate.name] = gate
+        return gate
+
+    async def resolve_gate(self, session: AsyncSession, gate_id: Any = None) -> GateRef:
+        """Gate by id when given and known, otherwise the Main Gate."""
+        gate = await self.get_gate(session, gate_id) if gate_id else None
+        return gate or await self.main_gate(session)
+
+    # --- Roles ---
+
+    async def get_role(self, session: AsyncSession, role_id: Any) -> Optional[RoleRef]:
+        if role_id is None:
+            return None
+        await self._ensure("roles", session)
+        role = self._roles.get(role_id)
+        if role is None:
+            row = await session.get(Role, role_id)
+            if row:
+                role = RoleRef(row.id, row.name, row.description)
+                self._roles[role.id] = role
+        return role
+
+    # --- System configs / geofences ---
+
+    async def get_config(self, session: AsyncSession, key: str, default: Optional[str] = None) -> Optional[str]:
+        await self._ensure("configs", session)
+        return self._configs.get(key, default)
+
+    async def get_configs(self, session: AsyncSession) -> Dict[str, str]:
+        await self._ensure("configs", session)
+        return dict(self._configs)
+
+    async def get_geofence_ranges(self, session: AsyncSession) -> List[str]:
+        await self._ensure("geofences", session)
+        return list(self._geofences)
+
+    # --- Invalidation ---
+
+    def _drop(self, sections):
+        self.version += 1
+        for section in sections:
+            self._loaded_at.pop(section, None)
+
+    def invalidate(self, *sections: str):
+        """Force a reload of the given sections (all when none given) here and on the other workers."""
+        sections = [s for s in (sections or self.SECTIONS) if s in self.SECTIONS]
+        self._drop(sections)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        loop.create_task(redis_client.publish(REFERENCE_CACHE_CHANNEL, self._worker_id, {"sections": sections}))
+
+    def _on_remote(self, payload: dict):
+        self._drop([s for s in payload.get("sections", []) if s in self.SECTIONS])
+
+    def start_sync(self):
+        if self._listener is None:
+            self._listener = asyncio.get_running_loop().create_task(
+                redis_client.listen(REFERENCE_CACHE_CHANNEL, self._worker_id, self._on_remote)
+            )
+
+    async def stop_sync(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._listener = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "ttl_seconds": REFERENCE_CACHE_TTL,
+            "fresh_sections": [s for s in self.SECTIONS if self._fresh(s)],
+            "gates": len(self._gates),
+            "roles": len(self._roles),
+            "configs": len(self._configs),
+            "hits": self.hits,
+            "loads": self.loads,
+        }
+
+
+reference_cache = ReferenceCache()
@@ -0,0 +1,198 @@
+import base64
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Optional, Dict, List, Any, Tuple, Callable, NamedTuple
+from uuid import UUID, uuid4
+from sqlalchemy import event, and_, or_, true
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.models import User, Vehicle, Visitor, RosterTombstone
+from app.utils.timezone import get_eat_time
+
+ROSTER_PAGE = int(os.getenv("ROSTER_PAGE", "2000"))
+# Rows changed this recently are held back one sync, so a transaction that stamped updated_at
+# but had not committed yet when a page was read cannot be skipped past by the cursor
+ROSTER_SETTLE_SECONDS = float(os.getenv("ROSTER_SETTLE_SECONDS", "5"))
+
+RESET = "*"
+_ZERO = UUID(int=0)
+
+
+class InvalidCursor(ValueError):
+    """A cursor that was not produced by this module."""
+
+
+def image_hash(profile_image: Optional[str]) -> Optional[str]:
+    """Short fingerprint of a profile image reference; devices refetch the photo when it changes."""
+    if not profile_image:
+        return None
+    return hashlib.sha1(profile_image.encode()).hexdigest()[:16]
+
+
+# --- Sources ---
+
+class _Source(NamedTuple):
+    model: Any
+    columns: Callable
+    # Rows a fresh device needs; everything else only travels as a delta
+    active: Callable
+    item: Callable
+
+
+SOURCES: Dict[str, _Source] = {
+    "users": _Source(
+        User,
+        lambda: (User.id, User.updated_at, User.admission_number, User.full_name, User.status, User.profile_image),
+        lambda: User.status == "active",
+        lambda row: {
+            "id": str(row.id), "admission_number": row.admission_number, "name": row.full_name,
+            "status": row.status, "image_hash": image_hash(row.profile_image),
+        },
+    ),
+    "vehicles": _Source(
+        Vehicle,
+        lambda: (Vehicle.id, Vehicle.updated_at, Vehicle.plate_number, Vehicle.driver_name, Vehicle.owner_id, Vehicle.status),
+        lambda: true(),
+        lambda row: {
+            "id": str(row.id), "plate_number": row.plate_number, "driver_name": row.driver_name,
+            "owner_id": str(row.owner_id) if row.owner_id else None, "status": row.status,
+        },
+    ),
+    "visitors": _Source(
+        Visitor,
+        lambda: (Visitor.id, Visitor.updated_at, Visitor.first_name, Visitor.last_name, Visitor.id_number,
+                 Visitor.visitor_type, Visitor.status, Visitor.time_in),
+        lambda: Visitor.status == "checked_in",
+        lambda row: {
+            "id": str(row.id), "name": f"{row.first_name} {row.last_name}", "id_number": row.id_number,
+            "visitor_type": row.visitor_type, "status": row.status,
+            "time_in": row.time_in.isoformat() if row.time_in else None,
+        },
+    ),
+}
+_TOMBSTONE_KINDS = {User: "user", Vehicle: "vehicle", Visitor: "visitor"}
+
+
+# --- Cursor: sync mode, snapshot start and the (time, id) reached in each table ---
+
+def _encode(state: Dict[str, Any]) -> str:
+    raw = json.dumps(state, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode(cursor: str) -> Dict[str, Any]:
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if state["mode"] not in ("snapshot", "delta"):
+            raise ValueError(state["mode"])
+        datetime.fromisoformat(state["started"])
+        for name in list(SOURCES) + ["removed"]:
+            if state[name] is not None:
+                datetime.fromisoformat(state[name][0])
+                UUID(state[name][1])
+        return state
+    except (ValueError, TypeError, KeyError, IndexError):
+        raise InvalidCursor("invalid roster cursor")
+
+
+def _position(state: Dict[str, Any], name: str) -> Optional[Tuple[datetime, UUID]]:
+    if state[name] is None:
+        return None
+    moment, row_id = state[name]
+    return datetime.fromisoformat(moment), UUID(row_id)
+
+
+def _after(time_col, id_col, position: Optional[Tuple[datetime, UUID]]):
+    moment, row_id = position
+    return or_(time_col > moment, and_(time_col == moment, id_col > row_id))
+
+
+# --- Sync ---
+
+async def page(session: AsyncSession, cursor: Optional[str] = None, limit: int = ROSTER_PAGE) -> Dict[str, Any]:
+    """
+    One page of the gate roster.
+
+    Without a cursor this starts a snapshot: active users, all vehicles and
+    checked-in visitors, in (updated_at, id) order. Follow next_cursor while
+    has_more is true; once the snapshot is complete the cursor switches to
+    delta mode and later calls return only rows changed since (any status,
+    so devices can drop suspended users or checked-out visitors) plus the ids
+    of deleted rows under "removed". reset=True means the roster was wiped
+    with bulk SQL: the device should discard its copy and sync without a cursor.
+    """
+    now = get_eat_time()
+    ceiling = now - timedelta(seconds=ROSTER_SETTLE_SECONDS)
+    if cursor:
+        state = _decode(cursor)
+    else:
+        # Deletions before the snapshot started are already reflected in it
+        state = {"mode": "snapshot", "started": now.isoformat(), "removed": [now.isoformat(), _ZERO.hex]}
+        state.update({name: None for name in SOURCES})
+    started = datetime.fromisoformat(state["started"])
+    result: Dict[str, Any] = {"mode": state["mode"], "reset": False}
+    more = False
+
+    # Deletions and resets (delta mode only)
+    removed: List[Dict[str, str]] = []
+    if state["mode"] == "delta":
+        query = select(RosterTombstone).where(RosterTombstone.deleted_at <= ceiling)
+        position = _position(state, "removed")
+        if position is not None:
+            query = query.where(_after(RosterTombstone.deleted_at, RosterTombstone.id, position))
+        tombstones = (await session.exec(
+            query.order_by(RosterTombstone.deleted_at, RosterTombstone.id).limit(limit + 1)
+        )).all()
+        if any(t.kind == RESET for t in tombstones):
+            return {**result, "reset": True, "has_more": False, "next_cursor": None}
+        more = more or len(tombstones) > limit
+        tombstones = tombstones[:limit]
+        removed = [{"kind": t.kind, "id": str(t.entity_id)} for t in tombstones]
+        if tombstones:
+            state["removed"] = [tombstones[-1].deleted_at.isoformat(), tombstones[-1].id.hex]
+
+    for name, source in SOURCES.items():
+        model = source.model
+        query = select(*source.columns()).where(model.updated_at <= ceiling)
+        position = _position(state, name)
+        if position is not None:
+            query = query.where(_after(model.updated_at, model.id, position))
+        if state["mode"] == "snapshot":
+            # Rows touched after the snapshot began are sent whatever their status, in case
+            # the device already received them earlier in this snapshot
+            query = query.where(or_(source.active(), model.updated_at > started))
+        rows = (await session.exec(query.order_by(model.updated_at, model.id).limit(limit + 1))).all()
+        more = more or len(rows) > limit
+        rows = rows[:limit]
+        result[name] = [source.item(row) for row in rows]
+        if rows:
+            state[name] = [rows[-1].updated_at.isoformat(), rows[-1].id.hex]
+
+    result["removed"] = removed
+    if state["mode"] == "snapshot" and not more:
+        state["mode"] = "delta"
+    result["has_more"] = more
+    result["next_cursor"] = _encode(state)
+    return result
+
+
+async def mark_reset(session: AsyncSession):
+    """Tell synced devices to re-download the roster (after raw SQL that bypasses the ORM hooks)."""
+    session.add(RosterTombstone(kind=RESET))
+    await session.commit()
+
+
+# --- ORM hook: a tombstone in the same transaction as every delete ---
+
+def _register(model, kind: str):
+    @event.listens_for(model, "after_delete")
+    def _after_delete(mapper, connection, target):
+        connection.execute(RosterTombstone.__table__.insert().values(
+            id=uuid4(), kind=kind, entity_id=target.id, deleted_at=get_eat_time()
+        ))
+
+
+for _model, _kind in _TOMBSTONE_KINDS.items():
+    _register(_model, _kind)
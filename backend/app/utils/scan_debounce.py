@@ -0,0 +1,132 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple, Callable, Awaitable
+from app.utils import redis_client
+from app.utils.identity_index import normalize_code
+from app.utils.timing import span
+
+# Repeat reads of the same code at the same gate within this window get the first result back; 0 disables
+SCAN_DEBOUNCE_MS = int(os.getenv("SCAN_DEBOUNCE_MS", "2000"))
+SCAN_DEBOUNCE_MAX_ENTRIES = 50000
+SCAN_DEBOUNCE_KEY = "smartcampus:scan-debounce:"
+
+DEFAULT_GATE = "default"
+
+
+class ScanDebouncer:
+    """
+    Per-(gate, code) debounce for /api/gate/scan.
+
+    The first read of a code at a gate runs the normal scan and its response is
+    kept for SCAN_DEBOUNCE_MS in an in-memory TTL map (and in Redis, when
+    REDIS_URL is set, so the other workers see it too). Repeat reads inside the
+    window, including ones that arrive while the first is still in flight, get
+    that response back without touching the database, the audit log or the gate
+    feed; they only bump the suppressed counter.
+    """
+
+    def __init__(self, window_ms: int = SCAN_DEBOUNCE_MS):
+        self.window = window_ms / 1000
+        # key -> (expires_at monotonic, result); insertion order is expiry order
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, dict]]" = OrderedDict()
+        self._pending: Dict[Tuple[str, str], asyncio.Future] = {}
+        self.suppressed = 0
+        self.suppressed_by_gate: Dict[str, int] = {}
+
+    @staticmethod
+    def key(gate_id: Any, code: str) -> Tuple[str, str]:
+        gate = str(gate_id).strip().lower() if gate_id else DEFAULT_GATE
+        return gate, normalize_code(code)
+
+    def _prune(self):
+        now = time.monotonic()
+        while self._entries:
+            expires_at, _ = next(iter(self._entries.values()))
+            if expires_at > now and len(self._entries) <= SCAN_DEBOUNCE_MAX_ENTRIES:
+                break
+            self._entries.popitem(last=False)
+
+    async def _recent(self, key: Tuple[str, str]) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry:
+            if entry[0] > time.monotonic():
+                return entry[1]
+            del self._entries[key]
+
+        redis = await redis_client.get_redis()
+        if redis is None:
+            return None
+        try:
+            raw = await redis.get(SCAN_DEBOUNCE_KEY + ":".join(key))
+        except Exception as e:
+            print(f"Scan debounce Redis lookup failed: {e}")
+            return None
+        if not raw:
+            return None
+        stored = json.loads(raw)
+        remaining = stored["expires_at"] - time.time()
+        if remaining <= 0:
+            return None
+        self._entries[key] = (time.monotonic() + remaining, stored["result"])
+        return stored["result"]
+
+    async def _share(self, key: Tuple[str, str], result: dict):
+        redis = await redis_client.get_redis()
+        if redis is None:
+            return
+        try:
+            value = json.dumps({"expires_at": time.time() + self.window, "result": result}, default=str)
+            await redis.set(SCAN_DEBOUNCE_KEY + ":".join(key), value, px=int(self.window * 1000))
+        except Exception as e:
+            print(f"Scan debounce Redis store failed: {e}")
+
+    def _suppress(self, key: Tuple[str, str], result: dict) -> dict:
+        self.suppressed += 1
+        self.suppressed_by_gate[key[0]] = self.suppressed_by_gate.get(key[0], 0) + 1
+        return {**result, "debounced": True}
+
+    async def run(self, gate_id: Any, code: str, handler: Callable[[], Awaitable[dict]]) -> dict:
+        """Return handler()'s result, or the result of the same scan made within the window."""
+        if self.window <= 0 or not code:
+            return await handler()
+        key = self.key(gate_id, code)
+
+        with span("debounce"):
+            recent = await self._recent(key)
+            while recent is None and key in self._pending:
+                # Same code read again while the first scan is still being processed
+                recent = await asyncio.shield(self._pending[key])
+        if recent is not None:
+            return self._suppress(key, recent)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        result = None
+        try:
+            result = await handler()
+            return result
+        finally:
+            del self._pending[key]
+            # Waiters on a failed scan get None and run the scan themselves
+            future.set_result(result)
+            if isinstance(result, dict):
+                self._entries[key] = (time.monotonic() + self.window, result)
+                self._entries.move_to_end(key)
+                self._prune()
+                asyncio.get_running_loop().create_task(self._share(key, result))
+
+    def stats(self) -> Dict[str, Any]:
+        self._prune()
+        return {
+            "window_ms": int(self.window * 1000),
+            "entries": len(self._entries),
+            "in_flight": len(self._pending),
+            "suppressed": self.suppressed,
+            "suppressed_by_gate": dict(self.suppressed_by_gate),
+        }
+
+
+scan_debounce = ScanDebouncer()
@@ -0,0 +1,354 @@
+import asyncio
+import bisect
+import os
+import time
+import uuid
+from datetime import date, time as dtime
+from typing import Optional, Dict, List, Any, NamedTuple, Tuple, Iterable
+from uuid import UUID, uuid4
+from sqlalchemy import event, or_, delete, update, exists
+from sqlalchemy.orm import Session, object_session
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.models import Classroom, Course, TimetableSlot, ClassSession, AttendanceRecord, ScanLog, CameraAnalytics
+from app.utils import redis_client
+from app.utils.timezone import get_eat_time
+
+# Safety net for writes the ORM hooks cannot see (raw SQL, other workers without Redis)
+SCHEDULE_INDEX_TTL = int(os.getenv("SCHEDULE_INDEX_TTL", "300"))
+SCHEDULE_INDEX_CHANNEL = "smartcampus:schedule-index"
+
+
+class RoomRef(NamedTuple):
+    id: UUID
+    room_code: str
+    room_name: str
+
+
+class CourseRef(NamedTuple):
+    id: UUID
+    course_code: str
+    course_name: str
+    classroom_id: Optional[UUID]
+    lecturer_id: Optional[UUID]
+
+
+class Interval(NamedTuple):
+    """One entry of today's schedule: a ClassSession (session_id set) or a timetable slot without one yet."""
+    start: dtime
+    end: dtime
+    session_id: Optional[UUID]
+    slot_id: Optional[UUID]
+    course_id: UUID
+    classroom_id: Optional[UUID]
+    lecturer_id: Optional[UUID]
+
+
+def slots_running_on(day: date):
+    """WHERE clause for the active timetable slots that hold a class on day."""
+    return (
+        (TimetableSlot.day_of_week == day.weekday()) & (TimetableSlot.is_active == True)
+        & or_(TimetableSlot.effective_from == None, TimetableSlot.effective_from <= day)
+        & or_(TimetableSlot.effective_until == None, TimetableSlot.effective_until >= day)
+    )
+
+
+def _insert_ignore(dialect: str, rows: List[Dict[str, Any]]):
+    """INSERT of ClassSession rows that skips any (timetable_slot_id, session_date) already present."""
+    table = ClassSession.__table__
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        return insert(table).values(rows).prefix_with("IGNORE")
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table).values(rows).on_conflict_do_nothing(index_elements=["timetable_slot_id", "session_date"])
+
+
+async def materialize_sessions(session: AsyncSession, day: date, slot_ids: Optional[Iterable[UUID]] = None) -> int:
+    """
+    Create day's ClassSession for every slot running that day (or just slot_ids)
+    that has none yet, in one INSERT. Safe to run concurrently from several
+    workers: the (timetable_slot_id, session_date) unique constraint drops
+    duplicates. The caller commits; the schedule index is rebuilt on commit.
+    """
+    query = (
+        select(TimetableSlot, Course.lecturer_id)
+        .join(Course, TimetableSlot.course_id == Course.id)
+        .where(slots_running_on(day))
+        .where(~exists().where(
+            (ClassSession.timetable_slot_id == TimetableSlot.id) & (ClassSession.session_date == day)
+        ))
+    )
+    if slot_ids is not None:
+        query = query.where(TimetableSlot.id.in_(list(slot_ids)))
+    rows = [
+        {
+            "id": uuid4(),
+            "course_id": slot.course_id,
+            "timetable_slot_id": slot.id,
+            "session_date": day,
+            "start_time": slot.start_time,
+            "end_time": slot.end_time,
+            "classroom_id": slot.classroom_id,
+            "lecturer_id": slot.lecturer_id or course_lecturer_id,
+            "qr_code": str(uuid4()),
+            "room_unique_number": str(uuid4().int)[:6],
+            "status": "scheduled",
+            "active": True,
+        }
+        for slot, course_lecturer_id in (await session.exec(query)).all()
+    ]
+    if not rows:
+        return 0
+    dialect = (await session.connection()).dialect.name
+    result = await session.execute(_insert_ignore(dialect, rows))
+    # Core INSERTs skip the ORM hooks below
+    session.info["schedule_changed"] = True
+    return result.rowcount if result.rowcount is not None and result.rowcount >= 0 else len(rows)
+
+
+async def release_slot_sessions(session: AsyncSession, slot_id: UUID, from_day: date, detach: bool = False):
+    """
+    Drop a slot's pre-materialized sessions from from_day on that nobody has
+    used yet (still "scheduled", no attendance or scans), before the slot is
+    changed or deleted. With detach=True the sessions that were used keep
+    their history but no longer point at the slot.
+    """
+    used = or_(
+        ClassSession.status != "scheduled",
+        exists().where(AttendanceRecord.session_id == ClassSession.id),
+        exists().where(ScanLog.class_session_id == ClassSession.id),
+        exists().where(CameraAnalytics.class_session_id == ClassSession.id),
+    )
+    await session.execute(delete(ClassSession).where(
+        ClassSession.timetable_slot_id == slot_id, ClassSession.session_date >= from_day, ~used
+    ).execution_options(synchronize_session=False))
+    if detach:
+        await session.execute(update(ClassSession).where(
+            ClassSession.timetable_slot_id == slot_id
+        ).values(timetable_slot_id=None).execution_options(synchronize_session=False))
+    session.info["schedule_changed"] = True
+
+
+def _covering(starts: List[dtime], intervals: List[Interval], moment: dtime) -> List[Interval]:
+    """Intervals with start <= moment <= end, earliest start first (intervals sorted by start)."""
+    return [i for i in intervals[:bisect.bisect_right(starts, moment)] if i.end >= moment]
+
+
+class ScheduleIndex:
+    """
+    Today's classroom schedule in memory, for classroom QR scans.
+
+    All classrooms and courses, plus today's ClassSessions and today's active
+    timetable slots that have no session yet, as per-room and per-course lists
+    of intervals sorted by start time. Resolving a scan to its session is a
+    bisect with no SQL. The index is rebuilt with four queries when the date
+    changes, when a classroom, course, slot or session write commits (here or,
+    over Redis, on another worker) and at most every SCHEDULE_INDEX_TTL seconds.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._day: Optional[date] = None
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._rooms: Dict[UUID, RoomRef] = {}
+        self._rooms_by_code: Dict[str, RoomRef] = {}
+        self._courses: Dict[UUID, CourseRef] = {}
+        self._courses_by_code: Dict[str, CourseRef] = {}
+        # classroom/course id -> (starts, intervals), intervals sorted by (start, end)
+        self._by_room: Dict[UUID, Tuple[List[dtime], List[Interval]]] = {}
+        self._by_course: Dict[UUID, Tuple[List[dtime], List[Interval]]] = {}
+        # Serializes creating the session for one slot/course, so a room full of scans creates it once
+        self._creating: Dict[Any, asyncio.Lock] = {}
+        self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._listener: Optional[asyncio.Task] = None
+        self.resolved = 0
+        self.loads = 0
+
+    # --- Loading ---
+
+    def _fresh(self, today: date) -> bool:
+        return (
+            self._loaded_at is not None and self._day == today
+            and time.monotonic() - self._loaded_at < SCHEDULE_INDEX_TTL
+        )
+
+    async def ensure(self, session: AsyncSession):
+        today = get_eat_time().date()
+        if self._fresh(today):
+            return
+        async with self._lock:
+            if self._fresh(today):
+                return
+            version = self.version
+            await self._load(session, today)
+            self.loads += 1
+            # A commit that raced the load leaves the index stale
+            if version == self.version:
+                self._loaded_at = time.monotonic()
+
+    async def _load(self, session: AsyncSession, today: date):
+        rooms = [
+            RoomRef(r.id, r.room_code, r.room_name)
+            for r in (await session.exec(select(Classroom.id, Classroom.room_code, Classroom.room_name))).all()
+        ]
+        courses = [
+            CourseRef(c.id, c.course_code, c.course_name, c.classroom_id, c.lecturer_id)
+            for c in (await session.exec(select(
+                Course.id, Course.course_code, Course.course_name, Course.classroom_id, Course.lecturer_id
+            ))).all()
+        ]
+        sessions = (await session.exec(select(
+            ClassSession.id, ClassSession.timetable_slot_id, ClassSession.course_id, ClassSession.classroom_id,
+            ClassSession.lecturer_id, ClassSession.start_time, ClassSession.end_time
+        ).where(ClassSession.session_date == today))).all()
+        slots = (await session.exec(select(
+            TimetableSlot.id, TimetableSlot.course_id, TimetableSlot.classroom_id, TimetableSlot.lecturer_id,
+            TimetableSlot.start_time, TimetableSlot.end_time
+        ).where(slots_running_on(today)))).all()
+
+        intervals = [
+            Interval(s.start_time, s.end_time, s.id, s.timetable_slot_id, s.course_id, s.classroom_id, s.lecturer_id)
+            for s in sessions
+        ]
+        # A slot that already has today's session is represented by that session
+        held = {s.timetable_slot_id for s in sessions if s.timetable_slot_id}
+        intervals += [
+            Interval(s.start_time, s.end_time, None, s.id, s.course_id, s.classroom_id, s.lecturer_id)
+            for s in slots if s.id not in held
+        ]
+        intervals.sort(key=lambda i: (i.start, i.end))
+
+        by_room: Dict[UUID, List[Interval]] = {}
+        by_course: Dict[UUID, List[Interval]] = {}
+        for interval in intervals:
+            if interval.classroom_id:
+                by_room.setdefault(interval.classroom_id, []).append(interval)
+            by_course.setdefault(interval.course_id, []).append(interval)
+
+        self._rooms = {r.id: r for r in rooms}
+        self._rooms_by_code = {r.room_code: r for r in rooms}
+        self._courses = {c.id: c for c in courses}
+        self._courses_by_code = {c.course_code: c for c in courses}
+        self._by_room = {k: ([i.start for i in v], v) for k, v in by_room.items()}
+        self._by_course = {k: ([i.start for i in v], v) for k, v in by_course.items()}
+        self._day = today
+        print(f"Schedule index built for {today}: {len(sessions)} sessions, {len(intervals) - len(sessions)} open slots")
+
+    # --- Lookups (call ensure() first) ---
+
+    def room(self, room_id: Any) -> Optional[RoomRef]:
+        return self._rooms.get(room_id)
+
+    def room_by_code(self, room_code: str) -> Optional[RoomRef]:
+        return self._rooms_by_code.get(room_code)
+
+    def course(self, course_id: Any) -> Optional[CourseRef]:
+        return self._courses.get(course_id)
+
+    def course_by_code(self, course_code: str) -> Optional[CourseRef]:
+        return self._courses_by_code.get(course_code)
+
+    def for_course(self, course_id: UUID, moment: dtime) -> Optional[Interval]:
+        """
+        Today's entry for a course scan: the session running now, else any
+        session today, else any of today's slots (which still needs a session).
+        """
+        self.resolved += 1
+        starts, intervals = self._by_course.get(course_id, ([], []))
+        for candidates in (_covering(starts, intervals, moment), intervals):
+            for interval in candidates:
+                if interval.session_id:
+                    return interval
+        return intervals[0] if intervals else None
+
+    def for_room(self, room_id: UUID, moment: dtime) -> Optional[Interval]:
+        """The session running in a room now, else the slot scheduled there now (which still needs a session)."""
+        self.resolved += 1
+        starts, intervals = self._by_room.get(room_id, ([], []))
+        covering = _covering(starts, intervals, moment)
+        for interval in covering:
+            if interval.session_id:
+                return interval
+        return covering[0] if covering else None
+
+    def creating(self, key: Any) -> asyncio.Lock:
+        """Lock to hold while creating the session for a slot or ad-hoc course; re-resolve once acquired."""
+        if len(self._creating) > 1000:
+            self._creating = {k: v for k, v in self._creating.items() if v.locked()}
+        return self._creating.setdefault(key, asyncio.Lock())
+
+    # --- Invalidation ---
+
+    def _drop(self):
+        self.version += 1
+        self._loaded_at = None
+
+    def invalidate(self):
+        """Force a rebuild here and on the other workers."""
+        self._drop()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        loop.create_task(redis_client.publish(SCHEDULE_INDEX_CHANNEL, self._worker_id, {"invalidate": True}))
+
+    def _on_remote(self, payload: dict):
+        self._drop()
+
+    def start_sync(self):
+        if self._listener is None:
+            self._listener = asyncio.get_running_loop().create_task(
+                redis_client.listen(SCHEDULE_INDEX_CHANNEL, self._worker_id, self._on_remote)
+            )
+
+    async def stop_sync(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._listener = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "day": self._day.isoformat() if self._day else None,
+            "fresh": self._fresh(get_eat_time().date()),
+            "rooms": len(self._rooms),
+            "courses": len(self._courses),
+            "intervals": sum(len(v[1]) for v in self._by_course.values()),
+            "resolved": self.resolved,
+            "loads": self.loads,
+        }
+
+
+schedule_index = ScheduleIndex()
+
+
+# --- ORM hooks: note schedule writes on flush, rebuild once they commit ---
+
+def _stage(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info["schedule_changed"] = True
+
+
+for _model in (Classroom, Course, TimetableSlot, ClassSession):
+    for _event in ("after_insert", "after_update", "after_delete"):
+        event.listen(_model, _event, _stage)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_schedule_changes(session):
+    if session.info.pop("schedule_changed", None):
+        schedule_index.invalidate()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_schedule_changes(session, previous_transaction):
+    session.info.pop("schedule_changed", None)
@@ -0,0 +1,277 @@
+import contextvars
+import functools
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional, Dict, List, Any, Tuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# "always" attaches Server-Timing to every timed response; otherwise only when the
+# client asks with an "X-Debug-Timing: 1" header (guard console debug mode)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "").lower()
+DEBUG_TIMING_HEADER = b"x-debug-timing"
+
+# Histogram upper bounds; durations in milliseconds, the last bucket is open-ended
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+TOTAL = "total"
+UNATTRIBUTED = "other"
+COMMIT = "commit"
+
+
+class RequestTimer:
+    """Stage durations and SQL statement count for one request."""
+
+    __slots__ = ("endpoint", "started", "stages", "queries", "sql_seconds", "depth", "_commit_started", "_sql_started")
+
+    def __init__(self):
+        self.endpoint: Optional[str] = None
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.depth = 0
+        self._commit_started: Optional[float] = None
+        self._sql_started: Optional[float] = None
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        total_ms = self.elapsed() * 1000
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages.items()]
+        parts.append(f'sql;dur={self.sql_seconds * 1000:.2f};desc="{self.queries} queries"')
+        parts.append(f"{TOTAL};dur={total_ms:.2f}")
+        return ", ".join(parts)
+
+
+_current: contextvars.ContextVar[Optional[RequestTimer]] = contextvars.ContextVar("request_timer", default=None)
+
+
+class Histogram:
+    """Fixed-bucket histogram; cheap enough to update on every request."""
+
+    __slots__ = ("bounds", "counts", "count", "total", "max")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        index = len(self.bounds)
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th observation (the max for the open bucket)."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 3) if self.count else None,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": round(self.max, 3),
+            "buckets": {
+                **{f"le_{bound}": n for bound, n in zip(self.bounds, self.counts)},
+                "le_inf": self.counts[-1],
+            },
+        }
+
+
+class TimingStats:
+    """In-process aggregate of RequestTimers, per endpoint and stage (this worker only)."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.since = time.time()
+        self._stages: Dict[str, Dict[str, Histogram]] = {}
+        self._queries: Dict[str, Histogram] = {}
+
+    def record(self, timer: RequestTimer):
+        endpoint = timer.endpoint
+        stages = self._stages.setdefault(endpoint, {})
+        total_ms = timer.elapsed() * 1000
+        attributed_ms = 0.0
+        for name, seconds in list(timer.stages.items()) + [("sql", timer.sql_seconds)]:
+            if name not in stages:
+                stages[name] = Histogram(LATENCY_BUCKETS_MS)
+            stages[name].observe(seconds * 1000)
+            if name != "sql":
+                attributed_ms += seconds * 1000
+        for name, value in ((UNATTRIBUTED, max(0.0, total_ms - attributed_ms)), (TOTAL, total_ms)):
+            if name not in stages:
+                stages[name] = Histogram(LATENCY_BUCKETS_MS)
+            stages[name].observe(value)
+        if endpoint not in self._queries:
+            self._queries[endpoint] = Histogram(QUERY_BUCKETS)
+        self._queries[endpoint].observe(timer.queries)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "worker_pid": os.getpid(),
+            "since": self.since,
+            "unit": "ms",
+            "endpoints": {
+                endpoint: {
+                    "requests": stages[TOTAL].count,
+                    "stages": {name: hist.snapshot() for name, hist in stages.items()},
+                    "queries_per_request": self._queries[endpoint].snapshot(),
+                }
+                for endpoint, stages in self._stages.items()
+            },
+        }
+
+
+timing_stats = TimingStats()
+
+
+# --- Instrumentation API ---
+
+def current() -> Optional[RequestTimer]:
+    return _current.get()
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block as a named stage of the current request; a no-op outside a timed request."""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    timer.depth += 1
+    try:
+        yield
+    finally:
+        timer.depth -= 1
+        timer.add(stage, time.perf_counter() - started)
+
+
+def timed(endpoint: str):
+    """Name the endpoint a route's timings are aggregated under (place below the route decorator)."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            timer = _current.get()
+            if timer is not None:
+                timer.endpoint = endpoint
+            return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def measure(endpoint: str):
+    """Time one unit of work outside an HTTP request (e.g. a WebSocket scan frame) under endpoint."""
+    timer = RequestTimer()
+    timer.endpoint = endpoint
+    token = _current.set(timer)
+    try:
+        yield timer
+    finally:
+        _current.reset(token)
+        timing_stats.record(timer)
+
+
+# --- SQL hooks ---
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timer = _current.get()
+    if timer is not None:
+        timer.queries += 1
+        timer._sql_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timer = _current.get()
+    if timer is not None and timer._sql_started is not None:
+        timer.sql_seconds += time.perf_counter() - timer._sql_started
+        timer._sql_started = None
+
+
+def _before_commit(session):
+    timer = _current.get()
+    # Commits inside an explicit span (e.g. a synchronous audit write) belong to that span
+    if timer is not None and timer.depth == 0:
+        timer._commit_started = time.perf_counter()
+
+
+def _after_commit(session):
+    timer = _current.get()
+    if timer is not None and timer._commit_started is not None:
+        timer.add(COMMIT, time.perf_counter() - timer._commit_started)
+        timer._commit_started = None
+
+
+def install(engine):
+    """Hook SQL statement counting and commit timing into the engine (call once at import)."""
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Session, "before_commit", _before_commit)
+    event.listen(Session, "after_commit", _after_commit)
+
+
+# --- ASGI middleware ---
+
+class RequestTimingMiddleware:
+    """
+    Starts a RequestTimer for every HTTP request. Requests that reached a @timed
+    route are recorded into timing_stats and, when enabled, answered with a
+    Server-Timing header listing the stage durations and SQL count.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timer = RequestTimer()
+        token = _current.set(timer)
+        wants_header = SERVER_TIMING in ("1", "true", "always") or any(
+            name == DEBUG_TIMING_HEADER and value.strip() in (b"1", b"true") for name, value in scope.get("headers", ())
+        )
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start" and wants_header and timer.endpoint:
+                headers: List = list(message.get("headers", []))
+                headers.append((b"server-timing", timer.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            if timer.endpoint:
+                timing_stats.record(timer)
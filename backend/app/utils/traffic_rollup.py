@@ -0,0 +1,206 @@
+from collections import Counter
+from datetime import datetime
+from typing import Optional, Dict, List, Tuple, Any
+from uuid import UUID, uuid4
+from sqlalchemy import event, inspect, delete, or_, null
+from sqlalchemy.orm import Session, object_session
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.models import EntryLog, VehicleLog, GateTrafficHourly
+
+# Gate entries with any other status count as rejected (VehicleLog has no status)
+ALLOWED = "allowed"
+BACKFILL_CHUNK = 5000
+
+# model -> counter column prefix
+_TRACKED = {
+    EntryLog: "people",
+    VehicleLog: "vehicles",
+}
+_STATE = ("gate_id", "exit_gate_id", "entry_time", "exit_time", "status")
+
+# (gate_id, hour) -> {counter column: delta}
+Deltas = Dict[Tuple[UUID, datetime], Counter]
+
+
+def hour_bucket(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def contributions(prefix: str, gate_id, exit_gate_id, entry_time, exit_time, status=None) -> Counter:
+    """What one log row adds to the rollup: its entry (or rejection) and, once closed, its exit."""
+    counts = Counter()
+    if gate_id is None or entry_time is None:
+        return counts
+    if status is not None and status != ALLOWED:
+        counts[(gate_id, hour_bucket(entry_time), "rejected")] += 1
+        return counts
+    counts[(gate_id, hour_bucket(entry_time), f"{prefix}_in")] += 1
+    if exit_time is not None:
+        counts[(exit_gate_id or gate_id, hour_bucket(exit_time), f"{prefix}_out")] += 1
+    return counts
+
+
+def _state(target, old: bool) -> Tuple:
+    """Row values as last written to the database (old=True) or as about to be (old=False)."""
+    state = inspect(target)
+    values = []
+    for name in _STATE:
+        if name not in state.attrs:
+            values.append(None)
+            continue
+        history = state.attrs[name].history
+        if old and history.deleted:
+            values.append(history.deleted[0])
+        else:
+            values.append(getattr(target, name))
+    return tuple(values)
+
+
+def _as_deltas(counts: Counter) -> Deltas:
+    deltas: Deltas = {}
+    for (gate_id, hour, column), n in counts.items():
+        if n:
+            deltas.setdefault((gate_id, hour), Counter())[column] += n
+    return deltas
+
+
+def _upsert_statement(dialect: str, rows: List[Dict[str, Any]]):
+    """INSERT of rows that adds to the counters of any (gate_id, hour) row already present."""
+    table = GateTrafficHourly.__table__
+    columns = ("people_in", "people_out", "vehicles_in", "vehicles_out", "rejected")
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table).values(rows)
+        return stmt.on_duplicate_key_update({c: table.c[c] + stmt.inserted[c] for c in columns})
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(table).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=["gate_id", "hour"], set_={c: table.c[c] + stmt.excluded[c] for c in columns}
+    )
+
+
+def _rows(deltas: Deltas) -> List[Dict[str, Any]]:
+    return [
+        {
+            "id": uuid4(), "gate_id": gate_id, "hour": hour,
+            "people_in": counts["people_in"], "people_out": counts["people_out"],
+            "vehicles_in": counts["vehicles_in"], "vehicles_out": counts["vehicles_out"],
+            "rejected": counts["rejected"],
+        }
+        for (gate_id, hour), counts in deltas.items() if any(counts.values())
+    ]
+
+
+# --- Reads ---
+
+async def hourly(session: AsyncSession, start: datetime, end: Optional[datetime] = None,
+                 gate_id: Optional[UUID] = None) -> List[GateTrafficHourly]:
+    """Rollup rows with start <= hour < end, across all gates unless gate_id is given."""
+    query = select(GateTrafficHourly).where(GateTrafficHourly.hour >= hour_bucket(start))
+    if end is not None:
+        query = query.where(GateTrafficHourly.hour < end)
+    if gate_id is not None:
+        query = query.where(GateTrafficHourly.gate_id == gate_id)
+    return (await session.exec(query.order_by(GateTrafficHourly.hour))).all()
+
+
+# --- Backfill ---
+
+async def rebuild(session: AsyncSession, since: Optional[datetime] = None) -> int:
+    """
+    Recompute the rollup from entry_logs and vehicle_logs for every hour from
+    `since` (all history when None) and commit. Returns the number of rollup rows
+    written. Scans arriving while this runs can be counted twice for the hours
+    being rebuilt, so run it before opening the gates or for past hours only.
+    """
+    since = hour_bucket(since) if since else None
+    cleared = delete(GateTrafficHourly)
+    if since:
+        cleared = cleared.where(GateTrafficHourly.hour >= since)
+    await session.execute(cleared)
+
+    counts = Counter()
+    for model, prefix in _TRACKED.items():
+        status = getattr(model, "status", None)
+        query = select(model.gate_id, model.exit_gate_id, model.entry_time, model.exit_time,
+                       status if status is not None else null())
+        if since:
+            query = query.where(or_(model.entry_time >= since, model.exit_time >= since))
+        result = await session.stream(query.execution_options(yield_per=BACKFILL_CHUNK))
+        async for partition in result.partitions():
+            for row in partition:
+                counts.update(contributions(prefix, *row))
+    if since:
+        counts = Counter({key: n for key, n in counts.items() if key[1] >= since})
+
+    rows = _rows(_as_deltas(counts))
+    dialect = (await session.connection()).dialect.name
+    for start in range(0, len(rows), BACKFILL_CHUNK):
+        await session.execute(_upsert_statement(dialect, rows[start:start + BACKFILL_CHUNK]))
+    await session.commit()
+    return len(rows)
+
+
+async def refresh(since: Optional[datetime] = None):
+    """Rebuild with a private session (after bulk SQL that bypasses the ORM events)."""
+    from app.database import engine
+    try:
+        async with AsyncSession(engine) as session:
+            written = await rebuild(session, since)
+        print(f"Gate traffic rollup rebuilt: {written} hourly rows")
+    except Exception as e:
+        print(f"Gate traffic rollup rebuild failed: {e}")
+
+
+async def check(session: AsyncSession):
+    """Warn at boot when there is gate history but no rollup (backfill never run)."""
+    if (await session.exec(select(GateTrafficHourly.id).limit(1))).first():
+        return
+    if (await session.exec(select(EntryLog.id).limit(1))).first() or (await session.exec(select(VehicleLog.id).limit(1))).first():
+        print("WARNING: gate_traffic_hourly is empty but gate logs exist; run `python backfill_gate_traffic.py`")
+
+
+# --- ORM hooks: diff each flushed log row, upsert the totals before the flush ends ---
+
+def _stage(target, counts: Counter):
+    session = object_session(target)
+    if session is not None and counts:
+        session.info.setdefault("traffic_deltas", Counter()).update(counts)
+
+
+def _register(model, prefix: str):
+    @event.listens_for(model, "after_insert")
+    def _after_insert(mapper, connection, target):
+        _stage(target, contributions(prefix, *_state(target, old=False)))
+
+    @event.listens_for(model, "after_update")
+    def _after_update(mapper, connection, target):
+        counts = contributions(prefix, *_state(target, old=False))
+        counts.subtract(contributions(prefix, *_state(target, old=True)))
+        _stage(target, counts)
+
+    @event.listens_for(model, "after_delete")
+    def _after_delete(mapper, connection, target):
+        counts = Counter()
+        counts.subtract(contributions(prefix, *_state(target, old=True)))
+        _stage(target, counts)
+
+
+for _model, _prefix in _TRACKED.items():
+    _register(_model, _prefix)
+
+
+@event.listens_for(Session, "after_flush")
+def _write_traffic_deltas(session, flush_context):
+    counts = session.info.pop("traffic_deltas", None)
+    if not counts:
+        return
+    rows = _rows(_as_deltas(counts))
+    if rows:
+        # Same transaction as the log rows, so a rollback drops both
+        connection = session.connection()
+        connection.execute(_upsert_statement(connection.dialect.name, rows))
@@ -0,0 +1,75 @@
+import asyncio
+import ipaddress
+import os
+import time
+from typing import Optional, List, Set, Mapping, Union
+
+# Peers whose X-Real-IP / X-Forwarded-For headers are believed, comma-separated: IPs, CIDRs or
+# hostnames (e.g. the nginx service name under docker compose). Anyone else could send any
+# address in those headers, so other peers are known by the address they connect from.
+TRUSTED_PROXIES = [p.strip() for p in os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1").split(",") if p.strip()]
+# Seconds a proxy hostname's addresses are kept before it is looked up again
+TRUSTED_PROXY_RESOLVE_TTL = 60
+
+
+class TrustedProxies:
+    """
+    Works out the address a request really came from. Headers naming the client
+    are honoured only when the connecting peer is one of the configured proxies;
+    a forwarded chain is walked back from the nearest hop past any of our own
+    proxies, so a client cannot pick its address by prepending entries.
+    """
+
+    def __init__(self, entries: List[str]):
+        self._networks = []
+        self._hosts = []
+        for entry in entries:
+            try:
+                self._networks.append(ipaddress.ip_network(entry, strict=False))
+            except ValueError:
+                self._hosts.append(entry)
+        self._resolved: Set[Union[ipaddress.IPv4Address, ipaddress.IPv6Address]] = set()
+        self._resolved_at: Optional[float] = None
+
+    async def _refresh(self):
+        if not self._hosts:
+            return
+        if self._resolved_at is not None and time.monotonic() - self._resolved_at < TRUSTED_PROXY_RESOLVE_TTL:
+            return
+        self._resolved_at = time.monotonic()
+        loop = asyncio.get_running_loop()
+        resolved = set()
+        for host in self._hosts:
+            try:
+                infos = await loop.getaddrinfo(host, None)
+            except OSError as e:
+                print(f"Trusted proxy {host} not resolved: {e}")
+                continue
+            resolved.update(ipaddress.ip_address(info[4][0]) for info in infos)
+        self._resolved = resolved
+
+    def trusted(self, address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return ip in self._resolved or any(ip in network for network in self._networks)
+
+    async def client_ip(self, peer: Optional[str], headers: Mapping[str, str]) -> str:
+        """The caller's address: peer itself unless peer is a trusted proxy that named the client."""
+        if not peer:
+            return "unknown"
+        await self._refresh()
+        if not self.trusted(peer):
+            return peer
+        real_ip = (headers.get("x-real-ip") or "").strip()
+        if real_ip and not self.trusted(real_ip):
+            return real_ip
+        chain = [a.strip() for a in (headers.get("x-forwarded-for") or "").split(",") if a.strip()]
+        for address in reversed(chain):
+            if not self.trusted(address):
+                return address
+        return peer
+
+
+trusted_proxies = TrustedProxies(TRUSTED_PROXIES)
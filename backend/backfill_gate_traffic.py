@@ -0,0 +1,41 @@
+"""
+Rebuild the gate_traffic_hourly rollup from entry_logs and vehicle_logs.
+
+Run once after deploying the rollup (the app keeps it current from then on),
+or with --days to repair recent hours after bulk imports that bypass the ORM.
+
+    python backfill_gate_traffic.py            # all history
+    python backfill_gate_traffic.py --days 7   # the last week only
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.database import engine, init_db
+from app.utils import traffic_rollup
+from app.utils.timezone import get_eat_time
+
+
+async def main(since):
+    await init_db()
+    started = datetime.now()
+    async with AsyncSession(engine) as session:
+        written = await traffic_rollup.rebuild(session, since)
+    scope = f"since {since:%Y-%m-%d %H:00}" if since else "for all history"
+    print(f"Wrote {written} hourly rollup rows {scope} in {(datetime.now() - started).total_seconds():.1f}s")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--days", type=int, help="Only rebuild the last N days")
+    group.add_argument("--since", help="Only rebuild from this EAT date/time (YYYY-MM-DD or YYYY-MM-DDTHH:MM)")
+    args = parser.parse_args()
+
+    since = None
+    if args.days:
+        since = get_eat_time() - timedelta(days=args.days)
+    elif args.since:
+        since = datetime.fromisoformat(args.since)
+    asyncio.run(main(since))
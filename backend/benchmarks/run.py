@@ -0,0 +1,300 @@
+"""
+Load-test the scan hot paths in-process and write the results as JSON.
+
+    cd backend
+    python -m benchmarks.run --students 2000 --requests 1000 --concurrency 32
+
+The app is driven through httpx's ASGI transport, so no server, network or
+other services are needed. By default a fresh SQLite file is used as a stand-in
+for MySQL; pass --database-url to benchmark against a real (local) database.
+See benchmarks/README.md for what each workload does.
+"""
+import argparse
+import asyncio
+import contextvars
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+ENDPOINTS = {
+    "gate_scan": ("POST", "/api/gate/scan"),
+    # Before verify_scan, which also records attendance for the same live sessions
+    "attendance_mark": ("POST", "/api/attendance/mark"),
+    "verify_scan": ("POST", "/api/timetable/verify-scan"),
+    "gps_log": ("POST", "/api/fleet/gps-logs"),
+}
+
+# Per-request SQL statement counter; None outside a benchmarked request
+_query_counter: contextvars.ContextVar = contextvars.ContextVar("bench_query_counter", default=None)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the SmartCampus scan hot paths.")
+    parser.add_argument("--database-url", help="Async SQLAlchemy URL (default: fresh SQLite file in --workdir)")
+    parser.add_argument("--workdir", help="Directory for the SQLite file and uploaded evidence (default: a temp dir)")
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--vehicles", type=int, default=300)
+    parser.add_argument("--visitors", type=int, default=200)
+    parser.add_argument("--rooms", type=int, default=40)
+    parser.add_argument("--slots", type=int, default=200, help="Timetable slots (at least one per room)")
+    parser.add_argument("--requests", type=int, default=500, help="Measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests per endpoint before timing")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS),
+                        help=f"Comma separated subset of: {', '.join(ENDPOINTS)}")
+    parser.add_argument("--image-size", type=int, default=640, help="Width of the attendance selfie in pixels")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON file to write (default: benchmarks/results/<commit>-<time>.json)")
+    args = parser.parse_args(argv)
+    unknown = set(args.endpoints.split(",")) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    return args
+
+
+def git_commit() -> dict:
+    def git(*cmd):
+        return subprocess.run(["git", *cmd], cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip()
+    try:
+        return {"commit": git("rev-parse", "HEAD") or None, "dirty": bool(git("status", "--porcelain"))}
+    except OSError:
+        return {"commit": None, "dirty": None}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * pct // 100))
+    return values[int(rank) - 1]
+
+
+def summarize(samples, duration):
+    latencies = sorted(s[0] * 1000 for s in samples)
+    queries = sorted(s[1] for s in samples)
+    codes = {}
+    for _, _, status in samples:
+        codes[str(status)] = codes.get(str(status), 0) + 1
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for s in samples if not 200 <= s[2] < 300),
+        "status_codes": codes,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(samples) / duration, 1) if duration else None,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else None,
+            "p50": round(percentile(latencies, 50), 2) if latencies else None,
+            "p95": round(percentile(latencies, 95), 2) if latencies else None,
+            "p99": round(percentile(latencies, 99), 2) if latencies else None,
+            "max": round(latencies[-1], 2) if latencies else None,
+        },
+        "queries_per_request": {
+            "mean": round(sum(queries) / len(queries), 2) if queries else None,
+            "p50": percentile(queries, 50),
+            "p95": percentile(queries, 95),
+            "max": queries[-1] if queries else None,
+        },
+    }
+
+
+def selfie_jpeg(width: int) -> bytes:
+    """A JPEG with camera EXIF, so /attendance/mark takes its normal (unflagged) path."""
+    from PIL import Image
+    image = Image.new("RGB", (width, width * 3 // 4), (120, 140, 160))
+    exif = Image.Exif()
+    exif[271] = "BenchCam"
+    exif[272] = "Model B"
+    exif[306] = datetime.now().strftime("%Y:%m:%d %H:%M:%S")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85, exif=exif)
+    return buffer.getvalue()
+
+
+def build_workloads(campus, names, total, args):
+    """Request factories per endpoint; each call returns httpx request kwargs."""
+    from app.auth import create_access_token
+    rng = random.Random(args.seed)
+    tokens = {}
+
+    def auth(number):
+        if number not in tokens:
+            tokens[number] = {"Authorization": f"Bearer {create_access_token(data={'sub': number})}"}
+        return tokens[number]
+
+    def gate_scan():
+        roll = rng.random()
+        if roll < 0.70 and campus.student_numbers:
+            code = rng.choice(campus.student_numbers)
+        elif roll < 0.90 and campus.plates:
+            code = rng.choice(campus.plates)
+        elif roll < 0.95 and campus.visitor_id_numbers:
+            code = rng.choice(campus.visitor_id_numbers)
+        else:
+            code = f"UNKNOWN-{rng.randint(0, 10 ** 6)}"
+        return {"json": {"admission_number": code}}
+
+    def verify_scan():
+        return {
+            "json": {"room_code": rng.choice(campus.room_codes), "latitude": -1.2921, "longitude": 36.8219},
+            "headers": auth(rng.choice(campus.student_numbers)),
+        }
+
+    # Walk distinct (student, session) pairs so marks are first-time, not duplicates
+    pairs = [(s, q) for q in campus.live_sessions for s in campus.student_numbers]
+    rng.shuffle(pairs)
+    pair_iter = iter(pairs)
+    image = selfie_jpeg(args.image_size) if "attendance_mark" in names else b""
+    mark_meta = json.dumps({"geolocation": {"lat": -1.2921, "lng": 36.8219}, "connection": {"type": "wifi"}})
+
+    def attendance_mark():
+        number, (session_id, qr_code) = next(pair_iter, None) or (
+            rng.choice(campus.student_numbers), rng.choice(campus.live_sessions))
+        return {
+            "data": {"session_id": str(session_id), "qr_content": qr_code, "metadata": mark_meta},
+            "files": {"file": ("selfie.jpg", image, "image/jpeg")},
+            "headers": auth(number),
+        }
+
+    def gps_log():
+        return {"json": {
+            "vehicle_id": str(rng.choice(campus.fleet_vehicle_ids)),
+            "latitude": -1.29 + rng.uniform(-0.01, 0.01),
+            "longitude": 36.82 + rng.uniform(-0.01, 0.01),
+            "speed": round(rng.uniform(0, 60), 1),
+            "heading": round(rng.uniform(0, 360), 1),
+            "ignition_status": True,
+        }}
+
+    factories = {
+        "gate_scan": (gate_scan, True),
+        "verify_scan": (verify_scan, bool(campus.room_codes and campus.student_numbers)),
+        "attendance_mark": (attendance_mark, bool(campus.live_sessions and campus.student_numbers)),
+        "gps_log": (gps_log, bool(campus.fleet_vehicle_ids)),
+    }
+    workloads = {}
+    for name in names:
+        factory, possible = factories[name]
+        if not possible:
+            print(f"Skipping {name}: the seeded campus has no data for it")
+            continue
+        # Build every request up front so payload generation stays out of the timings
+        workloads[name] = [factory() for _ in range(total)]
+    return workloads
+
+
+async def drive(client, method, path, requests, concurrency):
+    """Send requests with `concurrency` in flight; returns ([(seconds, queries, status)], wall seconds)."""
+    samples = []
+    pending = iter(requests)
+
+    async def worker():
+        for kwargs in pending:
+            counter = [0]
+            token = _query_counter.set(counter)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+                status = response.status_code
+            except Exception as e:
+                print(f"{path} raised {type(e).__name__}: {e}")
+                status = 599
+            finally:
+                _query_counter.reset(token)
+            samples.append((time.perf_counter() - started, counter[0], status))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return samples, time.perf_counter() - started
+
+
+async def main(args):
+    import httpx
+    from sqlalchemy import event
+    from sqlalchemy.orm import sessionmaker
+    from sqlmodel.ext.asyncio.session import AsyncSession
+    from app.database import engine, init_db
+    from app.main import app
+    from benchmarks.seed import seed_campus
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        counter = _query_counter.get()
+        if counter is not None:
+            counter[0] += 1
+
+    # Seed before startup so the identity index and presence table warm with the campus
+    await init_db()
+    async with sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)() as session:
+        campus = await seed_campus(session, args.students, args.vehicles, args.visitors,
+                                   args.rooms, args.slots, seed=args.seed)
+
+    names = args.endpoints.split(",")
+    workloads = build_workloads(campus, names, args.warmup + args.requests, args)
+    results = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            for name, requests in workloads.items():
+                method, path = ENDPOINTS[name]
+                print(f"Benchmarking {name} ({path}): {args.requests} requests at concurrency {args.concurrency}")
+                await drive(client, method, path, requests[:args.warmup], args.concurrency)
+                samples, duration = await drive(client, method, path, requests[args.warmup:], args.concurrency)
+                results[name] = {"method": method, "path": path, **summarize(samples, duration)}
+
+    report = {
+        "meta": {
+            "started_at": args.started_at,
+            "git": git_commit(),
+            "database": engine.url.get_backend_name(),
+            "database_driver": engine.url.get_driver_name(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("database_url", "started_at")},
+        },
+        "dataset": campus.counts(),
+        "endpoints": results,
+    }
+    return report
+
+
+def print_summary(report):
+    print(f"\n{'endpoint':<18}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'q/req':>8}{'errors':>8}")
+    for name, r in report["endpoints"].items():
+        lat = r["latency_ms"]
+        print(f"{name:<18}{r['throughput_rps']:>9}{lat['p50']:>10}{lat['p95']:>10}{lat['p99']:>10}"
+              f"{r['queries_per_request']['mean']:>8}{r['errors']:>8}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.started_at = datetime.now().isoformat(timespec="seconds")
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="smartcampus-bench-")).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    args.workdir = str(workdir)
+    # The app reads DATABASE_URL at import time and writes static/ and uploads/ relative to the cwd
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{workdir / 'bench.sqlite'}"
+    sys.path.insert(0, str(BACKEND_DIR))
+    os.chdir(workdir)
+
+    report = asyncio.run(main(args))
+
+    output = Path(args.output) if args.output else RESULTS_DIR / (
+        f"{(report['meta']['git']['commit'] or 'nogit')[:10]}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    if not output.is_absolute():
+        output = BACKEND_DIR / output
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print_summary(report)
+    print(f"\nResults written to {output}")
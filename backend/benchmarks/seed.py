@@ -0,0 +1,272 @@
+"""
+Synthetic campus for the scan hot-path benchmarks.
+
+Every row is tagged with a BENCH prefix so a run can be pointed at an existing
+database without touching real data, and a second run against the same
+database reuses the campus instead of seeding it again. Generation is driven
+by a seeded random.Random, so the same arguments always build the same campus.
+"""
+import random
+from dataclasses import dataclass, field
+from datetime import time, timedelta
+from typing import List
+from uuid import UUID
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.models import (
+    Role, User, Vehicle, Visitor, Classroom, Course,
+    StudentCourseRegistration, TimetableSlot, ClassSession,
+)
+from app.auth import get_password_hash
+from app.utils.timezone import get_eat_time
+
+PREFIX = "BENCH"
+STUDENT_PASSWORD = "Bench123!"
+CHUNK = 1000
+
+
+@dataclass
+class Campus:
+    """Identifiers the workloads draw from."""
+    student_ids: List[UUID] = field(default_factory=list)
+    student_numbers: List[str] = field(default_factory=list)
+    plates: List[str] = field(default_factory=list)
+    fleet_vehicle_ids: List[UUID] = field(default_factory=list)
+    visitor_id_numbers: List[str] = field(default_factory=list)
+    room_codes: List[str] = field(default_factory=list)
+    # (session_id, qr_code) of the class sessions live today
+    live_sessions: List[tuple] = field(default_factory=list)
+    timetable_slots: int = 0
+
+    def counts(self) -> dict:
+        return {
+            "students": len(self.student_ids),
+            "vehicles": len(self.plates),
+            "fleet_vehicles": len(self.fleet_vehicle_ids),
+            "visitors": len(self.visitor_id_numbers),
+            "rooms": len(self.room_codes),
+            "timetable_slots": self.timetable_slots,
+            "live_sessions": len(self.live_sessions),
+        }
+
+
+def student_number(i: int) -> str:
+    return f"{PREFIX}-STU-{i:06d}"
+
+
+def plate_number(i: int) -> str:
+    # Kenyan-style plates: three letters, three digits, one letter
+    letters = "ABCDEFGHJKLMNPRSTUVWXYZ"
+    return f"K{letters[i // 1000 % len(letters)]}{letters[i // 23 % len(letters)]} {i % 1000:03d}{letters[i % len(letters)]}"
+
+
+async def _add_all(session: AsyncSession, rows: list):
+    for start in range(0, len(rows), CHUNK):
+        session.add_all(rows[start:start + CHUNK])
+        await session.commit()
+
+
+async def _get_role(session: AsyncSession, name: str) -> Role:
+    role = (await session.exec(select(Role).where(Role.name == name))).first()
+    if not role:
+        role = Role(name=name, description=f"{name} role")
+        session.add(role)
+        await session.commit()
+        await session.refresh(role)
+    return role
+
+
+async def load_campus(session: AsyncSession) -> Campus:
+    """Read back the BENCH rows already in the database."""
+    campus = Campus()
+    students = (await session.exec(
+        select(User.id, User.admission_number).where(User.admission_number.like(f"{PREFIX}-STU-%"))
+        .order_by(User.admission_number)
+    )).all()
+    campus.student_ids = [s[0] for s in students]
+    campus.student_numbers = [s[1] for s in students]
+
+    vehicles = (await session.exec(
+        select(Vehicle.id, Vehicle.plate_number, Vehicle.is_fleet).where(Vehicle.make == PREFIX)
+        .order_by(Vehicle.plate_number)
+    )).all()
+    campus.plates = [v[1] for v in vehicles]
+    campus.fleet_vehicle_ids = [v[0] for v in vehicles if v[2]]
+
+    campus.visitor_id_numbers = list((await session.exec(
+        select(Visitor.id_number).where(Visitor.id_number.like(f"{PREFIX}%")).order_by(Visitor.id_number)
+    )).all())
+
+    rooms = (await session.exec(
+        select(Classroom.id, Classroom.room_code).where(Classroom.room_code.like(f"{PREFIX}-R%"))
+        .order_by(Classroom.room_code)
+    )).all()
+    campus.room_codes = [r[1] for r in rooms]
+    room_ids = [r[0] for r in rooms]
+
+    if room_ids:
+        campus.timetable_slots = len((await session.exec(
+            select(TimetableSlot.id).where(TimetableSlot.classroom_id.in_(room_ids))
+        )).all())
+        campus.live_sessions = [tuple(s) for s in (await session.exec(
+            select(ClassSession.id, ClassSession.qr_code).where(
+                ClassSession.classroom_id.in_(room_ids),
+                ClassSession.session_date == get_eat_time().date(),
+                ClassSession.active == True,
+            )
+        )).all()]
+    return campus
+
+
+async def seed_campus(session: AsyncSession, students: int, vehicles: int, visitors: int,
+                      rooms: int, slots: int, courses_per_student: int = 3, seed: int = 42) -> Campus:
+    """
+    Create the synthetic campus unless one already exists.
+
+    Each room gets one course and one timetable slot covering the whole of
+    today (so verify-scan always finds a live class) plus an active ClassSession
+    with a known QR token for /attendance/mark. Remaining slots are spread
+    across the rest of the week.
+    """
+    existing = await load_campus(session)
+    if existing.student_ids:
+        print(f"Reusing existing benchmark campus: {existing.counts()}")
+        return existing
+
+    rng = random.Random(seed)
+    now = get_eat_time()
+    today = now.date()
+    student_role = await _get_role(session, "Student")
+    lecturer_role = await _get_role(session, "Lecturer")
+    # One bcrypt hash for everyone; hashing per row would dominate seeding time
+    hashed = get_password_hash(STUDENT_PASSWORD)
+
+    print(f"Seeding benchmark campus: {students} students, {vehicles} vehicles, "
+          f"{visitors} visitors, {rooms} rooms, {slots} timetable slots")
+
+    student_rows = [
+        User(
+            admission_number=student_number(i),
+            full_name=f"Bench Student {i}",
+            first_name="Bench", last_name=f"Student {i}",
+            school="School of Benchmarks",
+            email=f"bench.student{i}@bench.local",
+            hashed_password=hashed,
+            role_id=student_role.id,
+            status="Active",
+            has_smartphone=True,
+            pin_setup_required=False,
+        )
+        for i in range(students)
+    ]
+    await _add_all(session, student_rows)
+
+    lecturers = [
+        User(
+            admission_number=f"{PREFIX}-LEC-{i:04d}",
+            full_name=f"Bench Lecturer {i}",
+            school="School of Benchmarks",
+            email=f"bench.lecturer{i}@bench.local",
+            hashed_password=hashed,
+            role_id=lecturer_role.id,
+        )
+        for i in range(max(1, rooms // 4))
+    ]
+    await _add_all(session, lecturers)
+
+    vehicle_rows = [
+        Vehicle(
+            plate_number=plate_number(i),
+            make=PREFIX,
+            model="Synthetic",
+            color=rng.choice(["White", "Silver", "Black", "Blue"]),
+            driver_name=f"Bench Driver {i}",
+            owner_id=rng.choice(student_rows).id if student_rows and rng.random() < 0.6 else None,
+            # A quarter of the cars are fleet vehicles reporting GPS
+            is_fleet=i % 4 == 0,
+            vehicle_type="shuttle" if i % 4 == 0 else "utility",
+        )
+        for i in range(vehicles)
+    ]
+    await _add_all(session, vehicle_rows)
+
+    visitor_rows = [
+        Visitor(
+            first_name="Bench", last_name=f"Visitor {i}",
+            phone_number=f"07{i:08d}",
+            id_number=f"{PREFIX}{i:07d}",
+            visit_details="Benchmark visit",
+            time_in=now - timedelta(minutes=rng.randint(5, 600)),
+            status="checked_in" if rng.random() < 0.5 else "checked_out",
+        )
+        for i in range(visitors)
+    ]
+    await _add_all(session, visitor_rows)
+
+    room_rows = [
+        Classroom(
+            room_code=f"{PREFIX}-R{i:04d}",
+            room_name=f"Bench Hall {i}",
+            building="Benchmark Block",
+            capacity=rng.choice([40, 60, 120, 250]),
+        )
+        for i in range(rooms)
+    ]
+    await _add_all(session, room_rows)
+
+    course_rows = [
+        Course(
+            course_code=f"{PREFIX}-C{i:04d}",
+            course_name=f"Benchmark Course {i}",
+            department="Benchmarks",
+            classroom_id=room.id,
+            lecturer_id=lecturers[i % len(lecturers)].id,
+        )
+        for i, room in enumerate(room_rows)
+    ]
+    await _add_all(session, course_rows)
+
+    if course_rows:
+        registrations = []
+        per_student = min(courses_per_student, len(course_rows))
+        for student in student_rows:
+            for course in rng.sample(course_rows, per_student):
+                registrations.append(StudentCourseRegistration(student_id=student.id, course_id=course.id))
+        await _add_all(session, registrations)
+
+    slot_rows = []
+    for course in course_rows:
+        slot_rows.append(TimetableSlot(
+            course_id=course.id, classroom_id=course.classroom_id, lecturer_id=course.lecturer_id,
+            day_of_week=today.weekday(), start_time=time(0, 0), end_time=time(23, 59, 59),
+        ))
+    for _ in range(max(0, slots - len(slot_rows)) if course_rows else 0):
+        course = rng.choice(course_rows)
+        start_hour = rng.randint(7, 17)
+        slot_rows.append(TimetableSlot(
+            course_id=course.id, classroom_id=course.classroom_id, lecturer_id=course.lecturer_id,
+            day_of_week=rng.choice([d for d in range(7) if d != today.weekday()]),
+            start_time=time(start_hour, 0), end_time=time(start_hour + 2, 0),
+        ))
+    await _add_all(session, slot_rows)
+
+    session_rows = [
+        ClassSession(
+            course_id=slot.course_id,
+            timetable_slot_id=slot.id,
+            session_date=today,
+            start_time=slot.start_time,
+            end_time=slot.end_time,
+            classroom_id=slot.classroom_id,
+            lecturer_id=slot.lecturer_id,
+            qr_code=f"{PREFIX}-QR-{i:04d}",
+            status="ongoing",
+            active=True,
+        )
+        for i, slot in enumerate(slot_rows[:len(course_rows)])
+    ]
+    await _add_all(session, session_rows)
+
+    campus = await load_campus(session)
+    print(f"Seeded benchmark campus: {campus.counts()}")
+    return campus
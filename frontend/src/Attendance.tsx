@@ -326,6 +326,18 @@ function StudentView() {
     )
 }
 
+// Same rule as flag_outliers (backend/app/utils/live_attendance.py). Applied when rendering,
+// so rows that arrived earlier follow the latest dominant IP.
+function flagOutliers(row: any, analysis: any) {
+    const dominantIp = analysis?.dominant_ip
+    if (!dominantIp || row.ip === dominantIp || row.ip === 'unknown') return row
+    return {
+        ...row,
+        ai_flag: 'Suspicious IP Limit (VPN/Data)',
+        status: row.status === 'present' ? 'flagged_ip_mismatch' : row.status
+    }
+}
+
 function LecturerView() {
     const [subTab, setSubTab] = useState<'classes' | 'live'>('classes') // Default to classes overview
     
@@ -333,6 +345,7 @@ function LecturerView() {
     const [courses, setCourses] = useState<any[]>([])
     const [activeSession, setActiveSession] = useState<any>(null)
     const [attendees, setAttendees] = useState<any[]>([])
+    const [ipAnalysis, setIpAnalysis] = useState<any>(null)
     const [selectedCourse, setSelectedCourse] = useState('')
 
     // Class Registers States (New)
@@ -358,19 +371,47 @@ function LecturerView() {
         init()
     }, [])
 
-    // Poll active session attendees
+    // Live attendees: the roster once, then each new record pushed over /ws/attendance.
+    // Falls back to polling if the socket cannot be kept open.
     useEffect(() => {
         let interval: any
+        let socket: WebSocket | null = null
+        let closed = false
         if (activeSession?.id) {
+            const token = localStorage.getItem('token')
             const poll = async () => {
-                const token = localStorage.getItem('token')
                 const res = await fetch(`/api/attendance/sessions/${activeSession.id}/live`, { headers: { 'Authorization': `Bearer ${token}` } })
-                if (res.ok) setAttendees((await res.json()).attendees || [])
+                if (res.ok) {
+                    const data = await res.json()
+                    setAttendees(data.attendees || [])
+                    setIpAnalysis(data.analysis || null)
+                }
             }
-            poll()
-            interval = setInterval(poll, 15000)
+            const startPolling = () => {
+                if (closed || interval) return
+                poll()
+                interval = setInterval(poll, 15000)
+            }
+            try {
+                const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws'
+                socket = new WebSocket(`${protocol}://${window.location.host}/ws/attendance/${activeSession.id}`)
+                socket.onopen = () => socket?.send(JSON.stringify({ type: 'hello', token }))
+                socket.onmessage = (e) => {
+                    const msg = JSON.parse(e.data)
+                    if (msg.type === 'snapshot') setAttendees(msg.attendees || [])
+                    else if (msg.type === 'attendance') setAttendees(prev => [msg.attendee, ...prev])
+                    if (msg.analysis) setIpAnalysis(msg.analysis)
+                }
+                socket.onclose = startPolling
+            } catch {
+                startPolling()
+            }
+        }
+        return () => {
+            closed = true
+            socket?.close()
+            clearInterval(interval)
         }
-        return () => clearInterval(interval)
     }, [activeSession])
 
     // Fetch summary registers
@@ -678,6 +719,7 @@ function LecturerView() {
                                             await fetch(`/api/attendance/sessions/${activeSession.id}/end`, { method: 'POST', headers: { 'Authorization': `Bearer ${token}` } })
                                             setActiveSession(null)
                                             setAttendees([])
+                                            setIpAnalysis(null)
                                         }}
                                         className="w-full py-2 bg-red-100 text-red-600 rounded-lg font-bold"
                                     >
@@ -705,7 +747,7 @@ function LecturerView() {
                                         </tr>
                                     </thead>
                                     <tbody>
-                                        {attendees.map((a, i) => (
+                                        {attendees.map(a => flagOutliers(a, ipAnalysis)).map((a, i) => (
                                             <tr key={i} className="border-b border-slate-50 dark:border-slate-700">
                                                 <td className="p-3">
                                                     <div className="font-bold">{a.name}</div>
@@ -714,12 +756,20 @@ function LecturerView() {
                                                 <td className="p-3 font-mono text-sm">{new Date(a.time).toLocaleTimeString()}</td>
                                                 <td className="p-3 text-sm">
                                                     <div className="flex items-center gap-1">
-                                                        {a.evidence_url ? <ImageIcon size={14} /> : <Wifi size={14} />}
+                                                        {a.evidence_thumb_url ? (
+                                                            <a href={a.evidence_url} target="_blank" rel="noreferrer">
+                                                                <img src={a.evidence_thumb_url} loading="lazy" className="w-8 h-8 rounded object-cover" alt="Evidence" />
+                                                            </a>
+                                                        ) : a.evidence_url ? <ImageIcon size={14} /> : <Wifi size={14} />}
                                                         {a.ip ? 'Remote' : 'Local'}
                                                     </div>
                                                 </td>
                                                 <td className="p-3">
-                                                    <span className="bg-green-100 text-green-700 px-2 py-1 rounded text-xs font-bold">Verified</span>
+                                                    {a.ai_flag ? (
+                                                        <span className="bg-amber-100 text-amber-700 px-2 py-1 rounded text-xs font-bold" title={a.ai_flag}>Suspicious IP</span>
+                                                    ) : (
+                                                        <span className="bg-green-100 text-green-700 px-2 py-1 rounded text-xs font-bold">Verified</span>
+                                                    )}
                                                 </td>
                                             </tr>
                                         ))}
@@ -16,6 +16,7 @@ interface Classroom {
     floor: string
     capacity: number
     qr_code?: string
+    qr_token?: string
     last_attendance?: string
     last_student?: string
     last_student_adm?: string
@@ -736,7 +737,7 @@ export default function ClassroomManagement() {
                                                                         : `${window.location.protocol}//${serverIpOrDomain}`;
                                                                 }
                                                             }
-                                                            return `${base}/?room=${room.room_code}`;
+                                                            return `${base}/?room=${room.qr_token || room.room_code}`;
                                                         })()}
                                                         size={120}
                                                         level="H"
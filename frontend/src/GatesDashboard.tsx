@@ -45,11 +45,35 @@ export default function GatesDashboard() {
         } catch (e) { }
     }
 
+    // Recent activity: pushed over /ws/gate/all (snapshot, then each scan as it happens).
+    // Falls back to polling if the socket cannot be kept open.
     useEffect(() => {
         fetchGates()
-        fetchRecentActivity()
-        const interval = setInterval(fetchRecentActivity, 15000)
-        return () => clearInterval(interval)
+        let interval: any
+        let socket: WebSocket | null = null
+        let closed = false
+        const startPolling = () => {
+            if (closed || interval) return
+            fetchRecentActivity()
+            interval = setInterval(fetchRecentActivity, 15000)
+        }
+        try {
+            const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws'
+            socket = new WebSocket(`${protocol}://${window.location.host}/ws/gate/all`)
+            socket.onmessage = (e) => {
+                const msg = JSON.parse(e.data)
+                if (msg.type === 'snapshot') setRecentActivity((msg.events || []).slice(0, 5))
+                else if (msg.type === 'scan') setRecentActivity(prev => [msg.event, ...prev].slice(0, 5))
+            }
+            socket.onclose = startPolling
+        } catch {
+            startPolling()
+        }
+        return () => {
+            closed = true
+            socket?.close()
+            clearInterval(interval)
+        }
     }, [])
 
     const handleCreateGate = async (e: any) => {
@@ -224,7 +248,7 @@ export default function GatesDashboard() {
                                         </tr>
                                     ) : (
                                         recentActivity.map((log: any) => (
-                                            <tr key={log.id} className="hover:bg-gray-50 transition-colors">
+                                            <tr key={log.id || log.event_id} className="hover:bg-gray-50 transition-colors">
                                                 <td className="px-6 py-4 text-sm text-gray-500 font-mono">
                                                     {new Date(log.time).toLocaleTimeString()}
                                                 </td>
@@ -243,9 +267,9 @@ export default function GatesDashboard() {
                                                 </td>
                                                 <td className="px-6 py-4 text-sm text-gray-500">{log.details}</td>
                                                 <td className="px-6 py-4">
-                                                    <span className={`text-xs font-bold px-2 py-1 rounded-full ${log.status === 'allowed' || log.status === 'checked_in' ? 'bg-green-100 text-green-600' : 'bg-red-100 text-red-600'
+                                                    <span className={`text-xs font-bold px-2 py-1 rounded-full ${['allowed', 'event_pass', 'checked_in', 'checked_out'].includes(log.status) ? 'bg-green-100 text-green-600' : 'bg-red-100 text-red-600'
                                                         }`}>
-                                                        {log.status === 'checked_in' ? 'Entry' : log.status}
+                                                        {log.direction === 'in' || log.status === 'checked_in' ? 'Entry' : log.direction === 'out' || log.status === 'checked_out' ? 'Exit' : log.status}
                                                     </span>
                                                 </td>
                                             </tr>
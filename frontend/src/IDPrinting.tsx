@@ -453,7 +453,7 @@ function IDCardFront({ student, companySettings }: any) {
                 <div className="mt-1 flex items-end">
                     <div className="p-0.5 bg-white border border-gray-200 rounded-lg shadow-sm shrink-0">
                         <QRCodeSVG 
-                            value={student.admission_number} 
+                            value={student.qr_token || student.admission_number} 
                             size={44} 
                             level="H"
                         />
@@ -519,7 +519,7 @@ function IDCardBack({ student, companySettings }: any) {
 
             <div className="p-1 bg-white border border-gray-150 shadow-sm rounded-lg flex items-center justify-center">
                 <QRCodeSVG 
-                    value={student.admission_number} 
+                    value={student.qr_token || student.admission_number} 
                     size={70} 
                     level="H"
                 />
@@ -81,60 +81,31 @@ export default function Reports() {
         }
     }
 
-    // Export generated logs as CSV
-    const exportToCSV = (type: 'people' | 'vehicles') => {
+    // Download generated logs as CSV/XLSX (streamed by the server)
+    const exportToFile = async (type: 'people' | 'vehicles', format: 'csv' | 'xlsx') => {
         if (!genReport) return
-
-        let csvContent = ""
-        let filename = ""
-
-        if (type === 'people') {
-            filename = `people_scans_report_${selectedDate}.csv`
-            // Headers
-            csvContent += "Name,Email,Role,Gate Entered,Gate Exited,Entry Time,Exit Time,Method,Guard,Status\n"
-            genReport.entry_logs.forEach((log: any) => {
-                const row = [
-                    `"${log.name}"`,
-                    `"${log.email}"`,
-                    `"${log.role}"`,
-                    `"${log.gate}"`,
-                    `"${log.exit_gate || '-'}"`,
-                    `"${log.entry_time || '-'}"`,
-                    `"${log.exit_time || '-'}"`,
-                    `"${log.method}"`,
-                    `"${log.guard}"`,
-                    `"${log.status}"`
-                ].join(",")
-                csvContent += row + "\n"
-            })
-        } else {
-            filename = `vehicle_scans_report_${selectedDate}.csv`
-            // Headers
-            csvContent += "Plate Number,Driver Name,Vehicle Type,Gate Entered,Gate Exited,Entry Time,Exit Time,Guard\n"
-            genReport.vehicle_logs.forEach((log: any) => {
-                const row = [
-                    `"${log.plate_number}"`,
-                    `"${log.driver_name}"`,
-                    `"${log.vehicle_type}"`,
-                    `"${log.gate}"`,
-                    `"${log.exit_gate || '-'}"`,
-                    `"${log.entry_time || '-'}"`,
-                    `"${log.exit_time || '-'}"`,
-                    `"${log.guard}"`
-                ].join(",")
-                csvContent += row + "\n"
+        const token = localStorage.getItem('token')
+        try {
+            const res = await fetch(`/api/reports/detailed?date=${selectedDate}&kind=${type}&format=${format}`, {
+                headers: { 'Authorization': `Bearer ${token}` }
             })
+            if (!res.ok) {
+                alert(`Failed to export report. Server status: ${res.status}`)
+                return
+            }
+            const blob = await res.blob()
+            const url = URL.createObjectURL(blob)
+            const link = document.createElement("a")
+            link.setAttribute("href", url)
+            link.setAttribute("download", `${type === 'people' ? 'people' : 'vehicle'}_scans_report_${selectedDate}.${format}`)
+            link.style.visibility = 'hidden'
+            document.body.appendChild(link)
+            link.click()
+            document.body.removeChild(link)
+            URL.revokeObjectURL(url)
+        } catch (err) {
+            console.error("Error exporting report:", err)
         }
-
-        const blob = new Blob([csvContent], { type: 'text/csv;charset=utf-8;' })
-        const url = URL.createObjectURL(blob)
-        const link = document.createElement("a")
-        link.setAttribute("href", url)
-        link.setAttribute("download", filename)
-        link.style.visibility = 'hidden'
-        document.body.appendChild(link)
-        link.click()
-        document.body.removeChild(link)
     }
 
     // Export generated logs as Professional PDF
@@ -539,12 +510,19 @@ export default function Reports() {
                                             className="px-3 py-1.5 rounded-lg bg-[var(--bg-primary)] border border-[var(--border-color)] text-xs outline-none focus:border-[var(--primary-color)] w-full md:w-48"
                                         />
                                         <button
-                                            onClick={() => exportToCSV(generatorSubTab as 'people' | 'vehicles')}
+                                            onClick={() => exportToFile(generatorSubTab as 'people' | 'vehicles', 'csv')}
                                             className="px-3 py-1.5 bg-green-600 text-white rounded-lg text-xs font-bold hover:bg-green-700 active:scale-95 transition-all flex items-center gap-1.5 whitespace-nowrap"
                                         >
                                             <Download size={12} />
                                             CSV
                                         </button>
+                                        <button
+                                            onClick={() => exportToFile(generatorSubTab as 'people' | 'vehicles', 'xlsx')}
+                                            className="px-3 py-1.5 bg-emerald-700 text-white rounded-lg text-xs font-bold hover:bg-emerald-800 active:scale-95 transition-all flex items-center gap-1.5 whitespace-nowrap"
+                                        >
+                                            <Download size={12} />
+                                            XLSX
+                                        </button>
                                         <button
                                             onClick={() => exportToPDF(generatorSubTab as 'people' | 'vehicles')}
                                             className="px-3 py-1.5 bg-indigo-600 text-white rounded-lg text-xs font-bold hover:bg-indigo-700 active:scale-95 transition-all flex items-center gap-1.5 whitespace-nowrap"
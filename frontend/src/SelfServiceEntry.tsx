@@ -108,6 +108,27 @@ export default function SelfServiceEntry() {
         }
     }
 
+    // Visitor requests are queued at rush hour; hold on the ticket until the gate has checked it in
+    const awaitTicket = async (ticket: string) => {
+        for (let attempt = 0; attempt < 20; attempt++) {
+            try {
+                const res = await fetch(`/api/gate/public/access-request/${ticket}?wait=20`)
+                if (res.status === 404) return
+                if (res.ok) {
+                    const data = await res.json()
+                    if (data.status !== 'queued') {
+                        setResult(data)
+                        return
+                    }
+                } else {
+                    await new Promise(resolve => setTimeout(resolve, 2000))
+                }
+            } catch (err) {
+                await new Promise(resolve => setTimeout(resolve, 2000))
+            }
+        }
+    }
+
     const handleSubmit = async (e: any) => {
         e.preventDefault()
         setSubmitting(true)
@@ -126,6 +147,7 @@ export default function SelfServiceEntry() {
             if (res.ok) {
                 setResult(data)
                 setStep(3)
+                if (data.status === 'queued') awaitTicket(data.ticket)
             } else {
                 setError(data.detail || "Verification failed. Check credentials and retry.")
             }